@@ -1,3 +1,20 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import QueryUsage
+
+
+@admin.register(QueryUsage)
+class QueryUsageAdmin(admin.ModelAdmin):
+    """Consommation du moteur par exécution (lecture seule)."""
+
+    list_display = ("created_at", "client", "user", "kind", "query_class", "dataset",
+                    "wall_ms", "cpu_ms", "rows_scanned", "result_bytes", "status")
+    list_filter = ("kind", "query_class", "status")
+    search_fields = ("client", "dataset", "user__username")
+    date_hierarchy = "created_at"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
+
+    def ready(self):
+        # Enregistre les hooks post-chargement (rollups, ...) déclarés par les services
+        from . import services  # noqa: F401
@@ -22,28 +22,150 @@ DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 _normalize_cols = str(os.getenv("NORMALIZE_COLS", "0")).lower() in {"1", "true", "yes"}
 
 
-def query(sql: str, params: list | tuple | None = None) -> pd.DataFrame:
+def parse_bytes(value: str | int | None) -> int | None:
+    """'4GB', '512MiB', '1.5 GB', 1024 -> octets (None si vide ou illisible)."""
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    m = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)(i?b)?\s*", str(value).lower())
+    if not m:
+        return None
+    return int(float(m.group(1)) * 1024 ** " kmgt".index(m.group(2) or " "))
+
+
+def web_workers() -> int:
+    """Processus web servis par la même machine (WEB_CONCURRENCY, 1 par défaut)."""
+    return max(1, int(os.getenv("WEB_CONCURRENCY", "1") or 1))
+
+
+def _default_memory_limit() -> str:
+    """
+    La moitié de la RAM, partagée entre les workers web (WEB_CONCURRENCY) : pas les 80 % par défaut de DuckDB.
+    Avec le service moteur (DUCKDB_ENGINE_SOCKET), une seule instance reçoit toute cette moitié.
+    """
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return ""
+    workers = 1 if os.getenv("DUCKDB_ENGINE_SOCKET") else web_workers()
+    return f"{max(256, int(total * 0.5 / workers) >> 20)}MB"
+
+
+# Réglages de l'instance DuckDB du processus : globaux (partagés par toutes ses connexions, une
+# valeur par connexion serait écrasée par la suivante), donc réappliqués à l'identique à chaque connect().
+# Au-delà de memory_limit, les opérateurs (tri, agrégat, jointure) débordent dans temp_directory.
+ENGINE_SETTINGS = {k: v for k, v in {
+    "memory_limit": os.getenv("DUCKDB_MEMORY_LIMIT") or _default_memory_limit(),
+    "threads": os.getenv("DUCKDB_THREADS", ""),
+    "temp_directory": os.getenv("DUCKDB_TEMP_DIRECTORY", ""),
+    "max_temp_directory_size": os.getenv("DUCKDB_MAX_TEMP_DIRECTORY_SIZE", ""),
+}.items() if v}
+
+# Service moteur (manage.py run_engine) : s'il est configuré, le fichier n'est ouvert que par lui et
+# connect() renvoie une connexion distante (services.engine.RemoteConnection)
+ENGINE_SOCKET = os.getenv("DUCKDB_ENGINE_SOCKET", "")
+
+
+def engine_statements() -> list[str]:
+    return [f"SET {k} = '{str(v).replace(chr(39), chr(39) * 2)}'" for k, v in ENGINE_SETTINGS.items()]
+
+
+class ResultTooLarge(RuntimeError):
+    """Résultat dépassant le budget mémoire de matérialisation côté Python."""
+
+
+_CONNECT_HOOKS: list = []
+
+
+def on_connect(fn):
+    """
+    Enregistre un initialiseur appelé sur chaque connexion ouverte par connect() : fn(con).
+    Utilisé par les services qui enrichissent le moteur (fonctions SQL, réglages, ...).
+    """
+    if fn not in _CONNECT_HOOKS:
+        _CONNECT_HOOKS.append(fn)
+    return fn
+
+
+def connect(read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    """
+    Ouvre une connexion sur la base du projet et applique les initialiseurs enregistrés.
+    Avec ENGINE_SOCKET, session sur le service moteur (mêmes méthodes, réglages appliqués par le service).
+    """
+    if ENGINE_SOCKET:
+        from .services.engine import RemoteConnection
+        con = RemoteConnection(ENGINE_SOCKET)
+    else:
+        con = duckdb.connect(str(DB_PATH), read_only=read_only)
+        for stmt in engine_statements():
+            con.execute(stmt)
+    for hook in list(_CONNECT_HOOKS):
+        try:
+            hook(con)
+        except Exception:
+            logger.exception("Initialiseur de connexion %s échoué", getattr(hook, "__name__", hook))
+    return con
+
+
+_QUERY_HOOKS: list = []
+
+
+def on_query(fn):
+    """
+    Enregistre un observateur appelé après chaque requête exécutée par query() : fn(con),
+    sur la connexion encore ouverte (profilage de la dernière requête, ...).
+    """
+    if fn not in _QUERY_HOOKS:
+        _QUERY_HOOKS.append(fn)
+    return fn
+
+
+def _fetch_bounded(cur, max_bytes: int) -> pd.DataFrame:
+    """Lit le résultat par blocs et s'arrête dès que sa taille en mémoire dépasse max_bytes."""
+    frames, total = [], 0
+    while True:
+        chunk = cur.fetch_df_chunk(8)  # 8 vecteurs (~16 k lignes)
+        if chunk.empty:
+            break
+        total += int(chunk.memory_usage(deep=True).sum())
+        if total > max_bytes:
+            raise ResultTooLarge(
+                f"Résultat trop volumineux (plus de {max_bytes >> 20} Mo en mémoire après "
+                f"{sum(len(f) for f in frames) + len(chunk)} lignes) ; filtrez, agrégez ou ajoutez un LIMIT."
+            )
+        frames.append(chunk)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else (frames[0] if frames else chunk)
+
+
+def query(sql: str, params: list | tuple | None = None, max_bytes: int | None = None) -> pd.DataFrame:
     """
     Exécute une requête DuckDB en ouvrant une connexion temporaire.
     Compatible avec l'autoreload Django (aucun verrou permanent).
+    max_bytes : budget de matérialisation du DataFrame (ResultTooLarge au-delà, lecture interrompue).
     """
     if params is None:
         params = []
-    with duckdb.connect(str(DB_PATH)) as con:
-        return con.execute(sql, params).fetchdf()
+    with connect() as con:
+        cur = con.execute(sql, params)
+        df = _fetch_bounded(cur, max_bytes) if max_bytes else cur.fetchdf()
+        for hook in list(_QUERY_HOOKS):
+            try:
+                hook(con)
+            except Exception:
+                logger.exception("Observateur de requête %s échoué", getattr(hook, "__name__", hook))
+        return df
 
 
 # ============================================================
 # 🧩 UTILITAIRES GÉNÉRIQUES
 # ============================================================
 def _id(name: str) -> str:
-    """Quote un identifiant SQL (gère espaces, majuscules, caractères spéciaux)."""
+    """Quote un identifiant SQL (gère espaces, majuscules, caractères spéciaux, mots réservés)."""
     if not name:
         raise ValueError("Identifiant vide")
-    if re.search(r"[^0-9a-zA-Z_]", name):
-        safe = name.replace('"', '""')
-        return f'"{safe}"'
-    return name
+    safe = str(name).replace('"', '""')
+    return f'"{safe}"'
 
 
 def _jsonify_df(df: pd.DataFrame) -> list[dict]:
@@ -88,7 +210,9 @@ def _normalize(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def _ensure_df(path_or_file, file_type: str = "csv") -> pd.DataFrame:
-    """Accepte chemin, fichier binaire, ou buffer, et renvoie un DataFrame."""
+    """Accepte DataFrame, chemin, fichier binaire, ou buffer, et renvoie un DataFrame."""
+    if isinstance(path_or_file, pd.DataFrame):
+        return _normalize(path_or_file)
     if isinstance(path_or_file, (str, os.PathLike)):
         if file_type == "excel": return _normalize(pd.read_excel(path_or_file))
         if file_type == "json": return _normalize(pd.read_json(path_or_file))
@@ -107,20 +231,157 @@ def _ensure_df(path_or_file, file_type: str = "csv") -> pd.DataFrame:
 # ============================================================
 # 🏗️ INGESTION DES DONNÉES DANS DUCKDB
 # ============================================================
-def _create_or_replace_table(df: pd.DataFrame, table: str):
-    with duckdb.connect(str(DB_PATH)) as con:
+# Les tables internes (métadonnées, rollups, ...) sont préfixées par "__"
+# et ne sont pas listées comme datasets.
+INTERNAL_PREFIX = "__"
+META_TABLE = "__datasets"
+APPENDS_TABLE = "__appends"
+
+_LOAD_HOOKS: list = []
+
+
+def on_dataset_loaded(fn):
+    """
+    Enregistre un hook appelé après chaque chargement : fn(table, version).
+    Utilisé par les services qui maintiennent des structures dérivées (rollups, ...).
+    """
+    if fn not in _LOAD_HOOKS:
+        _LOAD_HOOKS.append(fn)
+    return fn
+
+
+def _ensure_meta(con) -> None:
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {META_TABLE} ("
+        "name VARCHAR PRIMARY KEY, version BIGINT, row_count BIGINT, loaded_at TIMESTAMP)"
+    )
+    # version du dernier remplacement complet : les versions suivantes ne sont que des ajouts
+    con.execute(f"ALTER TABLE {META_TABLE} ADD COLUMN IF NOT EXISTS replaced_version BIGINT")
+
+
+def _bump_version(con, table: str, row_count: int, append: bool = False) -> int:
+    _ensure_meta(con)
+    row = con.execute(
+        f"SELECT version, replaced_version FROM {META_TABLE} WHERE name = ?", [table]
+    ).fetchone()
+    version = (row[0] if row else 0) + 1
+    replaced = (row[1] or row[0]) if (row and append) else version
+    con.execute(
+        f"INSERT OR REPLACE INTO {META_TABLE} (name, version, row_count, loaded_at, replaced_version) "
+        "VALUES (?, ?, ?, now(), ?)",
+        [table, version, int(row_count), replaced],
+    )
+    return version
+
+
+def dataset_version(table: str) -> int:
+    """Version courante d'un dataset (incrémentée à chaque chargement, 0 si inconnue)."""
+    try:
+        df = query(f"SELECT version FROM {META_TABLE} WHERE name = ?", [table])
+    except Exception:
+        return 0
+    return int(df.iloc[0, 0]) if not df.empty else 0
+
+
+def dataset_versions() -> dict[str, int]:
+    """Versions de tous les datasets connus ({nom: version})."""
+    try:
+        df = query(f"SELECT name, version FROM {META_TABLE}")
+    except Exception:
+        return {}
+    return {str(n): int(v) for n, v in zip(df["name"], df["version"])}
+
+
+def dataset_lineage(table: str) -> tuple[int, int]:
+    """
+    (version courante, version du dernier remplacement complet).
+    Entre les deux, le dataset n'a reçu que des ajouts (mode="append").
+    """
+    try:
+        with connect() as con:
+            _ensure_meta(con)
+            row = con.execute(
+                f"SELECT version, COALESCE(replaced_version, version) FROM {META_TABLE} WHERE name = ?", [table]
+            ).fetchone()
+    except Exception:
+        return 0, 0
+    return (int(row[0]), int(row[1])) if row else (0, 0)
+
+
+def appended_min(table: str, since_version: int, column: str):
+    """
+    Plus petite valeur de `column` parmi les lots ajoutés après since_version,
+    None si aucun ajout, False si inconnue (colonne non temporelle dans un des lots).
+    """
+    try:
+        df = query(f"SELECT col_min FROM {APPENDS_TABLE} WHERE name = ? AND version > ?", [table, since_version])
+    except Exception:
+        return None
+    if df.empty:
+        return None
+    values = [json.loads(v or "{}").get(column) for v in df["col_min"]]
+    if any(v is None for v in values):
+        return False
+    return min(pd.Timestamp(v) for v in values)
+
+
+def _ensure_appends(con) -> None:
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {APPENDS_TABLE} (name VARCHAR, version BIGINT, rows BIGINT, col_min VARCHAR)"
+    )
+
+
+def _create_or_replace_table(df: pd.DataFrame, table: str) -> int:
+    with connect() as con:
         con.execute(f"DROP TABLE IF EXISTS {_id(table)};")
+        _ensure_appends(con)
+        con.execute(f"DELETE FROM {APPENDS_TABLE} WHERE name = ?", [table])
         con.register("tmp_df", df)
         con.execute(f"CREATE TABLE {_id(table)} AS SELECT * FROM tmp_df;")
         con.unregister("tmp_df")
+        return _bump_version(con, table, len(df))
+
+
+def _append_to_table(df: pd.DataFrame, table: str) -> int:
+    """Ajoute les lignes (colonnes appariées par nom) ; crée la table si elle n'existe pas."""
+    if table not in list_tables():
+        return _create_or_replace_table(df, table)
+    with connect() as con:
+        con.register("tmp_df", df)
+        con.execute(f"INSERT INTO {_id(table)} BY NAME SELECT * FROM tmp_df;")
+        con.unregister("tmp_df")
+        total = con.execute(f"SELECT COUNT(*) FROM {_id(table)}").fetchone()[0]
+        version = _bump_version(con, table, total, append=True)
+        # bornes temporelles du lot : permettent aux services dérivés de ne recalculer que la partie touchée
+        col_min = {c: df[c].min().isoformat() for c in df.columns
+                   if is_datetime64_any_dtype(df[c]) and df[c].notna().any()}
+        _ensure_appends(con)
+        con.execute(f"INSERT INTO {APPENDS_TABLE} VALUES (?, ?, ?, ?)", [table, version, len(df), json.dumps(col_min)])
+        return version
+
+
+def _run_load_hooks(table: str, version: int) -> None:
+    for hook in list(_LOAD_HOOKS):
+        try:
+            hook(table, version)
+        except Exception:
+            logger.exception("Hook post-chargement %s échoué pour '%s'", getattr(hook, "__name__", hook), table)
 
 
-def load_to_duckdb(path_or_file, table: str, file_type="csv") -> dict:
-    """Charge un fichier (CSV, Excel, JSON, Parquet) en table DuckDB."""
+def load_to_duckdb(path_or_file, table: str, file_type="csv", mode: str = "replace") -> dict:
+    """
+    Charge un fichier (CSV, Excel, JSON, Parquet) ou un DataFrame en table DuckDB.
+    mode="replace" (défaut) remplace la table ; mode="append" ajoute les lignes à la table existante.
+    """
+    if mode not in ("replace", "append"):
+        raise ValueError(f"Mode de chargement inconnu: {mode}")
     df = _ensure_df(path_or_file, file_type)
-    _create_or_replace_table(df, table)
+    version = _append_to_table(df, table) if mode == "append" else _create_or_replace_table(df, table)
+    _run_load_hooks(table, version)
     return {
         "count": len(df),
+        "mode": mode,
+        "version": version,
         "columns": [{"name": c, "dtype": str(t)} for c, t in df.dtypes.items()],
         "preview": _jsonify_df(df.head(10)),
     }
@@ -131,13 +392,46 @@ def load_to_duckdb(path_or_file, table: str, file_type="csv") -> dict:
 # ============================================================
 def list_tables() -> list[str]:
     df = query("SHOW TABLES;")
-    return df.iloc[:, 0].tolist()
+    return [t for t in df.iloc[:, 0].tolist() if not str(t).startswith(INTERNAL_PREFIX)]
+
+
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER",
+                  "UBIGINT", "UHUGEINT", "FLOAT", "DOUBLE", "DECIMAL")
+
+
+def describe_table(table: str) -> pd.DataFrame:
+    """
+    Équivalent de DataFrame.describe() (colonnes numériques et dates) calculé par DuckDB :
+    pas de copie pandas de la table entière.
+    """
+    schema = [(str(r[0]), str(r[1]).upper()) for r in query(f"DESCRIBE {_id(table)}").itertuples(index=False)]
+
+    def stats(cols: list[str], cast: str, mean: str, std: str) -> pd.DataFrame:
+        parts = []
+        for c in cols:
+            x = f"CAST({_id(c)} AS {cast})"
+            q = ", ".join(f"quantile_cont({x}, {p}) AS \"{int(p * 100)}%\"" for p in (0.25, 0.5, 0.75))
+            parts.append(f"SELECT '{c.replace(chr(39), chr(39) * 2)}' AS \"index\", CAST(COUNT({x}) AS DOUBLE) AS count, "
+                         f"{mean.format(x=x)} AS mean, {std.format(x=x)} AS std, MIN({x}) AS min, {q}, MAX({x}) AS max "
+                         f"FROM {_id(table)}")
+        return query(" UNION ALL ".join(parts)) if parts else pd.DataFrame()
+
+    numeric = stats([c for c, t in schema if t.startswith(_NUMERIC_TYPES)], "DOUBLE", "AVG({x})", "STDDEV_SAMP({x})")
+    temporal = stats([c for c, t in schema if t == "DATE" or t.startswith("TIMESTAMP")], "TIMESTAMP",
+                     "make_timestamp(CAST(AVG(epoch_us({x})) AS BIGINT))", "NULL::DOUBLE")
+    frames = [f for f in (numeric, temporal) if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    order = {c: i for i, (c, _) in enumerate(schema)}
+    desc = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    # colonnes objet comme describe().T d'un DataFrame mixte : NaN -> None à la sérialisation
+    return desc.sort_values("index", key=lambda s: s.map(order)).reset_index(drop=True).astype(object)
 
 
 def profile_table(table: str, limit: int = 10) -> dict:
     """Retourne le schéma + un échantillon + des stats descriptives."""
     df = query(f"SELECT * FROM {_id(table)} LIMIT {limit};")
-    desc = query(f"SELECT * FROM {_id(table)}").describe().T.reset_index()
+    desc = describe_table(table)
     return {
         "columns": [{"name": c, "dtype": str(t)} for c, t in df.dtypes.items()],
         "rows": _jsonify_df(df),
@@ -148,7 +442,7 @@ def profile_table(table: str, limit: int = 10) -> dict:
 # ============================================================
 # 🧠 EXÉCUTION SQL INTELLIGENTE
 # ============================================================
-def run_sql(sql: str) -> pd.DataFrame:
+def run_sql(sql: str, max_bytes: int | None = None) -> pd.DataFrame:
     """
     Exécute du SQL DuckDB avec :
     - correction automatique des guillemets et backslashes
@@ -165,7 +459,9 @@ def run_sql(sql: str) -> pd.DataFrame:
     sql = re.sub(r";+", ";", sql)
     logger.debug("Requete SQL normalisee: %s", sql)
     try:
-        return query(sql)
+        return query(sql, max_bytes=max_bytes)
+    except ResultTooLarge:
+        raise
     except Exception as e:
         raise RuntimeError(f"Erreur d'exécution SQL : {e}\nRequête : {sql}")
 
@@ -1,11 +1,11 @@
 from django.core.management.base import BaseCommand
-from django.conf import settings
-import duckdb
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import random
 
+from analytics.duck import DB_PATH, load_to_duckdb
+
 
 class Command(BaseCommand):
     help = "Charge un dataset de demonstration dans DuckDB (table 'sales_demo' par defaut)."
@@ -63,18 +63,10 @@ class Command(BaseCommand):
             }
         ).sort_values("date")
 
-        # 2) Connexion DuckDB
-        db_path = getattr(settings, "DUCKDB_PATH", str(settings.BASE_DIR / "data" / "insight.duckdb"))
-        con = duckdb.connect(db_path)
-
-        # 3) Ecrire la table (replace)
-        con.register("df", df)
-        con.execute(f"CREATE OR REPLACE TABLE {duckdb.identifier(table)} AS SELECT * FROM df;")
-
-        # 4) Infos
-        cnt = con.execute(f"SELECT COUNT(*) FROM {duckdb.identifier(table)};").fetchone()[0]
-        self.stdout.write(self.style.SUCCESS(f"Table '{table}' chargee avec {cnt} lignes dans {db_path}"))
+        # 2) Ecrire la table (replace) : passe par load_to_duckdb pour la version et les hooks (rollups...)
+        info = load_to_duckdb(df, table)
 
-        # 5) Index ou stats eventuelles (facultatif)
-        # DuckDB n'utilise pas d'index classiques; mais on peut materialiser des vues si besoin.
-        # con.execute(f"CREATE OR REPLACE VIEW {table}_by_month AS SELECT date_trunc('month', date) AS m, SUM(amount) AS total FROM {table} GROUP BY 1;")
+        # 3) Infos
+        self.stdout.write(self.style.SUCCESS(
+            f"Table '{table}' chargee avec {info['count']} lignes dans {DB_PATH} (version {info['version']})"
+        ))
@@ -0,0 +1,37 @@
+import os
+
+import duckdb
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.duck import DB_PATH, ENGINE_SETTINGS, ENGINE_SOCKET
+from analytics.services import engine
+
+
+class Command(BaseCommand):
+    help = ("Lance le service moteur : seul processus a ouvrir le fichier DuckDB, "
+            "les workers s'y connectent via DUCKDB_ENGINE_SOCKET.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", type=str, default=ENGINE_SOCKET or str(DB_PATH.with_suffix(".sock")),
+                            help="Chemin de la socket Unix (defaut : DUCKDB_ENGINE_SOCKET)")
+        parser.add_argument("--database", type=str, default=str(DB_PATH), help="Fichier DuckDB servi")
+
+    def handle(self, *args, **opts):
+        socket_path = str(opts["socket"])
+        if not ENGINE_SOCKET:
+            self.stdout.write(self.style.WARNING(
+                f"DUCKDB_ENGINE_SOCKET n'est pas defini : les workers ouvriront encore le fichier eux-memes "
+                f"(definir DUCKDB_ENGINE_SOCKET={socket_path})"
+            ))
+        self.stdout.write(self.style.NOTICE(
+            f"Service moteur : {opts['database']} sur {socket_path} ({', '.join(f'{k}={v}' for k, v in ENGINE_SETTINGS.items())})"
+        ))
+        if not os.getenv("DUCKDB_ENGINE_TOKEN"):
+            self.stdout.write(self.style.WARNING(
+                "DUCKDB_ENGINE_TOKEN n'est pas defini : acces limite aux processus du meme utilisateur (socket 0660)"
+            ))
+        try:
+            engine.serve(socket_path, str(opts["database"]), ENGINE_SETTINGS)
+        except (OSError, duckdb.IOException) as e:
+            raise CommandError(f"Impossible d'ouvrir la base ou la socket : {e}")
+        self.stdout.write(self.style.SUCCESS("Service moteur arrete"))
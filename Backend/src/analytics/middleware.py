@@ -0,0 +1,18 @@
+from typing import Callable
+from django.http import HttpRequest, HttpResponse
+
+from .services import admission
+
+
+class AdmissionScopeMiddleware:
+    """
+    Borne la décision d'admission a la requete HTTP : admission.current() repart de None a chaque
+    requete et est remis a zero en fin de traitement (threads de workers reutilises d'une requete a l'autre).
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        with admission.scope():
+            return self.get_response(request)
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueryUsage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "client",
+                    models.CharField(
+                        help_text="user:<id> ou ip:<adresse> (clé des quotas)",
+                        max_length=128,
+                    ),
+                ),
+                ("kind", models.CharField(max_length=16)),
+                (
+                    "query_class",
+                    models.CharField(blank=True, default="", max_length=16),
+                ),
+                ("dataset", models.CharField(blank=True, default="", max_length=255)),
+                ("wall_ms", models.FloatField(default=0)),
+                ("cpu_ms", models.FloatField(default=0)),
+                ("rows_scanned", models.BigIntegerField(default=0)),
+                ("result_rows", models.BigIntegerField(default=0)),
+                ("result_bytes", models.BigIntegerField(default=0)),
+                ("peak_memory_bytes", models.BigIntegerField(blank=True, null=True)),
+                ("status", models.CharField(default="ok", max_length=16)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="query_usages",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["client", "created_at"],
+                        name="analytics_q_client_839d1b_idx",
+                    ),
+                    models.Index(
+                        fields=["dataset", "created_at"],
+                        name="analytics_q_dataset_6e94cb_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -1,3 +1,35 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class QueryUsage(models.Model):
+    """
+    Consommation du moteur par exécution (services.accounting) : une ligne par requête SQL,
+    analyse Pandas ou export, imputée à l'utilisateur (ou au client anonyme) et au dataset.
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="query_usages"
+    )
+    client = models.CharField(max_length=128, help_text="user:<id> ou ip:<adresse> (clé des quotas)")
+    kind = models.CharField(max_length=16)              # sql | pandas | export
+    query_class = models.CharField(max_length=16, blank=True, default="")
+    dataset = models.CharField(max_length=255, blank=True, default="")
+    wall_ms = models.FloatField(default=0)
+    cpu_ms = models.FloatField(default=0)
+    rows_scanned = models.BigIntegerField(default=0)
+    result_rows = models.BigIntegerField(default=0)
+    result_bytes = models.BigIntegerField(default=0)
+    peak_memory_bytes = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=16, default="ok")  # ok | error | rejected
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["client", "created_at"]),
+            models.Index(fields=["dataset", "created_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.client} {self.kind} {self.dataset} ({self.cpu_ms:.0f} ms CPU)"
@@ -1,7 +1,10 @@
 from .guards import is_safe, add_limit_if_missing, wrap_sample
 from .runners import run_sql_safe, preview_table, profile_table
 from .planner import build_sql_from_plan
-from .kpis import safe_div, growth_rate, mean, stddev_pop, zscore
+from .kpis import (
+    safe_div, growth_rate, mean, stddev_pop, zscore,
+    Moments, growth_rates, zscores, percentiles, moving_mean, moving_std, moving_quantile,
+)
 
 __all__ = [
     "is_safe",
@@ -16,4 +19,11 @@ __all__ = [
     "mean",
     "stddev_pop",
     "zscore",
+    "Moments",
+    "growth_rates",
+    "zscores",
+    "percentiles",
+    "moving_mean",
+    "moving_std",
+    "moving_quantile",
 ]
@@ -0,0 +1,267 @@
+"""
+Comptabilité des ressources du moteur par utilisateur et par dataset, avec quotas glissants.
+
+Chaque exécution mesurée (run_sql_safe, runners Pandas, exports) ouvre un compteur `meter()` :
+- temps mur, temps CPU (thread Python + opérateurs DuckDB)
+- lignes scannées, taille du résultat, pic de mémoire du moteur : profilage DuckDB de chaque
+  requête passée par duck.query() pendant la mesure (activé seulement à ce moment-là)
+- côté Pandas : pic approché par l'empreinte des DataFrames présents en fin d'exécution
+La mesure est enregistrée (modèle QueryUsage) pour l'utilisateur authentifié, sinon pour le client
+anonyme (adresse), et pour les datasets cités.
+
+Quotas (ACCOUNTING_QUOTAS, dict ou JSON) sur une fenêtre glissante de ACCOUNTING_QUOTA_WINDOW
+secondes, par client ; les comptes staff en sont exemptés. Ex. :
+    {"rows_scanned": 5000000000, "cpu_ms": 3600000}
+top_consumers() alimente la planification de capacité (par utilisateur ou par dataset).
+"""
+from __future__ import annotations
+import contextvars
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import admission, scheduler
+from .cache import LRUCache
+from ..duck import dataset_versions, on_connect, on_dataset_loaded, on_query
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("queries", "wall_ms", "cpu_ms", "rows_scanned", "result_bytes")
+_PROFILING = json.dumps({"CPU_TIME": "true", "CUMULATIVE_ROWS_SCANNED": "true",
+                         "SYSTEM_PEAK_BUFFER_MEMORY": "true", "RESULT_SET_SIZE": "true"})
+
+_meter: contextvars.ContextVar = contextvars.ContextVar("accounting_meter", default=None)
+# consommation récente par client (relue au plus toutes les quelques secondes, complétée localement)
+_totals = LRUCache(maxsize=4096, ttl=10.0)
+_versions = LRUCache(maxsize=1, ttl=1.0)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def enabled() -> bool:
+    return str(_setting("ACCOUNTING_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+def quotas() -> Dict[str, float]:
+    raw = _setting("ACCOUNTING_QUOTAS", {}) or {}
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    return {k: float(v) for k, v in raw.items() if k in METRICS and v}
+
+
+def window() -> float:
+    return float(_setting("ACCOUNTING_QUOTA_WINDOW", 3600))
+
+
+class QuotaExceeded(Exception):
+    """Quota glissant du client atteint : la requête n'est pas exécutée."""
+
+    def __init__(self, metric: str, used: float, limit: float, window_s: float):
+        self.metric, self.used, self.limit, self.window = metric, used, limit, window_s
+        super().__init__(f"Quota atteint : {metric} = {used:,.0f} sur les {window_s / 60:.0f} dernières minutes "
+                         f"(limite {limit:,.0f}), réessayez plus tard.")
+
+
+@dataclass
+class Usage:
+    kind: str
+    query_class: str = ""
+    dataset: str = ""
+    client: str = "system"
+    user_id: Optional[int] = None
+    wall_ms: float = 0.0
+    cpu_ms: float = 0.0
+    engine_cpu_ms: float = 0.0
+    rows_scanned: int = 0
+    result_rows: int = 0
+    result_bytes: int = 0
+    peak_memory_bytes: Optional[int] = None
+    status: str = "ok"
+
+    def peak(self, nbytes: Optional[int]) -> None:
+        if nbytes is not None:
+            self.peak_memory_bytes = max(self.peak_memory_bytes or 0, int(nbytes))
+
+
+# ------------------ Collecte (moteur) ------------------ #
+
+@on_connect
+def _enable_profiling(con) -> None:
+    """Profilage DuckDB (sans sortie) uniquement sur les connexions ouvertes pendant une mesure."""
+    if _meter.get() is not None:
+        con.execute("SET enable_profiling = 'no_output'")
+        con.execute(f"SET custom_profiling_settings = '{_PROFILING}'")
+
+
+@on_query
+def _collect(con) -> None:
+    usage = _meter.get()
+    if usage is None:
+        return
+    info = json.loads(con.get_profiling_information(format="json"))
+    usage.engine_cpu_ms += float(info.get("cpu_time") or 0.0) * 1000
+    usage.rows_scanned += int(info.get("cumulative_rows_scanned") or 0)
+    usage.result_bytes += int(info.get("result_set_size") or 0)
+    usage.peak(info.get("system_peak_buffer_memory"))
+
+
+@on_dataset_loaded
+def _reset_versions(dataset: str, version: int) -> None:
+    _versions.clear()
+
+
+def datasets_in(text: str) -> str:
+    """Datasets cités dans une requête (ou du code), séparés par des virgules."""
+    low = (text or "").lower()
+    names = [n for n in _versions.get_or_set("all", dataset_versions)
+             if re.search(rf"\b{re.escape(n.lower())}\b", low)]
+    return ",".join(sorted(names))[:255]
+
+
+def frames_footprint(env: Dict[str, Any]) -> int:
+    """Empreinte mémoire des DataFrames / Series d'un environnement d'exécution Pandas."""
+    import pandas as pd
+
+    total = 0
+    for value in env.values():
+        if isinstance(value, pd.DataFrame):
+            total += int(value.memory_usage(deep=True).sum())
+        elif isinstance(value, pd.Series):
+            total += int(value.memory_usage(deep=True))
+    return total
+
+
+# ------------------ Mesure ------------------ #
+
+def identity():
+    """(clé client, utilisateur authentifié ou None) de la requête HTTP courante."""
+    from common.middleware import current_request
+
+    request = current_request()
+    user = getattr(request, "user", None) if request is not None else None
+    if user is not None and not getattr(user, "is_authenticated", False):
+        user = None
+    return scheduler.client_key(request), user
+
+
+def _aggregate(client: str) -> Dict[str, float]:
+    from django.db.models import Count, Sum
+    from django.utils import timezone
+    from ..models import QueryUsage
+
+    since = timezone.now() - timedelta(seconds=window())
+    agg = QueryUsage.objects.filter(client=client, created_at__gte=since).aggregate(
+        queries=Count("id"), wall_ms=Sum("wall_ms"), cpu_ms=Sum("cpu_ms"),
+        rows_scanned=Sum("rows_scanned"), result_bytes=Sum("result_bytes"),
+    )
+    return {k: float(v or 0) for k, v in agg.items()}
+
+
+def check_quota(client: str, user=None) -> None:
+    """Lève QuotaExceeded si le client a atteint l'un de ses quotas sur la fenêtre glissante."""
+    limits = quotas()
+    if not limits or (user is not None and user.is_staff):
+        return
+    try:
+        totals = _totals.get_or_set(client, lambda: _aggregate(client))
+    except Exception as e:
+        logger.debug(f"[accounting] quotas non vérifiables: {e}")
+        return
+    for metric, limit in limits.items():
+        if totals.get(metric, 0.0) >= limit:
+            raise QuotaExceeded(metric, totals[metric], limit, window())
+
+
+def _save(usage: Usage) -> None:
+    from ..models import QueryUsage
+
+    QueryUsage.objects.create(
+        user_id=usage.user_id, client=usage.client, kind=usage.kind, query_class=usage.query_class,
+        dataset=usage.dataset, wall_ms=round(usage.wall_ms, 3), cpu_ms=round(usage.cpu_ms, 3),
+        rows_scanned=usage.rows_scanned, result_rows=usage.result_rows, result_bytes=usage.result_bytes,
+        peak_memory_bytes=usage.peak_memory_bytes, status=usage.status,
+    )
+    # totals en cache : on ajoute la mesure plutôt que d'attendre la prochaine relecture
+    totals = _totals.get(usage.client)
+    if totals is not None:
+        totals["queries"] = totals.get("queries", 0.0) + 1
+        for metric in ("wall_ms", "cpu_ms", "rows_scanned", "result_bytes"):
+            totals[metric] = totals.get(metric, 0.0) + getattr(usage, metric)
+
+
+@contextmanager
+def meter(kind: str, query_class: str = "", dataset: str = "", text: Optional[str] = None,
+          who: Optional[tuple] = None) -> Iterator[Usage]:
+    """
+    Mesure le bloc et l'impute au client courant (ou à `who` = identity() capturée ailleurs, pour un
+    thread hors requête) ; vérifie ses quotas avant d'entrer.
+    Réentrant : un bloc déjà mesuré (ex. run_plan -> run_sql_safe) est compté dans la mesure englobante.
+    """
+    outer = _meter.get()
+    if outer is not None or not enabled():
+        yield outer or Usage(kind)
+        return
+    client, user = who or identity()
+    check_quota(client, user)
+    usage = Usage(kind, query_class, dataset or datasets_in(text or ""), client, user.pk if user else None)
+    token = _meter.set(usage)
+    t0, c0 = time.perf_counter(), time.thread_time()
+    try:
+        yield usage
+    except Exception as e:
+        usage.status = "rejected" if isinstance(e, (admission.QueryRejected, scheduler.QueueTimeout)) else "error"
+        raise
+    finally:
+        _meter.reset(token)
+        usage.wall_ms = (time.perf_counter() - t0) * 1000
+        usage.cpu_ms = (time.thread_time() - c0) * 1000 + usage.engine_cpu_ms
+        try:
+            _save(usage)
+        except Exception as e:
+            # base Django indisponible (commande hors requête, tests sans base...) : mesure perdue
+            logger.debug(f"[accounting] mesure non enregistrée: {e}")
+
+
+def current() -> Optional[Usage]:
+    return _meter.get()
+
+
+# ------------------ Synthèse ------------------ #
+
+def top_consumers(by: str = "user", window_s: float = 86400, metric: str = "cpu_ms", limit: int = 20) -> Dict[str, Any]:
+    """Plus gros consommateurs sur la fenêtre (by = "user" ou "dataset"), triés par `metric`."""
+    from django.db.models import Count, Max, Sum
+    from django.utils import timezone
+    from ..models import QueryUsage
+
+    if metric not in METRICS:
+        raise ValueError(f"Métrique inconnue: {metric} ({', '.join(METRICS)})")
+    keys = {"user": ("client", "user__username"), "dataset": ("dataset",)}.get(by)
+    if keys is None:
+        raise ValueError("'by' attend 'user' ou 'dataset'")
+    since = timezone.now() - timedelta(seconds=window_s)
+    qs = QueryUsage.objects.filter(created_at__gte=since)
+    sums = dict(queries=Count("id"), wall_ms=Sum("wall_ms"), cpu_ms=Sum("cpu_ms"),
+                rows_scanned=Sum("rows_scanned"), result_bytes=Sum("result_bytes"))
+    total = {k: v or 0 for k, v in qs.aggregate(**sums).items()}
+    rows: List[Dict[str, Any]] = []
+    for row in qs.values(*keys).annotate(**sums, peak_memory_bytes=Max("peak_memory_bytes")).order_by(f"-{metric}")[:limit]:
+        row = {k: (round(v, 1) if isinstance(v, float) else v) for k, v in row.items()}
+        row["share"] = round(row[metric] / total[metric], 4) if total[metric] else None
+        rows.append(row)
+    return {"by": by, "metric": metric, "window_s": window_s, "total": total, "top": rows}
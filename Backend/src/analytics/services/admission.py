@@ -0,0 +1,275 @@
+"""
+Admission des requêtes par coût estimé (avant exécution).
+
+Le SQL validé passe par `EXPLAIN (FORMAT JSON)` : le plan physique de DuckDB donne les tables lues,
+les cardinalités estimées des jointures et du résultat. Les lignes scannées viennent du catalogue de
+stats (services.stats) quand le dataset est connu. On en déduit :
+- scan_rows   : lignes lues (somme des tables scannées)
+- fanout      : facteur de multiplication de la pire jointure (sortie / plus grande entrée)
+- result_rows : lignes produites (bornées par le LIMIT final)
+
+Politique par classe d'endpoint (interactive, nl, export, analysis ; ADMISSION_POLICIES surcharge) :
+- jointure explosive (fanout > max_fanout)                            -> refus
+- scan > sample_scan_rows (ou > max_scan_rows), requête d'agrégat et   -> estimation sur l'échantillon
+  classe avec "approximate": true (désactivé par défaut)                 persistant du dataset (services.sampling :
+                                                                          agrégats pondérés + erreurs types) ;
+                                                                          MIN / MAX ne sont jamais estimés
+- scan > max_scan_rows sans échantillon possible ou autorisé           -> refus (QueryRejected, 422)
+- résultat > max_result_rows                                           -> wrap_sample du résultat
+  (si sample_result) ou refus
+- sinon                                                                -> exécution normale
+
+Chaque décision est journalisée avec le coût réel (durée, lignes) pour ajuster les seuils (stats()).
+La dernière décision est lisible via current() jusqu'à la fin du scope() englobant (une requête HTTP,
+cf. analytics.middleware.AdmissionScopeMiddleware).
+"""
+from __future__ import annotations
+import contextvars
+import json
+import logging
+import math
+import os
+import re
+import statistics
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+from . import sampling, stats as col_stats
+from .cache import LRUCache
+from .guards import normalize_sql, wrap_sample
+from ..duck import connect, dataset_versions, on_dataset_loaded
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_POLICIES: Dict[str, Dict[str, Any]] = {
+    "interactive": {"max_scan_rows": 2_000_000_000, "sample_scan_rows": 200_000_000, "approximate": False,
+                    "max_result_rows": 2_000_000, "max_fanout": 1000, "sample_result": True},
+    "nl": {"max_scan_rows": 2_000_000_000, "sample_scan_rows": 200_000_000, "approximate": False,
+           "max_result_rows": 2_000_000, "max_fanout": 1000, "sample_result": True},
+    "analysis": {"max_scan_rows": 2_000_000_000, "sample_scan_rows": 200_000_000, "approximate": False,
+                 "max_result_rows": 5_000_000, "max_fanout": 1000, "sample_result": True},
+    "export": {"max_scan_rows": 5_000_000_000, "sample_scan_rows": None, "approximate": False,
+               "max_result_rows": 50_000_000, "max_fanout": 1000, "sample_result": False},
+}
+_JOINS = ("JOIN", "CROSS_PRODUCT")
+_LIMIT_TAIL = re.compile(r"(?is)\blimit\s+(\d+)\s*(?:offset\s+\d+\s*)?;?\s*$")
+
+_estimates = LRUCache(maxsize=1024, ttl=300)
+_log: deque = deque(maxlen=500)
+_counters: Counter = Counter()
+_lock = threading.Lock()
+_current: contextvars.ContextVar = contextvars.ContextVar("admission_decision", default=None)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def enabled() -> bool:
+    return str(_setting("ADMISSION_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+def policy(endpoint: str) -> Dict[str, Any]:
+    """Politique d'une classe d'endpoint : défauts surchargés par ADMISSION_POLICIES (dict ou JSON)."""
+    overrides = _setting("ADMISSION_POLICIES", {}) or {}
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides)
+    base = _DEFAULT_POLICIES.get(endpoint, _DEFAULT_POLICIES["interactive"])
+    return {**base, **(overrides.get(endpoint) or {})}
+
+
+class QueryRejected(Exception):
+    """Requête refusée par l'admission (le message explique pourquoi et comment la réduire)."""
+
+
+@dataclass
+class Decision:
+    action: str                      # execute | sample | reject
+    sql: str
+    endpoint: str
+    estimate: Dict[str, Any] = field(default_factory=dict)
+    reason: Optional[str] = None
+    approximate: Optional[Dict[str, Any]] = None
+
+    def meta(self) -> Dict[str, Any]:
+        return {"action": self.action, "endpoint": self.endpoint, "estimate": self.estimate,
+                **({"reason": self.reason} if self.reason else {}),
+                **({"approximate": self.approximate} if self.approximate else {})}
+
+
+# ------------------ Estimation ------------------ #
+
+def _card(node: Dict[str, Any]) -> Optional[int]:
+    raw = (node.get("extra_info") or {}).get("Estimated Cardinality")
+    try:
+        return int(raw) if raw not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _walk(node: Dict[str, Any], out: Dict[str, Any], versions: Dict[str, int]) -> Optional[int]:
+    """Parcourt le plan ; retourne la cardinalité estimée du nœud (déduite des enfants si absente)."""
+    children = [_walk(c, out, versions) for c in node.get("children") or []]
+    est = _card(node)
+    name = str(node.get("name", "")).upper()
+    info = node.get("extra_info") or {}
+    if "SCAN" in name and info.get("Table"):
+        table = str(info["Table"]).split(".")[-1]
+        rows = est
+        if table in versions:
+            rows = (col_stats.get_stats(table) or {}).get("rows", est)
+        out["tables"][table] = max(out["tables"].get(table) or 0, rows or 0)
+    if any(j in name for j in _JOINS):
+        known = [c for c in children if c]
+        if est is None and known:
+            est = math.prod(known) if "CROSS" in name else max(known)
+        if known and est is not None:
+            out["fanout"] = max(out["fanout"], est / max(known))
+    if est is None and children:
+        est = next((c for c in children if c is not None), None)
+    return est
+
+
+def estimate(sql: str) -> Dict[str, Any]:
+    """{"scan_rows", "result_rows", "fanout", "tables"} d'après EXPLAIN (mis en cache par SQL normalisé)."""
+    key = normalize_sql(sql)
+
+    def _explain() -> Dict[str, Any]:
+        with connect() as con:
+            row = con.execute(f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}").fetchone()
+        plan = json.loads(row[1])
+        out: Dict[str, Any] = {"tables": {}, "fanout": 1.0}
+        roots = plan if isinstance(plan, list) else [plan]
+        result = None
+        versions = dataset_versions()
+        for root in roots:
+            result = _walk(root, out, versions)
+        limit = _LIMIT_TAIL.search(sql.strip())
+        if limit:
+            result = min(result, int(limit.group(1))) if result else int(limit.group(1))
+        return {"scan_rows": int(sum(out["tables"].values())), "result_rows": int(result or 0),
+                "fanout": round(out["fanout"], 2), "tables": out["tables"]}
+
+    return _estimates.get_or_set(key, _explain)
+
+
+@on_dataset_loaded
+def _reset(dataset: str, version: int) -> None:
+    _estimates.clear()
+
+
+# ------------------ Décision ------------------ #
+
+def _fmt(n: float) -> str:
+    for unit, size in (("Md", 1e9), ("M", 1e6), ("k", 1e3)):
+        if n >= size:
+            return f"{n / size:.1f} {unit}"
+    return f"{int(n)}"
+
+
+def admit(sql: str, endpoint: str = "interactive") -> Decision:
+    """Décide comment exécuter `sql` ; lève QueryRejected si la requête est trop coûteuse."""
+    if not enabled():
+        decision = Decision("execute", sql, endpoint)
+        _current.set(decision)
+        return decision
+    try:
+        est = estimate(sql)
+    except Exception as e:
+        # plan indisponible (syntaxe, table inconnue...) : l'erreur réelle viendra de l'exécution
+        logger.debug(f"[admission] EXPLAIN impossible: {e}")
+        decision = Decision("execute", sql, endpoint, reason="plan indisponible")
+        _current.set(decision)
+        return decision
+
+    p = policy(endpoint)
+    decision = Decision("execute", sql, endpoint, est)
+    scan, result, fanout = est["scan_rows"], est["result_rows"], est["fanout"]
+    if p.get("max_fanout") and fanout > p["max_fanout"]:
+        decision.action = "reject"
+        decision.reason = (f"jointure explosive : chaque ligne est multipliée ~×{fanout:.0f} "
+                           f"(~{_fmt(result)} lignes) ; précisez les conditions de jointure ou agrégez avant de joindre")
+    elif (p.get("sample_scan_rows") and scan > p["sample_scan_rows"]) or (p.get("max_scan_rows") and scan > p["max_scan_rows"]):
+        approx_sql, approx = sql, {"reason": f"estimation sur échantillon non activée pour '{endpoint}'"}
+        if p.get("approximate"):
+            approx_sql, approx = sampling.approximate_sql(sql)
+            if approx.get("sample_bounds"):
+                # bornes d'un échantillon : pas des MIN / MAX du dataset, la requête reste exacte
+                approx_sql, approx = sql, {"reason": "MIN / MAX ne s'estiment pas sur un échantillon"}
+        if approx.get("approximate") and approx.get("estimated"):
+            decision.action, decision.sql, decision.approximate = "sample", approx_sql, approx
+            decision.reason = f"~{_fmt(scan)} lignes à lire : estimation sur l'échantillon du dataset"
+        elif p.get("max_scan_rows") and scan > p["max_scan_rows"]:
+            decision.action = "reject"
+            decision.reason = (f"~{_fmt(scan)} lignes à lire (limite {_fmt(p['max_scan_rows'])}) ; "
+                               f"ajoutez des filtres ou agrégez ({approx.get('reason') or 'échantillon indisponible'})")
+    if decision.action == "execute" and p.get("max_result_rows") and result > p["max_result_rows"]:
+        if p.get("sample_result"):
+            perc = max(0.01, 100.0 * p["max_result_rows"] / result)
+            decision.action, decision.sql = "sample", wrap_sample(sql, perc)
+            decision.reason = f"~{_fmt(result)} lignes en sortie : échantillon de {perc:.2g} % du résultat"
+        else:
+            decision.action = "reject"
+            decision.reason = (f"~{_fmt(result)} lignes en sortie (limite {_fmt(p['max_result_rows'])}) ; "
+                               "filtrez ou agrégez avant d'exporter")
+    with _lock:
+        _counters[f"{endpoint}:{decision.action}"] += 1
+    _current.set(decision)
+    if decision.action == "reject":
+        record(decision, None, 0.0)
+        raise QueryRejected(f"Requête refusée : {decision.reason}.")
+    return decision
+
+
+def current() -> Optional[Dict[str, Any]]:
+    """Meta de la dernière décision prise dans ce contexte (thread / requête), None si aucune."""
+    decision = _current.get()
+    return decision.meta() if decision else None
+
+
+@contextmanager
+def scope() -> Iterator[None]:
+    """Borne current() au bloc : la décision d'une requête ne déborde pas sur la suivante du même thread."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+# ------------------ Journal ------------------ #
+
+def record(decision: Decision, actual_rows: Optional[int], elapsed_s: float) -> None:
+    """Coût estimé vs réel : journalisé et gardé en mémoire pour régler les seuils."""
+    entry = {"endpoint": decision.endpoint, "action": decision.action, **decision.estimate,
+             "actual_rows": actual_rows, "elapsed_ms": round(elapsed_s * 1000, 1)}
+    entry.pop("tables", None)
+    with _lock:
+        _log.append(entry)
+    logger.info("[admission] %s", json.dumps(entry))
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        entries = list(_log)
+        counters = dict(_counters)
+    # q-error : max(estimé/réel, réel/estimé) sur les résultats (1 = estimation parfaite)
+    q = [max(e["result_rows"], 1) / max(e["actual_rows"], 1) for e in entries if e.get("actual_rows") is not None
+         and e.get("result_rows") is not None and e["action"] == "execute"]
+    q = [max(v, 1 / v) for v in q]
+    return {
+        "enabled": enabled(),
+        "decisions": counters,
+        "result_q_error_median": round(statistics.median(q), 2) if q else None,
+        "recent": entries[-20:],
+    }
@@ -0,0 +1,123 @@
+"""
+Détection d'anomalies glissantes (intents anomaly_rolling / anomaly_mad / anomaly_seasonal).
+
+Le SQL est compilé par planner.build_anomaly_sql (fenêtres DuckDB, une passe).
+Les séries scorées sont gardées en cache par (dataset, paramètres) avec la version du dataset :
+- même version                      -> résultat en cache
+- versions suivantes = ajouts seuls -> on ne rescore que la fin de la série, à partir du plus ancien
+  jour touché par les lots ajoutés (ou du dernier point connu), avec juste assez d'historique
+  pour remplir les fenêtres (les `window` points précédents de chaque créneau saisonnier)
+- remplacement complet              -> recalcul intégral
+"""
+from __future__ import annotations
+import logging
+from typing import Any, Dict, Tuple
+
+import pandas as pd
+
+from .cache import LRUCache
+from .planner import ANOMALY_INTENTS, SEASONS, build_anomaly_sql
+from ..duck import appended_min, dataset_lineage, run_sql
+
+logger = logging.getLogger(__name__)
+
+_cache = LRUCache(maxsize=64)
+
+
+def _key(plan: Dict[str, Any]) -> tuple:
+    return (
+        plan["dataset"], plan["intent"], plan.get("date_col") or "date", plan.get("amount_col") or None,
+        int(plan.get("window") or 28), float(plan.get("threshold") or 3.0), plan.get("season") or "dow",
+    )
+
+
+def _score(plan: Dict[str, Any], since: Any = None) -> pd.DataFrame:
+    sql, _ = build_anomaly_sql(
+        plan["intent"], plan["dataset"], plan.get("date_col") or "date", plan.get("amount_col") or None,
+        window=int(plan.get("window") or 28), threshold=float(plan.get("threshold") or 3.0),
+        season=plan.get("season") or "dow", since=since, use_rollups=plan.get("use_rollups", True),
+    )
+    return run_sql(sql)
+
+
+def _resume_from(plan: Dict[str, Any], entry: Any, version: int, replaced: int):
+    """
+    Premier point à rescorer si la série en cache peut être reprise (seulement des ajouts depuis),
+    sinon None (recalcul complet).
+    """
+    if not entry or not version or entry["version"] < replaced or not len(entry["df"]):
+        return None
+    lo = appended_min(plan["dataset"], entry["version"], plan.get("date_col") or "date")
+    if lo is False:
+        return None
+    last_ts = pd.Timestamp(entry["df"]["ts"].iloc[-1])
+    # le dernier jour connu peut être incomplet : il est toujours rescoré
+    return last_ts if lo is None else min(last_ts, pd.Timestamp(lo).floor("D"))
+
+
+def _history_start(ts: pd.Series, resume: Any, intent: str, window: int, season: str):
+    """
+    Plus ancien point à relire pour rescorer à partir de `resume`, ou None (toute la série).
+    Les fenêtres portent sur des lignes : il faut les `window` points précédents de chaque créneau
+    (jour de semaine, mois) pour anomaly_seasonal, quelle que soit leur ancienneté, sinon de la série.
+    """
+    before = pd.to_datetime(ts[ts < resume])
+    if not len(before):
+        return None
+    window = max(2, window)
+    if intent != "anomaly_seasonal":
+        return before.iloc[max(0, len(before) - window)]
+    attr = SEASONS.get(season, SEASONS["dow"])[1]
+    return min(g.iloc[max(0, len(g) - window)] for _, g in before.groupby(getattr(before.dt, attr)))
+
+
+def detect(plan: Dict[str, Any]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Série scorée (ts, val, expected, score, is_anomaly) pour un plan d'anomalie,
+    restreinte aux `limit` points les plus récents. meta["mode"] : cache | incremental | full.
+    """
+    intent = plan.get("intent")
+    if intent not in ANOMALY_INTENTS:
+        raise ValueError(f"Intent d'anomalie inconnu: {intent}")
+    if not plan.get("dataset"):
+        raise ValueError("'dataset' requis")
+
+    key = _key(plan)
+    version, replaced = dataset_lineage(plan["dataset"])
+    entry = _cache.get(key)
+
+    if entry and entry["version"] == version:
+        df, mode = entry["df"], "cache"
+    else:
+        df, mode = None, "full"
+        resume = _resume_from(plan, entry, version, replaced)
+        if resume is not None:
+            old = entry["df"]
+            since = _history_start(old["ts"], resume, intent, int(plan.get("window") or 28),
+                                   plan.get("season") or "dow")
+            tail = _score(plan, since=None if since is None else pd.Timestamp(since).isoformat())
+            tail = tail[tail["ts"] >= resume]
+            df, mode = pd.concat([old[old["ts"] < resume], tail], ignore_index=True), "incremental"
+            logger.info(f"[anomaly] {plan['dataset']} v{entry['version']}->v{version}: {len(tail)} point(s) rescoré(s)")
+        if df is None:
+            df = _score(plan)
+
+    if mode != "cache":
+        _cache.set(key, {"version": version, "df": df})
+
+    limit = int(plan.get("limit") or 0)
+    out = df.tail(limit) if limit else df
+    return out.reset_index(drop=True), {
+        "mode": mode,
+        "version": version,
+        "points": len(df),
+        "anomalies": int(df["is_anomaly"].sum()) if len(df) else 0,
+    }
+
+
+def cache_clear() -> None:
+    _cache.clear()
+
+
+def stats() -> Dict[str, Any]:
+    return _cache.stats()
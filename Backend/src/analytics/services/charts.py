@@ -0,0 +1,271 @@
+"""
+Service de rendu des graphiques.
+
+- Figures matplotlib orientées objet (Figure + FigureCanvasAgg), sans état global pyplot
+- Rendu dans un pool de threads (ou de processus) dédié
+- Cache LRU keyé par (empreinte des données, chart_spec, format, dpi)
+- Sortie configurable : PNG (DPI réglable), SVG, ou "spec" (rendu laissé au frontend)
+  Les figures pyplot du code LLM n'ont pas de chart_spec équivalent : en mode "spec", elles restent
+  rendues côté serveur en PNG (figure_format)
+- Rendu de repli sur chart_spec borné à CHART_RENDER_TIMEOUT secondes sur le fil de la requête :
+  au-delà, la réponse part sans image (le frontend dessine le chart_spec), le rendu finit en tâche
+  de fond et alimente le cache pour l'appel suivant
+"""
+from __future__ import annotations
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("png", "svg", "spec")
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        return getattr(settings, name, None) or os.getenv(name) or default
+    except Exception:
+        return os.getenv(name) or default
+
+
+def output_format(fmt: Optional[str] = None) -> str:
+    fmt = (fmt or _setting("CHART_RENDER_FORMAT", "png")).lower()
+    return fmt if fmt in FORMATS else "png"
+
+
+def figure_format(fmt: Optional[str] = None) -> str:
+    """Format d'encodage d'une figure matplotlib existante : PNG en mode "spec" (pas de spec à transmettre)."""
+    fmt = output_format(fmt)
+    return "png" if fmt == "spec" else fmt
+
+
+def render_timeout() -> float:
+    return float(_setting("CHART_RENDER_TIMEOUT", 2.0))
+
+
+def output_dpi(dpi: Optional[int] = None) -> int:
+    return int(dpi or _setting("CHART_RENDER_DPI", 80))
+
+
+_cache = LRUCache(maxsize=int(_setting("CHART_RENDER_CACHE_SIZE", 256)))
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Executor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(_setting("CHART_RENDER_WORKERS", 2))
+            if str(_setting("CHART_RENDER_EXECUTOR", "thread")).lower() == "process":
+                _executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chart-render")
+        return _executor
+
+
+# ------------------ Empreintes ------------------ #
+
+def data_fingerprint(df: pd.DataFrame) -> str:
+    """Empreinte stable du contenu d'un DataFrame (colonnes + valeurs)."""
+    h = hashlib.sha1()
+    h.update(json.dumps([str(c) for c in df.columns]).encode("utf-8"))
+    try:
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    except TypeError:
+        # valeurs non hashables (listes, dicts...) -> repli sur la représentation texte
+        h.update(df.to_json(orient="values", date_format="iso", default_handler=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _spec_key(spec: Dict[str, Any]) -> str:
+    return json.dumps(spec, sort_keys=True, default=str)
+
+
+# ------------------ Encodage ------------------ #
+
+def encode_figure(fig, fmt: Optional[str] = None, dpi: Optional[int] = None) -> Optional[str]:
+    """Encode une figure matplotlib existante en base64 (PNG ou SVG). None en mode "spec"."""
+    fmt = output_format(fmt)
+    if fmt == "spec":
+        return None
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=output_dpi(dpi), bbox_inches="tight")
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+# ------------------ Dessin (API objet) ------------------ #
+
+def _first_numeric(df: pd.DataFrame) -> Optional[str]:
+    num_cols = df.select_dtypes(include=[np.number]).columns
+    return num_cols[0] if len(num_cols) else None
+
+
+def _draw_histogram(ax, df: pd.DataFrame, spec: Dict[str, Any]) -> bool:
+    if spec.get("binned") and {"bin_start", "bin_end", "count"} <= set(df.columns):
+        # classes déjà calculées par DuckDB (planner.build_histogram_sql)
+        ax.bar(df["bin_start"], df["count"], width=df["bin_end"] - df["bin_start"], align="edge")
+        col = spec.get("column") or "valeur"
+        ax.set_title(f"Histogramme de {col}")
+        ax.set_xlabel(col)
+        ax.set_ylabel("Fréquence")
+        return True
+    x = spec.get("x") or _first_numeric(df)
+    if not x or x not in df.columns:
+        return False
+    values = pd.to_numeric(df[x], errors="coerce").dropna().to_numpy()
+    if values.size == 0:
+        return False
+    ax.hist(values, bins=int(spec.get("bins", 30)))
+    ax.set_title(f"Histogramme de {x}")
+    ax.set_xlabel(x)
+    ax.set_ylabel("Fréquence")
+    return True
+
+
+def _xy(df: pd.DataFrame, spec: Dict[str, Any]) -> tuple[Optional[str], Optional[str]]:
+    cols = list(df.columns)
+    x = spec.get("x") or (cols[0] if cols else None)
+    y = spec.get("y") or (cols[1] if len(cols) > 1 else None)
+    if x not in df.columns or y not in df.columns:
+        return None, None
+    return x, y
+
+
+def _draw_bar(ax, df: pd.DataFrame, spec: Dict[str, Any]) -> bool:
+    x, y = _xy(df, spec)
+    if not (x and y):
+        return False
+    ax.bar(df[x].astype(str), pd.to_numeric(df[y], errors="coerce"))
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    ax.tick_params(axis="x", labelrotation=45)
+    return True
+
+
+def _draw_line(ax, df: pd.DataFrame, spec: Dict[str, Any]) -> bool:
+    x, y = _xy(df, spec)
+    if not (x and y):
+        return False
+    ax.plot(df[x], pd.to_numeric(df[y], errors="coerce"))
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    return True
+
+
+def _draw_scatter(ax, df: pd.DataFrame, spec: Dict[str, Any]) -> bool:
+    x, y = _xy(df, spec)
+    if not (x and y):
+        return False
+    ax.scatter(df[x], df[y], s=8)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    return True
+
+
+def _draw_pie(ax, df: pd.DataFrame, spec: Dict[str, Any]) -> bool:
+    label = spec.get("label") or spec.get("x")
+    value = spec.get("value") or spec.get("y")
+    if label not in df.columns or value not in df.columns:
+        label, value = _xy(df, {})
+    if not (label and value):
+        return False
+    ax.pie(pd.to_numeric(df[value], errors="coerce").fillna(0), labels=df[label].astype(str))
+    ax.axis("equal")
+    return True
+
+
+_DRAWERS = {
+    "histogram": _draw_histogram,
+    "bar": _draw_bar,
+    "line": _draw_line,
+    "timeseries": _draw_line,
+    "scatter": _draw_scatter,
+    "pie": _draw_pie,
+}
+
+
+def _render(df: pd.DataFrame, spec: Dict[str, Any], fmt: str, dpi: int) -> Optional[str]:
+    """Rendu pur (aucun état global) : exécutable dans un thread ou un processus."""
+    draw = _DRAWERS.get((spec.get("type") or "").lower())
+    if draw is None:
+        return None
+    fig = Figure(figsize=(8, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    if not draw(ax, df, spec):
+        return None
+    return encode_figure(fig, fmt, dpi)
+
+
+# ------------------ API publique ------------------ #
+
+def render_spec_async(
+    df: pd.DataFrame,
+    spec: Dict[str, Any],
+    fmt: Optional[str] = None,
+    dpi: Optional[int] = None,
+) -> Future:
+    """
+    Lance le rendu d'un chart_spec sur df dans le pool dédié.
+    Le Future renvoie le base64 (ou None si non rendu / mode "spec").
+    """
+    fmt, dpi = output_format(fmt), output_dpi(dpi)
+    done: Future = Future()
+    if fmt == "spec" or not isinstance(spec, dict) or df is None or df.empty:
+        done.set_result(None)
+        return done
+
+    key = (data_fingerprint(df), _spec_key(spec), fmt, dpi)
+    cached = _cache.get(key)
+    if cached is not None:
+        done.set_result(cached)
+        return done
+
+    fut = _get_executor().submit(_render, df, spec, fmt, dpi)
+
+    def _store(f: Future) -> None:
+        try:
+            img = f.result()
+        except Exception as e:
+            logger.warning(f"Rendu du graphique échoué ({spec.get('type')}): {e}")
+            img = None
+        if img:
+            _cache.set(key, img)
+        done.set_result(img)
+
+    fut.add_done_callback(_store)
+    return done
+
+
+def render_spec(
+    df: pd.DataFrame,
+    spec: Dict[str, Any],
+    fmt: Optional[str] = None,
+    dpi: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Optional[str]:
+    """Version bloquante de render_spec_async. Retourne base64 ou None."""
+    try:
+        return render_spec_async(df, spec, fmt, dpi).result(timeout=timeout)
+    except Exception as e:
+        logger.warning(f"Rendu du graphique indisponible: {e}")
+        return None
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
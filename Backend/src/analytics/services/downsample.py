@@ -0,0 +1,248 @@
+"""
+Réduction côté serveur des séries envoyées aux graphiques, pilotée par le chart_spec final :
+- line / timeseries / area : LTTB (Largest-Triangle-Three-Buckets) ou buckets min/max
+- bar / pie : top-N + un bucket agrégé "Autres"
+
+Deux chemins :
+- reduce_query() : réduction poussée dans DuckDB sur la requête elle-même (min/max par bucket, top-N),
+  le résultat complet n'est jamais matérialisé côté Python ; LTTB, sans équivalent SQL, s'applique
+  ensuite sur les candidats min/max (au plus 4 × la cible)
+- downsample_rows() : lignes déjà en mémoire (plans de service, spéculation, analyse n8n), via une
+  connexion DuckDB en mémoire (aucun verrou sur le fichier)
+Les valeurs y manquantes (NULL / NaN) ne sont pas des points : elles sont écartées, jamais remplacées par 0.
+Le tableau ne reçoit qu'une page (page_rows()) ; la suite se lit par l'endpoint query/rows.
+"""
+from __future__ import annotations
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+OTHER_LABEL = "Autres"
+_SERIES_TYPES = {"line", "timeseries", "area"}
+_CATEGORY_TYPES = {"bar", "bar_horizontal", "bar_vertical", "pie"}
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        return getattr(settings, name, None) or os.getenv(name) or default
+    except Exception:
+        return os.getenv(name) or default
+
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def page_rows() -> int:
+    """Lignes de tableau renvoyées avec une réponse NL (le reste est paginé)."""
+    return int(_setting("NL_RESULT_PAGE_ROWS", 200))
+
+
+def _params(chart_spec: Dict[str, Any], keys: Optional[List[str]], target_points: Optional[int],
+            top_n: Optional[int]) -> Tuple[str, Optional[str], Optional[str], int, int]:
+    typ = (chart_spec.get("type") or "").lower()
+    if keys is None:
+        x, y = chart_spec.get("x"), chart_spec.get("y")
+    else:
+        x = chart_spec.get("x") if chart_spec.get("x") in keys else (keys[0] if keys else None)
+        y = chart_spec.get("y") if chart_spec.get("y") in keys else (keys[1] if len(keys) > 1 else None)
+    target = int(target_points or chart_spec.get("max_points") or _setting("CHART_MAX_POINTS", 2000))
+    top = int(top_n or chart_spec.get("top_n") or _setting("CHART_TOP_N", 20))
+    return typ, x, y, target, top
+
+
+def _series_method(chart_spec: Dict[str, Any]) -> str:
+    method = str(chart_spec.get("downsample") or _setting("CHART_DOWNSAMPLE_METHOD", "lttb")).lower()
+    return method if method in ("lttb", "minmax") else "lttb"
+
+
+# ------------------ Séries temporelles ------------------ #
+
+def _numeric_axis(values: pd.Series) -> np.ndarray:
+    """Axe x numérique pour le calcul des aires (dates -> epoch, sinon rang)."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype="float64")
+    dt = pd.to_datetime(values, errors="coerce")
+    if dt.notna().all():
+        return dt.astype("int64").to_numpy(dtype="float64")
+    return np.arange(len(values), dtype="float64")
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Indices retenus par LTTB (x trié croissant). Conserve le premier et le dernier point.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    out = np.empty(threshold, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[end:nxt_end].mean(), y[end:nxt_end].mean()
+        bx, by = x[start:end], y[start:end]
+        area = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def _minmax_sql(source: str, x: str, y: str, buckets: int, keep_below: int = 0) -> str:
+    """
+    Pour chaque bucket de rang, garde les points min et max de y (2 points max par bucket).
+    Sous keep_below points, chaque ligne est son propre bucket (rien n'est réduit). Les y NULL / NaN
+    sont écartés. La colonne __n porte le nombre de lignes de la source (y NULL compris).
+    """
+    return f"""
+WITH base AS (
+  SELECT *, COUNT(*) OVER () AS __n FROM {source}
+),
+src AS (
+  SELECT *, row_number() OVER (ORDER BY {_q(x)}) - 1 AS __rid, COUNT(*) OVER () AS __m
+  FROM base
+  WHERE {_q(y)} IS NOT NULL AND COALESCE(NOT isnan(TRY_CAST({_q(y)} AS DOUBLE)), TRUE)
+),
+bk AS (
+  SELECT *, CASE WHEN __m <= {int(keep_below)} THEN __rid ELSE __rid * {int(buckets)} // __m END AS __bucket
+  FROM src
+),
+ext AS (
+  SELECT __bucket, arg_min(__rid, {_q(y)}) AS rmin, arg_max(__rid, {_q(y)}) AS rmax
+  FROM bk GROUP BY 1
+)
+SELECT bk.* EXCLUDE (__bucket, __rid, __m)
+FROM bk JOIN ext ON bk.__bucket = ext.__bucket AND bk.__rid IN (ext.rmin, ext.rmax)
+ORDER BY bk.{_q(x)}
+"""
+
+
+def _lttb(df: pd.DataFrame, x: str, y: str, target: int) -> pd.DataFrame:
+    yv = pd.to_numeric(df[y], errors="coerce")
+    df = df[yv.notna()].sort_values(x, kind="stable").reset_index(drop=True)
+    idx = lttb_indices(_numeric_axis(df[x]), pd.to_numeric(df[y]).to_numpy(dtype="float64"), target)
+    return df.iloc[idx]
+
+
+def _downsample_series(df: pd.DataFrame, x: str, y: str, target: int, method: str) -> pd.DataFrame:
+    if method == "minmax":
+        with duckdb.connect() as con:
+            con.register("src_df", df)
+            return con.execute(_minmax_sql("src_df", x, y, max(1, target // 2))).fetchdf().drop(columns="__n")
+    return _lttb(df, x, y, target)
+
+
+# ------------------ Catégories ------------------ #
+
+def _top_n_sql(source: str, label: str, value: str, top_n: int) -> str:
+    """Top-N par valeur + bucket "Autres" ; __n = nombre de lignes de la source."""
+    other = OTHER_LABEL.replace("'", "''")
+    return f"""
+WITH ranked AS (
+  SELECT CAST({_q(label)} AS VARCHAR) AS lbl, CAST({_q(value)} AS DOUBLE) AS val,
+         row_number() OVER (ORDER BY {_q(value)} DESC NULLS LAST) AS rn, COUNT(*) OVER () AS n
+  FROM {source}
+)
+SELECT CASE WHEN rn <= {int(top_n)} THEN lbl ELSE '{other}' END AS {_q(label)},
+       SUM(val) AS {_q(value)}, MAX(n) AS __n
+FROM ranked
+GROUP BY 1
+ORDER BY (MIN(rn) > {int(top_n)}), 2 DESC
+"""
+
+
+def _top_n_other(df: pd.DataFrame, label: str, value: str, top_n: int) -> pd.DataFrame:
+    with duckdb.connect() as con:
+        con.register("src_df", df)
+        return con.execute(_top_n_sql("src_df", label, value, top_n)).fetchdf().drop(columns="__n")
+
+
+# ------------------ API publique ------------------ #
+
+def downsample_rows(
+    rows: List[Dict[str, Any]],
+    chart_spec: Optional[Dict[str, Any]],
+    target_points: Optional[int] = None,
+    top_n: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Retourne (lignes_pour_le_graphique, meta). meta vaut None si aucune réduction n'a été appliquée
+    (les lignes d'origine sont alors renvoyées telles quelles).
+    """
+    if not rows or not isinstance(chart_spec, dict) or not isinstance(rows[0], dict):
+        return rows, None
+
+    keys = list(rows[0].keys())
+    typ, x, y, target, top = _params(chart_spec, keys, target_points, top_n)
+    if not (x and y) or x == y:
+        return rows, None
+
+    try:
+        if typ in _SERIES_TYPES and len(rows) > target:
+            method = _series_method(chart_spec)
+            out = _downsample_series(pd.DataFrame(rows), x, y, target, method)
+        elif typ in _CATEGORY_TYPES and len(rows) > top + 1:
+            method = "top_n"
+            out = _top_n_other(pd.DataFrame(rows, columns=keys)[[x, y]], x, y, top)
+        else:
+            return rows, None
+    except Exception as e:
+        logger.warning(f"Réduction du graphique ignorée ({typ}): {e}")
+        return rows, None
+
+    out = out.where(pd.notna(out), None)
+    chart_rows = [{k: (v.item() if isinstance(v, np.generic) else v) for k, v in r.items()}
+                  for r in out.to_dict("records")]
+    return chart_rows, {"method": method, "source_rows": len(rows), "points": len(chart_rows)}
+
+
+def reduce_query(
+    sql: str,
+    chart_spec: Optional[Dict[str, Any]],
+    run: Callable[[str], List[Dict[str, Any]]],
+    target_points: Optional[int] = None,
+    top_n: Optional[int] = None,
+) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+    """
+    Réduit la série du graphique dans DuckDB, sur la requête elle-même : run(sql_réduit) exécute
+    (ex. run_sql_safe, donc admission, créneau et comptabilité). None si le chart_spec ne se prête pas à
+    une réduction SQL (type non réductible, x / y non explicites) : utiliser downsample_rows().
+    meta : {"method", "source_rows", "points", "pushdown"} ; method vaut None si rien n'a été réduit.
+    """
+    if not isinstance(chart_spec, dict):
+        return None
+    typ, x, y, target, top = _params(chart_spec, None, target_points, top_n)
+    if not (x and y) or x == y:
+        return None
+    source = f"({sql.strip().rstrip(';')}) __src"
+    if typ in _SERIES_TYPES:
+        method = _series_method(chart_spec)
+        # LTTB n'a pas d'équivalent SQL : candidats min/max (2 par bucket, 2 × cible buckets) puis LTTB
+        buckets = max(1, target // 2) if method == "minmax" else 2 * target
+        rows = run(_minmax_sql(source, x, y, buckets, keep_below=target))
+    elif typ in _CATEGORY_TYPES:
+        method = "top_n"
+        rows = run(_top_n_sql(source, x, y, top))
+    else:
+        return None
+    if not rows:
+        return None
+    source_rows = int(rows[0]["__n"])
+    rows = [{k: v for k, v in r.items() if k != "__n"} for r in rows]
+    if method == "lttb" and len(rows) > target:
+        out = _lttb(pd.DataFrame(rows), x, y, target).where(lambda d: pd.notna(d), None)
+        rows = [{k: (v.item() if isinstance(v, np.generic) else v) for k, v in r.items()}
+                for r in out.to_dict("records")]
+    reduced = source_rows > len(rows) if method != "top_n" else source_rows > top + 1
+    return rows, {"method": method if reduced else None, "source_rows": source_rows,
+                  "points": len(rows), "pushdown": True}
@@ -0,0 +1,486 @@
+"""
+Service moteur : un processus dédié possède le fichier DuckDB, les workers Django en sont clients.
+
+DuckDB n'accepte qu'un processus en lecture-écriture par fichier : plusieurs workers gunicorn plus les
+commandes de gestion (load_demo, ...) se disputent le verrou. Avec DUCKDB_ENGINE_SOCKET, duck.connect()
+renvoie une RemoteConnection vers ce service (`manage.py run_engine`) au lieu d'ouvrir le fichier :
+- une session par connexion cliente = un curseur sur l'unique instance DuckDB du service (requêtes
+  concurrentes entre sessions, réglages ENGINE_SETTINGS appliqués une fois au démarrage)
+- résultats diffusés en lots Arrow (IPC) à la demande du client : fetch_df_chunk() et la lecture bornée
+  de duck.query() ne matérialisent que ce qu'elles lisent, côté service comme côté client
+- ingestion : le DataFrame voyage en Arrow et est enregistré comme vue de la session (con.register)
+- annulation : interrupt() ouvre une seconde connexion et interrompt la requête de la session
+- démarrage : le fichier DuckDB est ouvert (et verrouillé) avant toute action sur la socket ; une socket
+  existante qui répond fait échouer le démarrage, seule une socket orpheline (refus de connexion) est supprimée
+- accès : socket en 0660, pair vérifié (SO_PEERCRED : même utilisateur que le service, ou root) et, si
+  DUCKDB_ENGINE_TOKEN est défini, jeton exigé dans la première trame de chaque connexion
+
+Protocole (socket Unix, requête / réponse) : trame = [taille en-tête u32][taille corps u64][en-tête JSON][corps].
+Opérations : hello, execute, fetch, ingest, unregister, profile, cancel, stats.
+Les erreurs DuckDB sont renvoyées par nom de classe et relevées côté client (duckdb.CatalogException, ...).
+"""
+from __future__ import annotations
+import hmac
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+_FRAME = struct.Struct("!IQ")
+_VECTOR = 2048  # lignes par vecteur DuckDB : unité de fetch_df_chunk()
+_BATCH_ROWS = 8 * _VECTOR
+
+_sessions: Dict[str, "_Session"] = {}
+_sessions_lock = threading.Lock()
+_counters: Counter = Counter()
+_local = threading.local()
+
+
+class EngineUnavailable(RuntimeError):
+    """Service moteur injoignable (socket absente, processus arrêté)."""
+
+
+def _token() -> str:
+    return os.getenv("DUCKDB_ENGINE_TOKEN", "")
+
+
+# ------------------ Trames ------------------ #
+
+def _read_exact(sock: socket.socket, n: int) -> bytearray:
+    buf = bytearray(n)
+    view, got = memoryview(buf), 0
+    while got < n:
+        r = sock.recv_into(view[got:], n - got)
+        if not r:
+            raise ConnectionError("connexion fermée par le pair")
+        got += r
+    return buf
+
+
+def _send(sock: socket.socket, header: Dict[str, Any], body: Any = b"") -> None:
+    head = json.dumps(header, default=str).encode()
+    view = memoryview(body)
+    sock.sendall(_FRAME.pack(len(head), view.nbytes) + head)
+    if view.nbytes:
+        sock.sendall(view)
+
+
+def _recv(sock: socket.socket) -> Tuple[Dict[str, Any], bytearray]:
+    head_len, body_len = _FRAME.unpack(_read_exact(sock, _FRAME.size))
+    header = json.loads(bytes(_read_exact(sock, head_len)))
+    return header, (_read_exact(sock, body_len) if body_len else bytearray())
+
+
+def _ipc(schema: pa.Schema, batches: List[pa.RecordBatch] = ()) -> pa.Buffer:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    return sink.getvalue()
+
+
+def _read_ipc(body) -> pa.Table:
+    return pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+
+
+# ------------------ Service ------------------ #
+
+class _Session:
+    """Un client : son curseur DuckDB, le résultat en cours de lecture, ses vues enregistrées."""
+
+    def __init__(self, db: duckdb.DuckDBPyConnection, sid: str):
+        self.sid = sid
+        self.con = db.cursor()
+        self.reader: Optional[pa.RecordBatchReader] = None
+        self.registered: Dict[str, pa.Table] = {}
+
+    def execute(self, sql: str, params: Optional[list]) -> Optional[pa.Schema]:
+        self.reader = None
+        self.con.execute(sql, params or [])
+        if self.con.description is None:
+            return None
+        to_reader = getattr(self.con, "to_arrow_reader", None) or self.con.fetch_record_batch
+        self.reader = to_reader(_BATCH_ROWS)
+        return self.reader.schema
+
+    def fetch(self, sock: socket.socket, rows: Optional[int]) -> None:
+        """Envoie des lots jusqu'à `rows` lignes (tout le reste si None), puis une trame de fin."""
+        sent = 0
+        while self.reader is not None and (rows is None or sent < rows):
+            try:
+                batch = self.reader.read_next_batch()
+            except StopIteration:
+                self.reader = None
+                break
+            _send(sock, {"batch": batch.num_rows}, _ipc(batch.schema, [batch]))
+            sent += batch.num_rows
+            _counters["rows_sent"] += batch.num_rows
+        _send(sock, {"done": self.reader is None})
+
+    def close(self) -> None:
+        self.reader = None
+        self.registered.clear()
+        try:
+            self.con.close()
+        except Exception:
+            pass
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        server: EngineServer = self.server  # type: ignore[assignment]
+        sock = self.request
+        session: Optional[_Session] = None
+        authenticated = False
+        try:
+            while True:
+                try:
+                    header, body = _recv(sock)
+                except ConnectionError:
+                    return
+                if not authenticated:
+                    # première trame de la connexion (hello, cancel ou stats) : pair et jeton vérifiés
+                    if not server.authorized(sock, header):
+                        _counters["denied"] += 1
+                        _send(sock, {"error": "accès au service moteur refusé", "type": "PermissionException"})
+                        return
+                    authenticated = True
+                op = header.get("op")
+                _counters[op] += 1
+                try:
+                    if op == "hello":
+                        session = server.open_session()
+                        _send(sock, {"session": session.sid, "duckdb": duckdb.__version__})
+                    elif op == "cancel":
+                        _send(sock, {"cancelled": server.cancel(str(header.get("session")))})
+                        return
+                    elif op == "stats":
+                        _send(sock, server.stats())
+                        return
+                    elif session is None:
+                        raise RuntimeError("session non ouverte (hello attendu)")
+                    elif op == "execute":
+                        schema = session.execute(header["sql"], header.get("params"))
+                        types = [str(d[1]) for d in session.con.description or []]
+                        _send(sock, {"columns": schema is not None, "types": types},
+                              _ipc(schema) if schema is not None else b"")
+                    elif op == "fetch":
+                        session.fetch(sock, header.get("rows"))
+                    elif op == "ingest":
+                        table = _read_ipc(body)
+                        session.registered[header["name"]] = table
+                        session.con.register(header["name"], table)
+                        _counters["rows_ingested"] += table.num_rows
+                        _send(sock, {"rows": table.num_rows})
+                    elif op == "unregister":
+                        session.con.unregister(header["name"])
+                        session.registered.pop(header["name"], None)
+                        _send(sock, {})
+                    elif op == "profile":
+                        _send(sock, {"profile": session.con.get_profiling_information(format=header.get("format", "json"))})
+                    else:
+                        raise ValueError(f"opération inconnue: {op}")
+                except (ConnectionError, BrokenPipeError):
+                    return
+                except Exception as e:
+                    _counters["errors"] += 1
+                    _send(sock, {"error": str(e), "type": type(e).__name__})
+        finally:
+            if session is not None:
+                server.close_session(session)
+
+
+class EngineServer(socketserver.ThreadingUnixStreamServer):
+    """Possède la base DuckDB ; un thread par client connecté."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, db_path: str, settings: Optional[Dict[str, Any]] = None,
+                 token: Optional[str] = None):
+        self.socket_path = socket_path
+        self.token = _token() if token is None else token
+        self._bound = False
+        self._ids = itertools.count(1)
+        self.started = time.time()
+        # verrou du fichier d'abord : un second service échoue ici (IOException) sans toucher à la socket
+        self.db = duckdb.connect(db_path)
+        try:
+            for key, value in (settings or {}).items():
+                self.db.execute(f"SET {key} = '{str(value).replace(chr(39), chr(39) * 2)}'")
+            _claim_socket(socket_path)
+            umask = os.umask(0o117)  # socket créée directement en 0660
+            try:
+                super().__init__(socket_path, _Handler)
+            finally:
+                os.umask(umask)
+            self._bound = True
+        except BaseException:
+            self.db.close()
+            raise
+
+    def authorized(self, sock: socket.socket, header: Dict[str, Any]) -> bool:
+        uid = _peer_uid(sock)
+        if uid is not None and uid not in (0, os.getuid()):
+            return False
+        return not self.token or hmac.compare_digest(str(header.get("token") or ""), self.token)
+
+    def open_session(self) -> _Session:
+        session = _Session(self.db, f"s{next(self._ids)}")
+        with _sessions_lock:
+            _sessions[session.sid] = session
+        return session
+
+    def close_session(self, session: _Session) -> None:
+        with _sessions_lock:
+            _sessions.pop(session.sid, None)
+        session.close()
+
+    def cancel(self, sid: str) -> bool:
+        with _sessions_lock:
+            session = _sessions.get(sid)
+        if session is None:
+            return False
+        session.con.interrupt()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with _sessions_lock:
+            sessions = len(_sessions)
+        return {"sessions": sessions, "uptime_s": round(time.time() - self.started, 1),
+                "duckdb": duckdb.__version__, "counters": dict(_counters)}
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self._bound:  # jamais la socket d'un autre service (échec du bind)
+            self._bound = False
+            self.db.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+def _claim_socket(path: str) -> None:
+    """Libère `path` s'il s'agit d'une socket orpheline ; OSError si un service y répond ou si ce n'en est pas une."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} existe et n'est pas une socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.settimeout(1.0)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)  # arrêt brutal précédent : personne n'écoute
+        return
+    finally:
+        probe.close()
+    raise OSError(f"un service moteur répond déjà sur {path}")
+
+
+def _peer_uid(sock: socket.socket) -> Optional[int]:
+    """Utilisateur du processus client (Linux, SO_PEERCRED) ; None si l'information n'est pas disponible."""
+    opt = getattr(socket, "SO_PEERCRED", None)
+    if opt is None:
+        return None
+    try:
+        _pid, uid, _gid = struct.unpack("3i", sock.getsockopt(socket.SOL_SOCKET, opt, struct.calcsize("3i")))
+    except OSError:
+        return None
+    return uid
+
+
+# ------------------ Client ------------------ #
+
+def _converter() -> duckdb.DuckDBPyConnection:
+    """DuckDB en mémoire (par thread) : Arrow -> DataFrame / tuples avec les conversions de .df() / fetchall()."""
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = _local.con = duckdb.connect()
+    return con
+
+
+def _raise(header: Dict[str, Any]) -> None:
+    if "error" in header:
+        exc = getattr(duckdb, str(header.get("type")), None)
+        if not (isinstance(exc, type) and issubclass(exc, Exception)):
+            exc = duckdb.Error
+        raise exc(header["error"])
+
+
+def _open(path: str, timeout: Optional[float] = None) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        sock.close()
+        raise EngineUnavailable(f"Service moteur injoignable sur {path} ({e}) ; lancez `manage.py run_engine`.") from e
+    return sock
+
+
+def _call(path: str, header: Dict[str, Any], timeout: float = 5.0, token: Optional[str] = None) -> Dict[str, Any]:
+    """Appel ponctuel sur une connexion dédiée (cancel, stats)."""
+    sock = _open(path, timeout)
+    try:
+        _send(sock, {**header, "token": _token() if token is None else token})
+        reply, _ = _recv(sock)
+    finally:
+        sock.close()
+    _raise(reply)
+    return reply
+
+
+class RemoteConnection:
+    """
+    Sous-ensemble de DuckDBPyConnection utilisé par analytics (execute, fetch*, df, fetch_df_chunk,
+    register / unregister, interrupt, get_profiling_information, close, contexte `with`).
+    Comme DuckDB, execute() renvoie la connexion elle-même, porteuse du résultat courant.
+    """
+
+    def __init__(self, path: str, token: Optional[str] = None):
+        self.path = path
+        self.token = _token() if token is None else token
+        self._sock = _open(path)
+        self._lock = threading.Lock()
+        self._schema: Optional[pa.Schema] = None
+        self._types: List[str] = []
+        self._pending: List[pa.RecordBatch] = []
+        self._exhausted = True
+        self.session = self._request({"op": "hello", "token": self.token})[0]["session"]
+
+    def _request(self, header: Dict[str, Any], body: Any = b"") -> Tuple[Dict[str, Any], bytearray]:
+        if self._sock is None:
+            raise duckdb.ConnectionException("Connection already closed!")
+        try:
+            _send(self._sock, header, body)
+            reply, data = _recv(self._sock)
+        except (ConnectionError, OSError) as e:
+            raise EngineUnavailable(f"Service moteur perdu ({e})") from e
+        _raise(reply)
+        return reply, data
+
+    # -- exécution -- #
+
+    def execute(self, sql: str, params: list | tuple | None = None) -> "RemoteConnection":
+        self._pending, self._schema, self._exhausted = [], None, True
+        reply, body = self._request({"op": "execute", "sql": sql, "params": list(params or [])})
+        if reply.get("columns"):
+            self._schema = pa.ipc.open_stream(pa.py_buffer(body)).schema
+            self._types = reply.get("types") or [str(f.type) for f in self._schema]
+            self._exhausted = False
+        return self
+
+    def _fill(self, rows: Optional[int]) -> None:
+        """Lit des lots jusqu'à disposer de `rows` lignes en attente (tout le résultat si None)."""
+        have = sum(b.num_rows for b in self._pending)
+        if self._exhausted or (rows is not None and have >= rows):
+            return
+        _send(self._sock, {"op": "fetch", "rows": None if rows is None else rows - have})
+        while True:
+            reply, body = _recv(self._sock)
+            _raise(reply)
+            if "done" in reply:
+                self._exhausted = bool(reply["done"])
+                return
+            self._pending.extend(_read_ipc(body).to_batches())
+
+    def _take(self, rows: Optional[int]) -> pa.Table:
+        if self._schema is None:
+            raise duckdb.InvalidInputException("No open result set")
+        self._fill(rows)
+        table = pa.Table.from_batches(self._pending, schema=self._schema)
+        if rows is not None and table.num_rows > rows:
+            table, rest = table.slice(0, rows), table.slice(rows)
+            self._pending = rest.to_batches()
+        else:
+            self._pending = []
+        return table
+
+    @property
+    def description(self):
+        if self._schema is None:
+            return None
+        return [(f.name, t, None, None, None, None, None) for f, t in zip(self._schema, self._types)]
+
+    def fetch_arrow_table(self) -> pa.Table:
+        return self._take(None)
+
+    arrow = fetch_arrow_table
+
+    def df(self) -> pd.DataFrame:
+        return _converter().from_arrow(self._take(None)).df()
+
+    fetchdf = df
+
+    def fetch_df_chunk(self, vectors_per_chunk: int = 1) -> pd.DataFrame:
+        return _converter().from_arrow(self._take(vectors_per_chunk * _VECTOR)).df()
+
+    def fetchall(self) -> List[tuple]:
+        return _converter().from_arrow(self._take(None)).fetchall()
+
+    def fetchmany(self, size: int = 1) -> List[tuple]:
+        return _converter().from_arrow(self._take(size)).fetchall()
+
+    def fetchone(self) -> Optional[tuple]:
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    # -- ingestion, profilage, annulation -- #
+
+    def register(self, name: str, df) -> "RemoteConnection":
+        table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+        self._request({"op": "ingest", "name": name}, _ipc(table.schema, table.to_batches()))
+        return self
+
+    def unregister(self, name: str) -> "RemoteConnection":
+        self._request({"op": "unregister", "name": name})
+        return self
+
+    def get_profiling_information(self, format: str = "json") -> str:
+        return self._request({"op": "profile", "format": format})[0]["profile"]
+
+    def interrupt(self) -> None:
+        """Interrompt la requête en cours de la session (depuis un autre thread)."""
+        _call(self.path, {"op": "cancel", "session": self.session}, token=self.token)
+
+    def close(self) -> None:
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+
+    def __enter__(self) -> "RemoteConnection":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def stats(path: str, token: Optional[str] = None) -> Dict[str, Any]:
+    """Sessions ouvertes et compteurs du service moteur."""
+    return _call(path, {"op": "stats"}, token=token)
+
+
+def serve(socket_path: str, db_path: str, settings: Optional[Dict[str, Any]] = None,
+          token: Optional[str] = None) -> None:
+    with EngineServer(socket_path, db_path, settings, token) as server:
+        logger.info(f"[engine] {db_path} servi sur {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
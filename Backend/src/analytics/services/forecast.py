@@ -0,0 +1,151 @@
+"""
+Prévision multi-séries (intent "forecast").
+
+- Séries construites en une agrégation DuckDB (planner.build_series_sql : une série par catégorie)
+- Grille temporelle commune : matrice Y (périodes × séries), périodes absentes = 0
+- Modèle tendance linéaire (+ saisonnalité par indicatrices si l'historique couvre 2 saisons)
+- Un seul np.linalg.lstsq pour toutes les séries (la matrice de design est partagée),
+  résidus et intervalles de prévision calculés en bloc
+"""
+from __future__ import annotations
+import logging
+import time
+from statistics import NormalDist
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import stats
+from .planner import compile_plan
+from ..duck import run_sql
+
+logger = logging.getLogger(__name__)
+
+# longueur de saison par grain (None = pas de saisonnalité)
+SEASON_LENGTH = {"day": 7, "week": 52, "month": 12, "quarter": 4, "year": None}
+_OFFSETS = {
+    "day": pd.DateOffset(days=1),
+    "week": pd.DateOffset(weeks=1),
+    "month": pd.DateOffset(months=1),
+    "quarter": pd.DateOffset(months=3),
+    "year": pd.DateOffset(years=1),
+}
+
+
+def design_matrix(t: np.ndarray, season: Optional[int]) -> np.ndarray:
+    """Colonnes : constante, tendance, puis (season - 1) indicatrices de position dans la saison."""
+    cols = [np.ones_like(t, dtype="float64"), t.astype("float64")]
+    if season:
+        pos = t.astype(np.int64) % season
+        cols += [(pos == k).astype("float64") for k in range(1, season)]
+    return np.column_stack(cols)
+
+
+def fit_predict(
+    Y: np.ndarray,
+    horizon: int,
+    season: Optional[int] = None,
+    level: float = 0.95,
+) -> Dict[str, np.ndarray]:
+    """
+    Ajuste toutes les séries (colonnes de Y, shape (T, n)) en un seul moindres carrés.
+    Retourne forecast / lower / upper de shape (horizon, n), sigma (n,) et le modèle utilisé.
+    """
+    T, n = Y.shape
+    if season and T < 2 * season:
+        season = None
+    X = design_matrix(np.arange(T), season)
+    p = X.shape[1]
+    if T <= p:
+        # pas assez d'historique : niveau constant
+        season, X = None, design_matrix(np.arange(T), None)[:, :1]
+        p = 1
+    B, *_ = np.linalg.lstsq(X, Y, rcond=None)               # (p, n)
+    resid = Y - X @ B
+    dof = max(T - p, 1)
+    sigma = np.sqrt((resid ** 2).sum(axis=0) / dof)           # (n,)
+
+    Xf = design_matrix(np.arange(T, T + horizon), season)[:, :p]
+    pred = Xf @ B                                             # (horizon, n)
+    # levier commun à toutes les séries : diag(Xf (X'X)^-1 Xf')
+    xtx_inv = np.linalg.pinv(X.T @ X)
+    lev = np.einsum("ij,jk,ik->i", Xf, xtx_inv, Xf)
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    half = z * np.sqrt(1.0 + lev)[:, None] * sigma[None, :]
+    return {"forecast": pred, "lower": pred - half, "upper": pred + half, "sigma": sigma,
+            "model": "trend+seasonal" if season else ("trend" if p > 1 else "level")}
+
+
+def _pivot(series: pd.DataFrame, grain: str) -> Tuple[pd.DatetimeIndex, list, np.ndarray]:
+    series = series.assign(ts=pd.to_datetime(series["ts"]))
+    grid = pd.date_range(series["ts"].min(), series["ts"].max(), freq=_OFFSETS[grain])
+    wide = (series.pivot_table(index="ts", columns="category", values="val", aggfunc="sum", dropna=False)
+            .reindex(grid).fillna(0.0))
+    return grid, list(wide.columns), wide.to_numpy(dtype="float64")
+
+
+def run(plan: Dict[str, Any]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Prévision de la mesure pour chaque catégorie.
+    Champs plan : dataset, date_col, amount_col, category_col (optionnel), grain (optionnel),
+    horizon (défaut 12), seasonal (défaut True), level (défaut 0.95), include_history (défaut False).
+    Lignes : category, ts, kind (history | forecast), value, lower, upper.
+    """
+    plan = {**plan, "intent": "forecast"}
+    horizon = max(1, min(int(plan.get("horizon") or 12), 1000))
+    level = float(plan.get("level") or 0.95)
+    sql, meta = compile_plan(plan)
+    grain = meta["grain"]
+
+    series = run_sql(sql)
+    if series.empty:
+        return pd.DataFrame(columns=["category", "ts", "kind", "value", "lower", "upper"]), {**meta, "series": 0}
+
+    series["category"] = series["category"].astype(object).fillna("Total" if not plan.get("category_col") else "(vide)")
+    grid, cats, Y = _pivot(series, grain)
+    # dernière période incomplète (données arrêtées en cours de période) : exclue de l'ajustement
+    last_day = pd.to_datetime(series["ts"]).max()
+    col = stats.column_stats(plan["dataset"], plan.get("date_col") or "date")
+    raw_max = pd.to_datetime(col["max"], errors="coerce") if col and col.get("max") else None
+    if (raw_max is not None and not pd.isna(raw_max) and len(grid) > 2
+            and raw_max.normalize() < last_day + _OFFSETS[grain] - pd.Timedelta(days=1)):
+        grid, Y = grid[:-1], Y[:-1]
+
+    t0 = time.perf_counter()
+    season = SEASON_LENGTH.get(grain) if plan.get("seasonal", True) else None
+    fit = fit_predict(Y, horizon, season, level)
+    fit_ms = (time.perf_counter() - t0) * 1000
+
+    future = pd.date_range(grid[-1] + _OFFSETS[grain], periods=horizon, freq=_OFFSETS[grain])
+    n = len(cats)
+    out = pd.DataFrame({
+        "category": np.tile(np.array(cats, dtype=object), horizon),
+        "ts": np.repeat(future.values, n),
+        "kind": "forecast",
+        "value": fit["forecast"].ravel(),
+        "lower": fit["lower"].ravel(),
+        "upper": fit["upper"].ravel(),
+    })
+    if plan.get("include_history"):
+        hist = pd.DataFrame({
+            "category": np.tile(np.array(cats, dtype=object), len(grid)),
+            "ts": np.repeat(grid.values, n),
+            "kind": "history",
+            "value": Y.ravel(),
+            "lower": np.nan,
+            "upper": np.nan,
+        })
+        out = pd.concat([hist, out], ignore_index=True)
+    out = out.sort_values(["category", "ts"], kind="stable", na_position="first").reset_index(drop=True)
+
+    logger.info(f"[forecast] {n} série(s) × {len(grid)} périodes ajustées en {fit_ms:.1f} ms")
+    return out, {
+        **meta,
+        "series": n,
+        "periods": len(grid),
+        "horizon": horizon,
+        "level": level,
+        "model": fit["model"],
+        "fit_ms": round(fit_ms, 2),
+    }
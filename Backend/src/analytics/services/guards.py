@@ -22,7 +22,8 @@ def is_safe(sql: str) -> bool:
         return False
 
     s = sql.strip().lower()
-    if not s.startswith("select"):
+    # SELECT simple ou précédé de CTE (WITH ... SELECT), les tokens interdits restent filtrés
+    if not (s.startswith("select") or s.startswith("with")):
         return False
 
     # Pas de commentaires
@@ -64,3 +65,20 @@ def wrap_sample(sql: str, perc: Optional[float]) -> str:
     inner = sql.strip().rstrip(";")
     # Syntaxe DuckDB : FROM ( ... ) t USING SAMPLE <p> PERCENT
     return f"SELECT * FROM ({inner}) t USING SAMPLE {perc} PERCENT"
+
+
+def wrap_page(sql: str, limit: int, offset: int = 0) -> str:
+    """
+    Une page du résultat : la requête devient une sous-requête (son propre LIMIT / ORDER BY est respecté).
+    Ne lève pas d'exception.
+    """
+    if not sql:
+        return sql
+    inner = sql.strip().rstrip(";")
+    return f"SELECT * FROM ({inner}) t LIMIT {max(0, int(limit))} OFFSET {max(0, int(offset))}"
+
+
+def normalize_sql(sql: str) -> str:
+    """Forme canonique pour comparer deux requêtes (espaces, casse hors littéraux, ';' final)."""
+    parts = re.split(r"('(?:[^']|'')*')", (sql or "").strip().rstrip(";"))
+    return "".join(p if p.startswith("'") else re.sub(r"\s+", " ", p).lower() for p in parts).strip()
@@ -1,12 +1,214 @@
 """
 KPIs et petites fonctions statistiques reutilisables
 (utilisables dans des post-traitements Django si besoin).
+
+Les calculs travaillent sur des colonnes NumPy (listes, Series pandas et tableaux Arrow
+sont convertis sans boucle Python). Les valeurs manquantes (None / NaN) sont ignorées.
+- Moments : accumulateur de Welford fusionnable (morceaux, workers) pour count/moyenne/variance/min/max
+- growth_rates / zscores / percentiles : versions vectorisées
+- moving_mean / moving_std / moving_quantile : fenêtres glissantes
+Les fonctions scalaires historiques (mean, stddev_pop, growth_rate, zscore) restent des enveloppes.
+
+Les mêmes KPIs existent côté SQL (macros DuckDB installées sur chaque connexion de duck.connect()) :
+safe_div, growth_rate, zscore, et leurs équivalents fenêtrés period_growth, zscore_over,
+rolling_zscore, share_of_total (+ variantes *_by partitionnées).
 """
 from __future__ import annotations
-from typing import Iterable, Optional
-import math
+from dataclasses import dataclass
+import json
+import warnings
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import duckdb
+import numpy as np
+
+from .cache import LRUCache
+from ..duck import _NUMERIC_TYPES, _id, dataset_version, on_connect, query
+
+ArrayLike = Union[Iterable[float], np.ndarray]
+
+
+def as_array(xs: Any) -> np.ndarray:
+    """Colonne float64 (None -> NaN) depuis une liste, un itérable, une Series ou un tableau Arrow."""
+    if isinstance(xs, np.ndarray):
+        arr = xs
+    elif hasattr(xs, "to_numpy"):
+        try:
+            arr = xs.to_numpy(zero_copy_only=False)  # pyarrow.Array / ChunkedArray
+        except TypeError:
+            arr = xs.to_numpy()  # pandas
+    elif isinstance(xs, (list, tuple)):
+        arr = xs
+    else:
+        arr = list(xs)
+    return np.asarray(arr, dtype="float64")
+
+
+def _valid(xs: Any) -> np.ndarray:
+    arr = as_array(xs)
+    return arr[~np.isnan(arr)]
+
+
+# ------------------ Accumulateur fusionnable ------------------ #
+
+@dataclass
+class Moments:
+    """
+    Moments d'une colonne (algorithme de Welford / Chan) : count, mean, m2 (somme des carrés
+    des écarts), min, max. update() ajoute un morceau, merge() combine deux résultats partiels.
+    """
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    min: float = float("inf")
+    max: float = float("-inf")
+
+    @classmethod
+    def of(cls, xs: Any) -> "Moments":
+        return cls().update(xs)
+
+    def update(self, xs: Any) -> "Moments":
+        arr = _valid(xs)
+        if arr.size:
+            mu = float(arr.mean())
+            chunk = Moments(int(arr.size), mu, float(((arr - mu) ** 2).sum()), float(arr.min()), float(arr.max()))
+            self._absorb(chunk)
+        return self
+
+    def merge(self, other: "Moments") -> "Moments":
+        """Nouveau Moments équivalent à la concaténation des deux échantillons."""
+        out = Moments(self.count, self.mean, self.m2, self.min, self.max)
+        out._absorb(other)
+        return out
+
+    __add__ = merge
+
+    def _absorb(self, o: "Moments") -> None:
+        if not o.count:
+            return
+        if not self.count:
+            self.count, self.mean, self.m2, self.min, self.max = o.count, o.mean, o.m2, o.min, o.max
+            return
+        n = self.count + o.count
+        delta = o.mean - self.mean
+        self.mean += delta * o.count / n
+        self.m2 += o.m2 + delta * delta * self.count * o.count / n
+        self.count = n
+        self.min, self.max = min(self.min, o.min), max(self.max, o.max)
+
+    @property
+    def variance(self) -> Optional[float]:
+        """Variance de population."""
+        return self.m2 / self.count if self.count else None
+
+    @property
+    def sample_variance(self) -> Optional[float]:
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def std(self) -> Optional[float]:
+        v = self.variance
+        return float(np.sqrt(v)) if v is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Moments":
+        return cls(int(d["count"]), float(d["mean"]), float(d["m2"]), float(d["min"]), float(d["max"]))
+
+
+# ------------------ Fonctions vectorisées ------------------ #
+
+def safe_divide(a: ArrayLike, b: ArrayLike, default: float = 0.0) -> np.ndarray:
+    a, b = as_array(a), as_array(b)
+    out = np.full(np.broadcast(a, b).shape, default, dtype="float64")
+    ok = (b != 0) & ~np.isnan(b)
+    np.divide(a, b, out=out, where=ok)
+    return out
+
+
+def growth_rates(curr: ArrayLike, prev: ArrayLike) -> np.ndarray:
+    """(curr - prev) / |prev| élément par élément ; 0 quand prev vaut 0 ou manque."""
+    curr, prev = as_array(curr), as_array(prev)
+    return safe_divide(curr - prev, np.abs(prev))
+
+
+def pct_change(values: ArrayLike, periods: int = 1) -> np.ndarray:
+    """Croissance de chaque point par rapport au point `periods` plus tôt (NaN pour les premiers)."""
+    arr = as_array(values)
+    out = np.full(arr.shape, np.nan)
+    if 0 < periods < arr.size:
+        out[periods:] = growth_rates(arr[periods:], arr[:-periods])
+    return out
+
+
+def zscores(values: ArrayLike, mu: Optional[float] = None, sigma: Optional[float] = None) -> np.ndarray:
+    """Z-scores ; mu / sigma (population) calculés sur les valeurs si absents. 0 si sigma nul."""
+    arr = as_array(values)
+    if mu is None or sigma is None:
+        m = Moments.of(arr)
+        mu = m.mean if mu is None else mu
+        sigma = m.std if sigma is None else sigma
+    if not sigma:
+        return np.zeros(arr.shape)
+    return (arr - mu) / sigma
+
+
+def percentiles(values: ArrayLike, qs: Sequence[float] = (25, 50, 75)) -> Dict[float, Optional[float]]:
+    """Percentiles (0-100) des valeurs non manquantes."""
+    arr = _valid(values)
+    if not arr.size:
+        return {q: None for q in qs}
+    return dict(zip(qs, (float(v) for v in np.percentile(arr, list(qs)))))
 
 
+def _windows(arr: np.ndarray, window: int) -> np.ndarray:
+    return np.lib.stride_tricks.sliding_window_view(arr, window)
+
+
+def _sliding(arr: np.ndarray, window: int, min_count: Optional[int], fn) -> np.ndarray:
+    """fn(fenêtres) sur les valeurs non manquantes, NaN si une fenêtre en a moins de `min_count`."""
+    out = np.full(arr.shape, np.nan)
+    if 0 < window <= arr.size:
+        w = _windows(arr, window)
+        enough = (~np.isnan(w)).sum(axis=1) >= max(1, min_count or 1)
+        if enough.any():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                out[window - 1:][enough] = fn(w[enough])
+    return out
+
+
+def moving_mean(values: ArrayLike, window: int, min_count: Optional[int] = None) -> np.ndarray:
+    """
+    Moyenne glissante sur `window` points (NaN tant que la fenêtre n'est pas pleine).
+    Les valeurs manquantes sont ignorées ; NaN si la fenêtre a moins de `min_count` valeurs (défaut 1).
+    """
+    arr = as_array(values)
+    out = np.full(arr.shape, np.nan)
+    if 0 < window <= arr.size:
+        valid = ~np.isnan(arr)
+        c = np.cumsum(np.insert(np.where(valid, arr, 0.0), 0, 0.0))
+        n = np.cumsum(np.insert(valid, 0, False))
+        sums, counts = c[window:] - c[:-window], n[window:] - n[:-window]
+        enough = counts >= max(1, min_count or 1)
+        out[window - 1:][enough] = sums[enough] / counts[enough]
+    return out
+
+
+def moving_std(values: ArrayLike, window: int, min_count: Optional[int] = None) -> np.ndarray:
+    """Écart-type (population) glissant sur `window` points, valeurs manquantes ignorées (cf. moving_mean)."""
+    return _sliding(as_array(values), window, min_count, lambda w: np.nanstd(w, axis=1))
+
+
+def moving_quantile(values: ArrayLike, window: int, q: float = 50, min_count: Optional[int] = None) -> np.ndarray:
+    """Percentile `q` (0-100) glissant sur `window` points (médiane glissante par défaut), cf. moving_mean."""
+    return _sliding(as_array(values), window, min_count, lambda w: np.nanpercentile(w, q, axis=1))
+
+
+# ------------------ Enveloppes scalaires ------------------ #
+
 def safe_div(a: float, b: float, default: float = 0.0) -> float:
     try:
         return a / b if b not in (0, 0.0, None) else default
@@ -18,28 +220,125 @@ def growth_rate(curr: float, prev: float) -> float:
     """Taux de croissance ( (curr - prev) / abs(prev) )."""
     if prev in (0, 0.0, None):
         return 0.0
-    return (curr - prev) / abs(prev)
+    return float(growth_rates([curr], [prev])[0])
 
 
 def mean(xs: Iterable[float]) -> Optional[float]:
-    xs = list(x for x in xs if x is not None)
-    if not xs:
-        return None
-    return sum(xs) / len(xs)
+    m = Moments.of(xs)
+    return m.mean if m.count else None
 
 
 def stddev_pop(xs: Iterable[float]) -> Optional[float]:
-    xs = list(x for x in xs if x is not None)
-    if not xs:
-        return None
-    m = mean(xs)
-    if m is None:
-        return None
-    var = sum((x - m) ** 2 for x in xs) / len(xs)
-    return math.sqrt(var)
+    return Moments.of(xs).std
 
 
 def zscore(x: float, mu: float, sigma: float) -> float:
     if sigma in (0, 0.0, None):
         return 0.0
-    return (x - mu) / sigma
+    return float(zscores([x], mu, sigma)[0])
+
+
+# ------------------ Fonctions SQL (macros DuckDB) ------------------ #
+# Macros plutôt que UDF Python : elles sont développées dans le plan et exécutées par le moteur
+# (parallèle, sans GIL ni aller-retour Python), ce qui permet aussi les versions fenêtrées.
+
+SQL_MACROS = {
+    "safe_div": "(a, b, d := 0) AS CASE WHEN b IS NULL OR b = 0 THEN d ELSE a / b END",
+    "growth_rate": "(curr, prev) AS CASE WHEN prev IS NULL OR prev = 0 THEN 0 ELSE (curr - prev) / abs(prev) END",
+    "zscore": "(x, mu, sigma) AS CASE WHEN sigma IS NULL OR sigma = 0 THEN 0 ELSE (x - mu) / sigma END",
+    # croissance vs période précédente (NULL pour la première période)
+    "period_growth": "(x, o) AS CASE WHEN lag(x) OVER (ORDER BY o) IS NULL THEN NULL "
+                     "ELSE growth_rate(x, lag(x) OVER (ORDER BY o)) END",
+    "period_growth_by": "(x, o, p) AS CASE WHEN lag(x) OVER (PARTITION BY p ORDER BY o) IS NULL THEN NULL "
+                        "ELSE growth_rate(x, lag(x) OVER (PARTITION BY p ORDER BY o)) END",
+    "zscore_over": "(x) AS zscore(x, avg(x) OVER (), stddev_pop(x) OVER ())",
+    "zscore_over_by": "(x, p) AS zscore(x, avg(x) OVER (PARTITION BY p), stddev_pop(x) OVER (PARTITION BY p))",
+    # z-score vs les w points précédents
+    "rolling_zscore": "(x, o, w) AS zscore(x, avg(x) OVER (ORDER BY o ROWS BETWEEN w PRECEDING AND 1 PRECEDING), "
+                      "stddev_samp(x) OVER (ORDER BY o ROWS BETWEEN w PRECEDING AND 1 PRECEDING))",
+    "share_of_total": "(x) AS safe_div(x, sum(x) OVER ())",
+    "share_of_total_by": "(x, p) AS safe_div(x, sum(x) OVER (PARTITION BY p))",
+}
+
+
+def sql_function_signatures() -> list[str]:
+    """Signatures des fonctions KPI disponibles en SQL (contexte pour la génération NL→SQL)."""
+    return [name + body.split(" AS ", 1)[0] for name, body in SQL_MACROS.items()]
+
+
+def register_duckdb(con, temporary: bool = True) -> None:
+    """Crée les macros KPI sur une connexion (TEMP par défaut, sinon persistées dans la base)."""
+    kind = "TEMP MACRO" if temporary else "MACRO"
+    con.execute(";\n".join(f"CREATE OR REPLACE {kind} {name}{body}" for name, body in SQL_MACROS.items()))
+
+
+@on_connect
+def _install_macros(con) -> None:
+    # macros TEMP, propres à la connexion : rien n'est écrit dans le fichier (connexions read_only comprises)
+    register_duckdb(con, temporary=True)
+
+
+# ------------------ KPIs fenêtrés (endpoint /kpis) ------------------ #
+
+_window_cache = LRUCache(maxsize=256)
+
+# erreurs DuckDB dues aux paramètres (colonne / type / valeur) et non au moteur
+_INPUT_ERRORS = (duckdb.BinderException, duckdb.ConversionException, duckdb.InvalidInputException,
+                 duckdb.CatalogException)
+
+
+def _check_columns(dataset: str, date_col: str, amount_col: Optional[str], category_col: Optional[str]) -> None:
+    """Colonnes validées contre le DESCRIBE du dataset (ValueError si inconnue ou de mauvais type)."""
+    try:
+        schema = {str(r[0]): str(r[1]).upper() for r in query(f"DESCRIBE {_id(dataset)}").itertuples(index=False)}
+    except duckdb.CatalogException:
+        raise ValueError(f"Dataset inconnu: {dataset}")
+    for role, col in (("date_col", date_col), ("measure", amount_col), ("category_col", category_col)):
+        if col is not None and col not in schema:
+            raise ValueError(f"Colonne inconnue pour '{role}': {col}")
+    if not (schema[date_col] == "DATE" or schema[date_col].startswith("TIMESTAMP")):
+        raise ValueError(f"'{date_col}' n'est pas une colonne date ({schema[date_col]})")
+    if amount_col and not schema[amount_col].startswith(_NUMERIC_TYPES):
+        raise ValueError(f"'{amount_col}' n'est pas une colonne numérique ({schema[amount_col]})")
+
+
+def window_kpis(
+    dataset: str,
+    date_col: str,
+    amount_col: Optional[str] = None,
+    grain: str = "month",
+    metrics: Optional[List[str]] = None,
+    window: int = 3,
+    category_col: Optional[str] = None,
+    date_from: Any = None,
+    date_to: Any = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Exécute planner.build_kpi_sql via runners.run_sql_safe (admission, créneau, comptabilité) et met le
+    résultat en cache par version du dataset. Colonnes inconnues, de mauvais type ou refusées par DuckDB
+    (Binder / Conversion) -> ValueError.
+    Retourne (lignes JSON-safe, meta) ; meta["cached"] indique un résultat servi depuis le cache.
+    """
+    from .planner import build_kpi_sql
+    from .runners import QueryError, run_sql_safe
+
+    version = dataset_version(dataset)
+    params = [dataset, date_col, amount_col, grain, metrics, int(window or 3), category_col,
+              str(date_from or ""), str(date_to or "")]
+    key = (version, json.dumps(params, default=str))
+    hit = _window_cache.get(key)
+    if hit is not None:
+        rows, meta = hit
+        return rows, {**meta, "cached": True}
+
+    _check_columns(dataset, date_col, amount_col, category_col)
+    sql, meta = build_kpi_sql(dataset, date_col, amount_col, grain, metrics, window, category_col, date_from, date_to)
+    try:
+        rows = run_sql_safe(sql.strip().rstrip(";"), add_limit=None, endpoint="interactive")
+    except QueryError as e:
+        if isinstance(e.__cause__, _INPUT_ERRORS):
+            raise ValueError(str(e.__cause__)) from e
+        raise
+    meta = {**meta, "sql": sql, "version": version}
+    _window_cache.set(key, (rows, meta))
+    return rows, {**meta, "cached": False}
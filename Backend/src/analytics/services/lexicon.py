@@ -0,0 +1,12 @@
+"""
+Vocabulaire partagé par les services qui analysent les questions en langage naturel
+(cache NL→SQL, index des valeurs) : mots vides français / anglais, ignorés pour comparer
+des questions ou résoudre des termes.
+"""
+from __future__ import annotations
+
+STOPWORDS = frozenset({
+    "le", "la", "les", "l", "un", "une", "des", "de", "du", "d", "au", "aux", "et", "en", "a", "sur",
+    "est", "sont", "quel", "quelle", "quels", "quelles", "moi", "me", "montre", "affiche", "donne",
+    "stp", "svp", "the", "of", "an", "show", "what", "is", "are", "please", "for", "in",
+})
@@ -0,0 +1,238 @@
+"""
+Vues matérialisées automatiques pour les requêtes "chaudes".
+
+Chaque requête exécutée par run_sql_safe est réduite à une empreinte (SQL normalisé via sqlglot).
+On suit sa fréquence et son coût cumulé ; quand une requête d'agrégat dépasse les seuils,
+son résultat est matérialisé dans `__mv_<empreinte>` et les exécutions suivantes sont réécrites
+vers cette table. Les tables sont supprimées quand une table source est rechargée
+(load_to_duckdb) et l'ensemble reste sous un budget de stockage (MATVIEW_BUDGET_MB).
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+
+from .cache import LRUCache
+from ..duck import _id, connect, on_dataset_loaded, query
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TABLE = "__matviews"
+_NON_DETERMINISTIC = {"RAND", "RANDOM", "NOW", "CURRENT_DATE", "CURRENT_TIMESTAMP", "CURRENT_TIME",
+                      "UUID", "GEN_RANDOM_UUID", "TODAY", "SAMPLE"}
+
+_stats: Dict[str, Dict[str, Any]] = {}
+_stats_lock = threading.Lock()
+_pending: set = set()
+_catalog_cache = LRUCache(maxsize=1, ttl=10)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def _enabled() -> bool:
+    return str(_setting("MATVIEW_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+# ------------------ Empreintes ------------------ #
+
+def _parse(sql: str) -> Optional[exp.Expression]:
+    try:
+        return sqlglot.parse_one(sql, read="duckdb")
+    except Exception:
+        return None
+
+
+def fingerprint(sql: str) -> str:
+    """Empreinte stable d'une requête (casse/espaces/formatage normalisés)."""
+    tree = _parse(sql)
+    norm = tree.sql(dialect="duckdb") if tree is not None else re.sub(r"\s+", " ", sql.strip().lower())
+    return hashlib.sha1(norm.rstrip(";").encode("utf-8")).hexdigest()[:16]
+
+
+def _source_tables(tree: exp.Expression) -> List[str]:
+    ctes = {c.alias_or_name for c in tree.find_all(exp.CTE)}
+    return sorted({t.name for t in tree.find_all(exp.Table) if t.name and t.name not in ctes})
+
+
+def _is_candidate(tree: Optional[exp.Expression]) -> bool:
+    """Seules les requêtes d'agrégat déterministes sur des tables utilisateur sont matérialisables."""
+    if tree is None:
+        return False
+    if not (tree.find(exp.AggFunc) or tree.find(exp.Group)):
+        return False
+    if tree.find(exp.TableSample):
+        return False
+    for f in tree.find_all(exp.Func):
+        name = (f.name if isinstance(f, exp.Anonymous) else f.sql_name()).upper()
+        if name in _NON_DETERMINISTIC:
+            return False
+    tables = _source_tables(tree)
+    return bool(tables) and not any(t.startswith("__") for t in tables)
+
+
+def mv_table_name(fp: str) -> str:
+    return f"__mv_{fp}"
+
+
+# ------------------ Catalogue ------------------ #
+
+def _ensure_catalog(con) -> None:
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} ("
+        "fingerprint VARCHAR PRIMARY KEY, mv_table VARCHAR, sql VARCHAR, source_tables VARCHAR, "
+        "bytes BIGINT, runs BIGINT, cost_s DOUBLE, created_at TIMESTAMP)"
+    )
+
+
+def _catalog() -> Dict[str, str]:
+    """Empreinte -> table matérialisée (mis en cache quelques secondes)."""
+    def _load() -> Dict[str, str]:
+        try:
+            df = query(f"SELECT fingerprint, mv_table FROM {CATALOG_TABLE}")
+        except Exception:
+            return {}
+        return dict(zip(df["fingerprint"], df["mv_table"]))
+    return _catalog_cache.get_or_set("catalog", _load)
+
+
+def invalidate_cache() -> None:
+    _catalog_cache.clear()
+
+
+# ------------------ Réécriture / suivi ------------------ #
+
+def rewrite(sql: str) -> str:
+    """Retourne la requête réécrite vers sa vue matérialisée si elle existe, sinon sql inchangé."""
+    if not _enabled() or not sql:
+        return sql
+    mv = _catalog().get(fingerprint(sql))
+    return f"SELECT * FROM {mv}" if mv else sql
+
+
+def record(sql: str, elapsed_s: float, served_from_mv: bool = False) -> None:
+    """
+    Enregistre une exécution (fréquence + coût). Déclenche la matérialisation en tâche de fond
+    quand la requête devient assez fréquente et coûteuse.
+    """
+    if not _enabled() or not sql:
+        return
+    fp = fingerprint(sql)
+    with _stats_lock:
+        st = _stats.setdefault(fp, {"runs": 0, "hits": 0, "cost_s": 0.0, "sql": sql})
+        if served_from_mv:
+            st["hits"] += 1
+            return
+        st["runs"] += 1
+        st["cost_s"] += float(elapsed_s)
+        hot = (
+            st["runs"] >= int(_setting("MATVIEW_MIN_RUNS", 3))
+            and st["cost_s"] * 1000 >= float(_setting("MATVIEW_MIN_COST_MS", 200))
+            and fp not in _pending
+        )
+        if hot:
+            _pending.add(fp)
+    if hot:
+        threading.Thread(target=_materialize_safe, args=(fp, sql), daemon=True).start()
+
+
+def _materialize_safe(fp: str, sql: str) -> None:
+    try:
+        materialize(fp, sql)
+    except Exception as e:
+        logger.warning(f"[matviews] matérialisation {fp} échouée: {e}")
+    finally:
+        with _stats_lock:
+            _pending.discard(fp)
+
+
+def materialize(fp: str, sql: str) -> Optional[str]:
+    """Crée la table matérialisée pour sql si elle est éligible et tient dans le budget."""
+    tree = _parse(sql)
+    if fp in _catalog() or not _is_candidate(tree):
+        return None
+
+    budget = int(float(_setting("MATVIEW_BUDGET_MB", 256)) * 1024 * 1024)
+    max_rows = int(_setting("MATVIEW_MAX_ROWS", 100000))
+    table = mv_table_name(fp)
+    with connect() as con:
+        _ensure_catalog(con)
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS {sql.strip().rstrip(';')}")
+        n = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        size = con.execute(
+            "SELECT COALESCE(SUM(estimated_size * column_count * 8), 0) FROM duckdb_tables() WHERE table_name = ?",
+            [table],
+        ).fetchone()[0]
+        if n > max_rows or size > budget:
+            con.execute(f"DROP TABLE {table}")
+            return None
+        _evict_for(con, int(size), budget)
+        with _stats_lock:
+            st = dict(_stats.get(fp, {}))
+        con.execute(
+            f"INSERT OR REPLACE INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, now())",
+            [fp, table, sql, json.dumps(_source_tables(tree)), int(size), st.get("runs", 0), st.get("cost_s", 0.0)],
+        )
+    invalidate_cache()
+    logger.info(f"[matviews] {table} matérialisée ({n} lignes, ~{size} octets)")
+    return table
+
+
+def _evict_for(con, needed: int, budget: int) -> None:
+    """Supprime les vues de plus faible valeur (coût moyen × exécutions) jusqu'à libérer `needed` octets."""
+    rows = con.execute(
+        f"SELECT fingerprint, mv_table, bytes, cost_s FROM {CATALOG_TABLE} ORDER BY cost_s ASC"
+    ).fetchall()
+    used = sum(r[2] for r in rows)
+    for fp, table, size, _ in rows:
+        if used + needed <= budget:
+            break
+        con.execute(f"DROP TABLE IF EXISTS {table}")
+        con.execute(f"DELETE FROM {CATALOG_TABLE} WHERE fingerprint = ?", [fp])
+        used -= size
+        logger.info(f"[matviews] {table} évincée (budget)")
+
+
+def drop_for_table(table: str) -> int:
+    """Supprime les vues matérialisées qui lisent `table`. Retourne le nombre supprimé."""
+    dropped = 0
+    with connect() as con:
+        _ensure_catalog(con)
+        rows = con.execute(f"SELECT fingerprint, mv_table, source_tables FROM {CATALOG_TABLE}").fetchall()
+        for fp, mv, sources in rows:
+            if table in json.loads(sources or "[]"):
+                con.execute(f"DROP TABLE IF EXISTS {_id(mv)}")
+                con.execute(f"DELETE FROM {CATALOG_TABLE} WHERE fingerprint = ?", [fp])
+                with _stats_lock:
+                    _stats.pop(fp, None)
+                dropped += 1
+    invalidate_cache()
+    return dropped
+
+
+@on_dataset_loaded
+def _drop_on_load(dataset: str, version: int) -> None:
+    n = drop_for_table(dataset)
+    if n:
+        logger.info(f"[matviews] {n} vue(s) supprimée(s) après rechargement de '{dataset}'")
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        tracked = len(_stats)
+    return {"tracked": tracked, "materialized": len(_catalog())}
@@ -0,0 +1,266 @@
+"""
+Cache persistant des traductions NL → SQL (payloads n8n : sql, chart_spec, summary, code_python).
+
+Clé : question normalisée (casse, accents, espaces, mots vides) + dataset + empreinte du schéma
+(get_schema) + options de la requête. Les entrées vivent dans la table interne `__nl_cache`
+(TTL, éviction LRU sur last_hit), avec un LRU mémoire devant. query_nl n'enregistre une traduction
+qu'une fois son SQL validé et exécuté avec succès.
+
+Second niveau optionnel (NL_CACHE_SIMILARITY > 0, désactivé par défaut) : formulations proches,
+restreintes au même dataset / schéma et au même ensemble de mots pleins (nombres, négations et
+comparatifs compris : « actif » ≠ « inactif », « plus » ≠ « moins », « top 5 » ≠ « top 10 ») ;
+seuls l'ordre des mots, les mots vides et les pluriels peuvent différer.
+Un changement de schéma change la clé ; les entrées orphelines sont purgées au rechargement.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from .cache import LRUCache
+from .lexicon import STOPWORDS
+from .nl_fastpath import _norm
+from ..duck import _id, connect, on_dataset_loaded
+
+logger = logging.getLogger(__name__)
+
+NL_CACHE_TABLE = "__nl_cache"
+PAYLOAD_KEYS = ("sql", "chart_spec", "summary", "code_python")
+
+# mots terminés par s / x qui ne sont pas des pluriels (mois ≠ moi, pays, prix, plus, ...)
+_INVARIABLE = {
+    "mois", "pays", "prix", "fois", "temps", "taux", "poids", "cours", "choix", "corps", "avis", "devis",
+    "colis", "plus", "moins", "sans", "sous", "vers", "dans", "depuis", "apres", "tres", "jamais",
+    "toujours", "alors", "status", "bonus", "campus", "canvas", "ios", "sms", "kpis",
+}
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def enabled() -> bool:
+    return str(_setting("NL_CACHE_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+def _ttl() -> float:
+    return float(_setting("NL_CACHE_TTL", 7 * 24 * 3600))
+
+
+def _max_entries() -> int:
+    return int(_setting("NL_CACHE_MAX_ENTRIES", 5000))
+
+
+_mem = LRUCache(maxsize=512, ttl=300)
+_counters = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0}
+_counters_lock = threading.Lock()
+_table_ready = False
+
+
+def _bump(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+
+# ------------------ Clés ------------------ #
+
+def _stem(word: str) -> str:
+    """Pluriels réguliers : ventes -> vente, categories -> categorie (mots invariables conservés)."""
+    if len(word) <= 3 or word[-1] not in "sx" or word[-2].isdigit() or word in _INVARIABLE:
+        return word
+    return word if word.endswith(("ss", "us")) else word[:-1]
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(_stem(w) for w in _norm(question).split() if w not in STOPWORDS)
+
+
+def schema_hash(schema: str) -> str:
+    return hashlib.sha1(str(schema or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _options(options: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(options or {}, sort_keys=True, default=str)
+
+
+def _key(qnorm: str, dataset: str, shash: str, opts: str) -> str:
+    return hashlib.sha1(f"{dataset}\x00{shash}\x00{opts}\x00{qnorm}".encode("utf-8")).hexdigest()
+
+
+def _ngrams(text: str, n: int = 3) -> Counter:
+    """Trigrammes de caractères mot par mot (insensible à l'ordre des mots)."""
+    grams: Counter = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+    return grams
+
+
+def similarity(a: str, b: str) -> float:
+    """Cosinus entre vecteurs de trigrammes de caractères."""
+    va, vb = _ngrams(a), _ngrams(b)
+    dot = sum(c * vb[g] for g, c in va.items())
+    na = math.sqrt(sum(c * c for c in va.values()))
+    nb = math.sqrt(sum(c * c for c in vb.values()))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+# ------------------ Stockage ------------------ #
+
+def _ensure(con) -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {NL_CACHE_TABLE} ("
+        "key VARCHAR PRIMARY KEY, dataset VARCHAR, schema_hash VARCHAR, options VARCHAR, "
+        "question VARCHAR, payload VARCHAR, created_at DOUBLE, last_hit DOUBLE, hits BIGINT)"
+    )
+    _table_ready = True
+
+
+def lookup(
+    question: str,
+    dataset: str,
+    schema: str,
+    options: Optional[Dict[str, Any]] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """(payload, meta) si la question (ou une formulation proche) est en cache, sinon (None, None)."""
+    if not enabled():
+        return None, None
+    qnorm, shash, opts = normalize_question(question), schema_hash(schema), _options(options)
+    if not qnorm:
+        return None, None
+    key = _key(qnorm, dataset, shash, opts)
+    payload = _mem.get(key)
+    if payload is not None:
+        _bump("hits")
+        return payload, {"match": "exact", "key": key}
+
+    now = time.time()
+    try:
+        with connect() as con:
+            _ensure(con)
+            row = con.execute(
+                f"SELECT payload FROM {NL_CACHE_TABLE} WHERE key = ? AND created_at >= ?",
+                [key, now - _ttl()],
+            ).fetchone()
+            meta = {"match": "exact", "key": key}
+            if row is None and float(_setting("NL_CACHE_SIMILARITY", 0)) > 0:
+                row, meta = _similar(con, qnorm, dataset, shash, opts, now)
+            if row is None:
+                _bump("misses")
+                return None, None
+            con.execute(f"UPDATE {NL_CACHE_TABLE} SET last_hit = ?, hits = hits + 1 WHERE key = ?",
+                        [now, meta["key"]])
+    except Exception as e:
+        logger.warning(f"[nl_cache] lecture impossible: {e}")
+        return None, None
+
+    payload = json.loads(row[0])
+    _mem.set(key, payload)
+    _bump("hits" if meta["match"] == "exact" else "similar_hits")
+    return payload, meta
+
+
+def _similar(con, qnorm: str, dataset: str, shash: str, opts: str, now: float):
+    threshold = float(_setting("NL_CACHE_SIMILARITY", 0))
+    candidates = con.execute(
+        f"SELECT key, question, payload FROM {NL_CACHE_TABLE} "
+        "WHERE dataset = ? AND schema_hash = ? AND options = ? AND created_at >= ? "
+        "ORDER BY last_hit DESC LIMIT 1000",
+        [dataset, shash, opts, now - _ttl()],
+    ).fetchall()
+    tokens = set(qnorm.split())
+    best, best_score = None, threshold
+    for key, cand, payload in candidates:
+        # mêmes mots pleins exigés : un mot en plus ou en moins (négation, comparatif, nombre) change le sens
+        if set(cand.split()) != tokens:
+            continue
+        score = similarity(qnorm, cand)
+        if score >= best_score:
+            best, best_score = (key, cand, payload), score
+    if not best:
+        return None, None
+    logger.info(f"[nl_cache] '{qnorm}' ≈ '{best[1]}' ({best_score:.2f})")
+    return (best[2],), {"match": "similar", "key": best[0], "score": round(best_score, 3), "question": best[1]}
+
+
+def store(
+    question: str,
+    dataset: str,
+    schema: str,
+    payload: Dict[str, Any],
+    options: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Enregistre le payload n8n (champs utiles seulement) puis applique TTL et éviction LRU."""
+    if not enabled():
+        return
+    kept = {k: payload[k] for k in PAYLOAD_KEYS if payload.get(k)}
+    if not (kept.get("sql") or kept.get("code_python")):
+        return
+    qnorm, shash, opts = normalize_question(question), schema_hash(schema), _options(options)
+    if not qnorm:
+        return
+    key = _key(qnorm, dataset, shash, opts)
+    now = time.time()
+    try:
+        with connect() as con:
+            _ensure(con)
+            con.execute(f"INSERT OR REPLACE INTO {NL_CACHE_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                        [key, dataset, shash, opts, qnorm, json.dumps(kept, default=str), now, now])
+            con.execute(f"DELETE FROM {NL_CACHE_TABLE} WHERE created_at < ?", [now - _ttl()])
+            con.execute(
+                f"DELETE FROM {NL_CACHE_TABLE} WHERE key IN ("
+                f"SELECT key FROM {NL_CACHE_TABLE} ORDER BY last_hit DESC OFFSET ?)",
+                [_max_entries()],
+            )
+    except Exception as e:
+        logger.warning(f"[nl_cache] écriture impossible: {e}")
+        return
+    _mem.set(key, kept)
+    _bump("stores")
+
+
+@on_dataset_loaded
+def purge_stale(dataset: str, version: int) -> None:
+    """Supprime les traductions du dataset dont le schéma ne correspond plus."""
+    _mem.clear()
+    with connect() as con:
+        _ensure(con)
+        cols = con.execute(f"DESCRIBE {_id(dataset)}").fetchall()
+        # même format que views.get_schema
+        current = schema_hash(", ".join(f"{c[0]} ({c[1]})" for c in cols))
+        con.execute(f"DELETE FROM {NL_CACHE_TABLE} WHERE dataset = ? AND schema_hash <> ?", [dataset, current])
+
+
+def clear() -> None:
+    _mem.clear()
+    with connect() as con:
+        _ensure(con)
+        con.execute(f"DELETE FROM {NL_CACHE_TABLE}")
+
+
+def stats() -> Dict[str, Any]:
+    with _counters_lock:
+        out = dict(_counters)
+    try:
+        with connect() as con:
+            _ensure(con)
+            out["entries"] = con.execute(f"SELECT COUNT(*) FROM {NL_CACHE_TABLE}").fetchone()[0]
+    except Exception:
+        out["entries"] = None
+    return out
@@ -0,0 +1,306 @@
+"""
+Fast-path NL → plan : classifieur d'intention déterministe + remplissage des slots
+(grain, mesure, catégorie, top-N, année) à partir du texte de la question et du schéma en cache
+(services.stats). Les questions reconnues avec assez de confiance sont compilées directement par
+le planner ; les autres partent vers n8n comme avant.
+
+Des compteurs en mémoire mesurent la couverture (stats()).
+"""
+from __future__ import annotations
+import logging
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from . import stats as col_stats
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def enabled() -> bool:
+    return str(_setting("NL_FASTPATH_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+def _norm(text: str) -> str:
+    """Minuscules, sans accents, ponctuation -> espaces."""
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def _has(q: str, words) -> bool:
+    return any(re.search(rf"\b{w}\b", q) for w in words)
+
+
+# ------------------ Vocabulaire ------------------ #
+
+_INTENT_WORDS = {
+    "forecast": ("prevision\\w*", "prevoir", "predire", "prediction\\w*", "projection\\w*", "forecast\\w*"),
+    "anomaly": ("anomalie\\w*", "anormal\\w*", "aberrant\\w*", "outlier\\w*", "pic\\w*", "anomal\\w*"),
+    "top_growth": ("croissance", "progression", "hausse", "augmentation", "growth", "progresse\\w*"),
+    "top_total": ("top", "classement", "meilleur\\w*", "premier\\w*", "plus vendu\\w*", "palmares",
+                  "ranking", "best", "repartition"),
+    "timeseries_total": ("evolution", "tendance", "au fil", "dans le temps", "chronolog\\w*", "trend",
+                         "over time", "historique", "courbe", "par jour", "par semaine", "par mois",
+                         "par trimestre", "par an", "par annee", "mensuel\\w*", "quotidien\\w*",
+                         "hebdomadaire\\w*", "annuel\\w*", "daily", "weekly", "monthly", "yearly"),
+}
+_GRAIN_WORDS = {
+    "day": ("jour", "jours", "quotidien\\w*", "journalier\\w*", "daily", "day"),
+    "week": ("semaine\\w*", "hebdo\\w*", "weekly", "week"),
+    "month": ("mois", "mensuel\\w*", "monthly", "month"),
+    "quarter": ("trimestre\\w*", "trimestriel\\w*", "quarter\\w*"),
+    "year": ("an", "ans", "annee\\w*", "annuel\\w*", "yearly", "year"),
+}
+_COUNT_WORDS = ("nombre", "combien", "count", "nb", "volume de", "quantite de lignes")
+_MEASURE_SYNONYMS = ("vente\\w*", "chiffre d affaires", "ca", "revenu\\w*", "montant\\w*", "sales", "revenue",
+                     "recette\\w*", "total")
+# colonnes qui portent ces synonymes (revenue, sales_amount, montant_total, ca, ...)
+_MEASURE_COLUMNS = ("vente\\w*", "sales", "revenu\\w*", "montant\\w*", "amount\\w*", "total\\w*", "ca", "chiffre\\w*",
+                    "turnover", "recette\\w*")
+# grandeurs unitaires ou relatives : leur SUM n'a pas de sens, jamais prises par défaut
+_NON_ADDITIVE = ("prix", "price\\w*", "tarif\\w*", "cout\\w*", "cost\\w*", "taux", "rate\\w*",
+                 "ratio\\w*", "pct", "percent\\w*", "pourcent\\w*", "avg", "mean", "moyen\\w*")
+# filtres / calculs que le fast-path ne sait pas traduire -> LLM
+_UNSUPPORTED = ("ou", "where", "sauf", "hors", "excluding", "uniquement", "seulement", "only", "pour le",
+                "pour la", "pour les", "filtre\\w*", "superieur\\w*", "inferieur\\w*", "moyenne\\w*",
+                "median\\w*", "ratio", "correlation", "pourquoi", "explique\\w*", "compare\\w*", "versus", "vs")
+_SEASONAL_WORDS = ("saison\\w*", "jour de la semaine", "hebdomadaire\\w*")
+
+_DATE_TYPES = ("DATE", "TIMESTAMP")
+_NUM_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "FLOAT", "DOUBLE", "DECIMAL",
+              "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT")
+_CAT_TYPES = ("VARCHAR", "BOOLEAN", "ENUM")
+_ID_LIKE = {"id", "task id", "task_id"}
+
+
+@dataclass
+class FastPathMatch:
+    """Plan reconnu localement, prêt pour planner.compile_plan / runners.run_plan."""
+    plan: Dict[str, Any]
+    chart_spec: Dict[str, Any]
+    confidence: float
+    slots: Dict[str, Any] = field(default_factory=dict)
+
+
+# ------------------ Métriques ------------------ #
+
+_metrics: Dict[str, Any] = {"questions": 0, "matched": 0, "by_intent": {}, "fallback": {}}
+_metrics_lock = threading.Lock()
+
+
+def _count(matched: Optional[FastPathMatch], reason: str = "") -> None:
+    with _metrics_lock:
+        _metrics["questions"] += 1
+        if matched:
+            _metrics["matched"] += 1
+            it = matched.plan["intent"]
+            _metrics["by_intent"][it] = _metrics["by_intent"].get(it, 0) + 1
+        else:
+            _metrics["fallback"][reason] = _metrics["fallback"].get(reason, 0) + 1
+
+
+def stats() -> Dict[str, Any]:
+    with _metrics_lock:
+        q, m = _metrics["questions"], _metrics["matched"]
+        return {
+            "questions": q,
+            "matched": m,
+            "coverage": round(m / q, 4) if q else None,
+            "by_intent": dict(_metrics["by_intent"]),
+            "fallback": dict(_metrics["fallback"]),
+        }
+
+
+def reset_stats() -> None:
+    with _metrics_lock:
+        _metrics.update({"questions": 0, "matched": 0, "by_intent": {}, "fallback": {}})
+
+
+# ------------------ Classification ------------------ #
+
+def _columns(dataset: str) -> Dict[str, Dict[str, Any]]:
+    st = col_stats.get_stats(dataset)
+    return st["columns"] if st else {}
+
+
+def _token_match(t: str, words: List[str]) -> bool:
+    """Mot de colonne retrouvé dans la question : égalité, pluriel, ou préfixe commun
+    (category / categories / categorie)."""
+    for w in words:
+        if w == t or w == t + "s":
+            return True
+        k = 0
+        while k < min(len(w), len(t)) and w[k] == t[k]:
+            k += 1
+        if len(t) >= 5 and k >= max(5, len(t) - 2):
+            return True
+    return False
+
+
+def _mentioned(q: str, names: List[str]) -> Optional[str]:
+    """Colonne citée dans la question (la plus spécifique si plusieurs)."""
+    words = q.split()
+    best, best_len = None, 0
+    for name in names:
+        toks = _norm(name).split()
+        if toks and all(_token_match(t, words) for t in toks) and len(toks) > best_len:
+            best, best_len = name, len(toks)
+    return best
+
+
+def _default_measure(q: str, nums: List[str]) -> Optional[str]:
+    """
+    Mesure d'une question qui n'en cite aucune : la colonne dont le nom correspond aux synonymes
+    (ventes, CA -> revenue / amount / total), ou l'unique colonne additive. None si ambigu.
+    """
+    additive = [c for c in nums if not _has(_norm(c), _NON_ADDITIVE)]
+    named = [c for c in additive if _has(_norm(c), _MEASURE_COLUMNS)]
+    if _has(q, _MEASURE_SYNONYMS) and len(named) == 1:
+        return named[0]
+    return additive[0] if len(nums) == 1 and additive else None
+
+
+def _intent(q: str) -> Optional[str]:
+    for intent in ("forecast", "anomaly", "top_growth", "top_total", "timeseries_total"):
+        if _has(q, _INTENT_WORDS[intent]):
+            return intent
+    return None
+
+
+def classify(question: str, dataset: str) -> tuple[Optional[FastPathMatch], str]:
+    """(match, raison du rejet). match vaut None si la question n'est pas couverte avec confiance."""
+    q = _norm(question)
+    if not q:
+        return None, "empty"
+    if _has(q, _UNSUPPORTED):
+        return None, "unsupported"
+    intent = _intent(q)
+    if not intent:
+        return None, "no_intent"
+
+    cols = _columns(dataset)
+    if not cols:
+        return None, "no_schema"
+    dates = [c for c, s in cols.items() if str(s["type"]).startswith(_DATE_TYPES)]
+    nums = [c for c, s in cols.items()
+            if str(s["type"]).startswith(_NUM_TYPES) and c.lower() not in _ID_LIKE and not c.lower().endswith("_id")]
+    cats = [c for c, s in cols.items() if str(s["type"]).startswith(_CAT_TYPES) and c.lower() not in _ID_LIKE]
+
+    confidence = 0.5
+    slots: Dict[str, Any] = {}
+
+    # 🔹 Mesure : colonne citée, comptage explicite, synonyme de "montant" vers la colonne qui le porte,
+    #    ou l'unique mesure additive ; plusieurs candidates sans indice -> n8n
+    measure = _mentioned(q, nums)
+    if measure:
+        confidence += 0.25
+    elif _has(q, _COUNT_WORDS):
+        measure = None
+        confidence += 0.25
+    elif nums:
+        measure = _default_measure(q, nums)
+        if not measure:
+            return None, "ambiguous_measure"
+        confidence += 0.25 if _has(q, _MEASURE_SYNONYMS) else 0.0
+    slots["measure"] = measure
+
+    # 🔹 Date
+    date_col = _mentioned(q, dates) or (dates[0] if dates else None)
+    if intent != "top_total" and not date_col:
+        return None, "no_date"
+    slots["date_col"] = date_col
+
+    # 🔹 Catégorie ("par X" ou colonne citée)
+    category = _mentioned(q, cats)
+    if intent in ("top_total", "top_growth"):
+        if category:
+            confidence += 0.25
+        elif len(cats) == 1:
+            category = cats[0]
+            confidence += 0.1
+        else:
+            return None, "no_category"
+    elif intent == "forecast" and category:
+        confidence += 0.1
+    elif intent == "timeseries_total" and category:
+        # une série par catégorie : hors du périmètre de timeseries_total
+        return None, "unsupported"
+    else:
+        confidence += 0.25 if intent in ("timeseries_total", "anomaly") else 0.0
+    slots["category"] = category
+
+    # 🔹 Grain, top-N, année
+    grain = next((g for g, words in _GRAIN_WORDS.items() if _has(q, words)), None)
+    slots["grain"] = grain
+    m = re.search(r"\btop\s*(\d{1,4})\b|\b(\d{1,4})\s+(?:premier|meilleur|plus)", q)
+    top_n = int(m.group(1) or m.group(2)) if m else None
+    slots["top_n"] = top_n
+    years = [int(y) for y in re.findall(r"\b((?:19|20)\d{2})\b", q)]
+    year = max(years) if years else None
+    slots["year"] = year
+
+    plan: Dict[str, Any] = {"dataset": dataset, "date_col": date_col, "amount_col": measure}
+    if intent == "timeseries_total":
+        plan.update(intent="timeseries_total", limit=1000)
+        if grain:
+            plan["grain"] = grain
+        if year:
+            plan.update(date_from=f"{year}-01-01", date_to=f"{year + 1}-01-01")
+        chart = {"type": "line", "x": "ts", "y": "total"}
+    elif intent == "top_total":
+        plan.update(intent="top_total", category_col=category, limit=top_n or 10)
+        if year and date_col:
+            plan.update(date_from=f"{year}-01-01", date_to=f"{year + 1}-01-01")
+        chart = {"type": "bar", "x": "category", "y": "total"}
+    elif intent == "top_growth":
+        if not year:
+            ymax = col_stats.column_stats(dataset, date_col) or {}
+            year = int(str(ymax.get("max"))[:4]) if ymax.get("max") else None
+            if not year:
+                return None, "no_year"
+            slots["year"] = year
+        plan.update(intent="top_growth", category_col=category, year=year, limit=top_n or 10)
+        chart = {"type": "bar", "x": "category", "y": "growth_ratio"}
+    elif intent == "anomaly":
+        plan.update(intent="anomaly_seasonal" if _has(q, _SEASONAL_WORDS) else "anomaly_rolling", limit=1000)
+        chart = {"type": "line", "x": "ts", "y": "val"}
+    else:
+        plan.update(intent="forecast", category_col=category, horizon=top_n or 12)
+        if grain:
+            plan["grain"] = grain
+        chart = {"type": "line", "x": "ts", "y": "value"}
+
+    confidence = round(min(confidence, 1.0), 2)
+    if confidence < float(_setting("NL_FASTPATH_MIN_CONFIDENCE", 0.75)):
+        return None, "low_confidence"
+    return FastPathMatch(plan, chart, confidence, slots), ""
+
+
+def match(question: str, dataset: str) -> Optional[FastPathMatch]:
+    """Point d'entrée de query_nl : classe la question, met à jour les métriques."""
+    if not enabled():
+        return None
+    try:
+        m, reason = classify(question, dataset)
+    except Exception as e:
+        logger.warning(f"[fastpath] classification échouée: {e}")
+        m, reason = None, "error"
+    _count(m, reason)
+    if m:
+        logger.info(f"[fastpath] '{question}' -> {m.plan['intent']} ({m.confidence})")
+    return m
@@ -1,5 +1,5 @@
 import io
-import base64
+import os
 import contextlib
 from typing import Optional, Any, Dict
 
@@ -14,65 +14,110 @@ import seaborn as sns
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import IsolationForest
 
+from . import accounting
+from .charts import encode_figure, figure_format, output_format, render_spec, render_timeout
+from ..duck import _id, parse_bytes, query
 
-def _render_chart_to_base64() -> str:
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight")
-    buf.seek(0)
-    return base64.b64encode(buf.read()).decode("utf-8")
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+# Plafonds du runner (il partage le processus avec le moteur et les autres requêtes)
+def max_rows() -> int:
+    """Lignes chargées au plus dans le DataFrame de départ (seule borne appliquée avant l'exécution)."""
+    return int(_setting("PANDAS_MAX_ROWS", 1_000_000))
+
+
+def max_frames_memory() -> int:
+    """
+    Empreinte maximale des DataFrames restants en fin d'analyse (octets). Contrôle a posteriori : le
+    code a déjà tourné, un pic pendant l'exécution n'est pas borné ; au-delà, le résultat est refusé.
+    """
+    return parse_bytes(_setting("PANDAS_MAX_FRAMES_MEMORY", "512MB")) or 512 << 20
+
+
+def max_result_rows() -> int:
+    return int(_setting("PANDAS_MAX_RESULT_ROWS", 100_000))
+
+
+def read_bounded(path: str) -> pd.DataFrame:
+    """Charge un CSV / Excel en refusant au-delà de max_rows() lignes."""
+    low = path.lower()
+    limit = max_rows()
+    if low.endswith(".csv"):
+        df = pd.read_csv(path, nrows=limit + 1)
+    elif low.endswith(".xlsx") or low.endswith(".xls"):
+        df = pd.read_excel(path, nrows=limit + 1)
+    else:
+        raise ValueError("Format non supporté (CSV/XLSX/XLS)")
+    if len(df) > limit:
+        raise ValueError(f"Fichier trop volumineux pour une analyse Pandas (plus de {limit} lignes)")
+    return df
+
+
+def read_table_bounded(table: str) -> pd.DataFrame:
+    """Charge un dataset DuckDB (via duck.query, donc aussi à travers le service moteur) sous max_rows() lignes."""
+    limit = max_rows()
+    df = query(f"SELECT * FROM {_id(table)} LIMIT {limit + 1}")
+    if len(df) > limit:
+        raise ValueError(f"Dataset trop volumineux pour une analyse Pandas (plus de {limit} lignes) ; agrégez en SQL")
+    return df
+
+
+def _render_chart_to_base64() -> Optional[str]:
+    """Encode la figure pyplot courante (produite par le code du LLM) ; PNG en mode "spec"."""
+    return encode_figure(plt.gcf(), figure_format())
 
 
 def _fallback_plot_from_spec(df: pd.DataFrame, spec: Dict[str, Any]) -> Optional[str]:
     """
     Rend un petit graphique à partir d'un chart_spec minimal
     si le code du LLM n'a produit aucune figure. Retourne base64 ou None.
+    Le rendu passe par le service charts (Figure objet, pool dédié, cache) ; l'attente est bornée
+    à render_timeout(), au-delà le frontend dessine le chart_spec.
     """
     if not isinstance(spec, dict):
         return None
+    return render_spec(df, spec, timeout=render_timeout())
 
-    t = (spec.get("type") or "").lower()
-    try:
-        if t == "histogram":
-            # colonne x explicite sinon première numérique
-            x = spec.get("x")
-            if not x:
-                num_cols = df.select_dtypes(include=[np.number]).columns
-                if len(num_cols) == 0:
-                    return None
-                x = num_cols[0]
-            bins = int(spec.get("bins", 30))
-            plt.figure()
-            ax = sns.histplot(df[x].dropna(), bins=bins)
-            ax.set_title(f"Histogramme de {x}")
-            ax.set_xlabel(x)
-            ax.set_ylabel("Fréquence")
-            img = _render_chart_to_base64()
-            plt.close("all")
-            return img
-
-        # (tu peux ajouter d'autres types ici: bar, line, pie, scatter…)
-        return None
-    except Exception:
-        plt.close("all")
-        return None
 
-
-def run_pandas_analysis(dataset_path: Optional[str], code: str):
+def run_pandas_analysis(dataset_path: Optional[str], code: str, table: Optional[str] = None):
     """
     Exécute du code Pandas/Numpy/Sklearn généré par le LLM.
-    - dataset_path peut être None (chargement fait dans `code`, ex: DuckDB -> df)
+    - dataset_path peut être None (chargement fait dans `code`), ou `table` : dataset DuckDB chargé dans `df`
     - Retourne rows/chart/summary/chart_spec/stdout/result
+    - Temps, CPU et empreinte des DataFrames imputés au client courant (services.accounting)
+    - Plafonds : max_rows() en entrée (refus au-delà), max_result_rows() en sortie ("truncated": True),
+      max_frames_memory() vérifié après exécution sur les DataFrames restants
     """
-    # 1) éventuel chargement initial local
-    df = None
-    if dataset_path:
-        low = dataset_path.lower()
-        if low.endswith(".csv"):
-            df = pd.read_csv(dataset_path)
-        elif low.endswith(".xlsx") or low.endswith(".xls"):
-            df = pd.read_excel(dataset_path)
-        else:
-            raise ValueError("Format non supporté (CSV/XLSX/XLS)")
+    with accounting.meter("pandas", query_class="analysis", text=code) as usage:
+        env: Dict[str, Any] = {}
+        out = _execute(dataset_path, code, env, table)
+        footprint = accounting.frames_footprint(env)
+        usage.peak(footprint)
+        env.clear()  # DataFrames de l'analyse libérés avant la sérialisation de la réponse
+        if footprint > max_frames_memory():
+            out = {"error": f"Analyse trop gourmande en mémoire ({footprint >> 20} Mo de DataFrames en fin "
+                            f"d'analyse, limite {max_frames_memory() >> 20} Mo) ; agrégez en SQL avant l'analyse.",
+                   "stdout": out.get("stdout", "")}
+        usage.result_rows = len(out.get("rows") or [])
+        return out
+
+
+def _execute(dataset_path: Optional[str], code: str, env: Dict[str, Any], table: Optional[str] = None):
+    # 1) éventuel chargement initial : fichier local ou dataset DuckDB (au-delà de max_rows() : erreur, pas de coupe)
+    try:
+        df = read_bounded(dataset_path) if dataset_path else (read_table_bounded(table) if table else None)
+    except ValueError as e:
+        return {"error": str(e), "stdout": ""}
 
     # 2) environnement restreint
     safe_builtins = {
@@ -82,14 +127,14 @@ def run_pandas_analysis(dataset_path: Optional[str], code: str):
         "float": float, "int": int, "str": str, "bool": bool,
     }
 
-    env = {
+    env.update({
         "pd": pd,
         "np": np,
         "sns": sns,
         "plt": plt,
         "LinearRegression": LinearRegression,
         "IsolationForest": IsolationForest,
-    }
+    })
     if df is not None:
         env["df"] = df
 
@@ -100,20 +145,28 @@ def run_pandas_analysis(dataset_path: Optional[str], code: str):
 
         out = {}
 
-        # rows si un DF/Series de sortie est dispo
+        # rows si un DF/Series de sortie est dispo (tronquées à max_result_rows)
+        cap = max_result_rows()
         for key in ("result_df", "df_out", "output_df", "result", "df"):
             obj = env.get(key)
             if isinstance(obj, pd.Series):
-                df_res = obj.to_frame(name=obj.name or "value").reset_index()
-                out["rows"] = df_res.to_dict(orient="records")
-                break
-            if isinstance(obj, pd.DataFrame):
-                out["rows"] = obj.reset_index(drop=True).to_dict(orient="records")
-                break
-
-        # chart si une figure existe
+                df_res = obj.head(cap).to_frame(name=obj.name or "value").reset_index()
+            elif isinstance(obj, pd.DataFrame):
+                df_res = obj.head(cap).reset_index(drop=True)
+            else:
+                continue
+            out["rows"] = df_res.to_dict(orient="records")
+            if len(obj) > cap:
+                out["truncated"] = True
+            break
+
+        # chart si une figure existe (PNG en mode "spec" : une figure pyplot n'a pas de spec)
+        out["chart_format"] = output_format()
         if plt.get_fignums():
-            out["chart"] = _render_chart_to_base64()
+            img = _render_chart_to_base64()
+            if img:
+                out["chart"] = img
+                out["chart_format"] = figure_format()
 
         # summary / chart_spec éventuels fournis par le code
         if isinstance(env.get("summary"), str):
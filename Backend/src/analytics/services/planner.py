@@ -1,15 +1,67 @@
 # Backend/src/analytics/services/planner.py
 from __future__ import annotations
-from typing import Dict, Any
-import re
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+import os
+
+from . import rollups, stats
 
 def _id(name: str) -> str:
+    # toujours quoté : une colonne nommée comme un mot réservé (date, order, ...) reste un identifiant
     if not name:
         raise ValueError("Identifiant vide")
-    if re.search(r"[^0-9a-zA-Z_]", name):
-        safe = name.replace('"', '""')
-        return f'"{safe}"'
-    return name
+    safe = str(name).replace('"', '""')
+    return f'"{safe}"'
+
+
+GRAINS = ("day", "week", "month", "quarter", "year")
+_GRAIN_DAYS = {"day": 1.0, "week": 7.0, "month": 30.44, "quarter": 91.31, "year": 365.25}
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def _parse_dt(v: Any) -> Optional[datetime]:
+    if v is None:
+        return None
+    try:
+        return datetime.fromisoformat(str(v).replace("Z", ""))
+    except ValueError:
+        return None
+
+
+def _span_days(col_stats: Optional[Dict[str, Any]]) -> Optional[float]:
+    if not col_stats:
+        return None
+    lo, hi = _parse_dt(col_stats.get("min")), _parse_dt(col_stats.get("max"))
+    if not (lo and hi):
+        return None
+    return max((hi - lo).total_seconds() / 86400.0, 0.0)
+
+
+def _choose_grain(span_days: Optional[float], max_points: int) -> str:
+    """Plus petit grain dont le nombre de points sur la période tient dans max_points."""
+    if span_days is None:
+        return "day"
+    for g in GRAINS:
+        if span_days / _GRAIN_DAYS[g] + 1 <= max_points:
+            return g
+    return "year"
+
+
+def _lit_date(d: Any) -> str:
+    dt = _parse_dt(d)
+    if not dt:
+        raise ValueError(f"Date invalide: {d}")
+    return f"DATE '{dt.date().isoformat()}'"
 
 
 def build_sql_from_plan(plan: Dict[str, Any]) -> str:
@@ -17,12 +69,27 @@ def build_sql_from_plan(plan: Dict[str, Any]) -> str:
     Compile un plan en SQL DuckDB.
     Champs plan attendus (min):
       - intent: "timeseries_total" | "top_total" | "top_growth" | "anomaly_zscore"
+                | "anomaly_rolling" | "anomaly_mad" | "anomaly_seasonal" (window, threshold, season)
+                | "forecast" (horizon, seasonal, level ; séries par category_col, voir services.forecast)
       - dataset
       - date_col (si timeseries/anomaly/top_growth)
       - amount_col (optionnel => SUM(amount), sinon COUNT(*))
       - category_col (si top_total / top_growth)
       - year (si top_growth)
       - limit (optionnel, défaut 100)
+      - use_rollups (optionnel, défaut True) : lit depuis le rollup du dataset s'il peut répondre
+      - grain (optionnel, timeseries) : day|week|month|quarter|year, sinon choisi d'après les stats
+      - date_from / date_to (optionnels) : bornes de dates poussées en WHERE
+      - exact (optionnel) : interdit les agrégats approchés (échantillon) sur très gros volumes
+    """
+    return compile_plan(plan)[0]
+
+
+def compile_plan(plan: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Comme build_sql_from_plan, mais retourne aussi les choix faits (meta) :
+    grain, source (table ou ensemble de rollup), prédicats poussés, approximation, lignes estimées.
+    Les choix s'appuient sur les stats de colonnes du catalogue (services.stats).
     """
     intent = (plan.get("intent") or "").strip().lower()
     dataset = plan.get("dataset") or ""
@@ -35,34 +102,107 @@ def build_sql_from_plan(plan: Dict[str, Any]) -> str:
     if not dataset:
         raise ValueError("'dataset' requis")
 
-    agg = f"SUM({_id(amount_col)})" if amount_col else "COUNT(*)"
+    st = stats.get_stats(dataset) if plan.get("use_stats", True) else None
+    total_rows = st["rows"] if st else None
+    date_stats = st["columns"].get(date_col) if st else None
+    meta: Dict[str, Any] = {"intent": intent, "source": "table", "predicates": [], "approx": None,
+                            "estimated_rows": total_rows}
 
+    # 🔹 Grain : explicite, sinon borné par le nombre de points affichables
+    grain = (plan.get("grain") or "").lower()
     if intent == "timeseries_total":
-        return f"""SELECT date_trunc('day', {_id(date_col)}) AS ts, {agg} AS total
-FROM {_id(dataset)}
-GROUP BY 1
+        if grain not in GRAINS:
+            grain = _choose_grain(_span_days(date_stats), int(plan.get("max_points") or limit))
+        meta["grain"] = grain
+    elif intent != "forecast":
+        grain = "day"
+
+    # 🔹 Prédicats sur la date (permettent à DuckDB de sauter des row groups via les zonemaps)
+    d = _id(date_col)
+    if date_stats and not str(date_stats.get("type", "")).startswith(("DATE", "TIMESTAMP")):
+        d = f"TRY_CAST({d} AS DATE)"
+    preds = []
+    if plan.get("date_from"):
+        preds.append(f"{d} >= {_lit_date(plan['date_from'])}")
+    if plan.get("date_to"):
+        preds.append(f"{d} < {_lit_date(plan['date_to'])}")
+    if intent == "top_growth":
+        if not year:
+            raise ValueError("'year' requis pour top_growth")
+        preds.append(f"{d} >= DATE '{int(year) - 1:04d}-01-01'")
+        preds.append(f"{d} < DATE '{int(year) + 1:04d}-01-01'")
+        span = _span_days(date_stats)
+        if total_rows and span:
+            meta["estimated_rows"] = int(total_rows * min(1.0, 2 * 365.25 / max(span, 1.0)))
+    meta["predicates"] = preds
+
+    if intent in ANOMALY_INTENTS:
+        sql, extra = build_anomaly_sql(
+            intent, dataset, date_col, amount_col,
+            window=int(plan.get("window") or 28), threshold=float(plan.get("threshold") or 3.0),
+            season=plan.get("season") or "dow", since=plan.get("date_from"), limit=limit,
+            use_rollups=plan.get("use_rollups", True),
+        )
+        meta.update(extra)
+        return sql, meta
+
+    if intent == "forecast":
+        if grain not in GRAINS:
+            grain = _choose_grain(_span_days(date_stats), int(plan.get("max_points") or 400))
+        sql, extra = build_series_sql(dataset, date_col, amount_col, plan.get("category_col"), grain,
+                                      use_rollups=plan.get("use_rollups", True))
+        meta.update(extra)
+        return sql, meta
+
+    if plan.get("use_rollups", True) and not (plan.get("date_from") or plan.get("date_to")):
+        rolled = _sql_from_rollup(intent, dataset, date_col, amount_col, category_col, year, limit, grain)
+        if rolled:
+            sql, set_name, set_rows = rolled
+            meta.update({"source": f"rollup:{set_name}", "estimated_rows": set_rows})
+            return sql, meta
+
+    # 🔹 Exact vs approché : échantillon SYSTEM + remise à l'échelle si le scan estimé est énorme
+    scale = ""
+    sample = ""
+    est = meta["estimated_rows"]
+    if (est and not plan.get("exact") and intent in ("timeseries_total", "top_total", "top_growth")
+            and est > int(_setting("PLANNER_APPROX_MIN_ROWS", 100_000_000))):
+        perc = max(1.0, min(100.0, 100.0 * int(_setting("PLANNER_APPROX_TARGET_ROWS", 10_000_000)) / est))
+        if perc < 100.0:
+            sample = f" TABLESAMPLE {perc:g}% (system)"
+            scale = f" * {100.0 / perc:.6g}"
+            meta["approx"] = {"sample_percent": perc, "scale": round(100.0 / perc, 6)}
+            meta["estimated_rows"] = int(est * perc / 100.0)
+
+    where = ("WHERE " + " AND ".join(preds) + "\n") if preds else ""
+    src = f"{_id(dataset)}{sample}"
+    agg = (f"SUM({_id(amount_col)})" if amount_col else "COUNT(*)") + scale
+
+    if intent == "timeseries_total":
+        return f"""SELECT date_trunc('{grain}', {_id(date_col)}) AS ts, {agg} AS total
+FROM {src}
+{where}GROUP BY 1
 ORDER BY 1
-LIMIT {limit};""".strip()
+LIMIT {limit};""".strip(), meta
 
     if intent == "top_total":
         return f"""SELECT {_id(category_col)} AS category, {agg} AS total
-FROM {_id(dataset)}
-GROUP BY 1
+FROM {src}
+{where}GROUP BY 1
 ORDER BY total DESC
-LIMIT {limit};""".strip()
+LIMIT {limit};""".strip(), meta
 
     if intent == "top_growth":
-        if not year:
-            raise ValueError("'year' requis pour top_growth")
         prev = int(year) - 1
         val_prev = _id(amount_col) if amount_col else "1"
         val_curr = _id(amount_col) if amount_col else "1"
+        where_cte = ("  WHERE " + " AND ".join(preds) + "\n") if preds else ""
         return f"""WITH agg AS (
   SELECT {_id(category_col)} AS category,
-         SUM(CASE WHEN EXTRACT(YEAR FROM {_id(date_col)}) = {prev} THEN {val_prev} ELSE 0 END) AS total_prev,
-         SUM(CASE WHEN EXTRACT(YEAR FROM {_id(date_col)}) = {int(year)} THEN {val_curr} ELSE 0 END) AS total_curr
-  FROM {_id(dataset)}
-  GROUP BY 1
+         SUM(CASE WHEN EXTRACT(YEAR FROM {_id(date_col)}) = {prev} THEN {val_prev} ELSE 0 END){scale} AS total_prev,
+         SUM(CASE WHEN EXTRACT(YEAR FROM {_id(date_col)}) = {int(year)} THEN {val_curr} ELSE 0 END){scale} AS total_curr
+  FROM {src}
+{where_cte}  GROUP BY 1
 )
 SELECT category,
        total_prev,
@@ -70,15 +210,16 @@ SELECT category,
        CASE WHEN total_prev = 0 THEN NULL ELSE (total_curr - total_prev) * 1.0 / total_prev END AS growth_ratio
 FROM agg
 ORDER BY growth_ratio DESC NULLS LAST
-LIMIT {limit};""".strip()
+LIMIT {limit};""".strip(), meta
 
     if intent == "anomaly_zscore":
         # si pas d'amount -> zscore sur comptage journalier
         val_expr = _id(amount_col) if amount_col else "1"
+        where_cte = ("  WHERE " + " AND ".join(preds) + "\n") if preds else ""
         return f"""WITH s AS (
   SELECT CAST({_id(date_col)} AS TIMESTAMP) AS ts, CAST(SUM({val_expr}) AS DOUBLE) AS val
   FROM {_id(dataset)}
-  GROUP BY 1
+{where_cte}  GROUP BY 1
 ),
 stats AS (
   SELECT AVG(val) AS mu, STDDEV(val) AS sigma FROM s
@@ -88,7 +229,426 @@ SELECT s.ts, s.val,
             ELSE (s.val - stats.mu) / stats.sigma END AS zscore
 FROM s, stats
 ORDER BY s.ts
-LIMIT {limit};""".strip()
+LIMIT {limit};""".strip(), meta
 
     # Fallback: preview
-    return f"SELECT * FROM {_id(dataset)} LIMIT {limit};"
+    meta["source"] = "preview"
+    return f"SELECT * FROM {_id(dataset)} LIMIT {limit};", meta
+
+
+# ---------------------------------------------------------------------------
+# Anomalies glissantes : fenêtres DuckDB, une seule passe sur la série
+# ---------------------------------------------------------------------------
+
+ANOMALY_INTENTS = ("anomaly_rolling", "anomaly_mad", "anomaly_seasonal")
+# créneau saisonnier : (expression DuckDB, attribut pandas .dt équivalent à un renommage près)
+SEASONS = {"dow": ("dayofweek(ts)", "dayofweek"), "month": ("month(ts)", "month")}
+
+
+def build_anomaly_sql(
+    intent: str,
+    dataset: str,
+    date_col: str,
+    amount_col: Optional[str] = None,
+    window: int = 28,
+    threshold: float = 3.0,
+    season: str = "dow",
+    since: Any = None,
+    limit: Optional[int] = None,
+    use_rollups: bool = True,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Détection d'anomalies sur la série journalière SUM(amount) (ou COUNT(*)) :
+      - anomaly_rolling  : z-score vs moyenne/écart-type des `window` jours précédents
+      - anomaly_mad      : score robuste 0.6745·(x - médiane)/MAD sur les `window` jours précédents
+      - anomaly_seasonal : z-score vs les `window` mêmes créneaux précédents (jour de semaine ou mois)
+    Colonnes : ts, val, expected, score, is_anomaly. `since` restreint la série (reprise incrémentale),
+    `limit` garde les points les plus récents.
+    """
+    if intent not in ANOMALY_INTENTS:
+        raise ValueError(f"Intent d'anomalie inconnu: {intent}")
+    if not dataset:
+        raise ValueError("'dataset' requis")
+    window = max(2, int(window or 28))
+    threshold = float(threshold or 3.0)
+    season = season if season in SEASONS else "dow"
+    meta: Dict[str, Any] = {"intent": intent, "window": window, "threshold": threshold, "source": "table"}
+
+    m = rollups.match_rollup(dataset, date_col, None, amount_col, ["day"]) if use_rollups else None
+    if m:
+        r, set_name, _ = m
+        val = r.measures[amount_col] if amount_col else "__count"
+        since_pred = f" AND d_day >= {_lit_date(since)}" if since is not None else ""
+        series = f"""SELECT d_day AS ts, CAST({val} AS DOUBLE) AS val
+  FROM {_id(r.table)}
+  WHERE __gid = {r.gid(set_name)}{since_pred}"""
+        meta["source"] = f"rollup:{set_name}"
+    else:
+        val = _id(amount_col) if amount_col else "1"
+        since_pred = f"\n  WHERE {_id(date_col)} >= {_lit_date(since)}" if since is not None else ""
+        series = f"""SELECT date_trunc('day', {_id(date_col)}) AS ts, CAST(SUM({val}) AS DOUBLE) AS val
+  FROM {_id(dataset)}{since_pred}
+  GROUP BY 1"""
+
+    frame = f"ROWS BETWEEN {window} PRECEDING AND 1 PRECEDING"
+    if intent == "anomaly_mad":
+        scored = f"""w AS (
+  SELECT ts, val, list(val) OVER (ORDER BY ts {frame}) AS hist FROM s
+),
+m AS (
+  SELECT ts, val, hist, list_median(hist) AS expected FROM w
+),
+z AS (
+  SELECT ts, val, expected, list_median(list_transform(hist, x -> abs(x - expected))) AS spread FROM m
+)
+SELECT ts, val, expected,
+       CASE WHEN spread IS NULL OR spread = 0 THEN 0 ELSE 0.6745 * (val - expected) / spread END AS score"""
+    else:
+        part = f"PARTITION BY {SEASONS[season][0]} " if intent == "anomaly_seasonal" else ""
+        meta["season"] = season if part else None
+        scored = f"""z AS (
+  SELECT ts, val,
+         AVG(val) OVER win AS expected,
+         STDDEV_SAMP(val) OVER win AS spread
+  FROM s
+  WINDOW win AS ({part}ORDER BY ts {frame})
+)
+SELECT ts, val, expected,
+       CASE WHEN spread IS NULL OR spread = 0 THEN 0 ELSE (val - expected) / spread END AS score"""
+
+    tail = f"\nQUALIFY row_number() OVER (ORDER BY ts DESC) <= {int(limit)}" if limit else ""
+    sql = f"""WITH s AS (
+  {series}
+),
+{scored},
+       COALESCE(ABS(score) >= {threshold}, FALSE) AS is_anomaly
+FROM z{tail}
+ORDER BY ts;"""
+    return sql.strip(), meta
+
+
+# ---------------------------------------------------------------------------
+# Séries multiples (une par catégorie) : une seule agrégation GROUP BY
+# ---------------------------------------------------------------------------
+
+def build_series_sql(
+    dataset: str,
+    date_col: str,
+    amount_col: Optional[str] = None,
+    category_col: Optional[str] = None,
+    grain: str = "month",
+    use_rollups: bool = True,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    SQL des séries (category, ts, val) au grain demandé, toutes catégories en une passe.
+    Sans category_col, une seule série (category = NULL). Lit le rollup quand il peut répondre.
+    """
+    if not dataset:
+        raise ValueError("'dataset' requis")
+    grain = grain if grain in GRAINS else "month"
+    meta: Dict[str, Any] = {"grain": grain, "source": "table"}
+
+    m = (rollups.match_rollup(dataset, date_col, category_col, amount_col, _ROLLUP_FINER[grain])
+         if use_rollups else None)
+    if m:
+        r, set_name, src_grain = m
+        val = r.measures[amount_col] if amount_col else "__count"
+        cat = r.categories[category_col] if category_col else "NULL"
+        ts = f"d_{src_grain}" if src_grain == grain else f"date_trunc('{grain}', d_{src_grain})"
+        meta.update({"source": f"rollup:{set_name}", "estimated_rows": int(r.sets[set_name]["rows"])})
+        return f"""SELECT {cat} AS category, {ts} AS ts, CAST(SUM({val}) AS DOUBLE) AS val
+FROM {_id(r.table)}
+WHERE __gid = {r.gid(set_name)}
+GROUP BY 1, 2
+ORDER BY 1, 2;""", meta
+
+    val = f"SUM({_id(amount_col)})" if amount_col else "COUNT(*)"
+    cat = _id(category_col) if category_col else "NULL"
+    return f"""SELECT {cat} AS category, date_trunc('{grain}', {_id(date_col)}) AS ts, CAST({val} AS DOUBLE) AS val
+FROM {_id(dataset)}
+WHERE {_id(date_col)} IS NOT NULL
+GROUP BY 1, 2
+ORDER BY 1, 2;""", meta
+
+
+# ---------------------------------------------------------------------------
+# KPIs fenêtrés : une requête de fenêtres sur la série agrégée
+# ---------------------------------------------------------------------------
+
+KPI_METRICS = ("moving_avg", "yoy", "mom", "cumulative", "share")
+# décalage "même période l'an dernier / le mois dernier" par grain (None = non défini)
+_YOY_OFFSET = {"day": "1 YEAR", "week": "364 DAY", "month": "1 YEAR", "quarter": "1 YEAR", "year": "1 YEAR"}
+_MOM_OFFSET = {"day": "1 MONTH", "week": None, "month": "1 MONTH", "quarter": None, "year": None}
+
+
+def build_kpi_sql(
+    dataset: str,
+    date_col: str,
+    amount_col: Optional[str] = None,
+    grain: str = "month",
+    metrics: Optional[list] = None,
+    window: int = 3,
+    category_col: Optional[str] = None,
+    date_from: Any = None,
+    date_to: Any = None,
+    use_rollups: bool = True,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    KPIs standards sur la série SUM(amount) (ou COUNT(*)) au grain donné, par catégorie si demandé :
+      - moving_avg : moyenne mobile sur `window` périodes
+      - yoy / mom  : croissance vs même période un an / un mois plus tôt (fenêtre RANGE sur l'intervalle,
+                     robuste aux périodes manquantes)
+      - cumulative : cumul depuis le début de la série
+      - share      : part de la période (entre catégories) ou du total (sans catégorie)
+    Colonnes : ts, [category], value, puis une colonne par KPI. date_from / date_to filtrent la sortie
+    (les fenêtres voient tout l'historique).
+    """
+    grain = grain if grain in GRAINS else "month"
+    metrics = [m for m in (metrics or KPI_METRICS) if m in KPI_METRICS]
+    if not metrics:
+        raise ValueError(f"KPIs inconnus (attendus: {', '.join(KPI_METRICS)})")
+    if "mom" in metrics and not _MOM_OFFSET[grain]:
+        raise ValueError(f"'mom' n'est pas défini au grain '{grain}' (day ou month)")
+    window = max(1, int(window or 3))
+
+    series, meta = build_series_sql(dataset, date_col, amount_col, category_col, grain, use_rollups)
+    meta["metrics"] = metrics
+
+    order = "PARTITION BY category ORDER BY ts"
+    prev_cols, out_cols = [], []
+    if "yoy" in metrics:
+        off = _YOY_OFFSET[grain]
+        prev_cols.append(f"max(val) OVER ({order} RANGE BETWEEN INTERVAL {off} PRECEDING "
+                         f"AND INTERVAL {off} PRECEDING) AS prev_year")
+    if "mom" in metrics:
+        off = _MOM_OFFSET[grain]
+        prev_cols.append(f"max(val) OVER ({order} RANGE BETWEEN INTERVAL {off} PRECEDING "
+                         f"AND INTERVAL {off} PRECEDING) AS prev_month")
+    for m in metrics:
+        if m == "moving_avg":
+            out_cols.append(f"AVG(val) OVER ({order} ROWS BETWEEN {window - 1} PRECEDING AND CURRENT ROW) AS moving_avg")
+        elif m == "yoy":
+            out_cols.append("CASE WHEN prev_year IS NULL THEN NULL ELSE growth_rate(val, prev_year) END AS yoy")
+        elif m == "mom":
+            out_cols.append("CASE WHEN prev_month IS NULL THEN NULL ELSE growth_rate(val, prev_month) END AS mom")
+        elif m == "cumulative":
+            out_cols.append(f"SUM(val) OVER ({order} ROWS UNBOUNDED PRECEDING) AS cumulative")
+        elif m == "share":
+            out_cols.append("share_of_total_by(val, ts) AS share" if category_col else "share_of_total(val) AS share")
+
+    preds = []
+    if date_from:
+        preds.append(f"ts >= {_lit_date(date_from)}")
+    if date_to:
+        preds.append(f"ts < {_lit_date(date_to)}")
+    where = ("\nWHERE " + " AND ".join(preds)) if preds else ""
+    cat = "category, " if category_col else ""
+    prev = "".join(f",\n         {c}" for c in prev_cols)
+    kpi_cols = ",\n         ".join(out_cols)
+    body = series.strip().rstrip(";")
+    sql = f"""WITH s AS (
+  SELECT category, CAST(ts AS TIMESTAMP) AS ts, val
+  FROM ({body})
+),
+w AS (
+  SELECT category, ts, val{prev}
+  FROM s
+),
+k AS (
+  SELECT {cat}ts, val AS value,
+         {kpi_cols}
+  FROM w
+)
+SELECT * FROM k{where}
+ORDER BY {cat}ts;"""
+    return sql, meta
+
+
+# ---------------------------------------------------------------------------
+# Réécriture vers les rollups (services.rollups)
+# ---------------------------------------------------------------------------
+
+# grains de rollup capables de répondre à un grain demandé (ré-agrégation possible)
+# NB: pas de semaine pour mois/année (une semaine peut chevaucher deux mois/années)
+_ROLLUP_FINER = {
+    "day": ["day"],
+    "week": ["week", "day"],
+    "month": ["month", "day"],
+    "quarter": ["month", "day"],
+    "year": ["year", "month", "day"],
+    "all": ["all", "year", "month", "week", "day"],
+}
+
+
+def _sql_from_rollup(
+    intent: str,
+    dataset: str,
+    date_col: str,
+    amount_col: Optional[str],
+    category_col: str,
+    year: Any,
+    limit: int,
+    grain: str = "day",
+) -> Optional[Tuple[str, str, int]]:
+    """(SQL équivalent, ensemble utilisé, lignes lues) depuis le plus petit ensemble de rollup éligible, ou None."""
+    if intent == "timeseries_total":
+        m = rollups.match_rollup(dataset, date_col, None, amount_col, _ROLLUP_FINER[grain])
+    elif intent == "top_total":
+        m = rollups.match_rollup(dataset, None, category_col, amount_col, _ROLLUP_FINER["all"])
+    elif intent == "top_growth" and year:
+        m = rollups.match_rollup(dataset, date_col, category_col, amount_col, _ROLLUP_FINER["year"])
+    elif intent == "anomaly_zscore":
+        # le plan d'origine groupe par horodatage exact : équivalent au jour seulement pour une colonne DATE
+        m = rollups.match_rollup(dataset, date_col, None, amount_col, ["day"])
+        if m and m[0].date_type != "DATE":
+            m = None
+    else:
+        m = None
+    if not m:
+        return None
+
+    r, set_name, src_grain = m
+    set_rows = int(r.sets[set_name]["rows"])
+    table = _id(r.table)
+    where = f"__gid = {r.gid(set_name)}"
+    val = r.measures[amount_col] if amount_col else "__count"
+    ts = f"d_{src_grain}" if src_grain == grain else f"date_trunc('{grain}', d_{src_grain})"
+
+    if intent == "timeseries_total":
+        return f"""SELECT {ts} AS ts, SUM({val}) AS total
+FROM {table}
+WHERE {where}
+GROUP BY 1
+ORDER BY 1
+LIMIT {limit};""".strip(), set_name, set_rows
+
+    cat = r.categories.get(category_col)
+    if intent == "top_total":
+        return f"""SELECT {cat} AS category, SUM({val}) AS total
+FROM {table}
+WHERE {where}
+GROUP BY 1
+ORDER BY total DESC
+LIMIT {limit};""".strip(), set_name, set_rows
+
+    if intent == "top_growth":
+        prev = int(year) - 1
+        d = f"d_{src_grain}"
+        return f"""WITH agg AS (
+  SELECT {cat} AS category,
+         SUM(CASE WHEN EXTRACT(YEAR FROM {d}) = {prev} THEN {val} ELSE 0 END) AS total_prev,
+         SUM(CASE WHEN EXTRACT(YEAR FROM {d}) = {int(year)} THEN {val} ELSE 0 END) AS total_curr
+  FROM {table}
+  WHERE {where} AND {d} >= DATE '{prev:04d}-01-01' AND {d} < DATE '{int(year) + 1:04d}-01-01'
+  GROUP BY 1
+)
+SELECT category,
+       total_prev,
+       total_curr,
+       CASE WHEN total_prev = 0 THEN NULL ELSE (total_curr - total_prev) * 1.0 / total_prev END AS growth_ratio
+FROM agg
+ORDER BY growth_ratio DESC NULLS LAST
+LIMIT {limit};""".strip(), set_name, set_rows
+
+    # anomaly_zscore
+    return f"""WITH s AS (
+  SELECT CAST(d_day AS TIMESTAMP) AS ts, CAST({val} AS DOUBLE) AS val
+  FROM {table}
+  WHERE {where}
+),
+stats AS (
+  SELECT AVG(val) AS mu, STDDEV(val) AS sigma FROM s
+)
+SELECT s.ts, s.val,
+       CASE WHEN stats.sigma IS NULL OR stats.sigma = 0 THEN 0
+            ELSE (s.val - stats.mu) / stats.sigma END AS zscore
+FROM s, stats
+ORDER BY s.ts
+LIMIT {limit};""".strip(), set_name, set_rows
+
+
+# ---------------------------------------------------------------------------
+# Histogrammes : binning dans DuckDB (seuls les comptes par classe sortent)
+# ---------------------------------------------------------------------------
+
+HISTOGRAM_METHODS = ("fixed", "quantile", "fd")
+
+
+def build_histogram_sql(dataset: str, column: str, bins: int = 20, method: str = "fixed") -> str:
+    """
+    Compile un histogramme en une agrégation DuckDB qui ne renvoie que les classes :
+    colonnes (bin, bin_start, bin_end, count), une ligne par classe (classes vides incluses).
+      - fixed    : `bins` classes de largeur égale entre min et max
+      - quantile : `bins` classes d'effectifs ~égaux (bornes via approx_quantile)
+      - fd       : largeur Freedman–Diaconis (2·IQR/n^(1/3), IQR approché), `bins` = nombre max de classes
+    """
+    if not dataset or not column:
+        raise ValueError("'dataset' et 'column' requis")
+    bins = max(1, min(int(bins or 20), 1000))
+    method = (method or "fixed").lower()
+    if method not in HISTOGRAM_METHODS:
+        raise ValueError(f"Méthode de binning inconnue: {method}")
+
+    src = f"""src AS (
+  SELECT CAST({_id(column)} AS DOUBLE) AS v
+  FROM {_id(dataset)}
+  WHERE {_id(column)} IS NOT NULL
+)"""
+
+    if method == "quantile":
+        probs = ", ".join(f"{i / bins:.6f}" for i in range(bins + 1))
+        # classe = nombre de bornes intérieures <= v (les bornes extrêmes sont le min/max exacts)
+        case = " ".join(f"WHEN src.v < q.edges[{i + 2}] THEN {i}" for i in range(bins - 1))
+        bin_expr = f"CASE {case} ELSE {bins - 1} END" if case else "0"
+        return f"""WITH {src},
+q AS (
+  SELECT approx_quantile(v, [{probs}]) AS edges, MIN(v) AS lo, MAX(v) AS hi
+  FROM src
+),
+c AS (
+  SELECT {bin_expr} AS bin, COUNT(*) AS count
+  FROM src, q
+  GROUP BY 1
+),
+e AS (
+  SELECT i - 1 AS bin,
+         CASE WHEN i = 1 THEN lo ELSE edges[i] END AS bin_start,
+         CASE WHEN i = {bins} THEN hi ELSE edges[i + 1] END AS bin_end
+  FROM (SELECT generate_subscripts(edges, 1) AS i, edges, lo, hi FROM q WHERE lo IS NOT NULL)
+  WHERE i <= {bins}
+)
+SELECT e.bin, e.bin_start, e.bin_end, COALESCE(c.count, 0) AS count
+FROM e LEFT JOIN c ON e.bin = c.bin
+ORDER BY e.bin;""".strip()
+
+    if method == "fd":
+        nb_expr = (
+            f"COALESCE(CAST(LEAST({bins}, GREATEST(1, CEIL((hi - lo) / "
+            f"NULLIF(2 * (q3 - q1) / cbrt(n), 0)))) AS INTEGER), {bins})"
+        )
+    else:
+        nb_expr = str(bins)
+
+    return f"""WITH {src},
+stats AS (
+  SELECT MIN(v) AS lo, MAX(v) AS hi, COUNT(*) AS n,
+         approx_quantile(v, 0.25) AS q1, approx_quantile(v, 0.75) AS q3
+  FROM src
+),
+p AS (
+  SELECT lo, nb, CASE WHEN hi > lo THEN (hi - lo) / nb ELSE 1.0 END AS w
+  FROM (SELECT lo, hi, {nb_expr} AS nb FROM stats)
+  WHERE lo IS NOT NULL
+),
+c AS (
+  SELECT LEAST(CAST(FLOOR((src.v - p.lo) / p.w) AS INTEGER), p.nb - 1) AS bin, COUNT(*) AS count
+  FROM src, p
+  GROUP BY 1
+),
+e AS (
+  SELECT unnest(range(nb)) AS bin, lo, w FROM p
+)
+SELECT e.bin, e.lo + e.bin * e.w AS bin_start, e.lo + (e.bin + 1) * e.w AS bin_end,
+       COALESCE(c.count, 0) AS count
+FROM e LEFT JOIN c ON e.bin = c.bin
+ORDER BY e.bin;""".strip()
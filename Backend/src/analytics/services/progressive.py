@@ -0,0 +1,324 @@
+"""
+Agrégation progressive (online aggregation) des requêtes longues, diffusée en SSE.
+
+La requête est exécutée sur des échantillons croissants (PROGRESSIVE_STAGES, défaut 1 %, 10 %, 100 %) :
+chaque étape partielle lit le dataset en TABLESAMPLE SYSTEM (blocs de lignes, pas de lecture
+complète), ses agrégats sont repondérés par services.sampling (SUM / COUNT / AVG) avec une erreur type
+par groupes aléatoires de blocs et un intervalle de confiance à 95 % (Student, un degré de liberté par
+groupe non vide moins un). Les poids suivent la fraction
+réellement tirée (lignes de la table / lignes lues, et de même par groupe), pas le pourcentage nominal :
+SYSTEM tire des blocs entiers, la taille de l'échantillon varie. La dernière étape est exacte.
+
+La requête exacte passe l'admission (services.admission, classe interactive) à la création : refus ->
+QueryRejected avant tout flux. Chaque étape tourne sur sa propre connexion, dans un créneau interactif
+(services.scheduler), mesurée et imputée au client (services.accounting, quotas vérifiés), interruptible :
+- client déconnecté (écriture SSE en échec, y compris sur les battements de cœur) -> arrêt
+- estimation acceptée : cancel(run_id) (marqueur dans PROGRESSIVE_DIR, mode 0700, valable entre workers)
+Au plus PROGRESSIVE_MAX_PENDING étapes attendent un worker du pool : au-delà, QueueTimeout (503).
+Les étapes trop petites (moins de PROGRESSIVE_MIN_STAGE_ROWS lignes attendues) sont sautées ;
+une requête non estimable (pas d'agrégat, COUNT DISTINCT, ...) n'a que l'étape exacte.
+
+Événements : start, estimate (étapes partielles), result (étape exacte), done, cancelled, error.
+"""
+from __future__ import annotations
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from common.utils import private_dir
+
+from . import accounting, admission, matviews, sampling, scheduler, stats as col_stats
+from .guards import add_limit_if_missing
+from ..duck import _id, _jsonify_df, connect, dataset_versions
+
+logger = logging.getLogger(__name__)
+
+_Z95 = 1.96
+# quantiles 97,5 % de Student pour 1..29 degrés de liberté (groupes de réplication - 1), puis loi normale
+_T975 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145,
+         2.131, 2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045)
+_BLOCK_ROWS = 2048  # granularité de TABLESAMPLE SYSTEM (un vecteur DuckDB)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending = 0  # étapes soumises au pool et pas encore terminées
+_runs: Dict[str, "ProgressiveRun"] = {}
+_runs_lock = threading.Lock()
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(_setting("PROGRESSIVE_WORKERS", 4)),
+                                           thread_name_prefix="progressive")
+        return _executor
+
+
+def _saturated() -> bool:
+    return _pending >= int(_setting("PROGRESSIVE_MAX_PENDING", 16))
+
+
+def _submit(fn, *args):
+    """Soumet une étape au pool ; QueueTimeout si PROGRESSIVE_MAX_PENDING étapes attendent déjà."""
+    global _pending
+    with _executor_lock:
+        if _saturated():
+            raise scheduler.QueueTimeout("progressive", 0.0)
+        _pending += 1
+
+    def _done(_future) -> None:
+        global _pending
+        with _executor_lock:
+            _pending -= 1
+
+    try:
+        future = _pool().submit(fn, *args)
+    except Exception:
+        _done(None)
+        raise
+    future.add_done_callback(_done)
+    return future
+
+
+def _cancel_dir() -> Path:
+    base = _setting("PROGRESSIVE_DIR", None) or Path(_setting("DATA_DIR", "data")) / "progressive"
+    return private_dir(base)
+
+
+def parse_stages(value: Any) -> List[float]:
+    """"1,10,100" ou [1, 10, 100] -> pourcentages croissants, 100 toujours en dernier."""
+    raw = value if value not in (None, "") else _setting("PROGRESSIVE_STAGES", "1,10,100")
+    items = raw.split(",") if isinstance(raw, str) else list(raw)
+    stages = sorted({min(100.0, max(0.01, float(v))) for v in items if str(v).strip()})
+    return [p for p in stages if p < 100.0] + [100.0]
+
+
+def stage_source(dataset: str, percent: float) -> str:
+    """
+    Sous-requête pondérée d'une étape : blocs tirés au hasard, répartis à tour de rôle entre les groupes
+    de réplication (__reps groupes non vides). Poids = lignes de la table / lignes tirées (__w), ou tirées
+    dans le groupe (__wr).
+    """
+    reps = sampling._replicates()
+    n = f"(SELECT COUNT(*) FROM {_id(dataset)})::DOUBLE"
+    blocks = (f"SELECT *, (dense_rank() OVER (ORDER BY rowid // {_BLOCK_ROWS}) - 1) % {reps} AS __rep "
+              f"FROM {_id(dataset)} TABLESAMPLE {percent:g}% (system)")
+    return (f"SELECT *, {n} / COUNT(*) OVER () AS __w, {n} / COUNT(*) OVER (PARTITION BY __rep) AS __wr, "
+            f"MAX(__rep) OVER () + 1 AS __reps FROM ({blocks}) AS __blocks")
+
+
+def plan_stages(sql: str, stages: List[float]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """[{percent, sql, estimated}] à exécuter dans l'ordre, et la raison si seule l'étape exacte reste."""
+    exact = {"percent": 100.0, "sql": matviews.rewrite(sql), "estimated": []}
+    partial = [p for p in stages if p < 100.0]
+    if not partial:
+        return [exact], None
+    datasets = list(dataset_versions())
+    min_rows = int(_setting("PROGRESSIVE_MIN_STAGE_ROWS", 10_000))
+    planned, reason = [], None
+    for percent in partial:
+        try:
+            rewritten, estimated, used = sampling.rewrite_weighted(
+                sql, {d: stage_source(d, percent) for d in datasets}, allow_rows=False, nrep="__reps")
+        except sampling.NotEstimable as e:
+            return [exact], str(e)
+        rows = max(((col_stats.get_stats(d) or {}).get("rows") or 0) for d in used)
+        if rows * percent / 100.0 < min_rows:
+            reason = f"étape {percent:g} % ignorée (moins de {min_rows} lignes attendues)"
+            continue
+        planned.append({"percent": percent, "sql": rewritten, "estimated": estimated})
+    return planned + [exact], (reason if not planned else None)
+
+
+def _finite(value: Any) -> Any:
+    """NaN / ±inf -> None (JSON.parse refuse les jetons NaN / Infinity), récursivement."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(v) for v in value]
+    return value
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(_finite(data), default=str, allow_nan=False)}\n\n"
+
+
+def _quantile(reps: Any) -> float:
+    """Quantile de l'intervalle à 95 % : Student à reps - 1 degrés de liberté (peu de groupes), sinon 1,96."""
+    try:
+        df = int(reps) - 1
+    except (TypeError, ValueError):
+        return _Z95
+    return _T975[df - 1] if 1 <= df <= len(_T975) else _Z95
+
+
+def _with_intervals(rows: List[Dict[str, Any]], estimated: List[str]) -> List[Dict[str, Any]]:
+    for row in rows:
+        q = _quantile(row.pop("__reps", None))
+        for name in estimated:
+            est, se = _finite(row.get(name)), _finite(row.get(f"{name}_se"))
+            if est is not None and se is not None:
+                row[f"{name}_ci_low"] = est - q * se
+                row[f"{name}_ci_high"] = est + q * se
+    return rows
+
+
+class ProgressiveRun:
+    """Une exécution progressive : events() produit le flux SSE, cancel() l'arrête."""
+
+    def __init__(self, sql: str, stages: Any = None, limit: Optional[int] = 1000):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.sql = add_limit_if_missing(sql, limit) if limit else sql
+        if _saturated():
+            raise scheduler.QueueTimeout("progressive", 0.0)
+        # le flux est consommé après la vue : le client est capturé ici (équité des créneaux, quotas)
+        self.who = accounting.identity()
+        self.client = self.who[0]
+        if accounting.enabled():
+            accounting.check_quota(*self.who)
+        self.decision = admission.admit(self.sql, "interactive")
+        self.stages, self.reason = plan_stages(self.sql, parse_stages(stages))
+        if self.decision.sql != self.sql:
+            # résultat "exact" remplacé par l'admission (échantillon) : la dernière étape reste estimée
+            self.stages[-1] = {"percent": 100.0, "sql": self.decision.sql,
+                               "estimated": (self.decision.approximate or {}).get("estimated", [])}
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._con = None
+        with _runs_lock:
+            _runs[self.run_id] = self
+        _purge_markers()
+
+    def _execute(self, sql: str, final: bool = False):
+        with accounting.meter("progressive", query_class="interactive", text=sql, who=self.who) as usage:
+            t0 = time.perf_counter()
+            with scheduler.slot("interactive", client=self.client):
+                df = self._execute_in_slot(sql)
+            usage.result_rows = len(df)
+            if final:
+                admission.record(self.decision, len(df), time.perf_counter() - t0)
+            return df
+
+    def _execute_in_slot(self, sql: str):
+        con = connect()
+        with self._lock:
+            if self._event.is_set():
+                con.close()
+                raise RuntimeError("exécution annulée")
+            self._con = con
+        try:
+            return con.execute(sql).df()
+        finally:
+            with self._lock:
+                self._con = None
+            con.close()
+
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (_cancel_dir() / f"{self.run_id}.cancel").exists()
+
+    def cancel(self) -> None:
+        """Arrête les étapes restantes et interrompt la requête en cours."""
+        with self._lock:
+            self._event.set()
+            if self._con is not None:
+                try:
+                    self._con.interrupt()
+                except Exception:
+                    pass
+
+    def events(self) -> Iterator[str]:
+        heartbeat = float(_setting("PROGRESSIVE_HEARTBEAT", 2.0))
+        t0 = time.perf_counter()
+        outcome = "done"
+        try:
+            yield _sse("start", {"run_id": self.run_id, "stages": [s["percent"] for s in self.stages],
+                                 **({"reason": self.reason} if self.reason else {})})
+            for stage in self.stages:
+                if self.cancelled():
+                    outcome = "cancelled"
+                    break
+                future = _submit(self._execute, stage["sql"], stage["percent"] >= 100.0)
+                while True:
+                    try:
+                        df = future.result(timeout=heartbeat)
+                        break
+                    except FutureTimeout:
+                        if self.cancelled():
+                            self.cancel()
+                            outcome = "cancelled"
+                            break
+                        # commentaire SSE : détecte la déconnexion du client pendant une étape longue
+                        yield ": keep-alive\n\n"
+                if outcome == "cancelled":
+                    break
+                final = stage["percent"] >= 100.0
+                yield _sse("result" if final else "estimate", {
+                    "run_id": self.run_id,
+                    "percent": stage["percent"],
+                    "final": final,
+                    "rows": _with_intervals(_jsonify_df(df), stage["estimated"]),
+                    "estimated": stage["estimated"],
+                    "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+                })
+            yield _sse(outcome, {"run_id": self.run_id, "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)})
+        except GeneratorExit:
+            outcome = "client déconnecté"
+            raise
+        except Exception as e:
+            outcome = "error"
+            if self.cancelled():
+                yield _sse("cancelled", {"run_id": self.run_id})
+            else:
+                logger.warning(f"[progressive] {self.run_id} en échec: {e}")
+                yield _sse("error", {"run_id": self.run_id, "detail": str(e)})
+        finally:
+            # fin normale, annulation ou client déconnecté (GeneratorExit) : on interrompt ce qui tourne
+            self.cancel()
+            with _runs_lock:
+                _runs.pop(self.run_id, None)
+            (_cancel_dir() / f"{self.run_id}.cancel").unlink(missing_ok=True)
+            logger.info(f"[progressive] {self.run_id}: {outcome} en {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+
+def _purge_markers(max_age: float = 3600.0) -> None:
+    """Marqueurs d'annulation orphelins (exécution terminée ailleurs, identifiant inconnu)."""
+    now = time.time()
+    try:
+        for marker in _cancel_dir().glob("*.cancel"):
+            if now - marker.stat().st_mtime > max_age:
+                marker.unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def cancel(run_id: str) -> bool:
+    """Demande l'arrêt d'une exécution (ce worker ou un autre). True si elle tourne dans ce processus."""
+    if not run_id or not run_id.isalnum():
+        return False
+    (_cancel_dir() / f"{run_id}.cancel").touch()
+    with _runs_lock:
+        run = _runs.get(run_id)
+    if run:
+        run.cancel()
+    return run is not None
@@ -0,0 +1,226 @@
+"""
+Rollups : tables pré-agrégées par dataset (jour/semaine/mois/année × catégories),
+construites à l'ingestion en un seul scan (GROUPING SETS).
+
+Une table `__rollup_<dataset>` contient toutes les combinaisons ; la colonne `__gid`
+(bitmask GROUPING()) identifie l'ensemble de regroupement de chaque ligne.
+Le catalogue `__rollups` décrit les dimensions, mesures et la taille de chaque ensemble,
+ce qui permet au planner de réécrire un intent vers l'ensemble le plus petit qui y répond.
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+from .cache import LRUCache
+from ..duck import META_TABLE, _id, connect, on_dataset_loaded, query
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TABLE = "__rollups"
+GRAINS = ("day", "week", "month", "year")
+
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "FLOAT", "DOUBLE", "DECIMAL",
+                  "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT")
+_ID_LIKE = {"id", "task id", "task_id"}
+
+_catalog_cache = LRUCache(maxsize=256, ttl=30)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def rollup_table_name(dataset: str) -> str:
+    return f"__rollup_{dataset}"
+
+
+@dataclass
+class Rollup:
+    """Entrée du catalogue : une table de rollup et ses ensembles de regroupement."""
+    dataset: str
+    table: str
+    date_col: str
+    date_type: str
+    categories: Dict[str, str]          # colonne source -> colonne du rollup (c0, c1, ...)
+    measures: Dict[str, str]            # colonne source -> colonne SUM du rollup (m0, m1, ...)
+    sets: Dict[str, Dict[str, int]] = field(default_factory=dict)  # nom -> {"gid", "rows"}
+    source_version: int = 0
+
+    def candidates(self, grains: List[str], category_col: Optional[str]) -> List[tuple[str, str, int]]:
+        """Ensembles (nom, grain, lignes) qui peuvent répondre, du plus petit au plus grand."""
+        out = []
+        for g in grains:
+            name = f"{g}|{category_col}" if category_col else g
+            if name in self.sets:
+                out.append((name, g, self.sets[name]["rows"]))
+        return sorted(out, key=lambda c: c[2])
+
+    def gid(self, set_name: str) -> int:
+        return int(self.sets[set_name]["gid"])
+
+
+# ------------------ Construction ------------------ #
+
+def _describe(con, table: str) -> List[tuple[str, str]]:
+    return [(r[0], str(r[1]).upper()) for r in con.execute(f"DESCRIBE {_id(table)}").fetchall()]
+
+
+def _pick_columns(con, table: str):
+    cols = _describe(con, table)
+    date_col = next(((n, t) for n, t in cols if t.startswith("DATE") or t.startswith("TIMESTAMP")), None)
+    measures = [n for n, t in cols
+                if t.startswith(_NUMERIC_TYPES) and n.lower() not in _ID_LIKE and not n.lower().endswith("_id")]
+    text_cols = [n for n, t in cols if t in ("VARCHAR", "BOOLEAN") or t.startswith("ENUM")]
+
+    categories: List[str] = []
+    if text_cols:
+        max_card = int(_setting("ROLLUP_MAX_CARDINALITY", 500))
+        exprs = ", ".join(f"approx_count_distinct({_id(c)})" for c in text_cols)
+        cards = con.execute(f"SELECT {exprs} FROM {_id(table)}").fetchone()
+        ranked = sorted((card, c) for c, card in zip(text_cols, cards) if 0 < card <= max_card)
+        categories = [c for _, c in ranked[: int(_setting("ROLLUP_MAX_CATEGORIES", 3))]]
+    return date_col, measures, categories
+
+
+def build_rollup(dataset: str, version: int = 0) -> Optional[Rollup]:
+    """
+    (Re)construit le rollup d'un dataset. Retourne None si le dataset n'est pas éligible
+    (trop petit, pas de colonne date, rollups désactivés).
+    """
+    table = rollup_table_name(dataset)
+    _catalog_cache.pop(dataset)
+    with connect() as con:
+        con.execute(f"DROP TABLE IF EXISTS {_id(table)}")
+        _ensure_catalog(con)
+        con.execute(f"DELETE FROM {CATALOG_TABLE} WHERE dataset = ?", [dataset])
+
+        if str(_setting("ROLLUP_ENABLED", "1")).lower() in {"0", "false", "no"}:
+            return None
+        n = con.execute(f"SELECT COUNT(*) FROM {_id(dataset)}").fetchone()[0]
+        if n < int(_setting("ROLLUP_MIN_ROWS", 50000)):
+            return None
+
+        date_pick, measures, categories = _pick_columns(con, dataset)
+        if not date_pick:
+            return None
+        date_col, date_type = date_pick
+
+        cat_map = {c: f"c{i}" for i, c in enumerate(categories)}
+        mes_map = {m: f"m{i}" for i, m in enumerate(measures)}
+        dims = [f"d_{g}" for g in GRAINS] + list(cat_map.values())
+
+        # ensembles : (grain), (grain, cat), (cat), ()
+        sets: Dict[str, tuple] = {}
+        for g in GRAINS:
+            sets[g] = (f"d_{g}",)
+            for c, alias in cat_map.items():
+                sets[f"{g}|{c}"] = (f"d_{g}", alias)
+        for c, alias in cat_map.items():
+            sets[f"all|{c}"] = (alias,)
+        sets["all"] = ()
+
+        # GROUPING(d1, ..., dk) : bit à 1 (poids fort = 1re dim) si la dim est agrégée
+        def gid_of(members: tuple) -> int:
+            return sum(1 << (len(dims) - 1 - i) for i, d in enumerate(dims) if d not in members)
+
+        select_dims = [f"date_trunc('{g}', {_id(date_col)}) AS d_{g}" for g in GRAINS]
+        select_dims += [f"{_id(c)} AS {alias}" for c, alias in cat_map.items()]
+        select_mes = [f"SUM({_id(m)}) AS {alias}" for m, alias in mes_map.items()]
+        grouping_sets = ", ".join("(" + ", ".join(m) + ")" for m in sets.values())
+        con.execute(f"""
+CREATE TABLE {_id(table)} AS
+SELECT {", ".join(select_dims + select_mes)}, COUNT(*) AS __count, GROUPING({", ".join(dims)}) AS __gid
+FROM {_id(dataset)}
+GROUP BY GROUPING SETS ({grouping_sets})
+ORDER BY __gid
+""")
+        counts = dict(con.execute(f"SELECT __gid, COUNT(*) FROM {_id(table)} GROUP BY 1").fetchall())
+        set_info = {name: {"gid": gid_of(m), "rows": int(counts.get(gid_of(m), 0))} for name, m in sets.items()}
+
+        rollup = Rollup(dataset, table, date_col, date_type, cat_map, mes_map, set_info, version)
+        con.execute(
+            f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, now())",
+            [dataset, table, date_col, date_type, json.dumps(cat_map), json.dumps(mes_map),
+             json.dumps(set_info), version],
+        )
+    logger.info(f"[rollups] {table} construit ({sum(i['rows'] for i in set_info.values())} lignes, source {n})")
+    return rollup
+
+
+def _ensure_catalog(con) -> None:
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} ("
+        "dataset VARCHAR PRIMARY KEY, rollup_table VARCHAR, date_col VARCHAR, date_type VARCHAR, "
+        "categories VARCHAR, measures VARCHAR, sets VARCHAR, source_version BIGINT, built_at TIMESTAMP)"
+    )
+
+
+@on_dataset_loaded
+def _refresh_on_load(dataset: str, version: int) -> None:
+    build_rollup(dataset, version)
+
+
+# ------------------ Lecture du catalogue ------------------ #
+
+def get_rollup(dataset: str) -> Optional[Rollup]:
+    """Rollup à jour (même version que la source) pour ce dataset, sinon None."""
+    if not dataset:
+        return None
+
+    def _load() -> Optional[Rollup]:
+        try:
+            df = query(
+                f"SELECT r.* FROM {CATALOG_TABLE} r JOIN {META_TABLE} d "
+                "ON d.name = r.dataset AND d.version = r.source_version WHERE r.dataset = ?",
+                [dataset],
+            )
+        except Exception:
+            return None
+        if df.empty:
+            return None
+        r = df.iloc[0]
+        return Rollup(
+            dataset=r["dataset"], table=r["rollup_table"], date_col=r["date_col"], date_type=r["date_type"],
+            categories=json.loads(r["categories"]), measures=json.loads(r["measures"]),
+            sets=json.loads(r["sets"]), source_version=int(r["source_version"]),
+        )
+
+    return _catalog_cache.get_or_set(dataset, _load)
+
+
+def match_rollup(
+    dataset: str,
+    date_col: Optional[str],
+    category_col: Optional[str],
+    amount_col: Optional[str],
+    grains: List[str],
+) -> Optional[tuple[Rollup, str, str]]:
+    """
+    Cherche l'ensemble de rollup le plus petit pouvant répondre.
+    Retourne (rollup, nom_ensemble, grain) ou None.
+    """
+    r = get_rollup(dataset)
+    if r is None:
+        return None
+    if amount_col and amount_col not in r.measures:
+        return None
+    if category_col and category_col not in r.categories:
+        return None
+    if date_col and date_col != r.date_col:
+        return None
+    cands = r.candidates(grains, category_col)
+    if not cands:
+        return None
+    name, grain, _ = cands[0]
+    return r, name, grain
@@ -5,24 +5,39 @@ Expose aussi des helpers de profilage.
 """
 
 from __future__ import annotations
-from typing import Any, Dict, Optional, List, Union
+from typing import Any, Dict, Optional, List, Tuple, Union
+import os
+import re
+import time
 
 import numpy as np
 import pandas as pd
-import io, base64
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import IsolationForest
 
-from .guards import is_safe, add_limit_if_missing, wrap_sample
-from ..duck import run_sql as _run_sql, profile_table as _profile_table
+from .guards import is_safe, add_limit_if_missing, normalize_sql, wrap_sample
+from .cache import LRUCache
+from .charts import encode_figure, figure_format
+from . import accounting, admission, anomaly, forecast, matviews, scheduler, singleflight
+from .pandas_runner import read_bounded
+from .planner import ANOMALY_INTENTS, compile_plan
+from ..duck import (
+    ResultTooLarge, dataset_versions, on_dataset_loaded, run_sql as _run_sql, profile_table as _profile_table,
+)
 
 
 class QueryError(Exception):
     pass
 
 
+# versions des datasets pour les clés de coalescence (relues au plus toutes les secondes)
+_versions = LRUCache(maxsize=1, ttl=1.0)
+
+
 # ------------------ Helpers ------------------ #
 
 def _jsonify_df(df: pd.DataFrame) -> List[Dict[str, Any]]:
@@ -48,8 +63,15 @@ def run_sql_safe(
     sql: str,
     add_limit: Optional[int] = 1000,
     sample_perc: Optional[float] = None,
+    endpoint: str = "interactive",
 ) -> List[Dict[str, Any]]:
-    """Valide et exécute du SQL, renvoie une liste de dicts JSON-safe."""
+    """
+    Valide et exécute du SQL, renvoie une liste de dicts JSON-safe.
+    Admission par coût estimé selon la classe d'endpoint (services.admission) : exécution, estimation
+    sur échantillon ou refus (QueryRejected) ; la décision est lisible via admission.current().
+    L'exécution prend un créneau de la même classe (services.scheduler, QueueTimeout si saturé) et est
+    imputée au client courant (services.accounting, QuotaExceeded si son quota glissant est atteint).
+    """
     if not is_safe(sql):
         raise QueryError("Requête SQL non autorisée.")
 
@@ -63,9 +85,54 @@ def run_sql_safe(
         if add_limit is not None:
             safe_sql = add_limit_if_missing(safe_sql, add_limit)
 
+    with accounting.meter("sql", query_class=endpoint, text=safe_sql) as usage:
+        decision = admission.admit(safe_sql, endpoint)
+        t0 = time.perf_counter()
+        rows = singleflight.sql_flight.do(_flight_key(decision.sql), lambda: _execute_sql(decision.sql, endpoint))
+        admission.record(decision, len(rows), time.perf_counter() - t0)
+        usage.result_rows = len(rows)
+    return rows
+
+
+@on_dataset_loaded
+def _reset_versions(dataset: str, version: int) -> None:
+    _versions.clear()
+
+
+def _flight_key(sql: str) -> tuple:
+    """Clé de coalescence : SQL normalisé + versions des datasets cités dans la requête."""
+    norm = normalize_sql(sql)
+    versions = _versions.get_or_set("all", dataset_versions)
+    used = tuple(sorted((n, v) for n, v in versions.items() if re.search(rf"\b{re.escape(n.lower())}\b", norm)))
+    return ("sql", norm, used)
+
+
+def _execute_sql(safe_sql: str, query_class: str = "interactive") -> List[Dict[str, Any]]:
+    """Exécution effective (une seule par clé en vol, cf. services.singleflight), dans un créneau."""
+    with scheduler.slot(query_class):
+        return _execute_in_slot(safe_sql, scheduler.result_budget(query_class))
+
+
+def _execute_in_slot(safe_sql: str, max_bytes: Optional[int] = None) -> List[Dict[str, Any]]:
     try:
-        df = _run_sql(safe_sql)  # DataFrame
+        # Vue matérialisée si la requête est "chaude" (services.matviews), sinon requête d'origine
+        exec_sql = matviews.rewrite(safe_sql)
+        t0 = time.perf_counter()
+        try:
+            df = _run_sql(exec_sql, max_bytes=max_bytes)  # DataFrame (lecture bornée par le budget de la classe)
+        except ResultTooLarge:
+            raise
+        except Exception:
+            if exec_sql == safe_sql:
+                raise
+            # vue supprimée entre-temps (rechargement par un autre worker) -> requête d'origine
+            matviews.invalidate_cache()
+            exec_sql = safe_sql
+            df = _run_sql(safe_sql, max_bytes=max_bytes)
+        matviews.record(safe_sql, time.perf_counter() - t0, served_from_mv=exec_sql != safe_sql)
         return _jsonify_df(df)
+    except ResultTooLarge:
+        raise
     except Exception as e:
         # Préserver l'erreur originale pour le formatage dans views.py
         error_msg = str(e)
@@ -76,6 +143,27 @@ def run_sql_safe(
             raise QueryError(f"Echec de l'exécution SQL: {error_msg}") from e
 
 
+# ------------------ Intents calculés (hors SQL brut) ------------------ #
+
+def run_plan(plan: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Exécute un plan du planner et renvoie (lignes JSON-safe, meta).
+    Les intents d'anomalies glissantes et de prévision passent par leurs services
+    (cache par version, ajustement vectorisé) ; les autres par run_sql_safe.
+    """
+    intent = (plan.get("intent") or "").strip().lower()
+    if intent in ANOMALY_INTENTS:
+        with scheduler.slot("nl"):
+            df, meta = anomaly.detect(plan)
+    elif intent == "forecast":
+        with scheduler.slot("nl"):
+            df, meta = forecast.run(plan)
+    else:
+        sql, meta = compile_plan(plan)
+        return run_sql_safe(sql, add_limit=None, endpoint="nl"), meta
+    return _jsonify_df(df), meta
+
+
 # ------------------ Pandas Runner ------------------ #
 
 def run_pandas_safe(dataset_path: str, code: str) -> Dict[str, Any]:
@@ -83,24 +171,30 @@ def run_pandas_safe(dataset_path: str, code: str) -> Dict[str, Any]:
     Exécute du code Pandas/Numpy/Scikit-learn généré par le LLM.
     Retourne toujours un dict JSON-safe (rows, chart, result, error).
     """
-    # Charger dataset
-    if dataset_path.endswith(".csv"):
-        df = pd.read_csv(dataset_path)
-    elif dataset_path.endswith(".xlsx"):
-        df = pd.read_excel(dataset_path)
-    else:
-        raise QueryError("Format non supporté")
-
-    env = {
-        "pd": pd,
-        "np": np,
-        "df": df,
-        "sns": sns,
-        "plt": plt,
-        "LinearRegression": LinearRegression,
-        "IsolationForest": IsolationForest,
-    }
-
+    dataset = os.path.splitext(os.path.basename(dataset_path))[0]
+    with accounting.meter("pandas", query_class="analysis", dataset=dataset) as usage, scheduler.slot("analysis"):
+        # Charger dataset (plafonné à PANDAS_MAX_ROWS lignes)
+        try:
+            df = read_bounded(dataset_path)
+        except ValueError as e:
+            raise QueryError(str(e)) from e
+
+        env = {
+            "pd": pd,
+            "np": np,
+            "df": df,
+            "sns": sns,
+            "plt": plt,
+            "LinearRegression": LinearRegression,
+            "IsolationForest": IsolationForest,
+        }
+        out = _eval_pandas(code, env)
+        usage.result_rows = len(out.get("rows") or [])
+        usage.peak(accounting.frames_footprint(env))
+    return out
+
+
+def _eval_pandas(code: str, env: Dict[str, Any]) -> Dict[str, Any]:
     try:
         # ⚠️ Attention: eval = dangereux (à sandboxer idéalement)
         result = eval(code, {"__builtins__": {}}, env)
@@ -109,14 +203,12 @@ def run_pandas_safe(dataset_path: str, code: str) -> Dict[str, Any]:
         if isinstance(result, (pd.DataFrame, pd.Series)):
             return {"rows": _jsonify_df(result)}
 
-        # Graphique → image base64
+        # Graphique → image base64 (PNG/SVG selon la config ; PNG en mode "spec", la figure n'a pas de spec)
         if plt.get_fignums():
-            buf = io.BytesIO()
-            plt.savefig(buf, format="png")
-            buf.seek(0)
-            img_b64 = base64.b64encode(buf.read()).decode("utf-8")
+            fmt = figure_format()
+            img_b64 = encode_figure(plt.gcf(), fmt)
             plt.close("all")
-            return {"chart": img_b64}
+            return {"chart": img_b64, "chart_format": fmt}
 
         return {"result": str(result)}
 
@@ -149,7 +241,7 @@ def run_analysis(
     Décide automatiquement entre SQL ou Pandas selon le plan fourni par le LLM.
     """
     if plan.get("sql"):
-        return run_sql_safe(plan["sql"])
+        return run_sql_safe(plan["sql"], endpoint="analysis")
     elif plan.get("code_python"):
         if not dataset_path:
             raise QueryError("Dataset path requis pour Pandas")
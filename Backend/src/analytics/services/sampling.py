@@ -0,0 +1,478 @@
+"""
+Échantillon persistant par dataset (`__sample_<dataset>`) : aperçus rapides et mode exploratoire.
+
+Échantillon stratifié sur les colonnes catégorielles de faible cardinalité (combinaison bornée par
+SAMPLE_MAX_STRATA) : allocation proportionnelle de SAMPLE_ROWS lignes, avec un minimum par strate
+pour que les petites catégories restent représentées. Chaque ligne porte une clé aléatoire `__r` ;
+une strate contient ses k lignes de plus petite clé (bottom-k), ce qui permet une mise à jour
+incrémentale exacte en mode append (réservoir) : seuls l'échantillon courant et les lignes ajoutées
+sont relus. Colonnes techniques : `__stratum`, `__r`, `__rep` (groupe de réplication), `__w`
+(poids = taille de la strate / lignes retenues) et `__wr` (même poids, rapporté au groupe de réplication).
+
+approximate_sql() réécrit une requête vers l'échantillon (sqlglot) : SUM / COUNT / AVG pondérés et,
+pour les agrégats de la requête principale, une colonne `<nom>_se` (erreur type estimée par groupes
+aléatoires stratifiés : SAMPLE_REPLICATES sous-échantillons). Les requêtes non estimables (COUNT DISTINCT,
+médianes, agrégats sur sous-requête, ...) restent exactes, avec la raison dans la meta. MIN / MAX lus
+sur l'échantillon sont des bornes de l'échantillon : signalés dans la meta ("sample_bounds").
+
+preview() ne sert l'échantillon qu'au-delà de SAMPLE_ROWS lignes ; en dessous, l'aperçu reste la tête
+de la table (ordre d'insertion, stable d'un appel à l'autre).
+"""
+from __future__ import annotations
+import json
+import logging
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+
+from . import stats as col_stats
+from .cache import LRUCache
+from ..duck import (
+    _id, _jsonify_df, connect, dataset_lineage, dataset_versions, on_dataset_loaded, query,
+)
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TABLE = "__samples"
+HIDDEN_COLUMNS = ("__stratum", "__r", "__rep", "__w", "__wr")
+
+_CAT_TYPES = ("VARCHAR", "BOOLEAN", "ENUM")
+_ID_LIKE = {"id", "task id", "task_id"}
+_MAX_STRATA_COLUMNS = 3
+
+_catalog_cache = LRUCache(maxsize=1, ttl=5.0)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def enabled() -> bool:
+    return str(_setting("SAMPLE_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+def sample_table(dataset: str) -> str:
+    return f"__sample_{dataset}"
+
+
+def _replicates() -> int:
+    return max(2, int(_setting("SAMPLE_REPLICATES", 10)))
+
+
+# ------------------ Strates ------------------ #
+
+def strata_columns(dataset: str) -> List[str]:
+    """Colonnes catégorielles retenues pour la stratification (produit des cardinalités borné)."""
+    st = col_stats.get_stats(dataset) or {"columns": {}}
+    max_strata = int(_setting("SAMPLE_MAX_STRATA", 200))
+    candidates = sorted(
+        (s["distinct"], name) for name, s in st["columns"].items()
+        if str(s["type"]).startswith(_CAT_TYPES) and name.lower() not in _ID_LIKE
+        and not name.lower().endswith("_id") and s.get("distinct") and 2 <= s["distinct"] <= max_strata
+    )
+    out, product = [], 1
+    for distinct, name in candidates:
+        if product * distinct > max_strata or len(out) >= _MAX_STRATA_COLUMNS:
+            break
+        out.append(name)
+        product *= distinct
+    return out
+
+
+def _stratum_expr(columns: List[str]) -> str:
+    if not columns:
+        return "''"
+    return "concat_ws('|', " + ", ".join(f"COALESCE(CAST({_id(c)} AS VARCHAR), '∅')" for c in columns) + ")"
+
+
+def _quota(n: int, total: int, target: int, min_per: int) -> int:
+    return int(min(n, max(min_per, round(target * n / total)))) if total else 0
+
+
+def _threshold(k: int, n: int) -> float:
+    """Pré-filtre sur __r : laisse passer ~k + 4√k lignes, le classement garde les k plus petites."""
+    return min(1.0, (k + 4 * math.sqrt(k) + 10) / n) if n else 1.0
+
+
+# ------------------ Construction / mise à jour ------------------ #
+
+def _ensure_catalog(con) -> None:
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} ("
+        "dataset VARCHAR PRIMARY KEY, version BIGINT, source_rows BIGINT, sample_rows BIGINT, "
+        "strata_columns VARCHAR, strata VARCHAR, built_at TIMESTAMP)"
+    )
+
+
+def _materialize(con, dataset: str, quotas: Dict[str, Tuple[int, int, float]], columns: List[str],
+                 since_row: Optional[int]) -> int:
+    """
+    (Re)crée l'échantillon : candidats = lignes du dataset (ou échantillon courant + lignes ajoutées
+    depuis since_row), puis les k plus petites clés __r de chaque strate. quotas : {strate: (n, k, seuil)}.
+    """
+    table = sample_table(dataset)
+    con.register("__sample_quotas", pd.DataFrame(
+        [(s, n, k, t) for s, (n, k, t) in quotas.items()], columns=["stratum", "n", "k", "t"]
+    ).astype({"stratum": "object", "n": "int64", "k": "int64", "t": "float64"}))
+    fresh = f"SELECT *, {_stratum_expr(columns)} AS __stratum, random() AS __r FROM {_id(dataset)}"
+    if since_row is None:
+        candidates, params = fresh, []
+    else:
+        candidates = (f"SELECT * EXCLUDE (__rep, __w, __wr) FROM {_id(table)} "
+                      f"UNION ALL BY NAME {fresh} WHERE rowid >= ?")
+        params = [int(since_row)]
+    reps = _replicates()
+    try:
+        con.execute(
+            f"CREATE OR REPLACE TABLE {_id(table)} AS "
+            f"WITH ranked AS ("
+            f"  SELECT c.*, q.n AS __n, row_number() OVER (PARTITION BY c.__stratum ORDER BY c.__r) AS __k "
+            f"  FROM ({candidates}) c JOIN __sample_quotas q ON q.stratum = c.__stratum "
+            f"  WHERE c.__r <= q.t "
+            f"  QUALIFY row_number() OVER (PARTITION BY c.__stratum ORDER BY c.__r) <= q.k"
+            f"), kept AS ("
+            # groupes de réplication équilibrés dans chaque strate (aucun groupe vide dès k >= reps)
+            f"  SELECT * EXCLUDE (__k), (__k - 1) % {reps} AS __rep FROM ranked"
+            f") "
+            f"SELECT * EXCLUDE (__n), __n / COUNT(*) OVER (PARTITION BY __stratum) AS __w, "
+            f"  __n / COUNT(*) OVER (PARTITION BY __stratum, __rep) AS __wr "
+            f"FROM kept",
+            params,
+        )
+    finally:
+        con.unregister("__sample_quotas")
+    return con.execute(f"SELECT COUNT(*) FROM {_id(table)}").fetchone()[0]
+
+
+def _record(con, dataset: str, version: int, source_rows: int, sample_rows: int, columns: List[str],
+            quotas: Dict[str, Tuple[int, int, float]]) -> None:
+    strata = {s: [n, k] for s, (n, k, _) in quotas.items()}
+    con.execute(f"INSERT OR REPLACE INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, now())",
+                [dataset, version, source_rows, sample_rows, json.dumps(columns), json.dumps(strata)])
+
+
+def build(dataset: str, con, version: int) -> int:
+    """Construction complète : allocation proportionnelle (minimum par strate), un scan + un tri borné."""
+    _ensure_catalog(con)
+    target = int(_setting("SAMPLE_ROWS", 100_000))
+    min_per = int(_setting("SAMPLE_MIN_PER_STRATUM", 200))
+    columns = strata_columns(dataset)
+    sizes = con.execute(
+        f"SELECT {_stratum_expr(columns)} AS s, COUNT(*) FROM {_id(dataset)} GROUP BY 1"
+    ).fetchall()
+    total = sum(n for _, n in sizes)
+    quotas = {}
+    for s, n in sizes:
+        k = _quota(n, total, target, min_per)
+        quotas[s] = (n, k, _threshold(k, n))
+    rows = _materialize(con, dataset, quotas, columns, since_row=None)
+    _record(con, dataset, version, total, rows, columns, quotas)
+    return rows
+
+
+def refresh_incremental(dataset: str, con, version: int, entry: Dict[str, Any]) -> Optional[int]:
+    """
+    Mise à jour réservoir après un append : chaque strate garde ses k plus petites clés parmi
+    l'échantillon courant et les lignes ajoutées. Le quota d'une strate ne peut croître que si
+    l'échantillon la contenait entièrement. None si une reconstruction complète est préférable.
+    """
+    target = int(_setting("SAMPLE_ROWS", 100_000))
+    min_per = int(_setting("SAMPLE_MIN_PER_STRATUM", 200))
+    columns, strata, since = entry["strata_columns"], entry["strata"], entry["source_rows"]
+    table = sample_table(dataset)
+    added = dict(con.execute(
+        f"SELECT {_stratum_expr(columns)} AS s, COUNT(*) FROM {_id(dataset)} WHERE rowid >= ? GROUP BY 1",
+        [since],
+    ).fetchall())
+    max_r = dict(con.execute(f"SELECT __stratum, max(__r) FROM {_id(table)} GROUP BY 1").fetchall())
+    total = since + sum(added.values())
+    quotas = {}
+    for s in set(strata) | set(added):
+        n_old, k_old = strata.get(s, (0, 0))
+        n = n_old + added.get(s, 0)
+        k = _quota(n, total, target, min_per)
+        complete = k_old >= n_old
+        if not complete:
+            k = min(k, k_old)
+        # nouvelles lignes utiles : clé sous le max courant de la strate (sauf strate complète)
+        quotas[s] = (n, k, 1.0 if complete else float(max_r.get(s, 1.0)))
+    if sum(k for _, k, _ in quotas.values()) > 1.5 * target:
+        return None
+    rows = _materialize(con, dataset, quotas, columns, since_row=since)
+    _record(con, dataset, version, total, rows, columns, quotas)
+    return rows
+
+
+def _entry(con, dataset: str) -> Optional[Dict[str, Any]]:
+    row = con.execute(
+        f"SELECT version, source_rows, sample_rows, strata_columns, strata FROM {CATALOG_TABLE} WHERE dataset = ?",
+        [dataset],
+    ).fetchone()
+    if not row:
+        return None
+    return {"version": int(row[0]), "source_rows": int(row[1]), "sample_rows": int(row[2]),
+            "strata_columns": json.loads(row[3]), "strata": {s: tuple(nk) for s, nk in json.loads(row[4]).items()}}
+
+
+@on_dataset_loaded
+def refresh_sample(dataset: str, version: int) -> None:
+    _catalog_cache.clear()
+    if not enabled():
+        return
+    _, replaced = dataset_lineage(dataset)
+    with connect() as con:
+        _ensure_catalog(con)
+        entry = _entry(con, dataset)
+        rows, mode = None, "incrémental"
+        # échantillon de la même lignée (ajouts seulement depuis) et strates inchangées -> réservoir
+        if entry and replaced <= entry["version"] < version and entry["strata_columns"] == strata_columns(dataset):
+            rows = refresh_incremental(dataset, con, version, entry)
+        if rows is None:
+            rows, mode = build(dataset, con, version), "complet"
+    logger.info(f"[sampling] {dataset} v{version}: échantillon {mode}, {rows} ligne(s)")
+
+
+# ------------------ Lecture ------------------ #
+
+def _catalog() -> Dict[str, Dict[str, Any]]:
+    """Échantillons à jour ({dataset: entrée}), relus au plus toutes les quelques secondes."""
+    def _load() -> Dict[str, Dict[str, Any]]:
+        try:
+            df = query(f"SELECT dataset, version, source_rows, sample_rows, strata_columns FROM {CATALOG_TABLE}")
+        except Exception:
+            return {}
+        versions = dataset_versions()
+        return {
+            d: {"table": sample_table(d), "version": int(v), "source_rows": int(n), "sample_rows": int(k),
+                "strata_columns": json.loads(c)}
+            for d, v, n, k, c in df.itertuples(index=False, name=None) if versions.get(d) == int(v)
+        }
+    return _catalog_cache.get_or_set("catalog", _load)
+
+
+def info(dataset: str) -> Optional[Dict[str, Any]]:
+    """Entrée de catalogue de l'échantillon si elle correspond à la version courante du dataset."""
+    return _catalog().get(dataset) if enabled() else None
+
+
+def weighted_source(dataset: str) -> Optional[Tuple[str, str]]:
+    """(table, expression d'effectif) pour estimer des comptages depuis l'échantillon, None sinon."""
+    entry = info(dataset)
+    return (_id(entry["table"]), "SUM(__w)") if entry else None
+
+
+def preview(dataset: str, limit: int = 10) -> Optional[Dict[str, Any]]:
+    """
+    Aperçu (lignes tirées de l'échantillon) + stats descriptives calculées sur l'échantillon, toutes
+    approchées (sampled.approximate_stats). None sans échantillon ou si le dataset tient sous
+    SAMPLE_ROWS lignes : l'appelant lit alors la tête de la table.
+    """
+    entry = info(dataset)
+    if not entry or entry["source_rows"] <= int(_setting("SAMPLE_ROWS", 100_000)):
+        return None
+    hidden = ", ".join(HIDDEN_COLUMNS)
+    df = query(f"SELECT * EXCLUDE ({hidden}) FROM {_id(entry['table'])} ORDER BY __r LIMIT {int(limit)}")
+    desc = query(f"SELECT * EXCLUDE ({hidden}) FROM {_id(entry['table'])}").describe().T.reset_index()
+    return {
+        "columns": [{"name": c, "dtype": str(t)} for c, t in df.dtypes.items()],
+        "rows": _jsonify_df(df),
+        "stats": _jsonify_df(desc),
+        "sampled": {"sample_rows": entry["sample_rows"], "source_rows": entry["source_rows"],
+                    "strata_columns": entry["strata_columns"],
+                    # describe() sur l'échantillon : min / max sont ceux de l'échantillon, pas du dataset
+                    "approximate_stats": True},
+    }
+
+
+# ------------------ Requêtes approchées ------------------ #
+
+class NotEstimable(ValueError):
+    """Requête non estimable sur un échantillon (la raison est le message)."""
+
+
+def _scope_aggs(select: exp.Select) -> List[exp.AggFunc]:
+    """Agrégats propres à ce SELECT (hors sous-requêtes et fonctions de fenêtre)."""
+    return [a for a in select.find_all(exp.AggFunc)
+            if a.find_ancestor(exp.Select) is select and not isinstance(a.parent, exp.Window)]
+
+
+def _weighted(agg: exp.AggFunc, w: str) -> Optional[str]:
+    """SQL pondéré équivalent, None si l'agrégat est conservé tel quel (MIN / MAX)."""
+    if isinstance(agg, (exp.Min, exp.Max)):
+        return None
+    if isinstance(agg, exp.Count):
+        if isinstance(agg.this, exp.Distinct):
+            raise NotEstimable("COUNT(DISTINCT) non estimable sur un échantillon")
+        if isinstance(agg.this, exp.Star) or agg.this is None:
+            return f"COALESCE(SUM({w}), 0)"
+        return f"COALESCE(SUM(CASE WHEN ({agg.this.sql('duckdb')}) IS NOT NULL THEN {w} END), 0)"
+    x = agg.this.sql("duckdb")
+    if isinstance(agg, exp.Sum):
+        return f"SUM(({x}) * {w})"
+    if isinstance(agg, exp.Avg):
+        return f"SUM(({x}) * {w}) / NULLIF(SUM(CASE WHEN ({x}) IS NOT NULL THEN {w} END), 0)"
+    raise NotEstimable(f"agrégat non estimable sur un échantillon: {agg.sql('duckdb')}")
+
+
+def _standard_error(agg: exp.AggFunc, w: str, wr: str, rep: str, nrep: Optional[str] = None) -> Optional[str]:
+    """
+    Erreur type par groupes aléatoires stratifiés : chaque groupe de réplication, repondéré par
+    strate (__wr), donne une estimation complète ; l'erreur type est la dispersion de ces estimations.
+    Les groupes sans estimation sont ignorés : groupe vide dans l'échantillon (`nrep` = nombre de groupes
+    non vides, numérotés 0..nrep-1, quand la source l'expose) ou sans valeur pour une moyenne.
+    """
+    reps = _replicates()
+    if isinstance(agg, (exp.Sum, exp.Count)):
+        if isinstance(agg, exp.Count):
+            value = "1" if isinstance(agg.this, exp.Star) or agg.this is None else \
+                f"CASE WHEN ({agg.this.sql('duckdb')}) IS NOT NULL THEN 1 END"
+        else:
+            value = f"({agg.this.sql('duckdb')})"
+        full = f"SUM({value} * {w})"
+        # un groupe non vide sans ligne dans ce groupe de résultat estime bien 0
+        ests = [f"COALESCE(SUM(CASE WHEN {rep} = {r} THEN {value} * {wr} END), 0)" for r in range(reps)]
+        if nrep:
+            ests = [f"CASE WHEN {r} < MAX({nrep}) THEN {e} END" for r, e in enumerate(ests)]
+    elif isinstance(agg, exp.Avg):
+        x = agg.this.sql("duckdb")
+        full = f"(SUM(({x}) * {w}) / NULLIF(SUM(CASE WHEN ({x}) IS NOT NULL THEN {w} END), 0))"
+        ests = [f"(SUM(CASE WHEN {rep} = {r} THEN ({x}) * {wr} END) / "
+                f"NULLIF(SUM(CASE WHEN {rep} = {r} AND ({x}) IS NOT NULL THEN {wr} END), 0))" for r in range(reps)]
+    else:
+        return None
+    total = " + ".join(f"COALESCE(power({e} - {full}, 2), 0)" for e in ests)
+    k = "(" + " + ".join(f"CASE WHEN {e} IS NULL THEN 0 ELSE 1 END" for e in ests) + ")"
+    return f"sqrt(({total}) / NULLIF({k} * ({k} - 1), 0))"
+
+
+def rewrite_weighted(
+    sql: str,
+    sources: Dict[str, str],
+    allow_rows: bool = True,
+    nrep: Optional[str] = None,
+) -> Tuple[str, List[str], List[str]]:
+    """
+    Remplace chaque dataset de `sources` lu par la requête par sa source pondérée : nom de table
+    d'échantillon, ou sous-requête SELECT exposant __w / __wr / __rep (et `nrep`, nombre de groupes
+    de réplication non vides, si donné : renvoyé aussi comme colonne `nrep`). Les agrégats sont pondérés
+    et ceux de la requête principale reçoivent une colonne `<nom>_se`.
+    Retourne (sql, agrégats estimés, datasets remplacés) ; lève NotEstimable sinon.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="duckdb")
+    except Exception:
+        tree = None
+    if not isinstance(tree, exp.Select):
+        raise NotEstimable("requête non analysable (SELECT simple attendu)")
+    ctes = {c.alias_or_name for c in tree.find_all(exp.CTE)}
+    tables = [t for t in tree.find_all(exp.Table) if t.name in sources and t.name not in ctes and not t.db]
+    if not tables:
+        raise NotEstimable("aucun dataset échantillonné dans la requête")
+
+    scopes: Dict[int, Tuple[exp.Select, exp.Table]] = {}
+    for t in tables:
+        select = t.find_ancestor(exp.Select)
+        if select is None or id(select) in scopes:
+            raise NotEstimable("plusieurs datasets échantillonnés dans un même SELECT")
+        scopes[id(select)] = (select, t)
+
+    used = sorted({tb.name for _, tb in scopes.values()})
+    estimated: List[str] = []
+    for select, table in scopes.values():
+        alias = table.alias_or_name
+        aggs = _scope_aggs(select)
+        if not aggs and not select.args.get("group"):
+            if not allow_rows:
+                raise NotEstimable("aucun agrégat à estimer")
+            if select is not tree:
+                raise NotEstimable("lignes échantillonnées réutilisées dans une sous-requête")
+            if any(w.find_ancestor(exp.Select) is select for w in select.find_all(exp.Window)):
+                raise NotEstimable("fonctions de fenêtre sur des lignes échantillonnées")
+            for star in [e for e in select.expressions if isinstance(e, exp.Star)]:
+                star.set("except_", [exp.column(c) for c in HIDDEN_COLUMNS])
+        else:
+            w, wr, rep = f"{_id(alias)}.__w", f"{_id(alias)}.__wr", f"{_id(alias)}.__rep"
+            # erreurs types : agrégats projetés directement par la requête principale
+            extra = []
+            if select is tree:
+                for item in select.expressions:
+                    agg = item.this if isinstance(item, exp.Alias) else item
+                    if isinstance(agg, exp.AggFunc) and agg in aggs:
+                        name = item.alias if isinstance(item, exp.Alias) else agg.sql("duckdb").lower()
+                        se = _standard_error(agg, w, wr, rep, f"{_id(alias)}.{nrep}" if nrep else None)
+                        if se:
+                            extra.append((name, se))
+                            estimated.append(name)
+                        if not isinstance(item, exp.Alias):
+                            item.replace(exp.alias_(agg.copy(), name, quoted=True))
+            for agg in _scope_aggs(select):
+                weighted = _weighted(agg, w)
+                if weighted:
+                    agg.replace(sqlglot.parse_one(weighted, read="duckdb"))
+            for name, se in extra:
+                select.append("expressions", exp.alias_(sqlglot.parse_one(se, read="duckdb"), f"{name}_se",
+                                                        quoted=True))
+            if extra and nrep:
+                # groupes ayant servi à l'erreur type : degrés de liberté de l'intervalle
+                select.append("expressions", exp.alias_(sqlglot.parse_one(f"MAX({_id(alias)}.{nrep})", read="duckdb"),
+                                                        nrep, quoted=True))
+        source = sources[table.name]
+        if source.lstrip().upper().startswith("SELECT"):
+            table.replace(exp.Subquery(this=sqlglot.parse_one(source, read="duckdb"),
+                                       alias=exp.TableAlias(this=exp.to_identifier(alias))))
+        else:
+            if not table.alias:
+                table.set("alias", exp.TableAlias(this=exp.to_identifier(table.name)))
+            table.set("this", exp.to_identifier(source))
+    return tree.sql(dialect="duckdb"), estimated, used
+
+
+def sample_bounds(sql: str) -> List[str]:
+    """Colonnes MIN / MAX projetées par la requête : lues sur un échantillon, ce sont des bornes approchées."""
+    try:
+        tree = sqlglot.parse_one(sql, read="duckdb")
+    except Exception:
+        return []
+    if not isinstance(tree, exp.Select):
+        return []
+    out = []
+    for item in tree.expressions:
+        agg = item.this if isinstance(item, exp.Alias) else item
+        if isinstance(agg, (exp.Min, exp.Max)):
+            out.append(item.alias if isinstance(item, exp.Alias) else agg.sql("duckdb").lower())
+    return out
+
+
+def approximate_sql(sql: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Réécrit la requête vers les échantillons des datasets qu'elle lit.
+    Retourne (sql, meta) ; meta["approximate"] est False (avec "reason") si la requête reste exacte.
+    """
+    samples = _catalog() if enabled() else {}
+    try:
+        rewritten, estimated, used = rewrite_weighted(sql, {d: e["table"] for d, e in samples.items()})
+    except NotEstimable as e:
+        return sql, {"approximate": False, "reason": str(e)}
+    return rewritten, {
+        "approximate": True,
+        "datasets": {d: {"sample_rows": samples[d]["sample_rows"], "source_rows": samples[d]["source_rows"],
+                         "strata_columns": samples[d]["strata_columns"]} for d in used},
+        "estimated": estimated,
+        **({"sample_bounds": bounds,
+            "bounds_note": "MIN / MAX observés sur l'échantillon (bornes approchées, sans erreur type)"}
+           if (bounds := sample_bounds(sql)) else {}),
+        "standard_error_suffix": "_se",
+        "replicates": _replicates(),
+        "note": "intervalle de confiance à 95 % ≈ estimation ± 1,96 × erreur type",
+    }
@@ -0,0 +1,314 @@
+"""
+Ordonnancement du travail DuckDB : créneaux de concurrence par classe de requête.
+
+Chaque exécution prend un créneau de sa classe (interactive, nl, analysis, export, ingest) avant
+d'ouvrir ses connexions ; au-delà, elle attend dans la file :
+- créneaux bornés par classe (`slots`) et au total (SCHEDULER_MAX_CONCURRENT) : une rafale
+  d'exports ne consomme que les créneaux export, jamais ceux des requêtes interactives
+- file à priorités : un créneau libéré va d'abord à la classe la plus prioritaire (`priority`,
+  0 = interactive), puis à l'utilisateur qui a le moins de requêtes en cours et, à égalité, à celui
+  servi le moins récemment (tourniquet entre utilisateurs), puis FIFO
+- attente bornée (`queue_timeout`) : QueueTimeout, que les vues traduisent en 503 + Retry-After
+- parallélisme : DuckDB ne règle pas `threads` par requête (SET threads s'applique à toute l'instance,
+  toutes connexions confondues, et la configuration par connexion le refuse sur une base déjà ouverte) ;
+  le plafond d'une classe passe donc uniquement par ses créneaux. Une clé "threads" dans
+  SCHEDULER_CLASSES est ignorée (avertissement) : régler DUCKDB_THREADS pour l'instance
+- budget mémoire : memory_limit et threads de DuckDB sont globaux à l'instance (duck.ENGINE_SETTINGS),
+  pas par requête ; chaque créneau réserve donc la part `memory` de sa classe et un créneau n'est
+  attribué que si la somme des réservations tient dans engine_memory() (au-delà, DuckDB déborde sur
+  disque au lieu d'échouer)
+- `result_memory` : plafond du DataFrame résultat côté Python (lecture par blocs, ResultTooLarge),
+  la conversion JSON coûtant environ _MATERIALIZATION_FACTOR fois plus
+
+Les réservations sont comptées par worker, alors que l'instance du service moteur (DUCKDB_ENGINE_SOCKET)
+est partagée : chaque worker n'y réserve que memory_limit / WEB_CONCURRENCY. Ce n'est qu'une régulation
+de l'admission (les commandes de gestion et les autres clients du service ne réservent rien) ; la seule
+borne dure reste le memory_limit de DuckDB. Côté Python, chaque worker garde au plus
+Σ slots × result_memory × (1 + facteur) de résultats en cours.
+SCHEDULER_CLASSES (dict ou JSON) surcharge les réglages par classe, ex. :
+    {"export": {"slots": 2, "memory": "1GB", "result_memory": "512MB", "queue_timeout": 300}}
+Les compteurs sont par processus (un ordonnanceur par worker gunicorn).
+"""
+from __future__ import annotations
+import contextvars
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from .. import duck
+from ..duck import ENGINE_SETTINGS, parse_bytes, web_workers
+
+logger = logging.getLogger(__name__)
+
+_CPUS = os.cpu_count() or 4
+_MATERIALIZATION_FACTOR = 4  # list[dict] + JSON par rapport au DataFrame
+_DEFAULT_CLASSES: Dict[str, Dict[str, Any]] = {
+    "interactive": {"slots": 4, "queue_timeout": 10.0, "priority": 0, "memory": "256MB", "result_memory": "64MB"},
+    "nl": {"slots": 2, "queue_timeout": 30.0, "priority": 1, "memory": "512MB", "result_memory": "128MB"},
+    "analysis": {"slots": 2, "queue_timeout": 60.0, "priority": 2, "memory": "1GB", "result_memory": "256MB"},
+    "ingest": {"slots": 1, "queue_timeout": 300.0, "priority": 2, "memory": "1GB", "result_memory": None},
+    "export": {"slots": 1, "queue_timeout": 120.0, "priority": 3, "memory": "512MB", "result_memory": "512MB"},
+}
+
+_UNSUPPORTED = {"threads": "DuckDB ne règle pas threads par requête, utiliser slots (ou DUCKDB_THREADS)"}
+
+_slot: contextvars.ContextVar = contextvars.ContextVar("scheduler_slot", default=None)
+_warned: set = set()
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def enabled() -> bool:
+    return str(_setting("SCHEDULER_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+def class_config(name: str) -> Dict[str, Any]:
+    """Réglages d'une classe : défauts surchargés par SCHEDULER_CLASSES (dict ou JSON)."""
+    overrides = _setting("SCHEDULER_CLASSES", {}) or {}
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides)
+    base = _DEFAULT_CLASSES.get(name, _DEFAULT_CLASSES["interactive"])
+    cfg = {**base, **(overrides.get(name) or {})}
+    for key in _UNSUPPORTED.keys() & cfg.keys():
+        if (name, key) not in _warned:
+            _warned.add((name, key))
+            logger.warning(f"[scheduler] SCHEDULER_CLASSES[{name!r}][{key!r}] ignoré : {_UNSUPPORTED[key]}")
+        del cfg[key]
+    return cfg
+
+
+def memory(name: str) -> int:
+    """Mémoire moteur réservée par un créneau de la classe (octets, 0 si non bornée)."""
+    return parse_bytes(class_config(name).get("memory")) or 0
+
+
+def result_budget(name: str) -> Optional[int]:
+    """Plafond du DataFrame résultat côté Python pour la classe (None si non borné)."""
+    return parse_bytes(class_config(name).get("result_memory"))
+
+
+def engine_memory() -> Optional[int]:
+    """Mémoire moteur que les créneaux de ce worker peuvent réserver (sa part du service moteur partagé)."""
+    limit = parse_bytes(ENGINE_SETTINGS.get("memory_limit"))
+    if limit and duck.ENGINE_SOCKET:
+        limit //= web_workers()
+    return limit
+
+
+class QueueTimeout(Exception):
+    """Pas de créneau libre dans le délai de la classe (moteur saturé)."""
+
+    def __init__(self, query_class: str, waited: float):
+        self.query_class = query_class
+        self.waited = waited
+        super().__init__(f"Moteur saturé : aucun créneau '{query_class}' libre après {waited:.0f} s, réessayez.")
+
+
+class _Ticket:
+    __slots__ = ("seq", "cls", "client", "priority", "enqueued")
+
+    def __init__(self, seq: int, cls: str, client: str, priority: int):
+        self.seq, self.cls, self.client, self.priority = seq, cls, client, priority
+        self.enqueued = time.perf_counter()
+
+
+class Scheduler:
+    """Créneaux par classe + plafond global, attribués sous une seule condition."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._running: Counter = Counter()                 # classe -> exécutions en cours
+        self._reserved = 0                                 # mémoire moteur réservée par les créneaux en cours
+        self._by_client: Counter = Counter()               # (classe, client) -> exécutions en cours
+        self._served: Dict[tuple, int] = {}                # (classe, client) -> rang de la dernière admission
+        self._admissions = itertools.count()
+        self._waits: Dict[str, Deque[float]] = {}
+        self.counters: Counter = Counter()
+
+    # -- attribution -- #
+
+    def _free(self, cls: str, max_total: int) -> bool:
+        running = sum(self._running.values())
+        if self._running[cls] >= int(class_config(cls)["slots"]) or running >= max_total:
+            return False
+        # au moins une exécution possible, même si sa réservation dépasse seule le budget
+        budget = engine_memory()
+        return not budget or not running or self._reserved + memory(cls) <= budget
+
+    def _next(self, max_total: int) -> Optional[_Ticket]:
+        eligible = [t for t in self._waiting if self._free(t.cls, max_total)]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda t: (t.priority, self._by_client[(t.cls, t.client)],
+                                            self._served.get((t.cls, t.client), -1), t.seq))
+
+    def acquire(self, cls: str, client: str, priority: Optional[int] = None) -> float:
+        """Bloque jusqu'à l'obtention d'un créneau ; retourne l'attente (s). Lève QueueTimeout."""
+        cfg = class_config(cls)
+        max_total = int(_setting("SCHEDULER_MAX_CONCURRENT", max(2, _CPUS)))
+        ticket = _Ticket(next(self._seq), cls, client, int(cfg["priority"] if priority is None else priority))
+        deadline = ticket.enqueued + float(cfg["queue_timeout"])
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while self._next(max_total) is not ticket:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.counters[f"{cls}:timeout"] += 1
+                        raise QueueTimeout(cls, time.perf_counter() - ticket.enqueued)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # notre départ peut débloquer un ticket moins prioritaire
+                self._cond.notify_all()
+            self._running[cls] += 1
+            self._reserved += memory(cls)
+            self._by_client[(cls, client)] += 1
+            if len(self._served) > 10_000:
+                self._served.clear()
+            self._served[(cls, client)] = next(self._admissions)
+            waited = time.perf_counter() - ticket.enqueued
+            self._waits.setdefault(cls, deque(maxlen=500)).append(waited)
+            self.counters[f"{cls}:admitted"] += 1
+            if waited > 0.001:
+                self.counters[f"{cls}:queued"] += 1
+        return waited
+
+    def release(self, cls: str, client: str) -> None:
+        with self._cond:
+            self._running[cls] -= 1
+            self._reserved -= memory(cls)
+            self._by_client[(cls, client)] -= 1
+            if self._by_client[(cls, client)] <= 0:
+                del self._by_client[(cls, client)]
+            self._cond.notify_all()
+
+    # -- observabilité -- #
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            running = dict(self._running)
+            reserved = self._reserved
+            queued = Counter(t.cls for t in self._waiting)
+            oldest = {}
+            now = time.perf_counter()
+            for t in self._waiting:
+                oldest[t.cls] = max(oldest.get(t.cls, 0.0), now - t.enqueued)
+            waits = {cls: list(values) for cls, values in self._waits.items()}
+            counters = dict(self.counters)
+        classes = {}
+        for cls in _DEFAULT_CLASSES:
+            cfg = class_config(cls)
+            w = sorted(waits.get(cls) or [])
+            classes[cls] = {
+                "slots": int(cfg["slots"]), "priority": int(cfg["priority"]),
+                "memory_bytes": memory(cls), "result_memory_bytes": result_budget(cls),
+                "running": running.get(cls, 0), "queued": queued.get(cls, 0),
+                "oldest_wait_ms": round(oldest.get(cls, 0.0) * 1000, 1),
+                "wait_ms_p50": round(statistics.median(w) * 1000, 1) if w else None,
+                "wait_ms_p95": round(w[int(0.95 * (len(w) - 1))] * 1000, 1) if w else None,
+                "admitted": counters.get(f"{cls}:admitted", 0),
+                "queued_total": counters.get(f"{cls}:queued", 0),
+                "timeouts": counters.get(f"{cls}:timeout", 0),
+            }
+        python_budget = sum(int(c["slots"]) * (c["result_memory_bytes"] or 0) for c in classes.values())
+        return {"enabled": enabled(), "max_concurrent": int(_setting("SCHEDULER_MAX_CONCURRENT", max(2, _CPUS))),
+                "running": sum(running.values()), "queued": sum(queued.values()),
+                "memory": {"engine": dict(ENGINE_SETTINGS), "engine_limit_bytes": engine_memory(),
+                           "reserved_bytes": reserved,
+                           "python_results_max_bytes": python_budget * (1 + _MATERIALIZATION_FACTOR)},
+                "classes": classes}
+
+
+scheduler = Scheduler()
+
+
+def _trusted_proxies() -> List[Any]:
+    """Réseaux des reverse proxies de confiance (TRUSTED_PROXIES : liste ou "10.0.0.0/8,127.0.0.1")."""
+    raw = _setting("TRUSTED_PROXIES", []) or []
+    items = raw.split(",") if isinstance(raw, str) else raw
+    return [ipaddress.ip_network(str(v).strip(), strict=False) for v in items if str(v).strip()]
+
+
+def _in(address: str, networks: List[Any]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in net for net in networks)
+
+
+def client_address(request) -> str:
+    """
+    Adresse du client : REMOTE_ADDR, sauf si la connexion vient d'un proxy de confiance ; X-Forwarded-For
+    est alors lu de droite à gauche et la première adresse qui n'est pas un proxy de confiance est retenue
+    (les entrées plus à gauche sont fournies par le client, donc falsifiables).
+    """
+    remote = request.META.get("REMOTE_ADDR") or ""
+    proxies = _trusted_proxies()
+    if not proxies or not _in(remote, proxies):
+        return remote or "?"
+    hops = [h.strip() for h in (request.META.get("HTTP_X_FORWARDED_FOR") or "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _in(hop, proxies):
+            return hop
+    return hops[0] if hops else remote
+
+
+def client_key(request=None) -> str:
+    """Clé d'équité : utilisateur authentifié, sinon adresse du client (client_address)."""
+    if request is None:
+        from common.middleware import current_request
+        request = current_request()
+    if request is None:
+        return "system"
+    user = getattr(request, "user", None)
+    if user is not None and getattr(user, "is_authenticated", False):
+        return f"user:{user.pk}"
+    return f"ip:{client_address(request)}"
+
+
+@contextmanager
+def slot(cls: str, client: Optional[str] = None, priority: Optional[int] = None) -> Iterator[float]:
+    """
+    Exécute le bloc dans un créneau de la classe `cls` (attente éventuelle dans la file).
+    Réentrant : un bloc déjà dans un créneau (ex. run_plan -> run_sql_safe) ne reprend pas de créneau.
+    """
+    if not enabled() or _slot.get() is not None:
+        yield 0.0
+        return
+    client = client or client_key()
+    waited = scheduler.acquire(cls, client, priority)
+    slot_token = _slot.set(cls)
+    try:
+        yield waited
+    finally:
+        _slot.reset(slot_token)
+        scheduler.release(cls, client)
+
+
+def current_class() -> Optional[str]:
+    return _slot.get()
+
+
+def stats() -> Dict[str, Any]:
+    return scheduler.stats()
@@ -0,0 +1,230 @@
+"""
+Fiche schéma ("schema card") par dataset, envoyée comme contexte au LLM à la place du DESCRIBE brut.
+
+Pour chaque colonne : type, rôle (date, mesure, catégorie, identifiant, texte), taux de nulls,
+min/max et valeurs les plus fréquentes des colonnes de faible cardinalité (scan GROUPING SETS,
+sur l'échantillon persistant du dataset quand il existe).
+Construite à l'ingestion à partir du catalogue de stats, persistée dans `__schema_cards` avec
+la version du dataset et mise en cache : aucun calcul au moment de la requête.
+
+La taille du texte est bornée (SCHEMA_CARD_MAX_CHARS) : pour les tables larges, les valeurs
+fréquentes puis les détails des dernières colonnes sont retirés en premier.
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from . import sampling, stats as col_stats
+from .cache import LRUCache
+from ..duck import META_TABLE, _id, connect, dataset_version, on_dataset_loaded, query
+
+logger = logging.getLogger(__name__)
+
+CARDS_TABLE = "__schema_cards"
+
+_DATE_TYPES = ("DATE", "TIMESTAMP")
+_NUM_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "FLOAT", "DOUBLE", "DECIMAL",
+              "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT")
+_ID_LIKE = {"id", "task id", "task_id"}
+
+_cache = LRUCache(maxsize=256, ttl=30)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def column_role(name: str, typ: str, distinct: Optional[int], rows: int,
+                min_value: Any = None, max_value: Any = None) -> str:
+    low = str(name).lower()
+    if typ.startswith(_DATE_TYPES):
+        return "date"
+    if typ.startswith("VARCHAR") and all(_ISO_DATE.match(str(v or "")) for v in (min_value, max_value)):
+        # dates restées en texte à l'import (le planner les convertit avec TRY_CAST)
+        return "date"
+    if low in _ID_LIKE or low.endswith("_id"):
+        return "identifiant"
+    if typ.startswith(_NUM_TYPES):
+        return "mesure"
+    if typ.startswith(("VARCHAR", "BOOLEAN", "ENUM")):
+        max_distinct = int(_setting("SCHEMA_CARD_CATEGORY_MAX_DISTINCT", 200))
+        if distinct is not None and (distinct <= max_distinct or (rows and distinct / rows < 0.01)):
+            return "catégorie"
+        return "texte"
+    return "autre"
+
+
+# ------------------ Construction ------------------ #
+
+_GROUPING_MAX = 60  # DuckDB : GROUPING() limité à 64 colonnes
+
+
+def _top_values(con, dataset: str, columns: List[str], k: int) -> Dict[str, List[List[Any]]]:
+    """
+    Top-k valeurs (valeur, effectif) de plusieurs colonnes en un scan GROUPING SETS (par lot de 60).
+    Lu depuis l'échantillon du dataset s'il est à jour (effectifs estimés par les poids).
+    """
+    source, count = sampling.weighted_source(dataset) or (_id(dataset), "COUNT(*)")
+    out: Dict[str, List[List[Any]]] = {c: [] for c in columns}
+    for start in range(0, len(columns), _GROUPING_MAX):
+        batch = columns[start:start + _GROUPING_MAX]
+        sets = ", ".join(f"({_id(c)})" for c in batch)
+        gid = f"GROUPING({', '.join(_id(c) for c in batch)})"
+        rows = con.execute(
+            f"SELECT {gid} AS g, {', '.join(f'CAST({_id(c)} AS VARCHAR)' for c in batch)}, {count} AS n "
+            f"FROM {source} GROUP BY GROUPING SETS ({sets}) "
+            f"QUALIFY row_number() OVER (PARTITION BY g ORDER BY n DESC) <= {int(k)}"
+        ).fetchall()
+        width = len(batch)
+        for row in rows:
+            # le bit à 0 désigne la colonne regroupée (bit de poids fort = première colonne)
+            idx = next(i for i in range(width) if not (row[0] >> (width - 1 - i)) & 1)
+            if row[1 + idx] is not None:
+                out[batch[idx]].append([row[1 + idx], int(round(row[-1]))])
+    for c in out:
+        out[c].sort(key=lambda vn: -vn[1])
+    return out
+
+
+def build_card(dataset: str, con=None) -> Dict[str, Any]:
+    """Fiche structurée : {"dataset", "rows", "columns": [{name, type, role, null_rate, ...}]}."""
+    st = col_stats.get_stats(dataset)
+    if not st:
+        raise ValueError(f"Statistiques indisponibles pour {dataset}")
+    rows = st["rows"]
+    k = int(_setting("SCHEMA_CARD_TOP_VALUES", 8))
+    columns = []
+    for name, s in st["columns"].items():
+        columns.append({
+            "name": name,
+            "type": s["type"],
+            "role": column_role(name, s["type"], s.get("distinct"), rows, s.get("min"), s.get("max")),
+            "null_rate": round(s["nulls"] / rows, 4) if rows else 0.0,
+            "distinct": s.get("distinct"),
+            "min": s.get("min"),
+            "max": s.get("max"),
+        })
+    cats = [c["name"] for c in columns if c["role"] == "catégorie"]
+    own = con is None
+    con = con or connect(read_only=False)
+    try:
+        tops = _top_values(con, dataset, cats, k) if k > 0 else {}
+    finally:
+        if own:
+            con.close()
+    for c in columns:
+        if c["name"] in tops:
+            c["top_values"] = tops[c["name"]]
+    return {"dataset": dataset, "rows": rows, "columns": columns}
+
+
+def _fmt(v: Any) -> str:
+    s = str(v)
+    return s[:10] if len(s) >= 19 and s[4] == "-" and s[10] == "T" and s.endswith("00:00:00") else s[:40]
+
+
+def _column_line(c: Dict[str, Any], rows: int, with_values: bool) -> str:
+    parts = [f"- {c['name']} {c['type']} [{c['role']}]"]
+    if c["role"] in ("date", "mesure") and c.get("min") is not None:
+        parts.append(f"{_fmt(c['min'])} → {_fmt(c['max'])}")
+    if c["role"] in ("catégorie", "texte", "identifiant") and c.get("distinct") is not None:
+        parts.append(f"~{c['distinct']} distincts")
+    if c.get("null_rate"):
+        parts.append(f"nulls {c['null_rate'] * 100:.1f}%")
+    line = ", ".join(parts)
+    if with_values and c.get("top_values"):
+        vals = "; ".join(
+            f"{str(v)[:40]} ({n / rows * 100:.0f}%)" if rows else str(v)[:40] for v, n in c["top_values"]
+        )
+        line += f" — valeurs: {vals}"
+    return line
+
+
+def render(card: Dict[str, Any], max_chars: Optional[int] = None) -> str:
+    """Texte compact de la fiche, borné à max_chars (défaut SCHEMA_CARD_MAX_CHARS)."""
+    max_chars = int(max_chars or _setting("SCHEMA_CARD_MAX_CHARS", 4000))
+    rows = card["rows"]
+    head = f"Table {card['dataset']} ({rows} lignes, {len(card['columns'])} colonnes)"
+    cols = card["columns"]
+    # niveau de détail décroissant jusqu'à tenir dans la borne
+    for n_values in (len(cols), len(cols) // 2, 0):
+        lines = [_column_line(c, rows, i < n_values) for i, c in enumerate(cols)]
+        text = "\n".join([head, *lines])
+        if len(text) <= max_chars:
+            return text
+    text, kept = head, 0
+    for line in lines:
+        if len(text) + len(line) + 1 > max_chars - 80:
+            break
+        text += "\n" + line
+        kept += 1
+    rest = [c["name"] for c in cols[kept:]]
+    tail = "\n- autres colonnes: " + ", ".join(rest)
+    return (text + tail)[:max_chars]
+
+
+# ------------------ Catalogue ------------------ #
+
+def _persist(con, dataset: str, version: int, card: Dict[str, Any]) -> None:
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {CARDS_TABLE} ("
+        "dataset VARCHAR PRIMARY KEY, version BIGINT, card VARCHAR, text VARCHAR, built_at TIMESTAMP)"
+    )
+    con.execute(f"INSERT OR REPLACE INTO {CARDS_TABLE} VALUES (?, ?, ?, ?, now())",
+                [dataset, version, json.dumps(card, default=str), render(card)])
+
+
+@on_dataset_loaded
+def refresh_card(dataset: str, version: int) -> None:
+    _cache.pop(dataset)
+    with connect() as con:
+        _persist(con, dataset, version, build_card(dataset, con))
+
+
+def get_card(dataset: str) -> Optional[Dict[str, Any]]:
+    """{"card": fiche structurée, "text": rendu borné} pour la version courante, None si indisponible."""
+    if not dataset:
+        return None
+
+    def _load() -> Optional[Dict[str, Any]]:
+        try:
+            df = query(
+                f"SELECT c.card, c.text FROM {CARDS_TABLE} c LEFT JOIN {META_TABLE} d ON d.name = c.dataset "
+                "WHERE c.dataset = ? AND c.version = COALESCE(d.version, 0)",
+                [dataset],
+            )
+            if not df.empty:
+                return {"card": json.loads(df.iloc[0, 0]), "text": df.iloc[0, 1]}
+        except Exception:
+            pass
+        try:
+            card = build_card(dataset)
+        except Exception as e:
+            logger.debug(f"[schema_card] indisponible pour {dataset}: {e}")
+            return None
+        try:
+            with connect() as con:
+                _persist(con, dataset, dataset_version(dataset), card)
+        except Exception:
+            pass
+        return {"card": card, "text": render(card)}
+
+    return _cache.get_or_set(dataset, _load)
+
+
+def card_text(dataset: str) -> Optional[str]:
+    entry = get_card(dataset)
+    return entry["text"] if entry else None
@@ -0,0 +1,188 @@
+"""
+Coalescence des requêtes identiques concurrentes (single-flight).
+
+Les appels simultanés avec la même clé attendent une seule exécution et en partagent le résultat :
+- dans le processus : un verrou + un événement par clé en vol
+- entre workers (gunicorn, ...) : un verrou fichier (flock) par clé dans SINGLEFLIGHT_DIR
+  (défaut DATA_DIR/singleflight, mode 0700, propriétaire vérifié) ; le premier worker exécute et
+  publie son résultat en JSON, les autres attendent le verrou puis relisent ce résultat.
+  Indisponible sans fcntl (Windows) : coalescence locale seulement.
+Chaque appelant en attente reçoit sa propre copie du résultat.
+
+Clés utilisées : SQL normalisé + versions des datasets cités (run_sql_safe),
+question normalisée + dataset + schéma (appels n8n NL→SQL).
+"""
+from __future__ import annotations
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable
+
+from common.utils import private_dir
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_RESULT_TTL = 60.0
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Groupe de coalescence : do(key, fn) exécute fn une seule fois par clé en vol."""
+
+    def __init__(self, name: str, cross_process: bool = True):
+        self.name = name
+        self.cross_process = cross_process and fcntl is not None
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.counters = {"executed": 0, "shared": 0, "shared_cross_process": 0}
+
+    def _dir(self) -> Path:
+        base = _setting("SINGLEFLIGHT_DIR", None) or Path(_setting("DATA_DIR", "data")) / "singleflight"
+        private_dir(base)
+        return private_dir(Path(base) / self.name)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        with self._lock:
+            call = self._calls.get(digest)
+            leader = call is None
+            if leader:
+                call = self._calls[digest] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.event.wait()
+            with self._lock:
+                self.counters["shared"] += 1
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = self._cross(digest, fn) if self.cross_process else self._execute(fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(digest, None)
+            call.event.set()
+
+    def _execute(self, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.counters["executed"] += 1
+        return fn()
+
+    def _cross(self, digest: str, fn: Callable[[], Any]) -> Any:
+        try:
+            folder = self._dir()
+            # un verrou par clé complète : deux requêtes différentes ne s'attendent jamais
+            fd = os.open(folder / f"{digest}.lock", os.O_CREAT | os.O_RDWR | getattr(os, "O_NOFOLLOW", 0), 0o600)
+        except OSError as e:
+            logger.debug(f"[singleflight] verrou fichier indisponible: {e}")
+            return self._execute(fn)
+        result_path = folder / f"{digest}.res"
+        try:
+            t0 = time.time()
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # un autre worker exécute (peut-être) la même requête : on attend son résultat
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.stat(result_path).st_mtime >= t0:
+                        with open(result_path, "r", encoding="utf-8") as fh:
+                            result = json.load(fh)
+                        with self._lock:
+                            self.counters["shared_cross_process"] += 1
+                        return result
+                except (OSError, ValueError):
+                    pass
+            result = self._execute(fn)
+            self._publish(folder, result_path, result)
+            return result
+        finally:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+
+    def _publish(self, folder: Path, result_path: Path, result: Any) -> None:
+        try:
+            data = json.dumps(result)  # résultats JSON-safe (lignes, payloads n8n) ; sinon non publié
+            tmp = result_path.with_suffix(f".{os.getpid()}.tmp")
+            fd = os.open(tmp, os.O_CREAT | os.O_WRONLY | os.O_TRUNC | getattr(os, "O_NOFOLLOW", 0), 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(data)
+            os.replace(tmp, result_path)
+            now = time.time()
+            for old in folder.glob("*.res"):
+                if now - old.stat().st_mtime > _RESULT_TTL:
+                    old.unlink(missing_ok=True)
+            for old in folder.glob("*.lock"):
+                if now - old.stat().st_mtime > _RESULT_TTL:
+                    self._drop_lock(old)
+        except Exception as e:
+            logger.debug(f"[singleflight] publication impossible: {e}")
+
+    @staticmethod
+    def _drop_lock(path: Path) -> None:
+        """Supprime un verrou ancien s'il n'est tenu par personne."""
+        try:
+            fd = os.open(path, os.O_RDWR | getattr(os, "O_NOFOLLOW", 0))
+        except OSError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._calls), "cross_process": self.cross_process}
+
+
+def _cross_enabled() -> bool:
+    return str(_setting("SINGLEFLIGHT_CROSS_PROCESS", "1")).lower() not in {"0", "false", "no"}
+
+
+sql_flight = SingleFlight("sql", cross_process=_cross_enabled())
+nl_flight = SingleFlight("nl", cross_process=_cross_enabled())
+
+
+def stats() -> Dict[str, Any]:
+    return {"sql": sql_flight.stats(), "nl": nl_flight.stats()}
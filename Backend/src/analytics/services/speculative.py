@@ -0,0 +1,219 @@
+"""
+Exécution spéculative pendant l'appel n8n (NL → SQL).
+
+Pendant que le LLM génère sa requête, on lance en arrière-plan la requête du plan local de repli
+(celle que query_nl exécuterait si n8n échouait). Elle lit les colonnes date / mesure du dataset,
+ce qui chauffe aussi le cache de pages de DuckDB (partagé entre les connexions du processus).
+
+- n8n en échec / timeout, ou même SQL que la spéculation -> résultat spéculatif servi
+- SQL différent                                          -> requête spéculative interrompue
+  (con.interrupt()) puis exécution normale
+
+La requête spéculative suit le même chemin que run_sql_safe (classe nl) : admission, créneau du
+scheduler et mesure imputés au client de la requête HTTP (capturé à la création, le pool n'a pas
+de requête courante), lecture du résultat bornée par le budget mémoire de la classe.
+
+race() met les deux en concurrence sous le timeout n8n : si la spéculation est prête et que n8n
+n'a pas répondu NL_SPECULATIVE_GRACE secondes plus tard, le résultat spéculatif est servi sans
+attendre n8n (sa réponse, jamais exécutée, n'entre pas dans le cache NL→SQL).
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import accounting, admission, matviews, scheduler
+from .guards import normalize_sql
+from ..duck import _fetch_bounded, connect
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def enabled() -> bool:
+    return str(_setting("NL_SPECULATIVE_ENABLED", "1")).lower() not in {"0", "false", "no"}
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_llm_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_counters = {"started": 0, "served": 0, "cancelled": 0, "failed": 0, "raced_llm": 0, "raced_speculative": 0}
+_counters_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(_setting("NL_SPECULATIVE_WORKERS", 4)),
+                                           thread_name_prefix="speculative")
+        return _executor
+
+
+def _llm_pool() -> ThreadPoolExecutor:
+    # appels n8n lancés par race() : pool séparé pour ne pas attendre derrière les requêtes spéculatives
+    global _llm_executor
+    with _executor_lock:
+        if _llm_executor is None:
+            _llm_executor = ThreadPoolExecutor(max_workers=int(_setting("NL_SPECULATIVE_WORKERS", 4)),
+                                               thread_name_prefix="speculative-llm")
+        return _llm_executor
+
+
+def _bump(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+
+class Speculation:
+    """Requête lancée en arrière-plan sur sa propre connexion, interruptible."""
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.key = normalize_sql(sql)
+        # exécutée dans le pool : le client est capturé ici (équité des créneaux, quotas)
+        self.who = accounting.identity()
+        self.decision: Optional[admission.Decision] = None
+        self._con = None
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._t0 = time.perf_counter()
+        self._future = _pool().submit(self._run)
+        _bump("started")
+
+    def _run(self) -> List[Dict[str, Any]]:
+        from .runners import _jsonify_df
+
+        with admission.scope(), accounting.meter("speculative", query_class="nl", text=self.sql, who=self.who) as usage:
+            self.decision = admission.admit(self.sql, "nl")
+            t0 = time.perf_counter()
+            with scheduler.slot("nl", client=self.who[0]):
+                df = self._execute_in_slot(matviews.rewrite(self.decision.sql), scheduler.result_budget("nl"))
+            admission.record(self.decision, len(df), time.perf_counter() - t0)
+            usage.result_rows = len(df)
+        return _jsonify_df(df)
+
+    def _execute_in_slot(self, sql: str, max_bytes: Optional[int]):
+        con = connect()
+        with self._lock:
+            if self._cancelled:
+                con.close()
+                raise RuntimeError("spéculation annulée")
+            self._con = con
+        try:
+            cur = con.execute(sql)
+            return _fetch_bounded(cur, max_bytes) if max_bytes else cur.fetchdf()
+        finally:
+            with self._lock:
+                self._con = None
+            con.close()
+
+    def admission(self) -> Optional[Dict[str, Any]]:
+        """Meta de la décision d'admission de la requête spéculative (None si elle n'a pas tourné)."""
+        return self.decision.meta() if self.decision else None
+
+    @property
+    def future(self):
+        return self._future
+
+    def ready(self) -> bool:
+        """Terminée avec succès (résultat servable)."""
+        return self._future.done() and not self._future.cancelled() and self._future.exception() is None
+
+    def matches(self, sql: str) -> bool:
+        return bool(sql) and normalize_sql(sql) == self.key
+
+    def result(self, timeout: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """Lignes de la requête spéculative (attend la fin), None si elle a échoué."""
+        try:
+            rows = self._future.result(timeout=timeout)
+        except Exception as e:
+            _bump("failed")
+            logger.info(f"[speculative] requête en échec: {e}")
+            return None
+        _bump("served")
+        logger.info(f"[speculative] résultat servi ({(time.perf_counter() - self._t0) * 1000:.0f} ms depuis le lancement)")
+        return rows
+
+    def cancel(self) -> None:
+        """Interrompt la requête si elle tourne encore (sans effet si elle est terminée)."""
+        if self._future.done():
+            return
+        with self._lock:
+            self._cancelled = True
+            if self._con is not None:
+                try:
+                    self._con.interrupt()
+                except Exception:
+                    pass
+        self._future.cancel()
+        _bump("cancelled")
+
+
+def start(sql: str) -> Optional[Speculation]:
+    if not enabled() or not sql:
+        return None
+    try:
+        return Speculation(sql)
+    except Exception as e:
+        logger.warning(f"[speculative] lancement impossible: {e}")
+        return None
+
+
+def race(
+    spec: Speculation,
+    call: Callable[[], Dict[str, Any]],
+    timeout: Optional[float] = None,
+    grace: Optional[float] = None,
+) -> Tuple[Dict[str, Any], str]:
+    """
+    Lance call() (appel n8n NL→SQL) en concurrence avec la spéculation, le tout borné par timeout
+    (N8N_TIMEOUT_SECONDS). Renvoie (payload, gagnant) :
+    - "llm"         : n8n a répondu en premier, ou dans le délai de grâce après la spéculation
+    - "speculative" : spéculation prête et n8n toujours muet après grace secondes -> payload vide,
+                      query_nl retombe sur le plan de repli dont le résultat est déjà calculé
+    - "timeout" / "failed" : n8n hors délai ou en échec -> payload vide (même repli)
+    call() continue en arrière-plan s'il perd ; seul un payload servi puis exécuté est mis en cache (query_nl).
+    """
+    timeout = float(timeout if timeout is not None else _setting("N8N_TIMEOUT_SECONDS", 30))
+    grace = float(grace if grace is not None else _setting("NL_SPECULATIVE_GRACE", 1.0))
+    llm = _llm_pool().submit(call)
+    deadline = time.monotonic() + timeout
+    wait([llm, spec.future], timeout=timeout, return_when=FIRST_COMPLETED)
+    if not llm.done() and spec.ready():
+        # spéculation prête : n8n n'a plus que le délai de grâce pour répondre
+        if not wait([llm], timeout=max(0.0, min(grace, deadline - time.monotonic())))[0]:
+            _bump("raced_speculative")
+            logger.info("[speculative] spéculation servie avant la réponse n8n")
+            return {}, "speculative"
+    elif not llm.done():
+        # spéculation en échec : n8n seul jusqu'au timeout
+        wait([llm], timeout=max(0.0, deadline - time.monotonic()))
+    if not llm.done():
+        logger.info(f"[speculative] n8n sans réponse après {timeout:.0f} s")
+        return {}, "timeout"
+    try:
+        payload = llm.result()
+    except Exception as e:
+        logger.warning(f"Erreur n8n (NL→SQL): {e}")
+        return {}, "failed"
+    _bump("raced_llm")
+    return payload or {}, "llm"
+
+
+def stats() -> Dict[str, Any]:
+    with _counters_lock:
+        return dict(_counters)
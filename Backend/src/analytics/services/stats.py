@@ -0,0 +1,120 @@
+"""
+Statistiques de colonnes par dataset (catalogue) : nombre de lignes, min/max,
+cardinalité approchée et nombre de valeurs nulles.
+
+Calculées en un seul scan à l'ingestion (hook load_to_duckdb), persistées dans
+`__column_stats` avec la version du dataset, puis mises en cache en mémoire.
+Utilisées par le planner pour choisir un grain, pousser des prédicats et estimer un coût.
+"""
+from __future__ import annotations
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+
+from .cache import LRUCache
+from ..duck import META_TABLE, _id, connect, dataset_version, on_dataset_loaded, query
+
+logger = logging.getLogger(__name__)
+
+STATS_TABLE = "__column_stats"
+
+_cache = LRUCache(maxsize=256, ttl=30)
+
+
+def _jsonable(v: Any) -> Any:
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, (int, float, str, bool)) or v is None:
+        return v
+    try:
+        return float(v)
+    except Exception:
+        return str(v)
+
+
+def compute_stats(dataset: str, con=None) -> Dict[str, Any]:
+    """Calcule les stats de toutes les colonnes en un scan. Format :
+    {"rows": n, "columns": {nom: {"type", "min", "max", "distinct", "nulls"}}}"""
+    own = con is None
+    con = con or connect()
+    try:
+        cols = [(r[0], str(r[1]).upper()) for r in con.execute(f"DESCRIBE {_id(dataset)}").fetchall()]
+        exprs = ["COUNT(*)"]
+        for name, typ in cols:
+            q = _id(name)
+            if typ.startswith(("STRUCT", "MAP", "LIST")) or typ.endswith("[]"):
+                exprs += ["NULL", "NULL", "NULL", f"COUNT(*) - COUNT({q})"]
+            else:
+                exprs += [f"MIN({q})", f"MAX({q})", f"approx_count_distinct({q})", f"COUNT(*) - COUNT({q})"]
+        row = con.execute(f"SELECT {', '.join(exprs)} FROM {_id(dataset)}").fetchone()
+    finally:
+        if own:
+            con.close()
+
+    out: Dict[str, Any] = {"rows": int(row[0]), "columns": {}}
+    for i, (name, typ) in enumerate(cols):
+        mn, mx, nd, nn = row[1 + 4 * i: 5 + 4 * i]
+        out["columns"][name] = {
+            "type": typ,
+            "min": _jsonable(mn),
+            "max": _jsonable(mx),
+            "distinct": int(nd) if nd is not None else None,
+            "nulls": int(nn or 0),
+        }
+    return out
+
+
+def _persist(con, dataset: str, version: int, stats: Dict[str, Any]) -> None:
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {STATS_TABLE} ("
+        "dataset VARCHAR PRIMARY KEY, version BIGINT, stats VARCHAR, computed_at TIMESTAMP)"
+    )
+    con.execute(f"INSERT OR REPLACE INTO {STATS_TABLE} VALUES (?, ?, ?, now())",
+                [dataset, version, json.dumps(stats)])
+
+
+@on_dataset_loaded
+def refresh_stats(dataset: str, version: int) -> None:
+    _cache.pop(dataset)
+    with connect() as con:
+        _persist(con, dataset, version, compute_stats(dataset, con))
+
+
+def get_stats(dataset: str) -> Optional[Dict[str, Any]]:
+    """Stats à jour pour le dataset (catalogue, sinon calculées et persistées). None si indisponible."""
+    if not dataset:
+        return None
+
+    def _load() -> Optional[Dict[str, Any]]:
+        try:
+            df = query(
+                f"SELECT s.stats FROM {STATS_TABLE} s LEFT JOIN {META_TABLE} d ON d.name = s.dataset "
+                "WHERE s.dataset = ? AND s.version = COALESCE(d.version, 0)",
+                [dataset],
+            )
+            if not df.empty:
+                return json.loads(df.iloc[0, 0])
+        except Exception:
+            pass
+        try:
+            stats = compute_stats(dataset)
+        except Exception as e:
+            logger.debug(f"[stats] indisponibles pour {dataset}: {e}")
+            return None
+        try:
+            with connect() as con:
+                _persist(con, dataset, dataset_version(dataset), stats)
+        except Exception:
+            pass
+        return stats
+
+    return _cache.get_or_set(dataset, _load)
+
+
+def column_stats(dataset: str, column: Optional[str]) -> Optional[Dict[str, Any]]:
+    st = get_stats(dataset)
+    if not st or not column:
+        return None
+    return st["columns"].get(column)
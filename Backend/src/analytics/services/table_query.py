@@ -0,0 +1,210 @@
+"""
+Vue tableau côté serveur : filtre / tri / projection / pagination + facettes.
+
+La spécification (JSON) est compilée en SQL DuckDB paramétré : identifiants vérifiés contre le schéma
+et quotés avec `_id`, valeurs toujours passées en paramètres. Les facettes (effectifs par valeur des
+colonnes filtrables) et le total filtré sont calculés en un seul scan GROUPING SETS, mis en cache
+par (dataset, version, filtres). Facettes disjonctives : une colonne filtrée est comptée sans son
+propre filtre (un scan de plus par colonne filtrée), pour proposer les autres valeurs possibles.
+Erreurs de liaison / conversion sur les valeurs des filtres -> SpecError.
+
+Spécification :
+    {"columns": [...], "filters": [{"column", "op", "value"}], "sort": [{"column", "dir"}],
+     "page": 1, "page_size": 100, "facets": [...], "facet_limit": 20}
+"""
+from __future__ import annotations
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from .cache import LRUCache
+from .runners import _jsonify_df
+from .value_index import indexable_columns
+from .. import duck
+from ..duck import _id, dataset_version
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 1000
+MAX_FACETS = 20
+_GROUPING_MAX = 60
+
+_OPS = {
+    "eq": "{c} = ?", "ne": "{c} <> ?", "lt": "{c} < ?", "lte": "{c} <= ?", "gt": "{c} > ?", "gte": "{c} >= ?",
+    "between": "{c} BETWEEN ? AND ?",
+    "contains": "CAST({c} AS VARCHAR) ILIKE ?", "starts_with": "CAST({c} AS VARCHAR) ILIKE ?",
+    "is_null": "{c} IS NULL", "not_null": "{c} IS NOT NULL",
+}
+
+_facet_cache = LRUCache(maxsize=512)
+
+
+class SpecError(ValueError):
+    """Spécification invalide (colonne inconnue, opérateur non supporté, ...)."""
+
+
+def _schema(dataset: str) -> Dict[str, str]:
+    df = duck.query(f"DESCRIBE {_id(dataset)}")
+    return {str(r["column_name"]): str(r["column_type"]) for _, r in df.iterrows()}
+
+
+# erreurs DuckDB imputables à la spécification (valeur non convertible, type incompatible, ...)
+_SPEC_ERRORS = (duckdb.BinderException, duckdb.ConversionException, duckdb.InvalidInputException)
+
+
+def _query(sql: str, params: List[Any]) -> pd.DataFrame:
+    try:
+        return duck.query(sql, params)
+    except _SPEC_ERRORS as e:
+        raise SpecError(str(e).split("\n", 1)[0]) from e
+
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def compile_where(filters: List[Dict[str, Any]], schema: Dict[str, str]) -> Tuple[str, List[Any]]:
+    """(clause WHERE, paramètres) ; clause vide si aucun filtre."""
+    preds, params = [], []
+    for f in filters or []:
+        col, op, value = f.get("column"), (f.get("op") or "eq").lower(), f.get("value")
+        if col not in schema:
+            raise SpecError(f"Colonne inconnue: {col}")
+        c = _id(col)
+        if op in ("in", "not_in"):
+            values = list(value or [])
+            if not values:
+                preds.append("FALSE" if op == "in" else "TRUE")
+                continue
+            marks = ", ".join("?" * len(values))
+            preds.append(f"{c} {'NOT IN' if op == 'not_in' else 'IN'} ({marks})")
+            params += values
+        elif op not in _OPS:
+            raise SpecError(f"Opérateur non supporté: {op}")
+        elif op == "between":
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise SpecError("'between' attend [min, max]")
+            preds.append(_OPS[op].format(c=c))
+            params += list(value)
+        elif op in ("contains", "starts_with"):
+            pattern = _like_escape(str(value or ""))
+            preds.append(_OPS[op].format(c=c) + " ESCAPE '\\'")
+            params.append(f"%{pattern}%" if op == "contains" else f"{pattern}%")
+        elif op in ("is_null", "not_null"):
+            preds.append(_OPS[op].format(c=c))
+        else:
+            preds.append(_OPS[op].format(c=c))
+            params.append(value)
+    return (" WHERE " + " AND ".join(preds)) if preds else "", params
+
+
+def compile_order(sort: List[Dict[str, Any]], schema: Dict[str, str]) -> str:
+    parts = []
+    for s in sort or []:
+        col = s.get("column")
+        if col not in schema:
+            raise SpecError(f"Colonne de tri inconnue: {col}")
+        direction = "DESC" if str(s.get("dir", "asc")).lower() == "desc" else "ASC"
+        parts.append(f"{_id(col)} {direction} NULLS LAST")
+    return (" ORDER BY " + ", ".join(parts)) if parts else ""
+
+
+def _native(v: Any) -> Any:
+    if v is None or (isinstance(v, float) and v != v) or v is pd.NaT:
+        return None
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, pd.Timestamp):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    return v
+
+
+def _facets(dataset: str, columns: List[str], where: str, params: List[Any], limit: int) -> Tuple[int, Dict]:
+    """Total filtré + top-`limit` valeurs de chaque colonne, en un scan GROUPING SETS (par lot de 60)."""
+    facets: Dict[str, List[Dict[str, Any]]] = {c: [] for c in columns}
+    total = None
+    batches = [columns[i:i + _GROUPING_MAX] for i in range(0, len(columns), _GROUPING_MAX)] or [[]]
+    for batch in batches:
+        sets = ", ".join([*(f"({_id(c)})" for c in batch), "()"])
+        gid = f"GROUPING({', '.join(_id(c) for c in batch)})" if batch else "0"
+        cols = "".join(f", {_id(c)}" for c in batch)
+        # départage déterministe des ex aequo : par valeur, NULL en dernier
+        ties = "".join(f", {_id(c)} ASC NULLS LAST" for c in batch)
+        rows = _query(
+            f"SELECT {gid} AS __g{cols}, COUNT(*) AS __n FROM {_id(dataset)}{where} "
+            f"GROUP BY GROUPING SETS ({sets}) "
+            f"QUALIFY row_number() OVER (PARTITION BY __g ORDER BY __n DESC{ties}) <= {int(limit)}",
+            params,
+        ).itertuples(index=False, name=None)
+        width, full = len(batch), (1 << len(batch)) - 1
+        for row in rows:
+            g, n = int(row[0]), int(row[-1])
+            if g == full:
+                total = n
+                continue
+            idx = next(i for i in range(width) if not (g >> (width - 1 - i)) & 1)
+            facets[batch[idx]].append({"value": _native(row[1 + idx]), "count": n})
+    for c in facets:
+        facets[c].sort(key=lambda v: (-v["count"], v["value"] is None, str(v["value"])))
+    return total or 0, facets
+
+
+def _disjunctive_facets(dataset: str, columns: List[str], filters: List[Dict[str, Any]], schema: Dict[str, str],
+                        limit: int) -> Tuple[int, Dict]:
+    """Total filtré + facettes ; chaque colonne filtrée est comptée avec les autres filtres seulement."""
+    where, params = compile_where(filters, schema)
+    filtered = {f.get("column") for f in filters}
+    total, facets = _facets(dataset, [c for c in columns if c not in filtered], where, params, limit)
+    for c in columns:
+        if c in filtered:
+            w, p = compile_where([f for f in filters if f.get("column") != c], schema)
+            facets[c] = _facets(dataset, [c], w, p, limit)[1][c]
+    return total, {c: facets[c] for c in columns}
+
+
+def run(dataset: str, spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Exécute la spécification : une page de lignes, le total filtré et les facettes."""
+    schema = _schema(dataset)
+    columns = spec.get("columns") or list(schema)
+    unknown = [c for c in columns if c not in schema]
+    if unknown:
+        raise SpecError(f"Colonnes inconnues: {', '.join(map(str, unknown))}")
+    page = max(1, int(spec.get("page") or 1))
+    page_size = max(1, min(int(spec.get("page_size") or 100), MAX_PAGE_SIZE))
+    where, params = compile_where(spec.get("filters") or [], schema)
+    order = compile_order(spec.get("sort") or [], schema)
+
+    facet_cols = spec.get("facets")
+    if facet_cols is None:
+        facet_cols = indexable_columns(dataset)
+    facet_cols = [c for c in facet_cols if c in schema][:MAX_FACETS]
+    facet_limit = max(1, min(int(spec.get("facet_limit") or 20), 200))
+
+    key = (dataset, dataset_version(dataset), json.dumps(spec.get("filters") or [], sort_keys=True, default=str),
+           tuple(facet_cols), facet_limit)
+    cached = _facet_cache.get(key)
+    hit = cached is not None
+    if not hit:
+        cached = _disjunctive_facets(dataset, facet_cols, spec.get("filters") or [], schema, facet_limit)
+        _facet_cache.set(key, cached)
+    total, facets = cached
+
+    select = ", ".join(_id(c) for c in columns)
+    df = _query(
+        f"SELECT {select} FROM {_id(dataset)}{where}{order} LIMIT {page_size} OFFSET {(page - 1) * page_size}",
+        params,
+    )
+    return {
+        "rows": _jsonify_df(df),
+        "columns": [{"name": c, "type": schema[c]} for c in columns],
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "pages": (total + page_size - 1) // page_size,
+        "facets": facets,
+        "facets_cached": hit,
+    }
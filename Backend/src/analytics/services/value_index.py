@@ -0,0 +1,246 @@
+"""
+Index des valeurs distinctes des colonnes texte catégorielles (résolution d'entités).
+
+Construit à l'ingestion en un scan (UNPIVOT + GROUP BY) : valeur → (colonne, fréquence),
+persisté dans `__value_index` avec la version du dataset. En mémoire, par version :
+- clés normalisées (casse, accents, ponctuation) → entrées
+- liste triée des clés pour la recherche par préfixe (bisect)
+- index de trigrammes pour les correspondances approchées
+
+resolve() associe les termes d'une question à des filtres colonne = valeur ;
+autocomplete() alimente la saisie de la page « Ask ».
+"""
+from __future__ import annotations
+import bisect
+import logging
+import math
+import os
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import stats as col_stats
+from .cache import LRUCache
+from .lexicon import STOPWORDS
+from .nl_fastpath import _norm
+from ..duck import META_TABLE, _id, connect, dataset_versions, on_dataset_loaded, query
+
+logger = logging.getLogger(__name__)
+
+INDEX_TABLE = "__value_index"
+
+_ID_LIKE = {"id", "task id", "task_id"}
+_FUZZY_RATIO = 0.85
+_MAX_CANDIDATES = 2000
+
+_cache = LRUCache(maxsize=32)
+# versions courantes (évite une requête catalogue par appel de resolve / autocomplete)
+_versions = LRUCache(maxsize=1, ttl=1.0)
+
+
+def _setting(name: str, default: Any) -> Any:
+    try:
+        from django.conf import settings
+        value = getattr(settings, name, None)
+    except Exception:
+        value = None
+    if value is None:
+        value = os.getenv(name)
+    return default if value is None or value == "" else value
+
+
+def _trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ValueIndex:
+    """Index en mémoire d'un dataset (une version)."""
+
+    def __init__(self, entries: List[Tuple[str, str, int]]):
+        # clé normalisée -> [(colonne, valeur, fréquence)] triées par fréquence décroissante
+        self.by_key: Dict[str, List[Tuple[str, str, int]]] = defaultdict(list)
+        for column, value, freq in entries:
+            key = _norm(value)
+            if key:
+                self.by_key[key].append((column, value, int(freq)))
+        for items in self.by_key.values():
+            items.sort(key=lambda t: -t[2])
+        self.keys = sorted(self.by_key)
+        self.key_grams = {key: _trigrams(key) for key in self.keys}
+        self.grams: Dict[str, List[str]] = defaultdict(list)
+        for key, grams in self.key_grams.items():
+            for g in grams:
+                self.grams[g].append(key)
+        self.max_words = max((k.count(" ") + 1 for k in self.keys), default=0)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def prefix(self, prefix: str, limit: int = 10) -> List[str]:
+        lo = bisect.bisect_left(self.keys, prefix)
+        out = []
+        for key in self.keys[lo:]:
+            if not key.startswith(prefix):
+                break
+            out.append(key)
+            if len(out) >= 2000:
+                break
+        out.sort(key=lambda k: -self.by_key[k][0][2])
+        return out[:limit]
+
+    def similar(self, key: str, threshold: float = 0.6, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        Clés dont les trigrammes recouvrent ceux de `key` (Jaccard >= threshold).
+        Filtre par préfixe : un candidat valide partage forcément l'un des trigrammes les plus rares.
+        """
+        grams = _trigrams(key)
+        need = math.ceil(threshold * len(grams))
+        rare = sorted(grams, key=lambda g: len(self.grams.get(g, ())))[:len(grams) - need + 1]
+        candidates: set = set()
+        for g in rare:
+            # trigrammes triés du plus rare au plus fréquent : on s'arrête avant les listes énormes
+            if candidates and len(candidates) + len(self.grams.get(g, ())) > _MAX_CANDIDATES:
+                break
+            candidates.update(self.grams.get(g, ()))
+        scored = []
+        for cand in candidates:
+            cg = self.key_grams[cand]
+            if not threshold * len(grams) <= len(cg) <= len(grams) / threshold:
+                continue
+            inter = len(grams & cg)
+            score = inter / (len(grams) + len(cg) - inter)
+            if score >= threshold:
+                scored.append((cand, score))
+        scored.sort(key=lambda cs: (-cs[1], -self.by_key[cs[0]][0][2]))
+        return scored[:limit]
+
+
+# ------------------ Construction ------------------ #
+
+def indexable_columns(dataset: str) -> List[str]:
+    """Colonnes texte de cardinalité raisonnable (hors identifiants)."""
+    st = col_stats.get_stats(dataset) or {"columns": {}}
+    max_distinct = int(_setting("VALUE_INDEX_MAX_DISTINCT", 50000))
+    out = []
+    for name, s in st["columns"].items():
+        low = name.lower()
+        if not str(s["type"]).startswith(("VARCHAR", "ENUM")) or low in _ID_LIKE or low.endswith("_id"):
+            continue
+        if s.get("distinct") is not None and s["distinct"] <= max_distinct:
+            out.append(name)
+    return out
+
+
+def build(dataset: str, con) -> int:
+    """(Re)construit l'index persistant du dataset, retourne le nombre de valeurs indexées."""
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {INDEX_TABLE} ("
+        "dataset VARCHAR, version BIGINT, \"column\" VARCHAR, value VARCHAR, freq BIGINT)"
+    )
+    con.execute(f"DELETE FROM {INDEX_TABLE} WHERE dataset = ?", [dataset])
+    columns = indexable_columns(dataset)
+    if not columns:
+        return 0
+    version = con.execute(f"SELECT version FROM {META_TABLE} WHERE name = ?", [dataset]).fetchone()
+    cols = ", ".join(f"CAST({_id(c)} AS VARCHAR) AS {_id(c)}" for c in columns)
+    con.execute(
+        f"INSERT INTO {INDEX_TABLE} "
+        f"SELECT ?, ?, col, val, COUNT(*) FROM ("
+        f"  UNPIVOT (SELECT {cols} FROM {_id(dataset)}) ON {', '.join(_id(c) for c in columns)} "
+        f"  INTO NAME col VALUE val"
+        f") WHERE val IS NOT NULL AND length(val) <= 200 GROUP BY col, val",
+        [dataset, version[0] if version else 0],
+    )
+    return con.execute(f"SELECT COUNT(*) FROM {INDEX_TABLE} WHERE dataset = ?", [dataset]).fetchone()[0]
+
+
+@on_dataset_loaded
+def refresh_index(dataset: str, version: int) -> None:
+    _versions.clear()
+    with connect() as con:
+        n = build(dataset, con)
+    logger.info(f"[value_index] {dataset} v{version}: {n} valeur(s) indexée(s)")
+
+
+def get_index(dataset: str) -> Optional[ValueIndex]:
+    """Index en mémoire de la version courante (chargé depuis `__value_index`, reconstruit si périmé)."""
+    if not dataset:
+        return None
+    version = _versions.get_or_set("all", dataset_versions).get(dataset, 0)
+
+    def _load() -> Optional[ValueIndex]:
+        try:
+            df = query(f'SELECT "column", value, freq, version FROM {INDEX_TABLE} WHERE dataset = ?', [dataset])
+        except Exception:
+            df = None
+        if df is None or df.empty or int(df["version"].iloc[0]) != version:
+            try:
+                with connect() as con:
+                    build(dataset, con)
+                df = query(f'SELECT "column", value, freq FROM {INDEX_TABLE} WHERE dataset = ?', [dataset])
+            except Exception as e:
+                logger.debug(f"[value_index] indisponible pour {dataset}: {e}")
+                return None
+        return ValueIndex(list(zip(df["column"], df["value"], df["freq"])))
+
+    return _cache.get_or_set((dataset, version), _load)
+
+
+# ------------------ Requêtes ------------------ #
+
+def resolve(question: str, dataset: str, fuzzy: bool = True) -> List[Dict[str, Any]]:
+    """
+    Termes de la question reconnus comme valeurs : [{column, value, freq, match, term}].
+    Les n-grammes de mots les plus longs sont prioritaires ; pas de chevauchement.
+    """
+    index = get_index(dataset)
+    if not index or not len(index):
+        return []
+    words = _norm(question).split()
+    used = [False] * len(words)
+    found: List[Dict[str, Any]] = []
+    # correspondances exactes d'abord (n-grammes les plus longs), puis approchées sur le reste
+    for match in ("exact", "approx") if fuzzy else ("exact",):
+        for n in range(min(index.max_words, len(words)), 0, -1):
+            for i in range(len(words) - n + 1):
+                if any(used[i:i + n]):
+                    continue
+                term = " ".join(words[i:i + n])
+                if n == 1 and (len(term) < 2 or term in STOPWORDS):
+                    continue
+                if match == "exact":
+                    items = index.by_key.get(term)
+                elif len(term) >= 4:
+                    # candidats par trigrammes, confirmés par un ratio d'édition (fautes de frappe)
+                    near = [(SequenceMatcher(None, term, k).ratio(), k) for k, _ in index.similar(term, 0.3, 5)]
+                    near = [rk for rk in near if rk[0] >= _FUZZY_RATIO]
+                    items = index.by_key[max(near)[1]] if near else None
+                else:
+                    items = None
+                if not items:
+                    continue
+                for k in range(i, i + n):
+                    used[k] = True
+                column, value, freq = items[0]
+                found.append({"column": column, "value": value, "freq": freq, "match": match, "term": term, "pos": i,
+                              **({"alternatives": [{"column": c, "value": v} for c, v, _ in items[1:4]]}
+                                 if len(items) > 1 else {})})
+    found.sort(key=lambda f: f.pop("pos"))
+    return found
+
+
+def autocomplete(dataset: str, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Suggestions de valeurs pour un début de saisie (préfixe, puis trigrammes)."""
+    index = get_index(dataset)
+    key = _norm(prefix)
+    if not index or not key:
+        return []
+    keys = index.prefix(key, limit)
+    if len(keys) < limit and len(key) >= 3:
+        keys += [k for k, _ in index.similar(key, threshold=0.3, limit=limit) if k not in keys]
+    out = []
+    for k in keys[:limit]:
+        column, value, freq = index.by_key[k][0]
+        out.append({"value": value, "column": column, "freq": freq})
+    return out
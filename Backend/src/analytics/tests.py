@@ -3,6 +3,24 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 
 
+@pytest.fixture
+def duck(tmp_path, monkeypatch):
+    """Module analytics.duck sur une base vierge (tmp_path), caches indexés par dataset / version vidés."""
+    from analytics import duck as duck_module
+    from analytics.services import (
+        accounting, admission, anomaly, matviews, nl_cache, rollups, runners, sampling, schema_card, stats,
+        table_query, value_index,
+    )
+
+    monkeypatch.setattr(duck_module, "DB_PATH", tmp_path / "t.duckdb")
+    for cache in (stats._cache, schema_card._cache, value_index._cache, value_index._versions, sampling._catalog_cache,
+                  matviews._catalog_cache, rollups._catalog_cache, nl_cache._mem, accounting._totals,
+                  accounting._versions, admission._estimates, runners._versions, table_query._facet_cache,
+                  anomaly._cache):
+        cache.clear()
+    return duck_module
+
+
 @pytest.mark.django_db
 def test_query_sql_basic_select():
     client = APIClient()
@@ -21,3 +39,833 @@ def test_query_sql_guard_blocks_dangerous():
     r = client.post(url, {"sql": "DROP TABLE foo"}, format="json")
     assert r.status_code == 400
     assert "error" in r.data
+
+
+def test_chart_render_cache_and_formats():
+    import pandas as pd
+    from analytics.services import charts
+
+    df = pd.DataFrame({"x": [1.0, 2.0, 2.5, 3.0, 4.0]})
+    spec = {"type": "histogram", "x": "x", "bins": 3}
+    png = charts.render_spec(df, spec, fmt="png")
+    assert png and charts.render_spec(df, spec, fmt="png") == png
+    assert charts.render_spec(df, spec, fmt="svg") != png
+    assert charts.render_spec(df, spec, fmt="spec") is None
+
+
+def test_spec_mode_keeps_server_rendered_figures(settings):
+    import matplotlib.pyplot as plt
+    from analytics.services import charts
+    from analytics.services.runners import _eval_pandas
+
+    settings.CHART_RENDER_FORMAT = "spec"
+    assert charts.figure_format() == "png"
+    out = _eval_pandas("plt.plot([1, 2, 3])", {"plt": plt})
+    assert out["chart"] and out["chart_format"] == "png"
+
+
+def test_downsample_line_and_top_n_other():
+    from analytics.services.downsample import downsample_rows, OTHER_LABEL
+
+    rows = [{"dt": i, "value": float(i % 7)} for i in range(5000)]
+    chart_rows, meta = downsample_rows(rows, {"type": "line", "x": "dt", "y": "value"}, target_points=100)
+    assert meta["method"] == "lttb" and len(chart_rows) == 100
+    assert chart_rows[0]["dt"] == 0 and chart_rows[-1]["dt"] == 4999
+
+    rows = [{"label": f"c{i}", "value": float(i)} for i in range(50)]
+    chart_rows, meta = downsample_rows(rows, {"type": "pie", "x": "label", "y": "value"}, top_n=5)
+    assert [r["label"] for r in chart_rows][-1] == OTHER_LABEL and len(chart_rows) == 6
+    assert sum(r["value"] for r in chart_rows) == sum(r["value"] for r in rows)
+
+
+def test_reduce_query_pushdown_and_result_pages(monkeypatch):
+    import duckdb
+    from analytics import views
+    from analytics.services.downsample import downsample_rows, reduce_query
+    from analytics.services.guards import wrap_page
+
+    con = duckdb.connect()
+    con.execute("CREATE TABLE s AS SELECT range AS dt, CASE WHEN range % 10 = 0 THEN 'NaN'::DOUBLE "
+                "ELSE (range % 7)::DOUBLE END AS value FROM range(5000)")
+
+    def run(q):
+        rows = con.execute(q).fetchall()
+        return [dict(zip([d[0] for d in con.description], r)) for r in rows]
+
+    chart_rows, meta = reduce_query("SELECT * FROM s", {"type": "line", "x": "dt", "y": "value"}, run,
+                                    target_points=100)
+    assert meta["pushdown"] and meta["method"] == "lttb" and meta["source_rows"] == 5000
+    assert len(chart_rows) == 100 and all(r["value"] == r["value"] for r in chart_rows)
+    assert reduce_query("SELECT * FROM s", {"type": "line"}, run) is None
+    assert len(run(wrap_page("SELECT * FROM s ORDER BY dt", 50, 100))) == 50
+
+    # LTTB côté Python : les NaN sont écartés, pas remplacés par 0
+    rows = [{"dt": i, "value": float("nan") if i % 2 else 1.0} for i in range(1000)]
+    chart_rows, _ = downsample_rows(rows, {"type": "line", "x": "dt", "y": "value"}, target_points=50)
+    assert all(r["value"] == 1.0 for r in chart_rows)
+
+    monkeypatch.setattr(views, "page_rows", lambda: 10)
+    out = views._paged([{"i": i} for i in range(25)])
+    assert len(out["rows"]) == 10 and out["row_count"] == 25
+    assert views._result_pages.get(out["rows_page"]["result_id"])[24] == {"i": 24}
+    assert views._paged([{"i": 1}], sql="SELECT 1", row_count=40)["rows_page"]["sql"] == "SELECT 1"
+
+
+def test_histogram_sql_bins_in_duckdb():
+    import duckdb
+    from analytics.services.guards import is_safe
+    from analytics.services.planner import build_histogram_sql
+
+    con = duckdb.connect()
+    con.execute("CREATE TABLE t AS SELECT range::DOUBLE AS x FROM range(1000)")
+    for method in ("fixed", "quantile", "fd"):
+        sql = build_histogram_sql("t", "x", bins=10, method=method)
+        assert is_safe(sql)
+        rows = con.execute(sql).fetchall()
+        assert 1 <= len(rows) <= 10
+        assert sum(r[3] for r in rows) == 1000
+
+
+def test_matview_fingerprint_and_candidates():
+    from analytics.services import matviews
+
+    a = matviews.fingerprint("select category, sum(amount) from sales group by 1")
+    b = matviews.fingerprint("SELECT  category,\n SUM(amount) FROM sales GROUP BY 1;")
+    assert a == b
+    assert matviews._is_candidate(matviews._parse("SELECT category, SUM(amount) FROM sales GROUP BY 1"))
+    assert not matviews._is_candidate(matviews._parse("SELECT * FROM sales"))
+    assert not matviews._is_candidate(matviews._parse("SELECT COUNT(*) FROM sales WHERE d < now()"))
+
+
+def test_planner_grain_and_pushdown():
+    from analytics.services.planner import _choose_grain, compile_plan
+
+    assert _choose_grain(60, 100) == "day"
+    assert _choose_grain(900, 100) == "month"
+    assert _choose_grain(900, 5) == "year"
+    sql, meta = compile_plan({"intent": "top_growth", "dataset": "sales", "date_col": "d", "year": 2024,
+                              "category_col": "cat", "use_stats": False, "use_rollups": False})
+    assert "\"d\" >= DATE '2023-01-01'" in sql and "\"d\" < DATE '2025-01-01'" in sql
+    assert meta["source"] == "table" and meta["approx"] is None
+
+
+def test_rollup_rewrite_matches_base_table_and_follows_loads(duck, settings):
+    import pandas as pd
+    from analytics.services import rollups
+    from analytics.services.planner import compile_plan
+
+    settings.ROLLUP_MIN_ROWS = 100
+    n = 1200
+    df = pd.DataFrame({"d": pd.date_range("2023-01-01", periods=n, freq="D").date,
+                       "cat": [f"c{i % 5}" for i in range(n)], "amount": [(i * 37) % 101 + i % 5 for i in range(n)]})
+    duck.load_to_duckdb(df, "sales")
+    r = rollups.get_rollup("sales")
+    assert r is not None and r.source_version == 1 and r.measures == {"amount": "m0"}
+
+    base = {"dataset": "sales", "date_col": "d", "amount_col": "amount", "category_col": "cat"}
+    for plan in ({"intent": "timeseries_total", "grain": "month"}, {"intent": "timeseries_total", "grain": "week"},
+                 {"intent": "timeseries_total", "grain": "month", "amount_col": None},
+                 {"intent": "top_total"}, {"intent": "top_growth", "year": 2024}):
+        plan = {**base, **plan, "limit": 1000}
+        sql, meta = compile_plan(plan)
+        exact, exact_meta = compile_plan({**plan, "use_rollups": False})
+        assert meta["source"].startswith("rollup:") and exact_meta["source"] == "table", (plan, meta)
+        got, want = duck.query(sql), duck.query(exact)
+        assert got.values.tolist() == want.values.tolist(), plan
+
+    # rechargement / ajout : le rollup suit la nouvelle version, sinon il est supprimé
+    duck.load_to_duckdb(df.head(600), "sales", mode="append")
+    assert rollups.get_rollup("sales").source_version == 2
+    month = {**base, "intent": "timeseries_total", "grain": "month", "limit": 1000}
+    assert (duck.query(compile_plan(month)[0]).values.tolist()
+            == duck.query(compile_plan({**month, "use_rollups": False})[0]).values.tolist())
+    duck.load_to_duckdb(df.head(50), "sales")
+    assert rollups.get_rollup("sales") is None
+    assert rollups.rollup_table_name("sales") not in duck.query("SHOW TABLES")["name"].tolist()
+    assert compile_plan(month)[1]["source"] == "table"
+
+
+def test_anomaly_window_intents_flag_spike():
+    import duckdb
+    from analytics.services.guards import is_safe
+    from analytics.services.planner import ANOMALY_INTENTS, build_anomaly_sql
+
+    con = duckdb.connect()
+    con.execute("""CREATE TABLE s AS
+        SELECT DATE '2024-01-01' + INTERVAL (i) DAY AS d,
+               100 + i + 5 * (i % 7) + CASE WHEN i = 150 THEN 500 ELSE 0 END AS amount
+        FROM range(200) t(i)""")
+    for intent in ANOMALY_INTENTS:
+        sql, meta = build_anomaly_sql(intent, "s", "d", "amount", window=21, use_rollups=False)
+        assert is_safe(sql)
+        flagged = [r[0] for r in con.execute(sql).fetchall() if r[4]]
+        assert len(flagged) >= 1 and str(flagged[0]).startswith("2024-05-30"), (intent, flagged)
+
+
+def test_anomaly_incremental_matches_full_recompute(duck):
+    import numpy as np
+    import pandas as pd
+    from analytics.services import anomaly
+
+    rng = np.random.default_rng(1)
+    days = pd.date_range("2019-01-01", "2023-03-20", freq="D")
+    days = days[rng.random(len(days)) > 0.1]  # trous : les fenêtres comptent des lignes, pas des jours
+    df = pd.DataFrame({"d": days, "amount": rng.gamma(2.0, 50.0, len(days))})
+    duck.load_to_duckdb(df, "sales")
+    plans = [{"intent": "anomaly_rolling"}, {"intent": "anomaly_mad"},
+             {"intent": "anomaly_seasonal", "season": "dow"}, {"intent": "anomaly_seasonal", "season": "month"}]
+    plans = [{**p, "dataset": "sales", "date_col": "d", "amount_col": "amount", "window": 28} for p in plans]
+    for plan in plans:
+        assert anomaly.detect(plan)[1]["mode"] == "full"
+
+    more = pd.date_range("2023-03-15", "2023-07-10", freq="D")
+    duck.load_to_duckdb(pd.DataFrame({"d": more, "amount": rng.gamma(2.0, 50.0, len(more))}), "sales", mode="append")
+    incremental = [anomaly.detect(plan) for plan in plans]
+    anomaly.cache_clear()
+    for plan, (inc, meta) in zip(plans, incremental):
+        full, full_meta = anomaly.detect(plan)
+        assert meta["mode"] == "incremental" and full_meta["mode"] == "full"
+        pd.testing.assert_frame_equal(inc, full, check_exact=False, rtol=1e-9, obj=str(plan))
+
+
+def test_forecast_batch_fit_matches_per_series():
+    import numpy as np
+    from analytics.services.forecast import design_matrix, fit_predict
+
+    rng = np.random.default_rng(0)
+    t = np.arange(48)
+    Y = np.column_stack([a + b * t + 10 * (t % 12 == 11) + rng.normal(0, 1, 48)
+                         for a, b in [(100, 2), (50, -1), (0, 0.5)]])
+    out = fit_predict(Y, horizon=6, season=12)
+    assert out["forecast"].shape == (6, 3) and out["model"] == "trend+seasonal"
+    assert np.all(out["lower"] < out["forecast"]) and np.all(out["forecast"] < out["upper"])
+    X, Xf = design_matrix(t, 12), design_matrix(np.arange(48, 54), 12)
+    for j in range(3):
+        beta = np.linalg.lstsq(X, Y[:, j], rcond=None)[0]
+        assert np.allclose(Xf @ beta, out["forecast"][:, j])
+
+
+def test_kpis_moments_merge_and_vectorized():
+    import numpy as np
+    from analytics.services import kpis
+
+    rng = np.random.default_rng(1)
+    data = rng.normal(10, 3, 1000)
+    merged = kpis.Moments.of(data[:300]) + kpis.Moments.of(list(data[300:]))
+    assert merged.count == 1000
+    assert np.isclose(merged.mean, data.mean()) and np.isclose(merged.std, data.std())
+    assert kpis.mean([1, None, 3]) == 2.0 and kpis.stddev_pop([]) is None
+    assert list(kpis.growth_rates([110, 5], [100, 0])) == [0.1, 0.0]
+    assert kpis.growth_rate(110, 100) == kpis.growth_rates([110], [100])[0]
+    assert np.allclose(kpis.moving_mean([1, 2, 3, 4], 2)[1:], [1.5, 2.5, 3.5])
+    gappy = [1, 2, None, 4, 5, 6, 7]
+    assert np.allclose(kpis.moving_mean(gappy, 2), [np.nan, 1.5, 2, 4, 4.5, 5.5, 6.5], equal_nan=True)
+    assert np.isnan(kpis.moving_mean(gappy, 2, min_count=2)[[0, 2, 3]]).all()
+    assert np.allclose(kpis.moving_std(gappy, 3)[2:], [0.5, 1, 0.5, 0.8164966, 0.8164966])
+    assert np.allclose(kpis.moving_quantile([None, None, 3, 1], 2), [np.nan, np.nan, 3, 2], equal_nan=True)
+    assert kpis.percentiles([1, 2, 3, None], (50,))[50] == 2.0
+
+
+def test_kpi_sql_macros_match_python():
+    import duckdb
+    from analytics.services import kpis
+
+    con = duckdb.connect()
+    kpis.register_duckdb(con)
+    assert con.execute("SELECT safe_div(1, 0), growth_rate(110, 100), zscore(5, 3, 0)").fetchone() == (0, 0.1, 0)
+    rows = con.execute("""SELECT i, share_of_total(i), period_growth(i + 1, i), zscore_over(i)
+                          FROM range(4) t(i) ORDER BY i""").fetchall()
+    assert [r[1] for r in rows] == [0, 1 / 6, 2 / 6, 3 / 6]
+    assert rows[0][2] is None and rows[1][2] == kpis.growth_rate(2, 1)
+    assert [round(r[3], 9) for r in rows] == [round(z, 9) for z in kpis.zscores([0, 1, 2, 3])]
+
+
+def test_kpi_window_sql_yoy_and_cumulative():
+    import duckdb
+    from analytics.services import kpis
+    from analytics.services.planner import build_kpi_sql
+
+    con = duckdb.connect()
+    kpis.register_duckdb(con)
+    con.execute("""CREATE TABLE sales AS
+        SELECT DATE '2023-01-15' + INTERVAL (i) MONTH AS d, 100.0 + i AS amount FROM range(24) t(i)""")
+    sql, meta = build_kpi_sql("sales", "d", "amount", "month", ["yoy", "cumulative", "moving_avg"],
+                              window=2, use_rollups=False)
+    rows = con.execute(sql).fetchall()
+    assert len(rows) == 24 and meta["metrics"] == ["yoy", "cumulative", "moving_avg"]
+    ts, value, yoy, cumul, mavg = rows[12]
+    assert yoy == kpis.growth_rate(112, 100) and rows[0][2] is None
+    assert cumul == sum(100.0 + i for i in range(13)) and mavg == 111.5
+
+
+@pytest.mark.django_db
+def test_kpis_endpoint_validates_columns(duck):
+    import pandas as pd
+
+    duck.load_to_duckdb(pd.DataFrame({"date": pd.date_range("2023-01-01", periods=90, freq="D"),
+                                      "order": range(90), "label": ["a", "b", "c"] * 30}), "orders")
+    client = APIClient()
+    ok = client.post(reverse("analytics_kpis"), {"dataset": "orders", "date_col": "date", "measure": "order",
+                                                 "kpis": "cumulative"}, format="json")
+    assert ok.status_code == 200, ok.content
+    assert [r["cumulative"] for r in ok.json()["rows"]][-1] == sum(range(90))
+    for bad in ({"date_col": "nope"}, {"date_col": "label"}, {"date_col": "date", "measure": "label"},
+                {"date_col": "date", "category_col": "x\"y"}, {"date_col": "date", "window": "abc"}):
+        r = client.post(reverse("analytics_kpis"), {"dataset": "orders", **bad}, format="json")
+        assert r.status_code == 400, (bad, r.content)
+
+
+def test_nl_fastpath_slots_and_fallback(monkeypatch):
+    from analytics.services import nl_fastpath
+
+    schema = {"rows": 10, "columns": {
+        "date": {"type": "TIMESTAMP", "max": "2025-06-30T00:00:00"},
+        "category": {"type": "VARCHAR"}, "region": {"type": "VARCHAR"},
+        "amount": {"type": "DOUBLE"}, "customer_id": {"type": "BIGINT"},
+    }}
+    monkeypatch.setattr(nl_fastpath.col_stats, "get_stats", lambda ds: schema)
+    m, _ = nl_fastpath.classify("Évolution des ventes par mois en 2024", "sales")
+    assert m.plan["intent"] == "timeseries_total" and m.plan["grain"] == "month"
+    assert m.plan["amount_col"] == "amount" and m.plan["date_from"] == "2024-01-01"
+    m, _ = nl_fastpath.classify("Top 5 catégories", "sales")
+    assert (m.plan["intent"], m.plan["category_col"], m.plan["limit"]) == ("top_total", "category", 5)
+    m, _ = nl_fastpath.classify("combien de lignes par région ? top 3", "sales")
+    assert m.plan["category_col"] == "region" and m.plan["amount_col"] is None
+    assert nl_fastpath.classify("Top 5", "sales") == (None, "no_category")
+    assert nl_fastpath.classify("ventes moyennes où la région est Nord", "sales") == (None, "unsupported")
+
+    # plusieurs mesures : les synonymes désignent la colonne qui les porte, jamais un prix par défaut
+    schema["columns"] = {"date": {"type": "DATE"}, "product": {"type": "VARCHAR"},
+                         "unit_price": {"type": "DOUBLE"}, "revenue": {"type": "DOUBLE"}}
+    m, _ = nl_fastpath.classify("évolution des ventes par mois", "sales")
+    assert m.plan["amount_col"] == "revenue" and m.confidence >= 0.75
+    assert nl_fastpath.classify("top 10 produits", "sales") == (None, "ambiguous_measure")
+    assert nl_fastpath.classify("croissance des produits", "sales") == (None, "ambiguous_measure")
+
+
+def test_nl_cache_exact_similar_and_schema_change(duck, monkeypatch, settings):
+    from analytics.services import nl_cache
+
+    monkeypatch.setattr(nl_cache, "_table_ready", False)
+    payload = {"sql": "SELECT 1", "chart_spec": {"type": "bar"}, "extra": "ignored"}
+    nl_cache.store("Top 5 des catégories par ventes", "sales", "a (INTEGER)", payload)
+
+    hit, meta = nl_cache.lookup("  top 5 DES catégories par ventes ?", "sales", "a (INTEGER)")
+    assert hit == {"sql": "SELECT 1", "chart_spec": {"type": "bar"}} and meta["match"] == "exact"
+    nl_cache._mem.clear()
+    assert nl_cache.lookup("ventes par catégorie, top 5", "sales", "a (INTEGER)") == (None, None)  # opt-in
+    settings.NL_CACHE_SIMILARITY = 0.85
+    hit, meta = nl_cache.lookup("ventes par catégorie, top 5", "sales", "a (INTEGER)")
+    assert hit and meta["match"] == "similar"
+    assert nl_cache.normalize_question("ventes par mois") == "vente par mois"
+    for a, b in (("tri croissant des ventes", "tri décroissant des ventes"),
+                 ("clients actifs par pays", "clients inactifs par pays"),
+                 ("produit le plus vendu", "produit le moins vendu")):
+        nl_cache.store(a, "sales", "a (INTEGER)", payload)
+        nl_cache._mem.clear()
+        assert nl_cache.lookup(b, "sales", "a (INTEGER)") == (None, None)
+    assert nl_cache.lookup("top 10 catégories par ventes", "sales", "a (INTEGER)") == (None, None)
+    assert nl_cache.lookup("top 5 des catégories par ventes", "sales", "a (BIGINT)") == (None, None)
+
+
+@pytest.mark.django_db
+def test_nl_cache_stores_only_executed_translations(duck, monkeypatch):
+    import pandas as pd
+    from analytics import views
+    from analytics.services import nl_cache
+
+    monkeypatch.setattr(nl_cache, "_table_ready", False)
+    duck.load_to_duckdb(pd.DataFrame({"g": ["a", "b"] * 5, "v": range(10)}), "facts")
+    answers = {"quel total": {"sql": "SELECT SUM(nope) AS total FROM facts"},
+               "quel autre total": {"sql": "DROP TABLE facts"},
+               "total par groupe": {"sql": "SELECT g, SUM(v) AS total FROM facts GROUP BY 1 ORDER BY 1"}}
+    monkeypatch.setattr(views, "n8n_is_configured", lambda: True)
+    monkeypatch.setattr(views, "analysis_is_configured", lambda: False)
+    monkeypatch.setattr(views, "n8n_nl_to_sql", lambda question, dataset, extra=None: answers[question])
+    client, url = APIClient(), reverse("analytics_query_nl")
+    schema = views.get_schema("facts")
+
+    for question, status in (("quel total", 400), ("quel autre total", 400), ("total par groupe", 200)):
+        r = client.post(url, {"question": question, "dataset": "facts", "force_llm": True}, format="json")
+        assert r.status_code == status, r.content
+    assert nl_cache.lookup("quel total", "facts", schema, {}) == (None, None)
+    assert nl_cache.lookup("quel autre total", "facts", schema, {}) == (None, None)
+    assert nl_cache.lookup("total par groupe", "facts", schema, {})[0]["sql"] == answers["total par groupe"]["sql"]
+
+
+def test_speculative_match_and_cancel(duck):
+    import time
+    from analytics.services import speculative
+
+    assert speculative.normalize_sql("SELECT  a\nFROM t WHERE b = 'X y';") == "select a from t where b = 'X y'"
+    spec = speculative.start("SELECT 42 AS answer")
+    assert spec.matches("select 42 as answer;") and not spec.matches("SELECT 43 AS answer")
+    assert spec.result(timeout=10) == [{"answer": 42}]
+
+    slow = speculative.start("SELECT count(*) FROM range(10000000000) a, range(10) b")
+    time.sleep(0.2)
+    slow.cancel()
+    assert slow.result(timeout=10) is None
+
+    # course n8n / spéculation : n8n rapide gagne, n8n lent perd après le délai de grâce, n8n muet -> timeout
+    def fast():
+        return {"sql": "SELECT 1"}
+
+    def slow_llm():
+        time.sleep(2)
+        return {"sql": "SELECT 2"}
+
+    assert speculative.race(speculative.start("SELECT 42 AS answer"), fast, timeout=5) == ({"sql": "SELECT 1"}, "llm")
+    t0 = time.monotonic()
+    assert speculative.race(speculative.start("SELECT 42 AS answer"), slow_llm, timeout=5, grace=0.1) == ({}, "speculative")
+    assert time.monotonic() - t0 < 1.5
+    hung = speculative.start("SELECT count(*) FROM range(10000000000) a, range(10) b")
+    assert speculative.race(hung, slow_llm, timeout=0.3) == ({}, "timeout")
+    hung.cancel()
+
+
+@pytest.mark.django_db(transaction=True)  # mesure enregistrée depuis le thread du pool
+def test_speculative_metered_admitted_and_bounded(duck, settings):
+    import pandas as pd
+    from django.contrib.auth import get_user_model
+    from django.test import RequestFactory
+    from analytics.models import QueryUsage
+    from analytics.services import speculative
+    from common.middleware import _current_request
+
+    duck.load_to_duckdb(pd.DataFrame({"s": [f"ligne {i}" * 10 for i in range(50_000)]}), "big")
+    user = get_user_model().objects.create_user("bob", password="x")
+    request = RequestFactory().get("/")
+    request.user = user
+    token = _current_request.set(request)
+    try:
+        # lancée depuis la requête HTTP, exécutée dans le pool : imputée au client de la requête
+        spec = speculative.start("SELECT COUNT(*) AS n FROM big")
+        assert spec.result(timeout=10) == [{"n": 50_000}]
+        settings.SCHEDULER_CLASSES = {"nl": {"result_memory": "1MB"}}
+        too_big = speculative.start("SELECT s FROM big")
+    finally:
+        _current_request.reset(token)
+
+    assert spec.admission()["action"] == "execute" and spec.admission()["endpoint"] == "nl"
+    assert too_big.result(timeout=10) is None  # ResultTooLarge : bornée comme run_sql_safe
+    usage = QueryUsage.objects.get(user=user, kind="speculative", result_rows=1)
+    assert usage.client == f"user:{user.pk}" and usage.dataset == "big"
+
+
+def test_singleflight_coalesces_concurrent_calls(tmp_path, settings):
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import json
+    from analytics.services.singleflight import SingleFlight
+
+    settings.SINGLEFLIGHT_DIR = str(tmp_path)
+    flight, calls, gate = SingleFlight("test"), [], threading.Event()
+
+    def work():
+        calls.append(1)
+        gate.wait(5)
+        return {"rows": [1, 2, 3]}
+
+    with ThreadPoolExecutor(8) as ex:
+        futures = [ex.submit(flight.do, ("sql", "select 1"), work) for _ in range(8)]
+        time.sleep(0.2)
+        gate.set()
+        results = [f.result() for f in futures]
+    assert len(calls) == 1 and all(r == {"rows": [1, 2, 3]} for r in results)
+    assert flight.stats()["shared"] == 7
+    results[1]["rows"].append(4)  # chaque appelant a sa copie
+    assert sum(len(r["rows"]) for r in results) == 25
+
+    # résultat publié en JSON dans un dossier privé, un verrou par clé complète
+    folder = tmp_path / "test"
+    assert oct(folder.stat().st_mode & 0o777) == "0o700"
+    assert [p.suffix for p in folder.iterdir()].count(".lock") == 1
+    assert json.loads(next(folder.glob("*.res")).read_text()) == {"rows": [1, 2, 3]}
+
+    def boom():
+        raise ValueError("x")
+    with pytest.raises(ValueError):
+        flight.do(("sql", "select 2"), boom)
+    assert flight.do(("sql", "select 2"), lambda: 2) == 2
+
+
+def test_schema_card_roles_top_values_and_bound(duck):
+    import io
+    from analytics.services import schema_card
+
+    csv = "date,category,amount,order_id\n" + "".join(
+        f"2024-01-{1 + i % 28:02d},{'AB'[i % 3 == 0]},{i},{i}\n" for i in range(90))
+    duck.load_to_duckdb(io.BytesIO(csv.encode()), "orders")
+
+    card = schema_card.get_card("orders")["card"]
+    roles = {c["name"]: c["role"] for c in card["columns"]}
+    assert roles == {"date": "date", "category": "catégorie", "amount": "mesure", "order_id": "identifiant"}
+    cat = next(c for c in card["columns"] if c["name"] == "category")
+    assert cat["top_values"] == [["A", 60], ["B", 30]]
+    assert "A (67%)" in schema_card.card_text("orders")
+    assert len(schema_card.render(card, max_chars=120)) <= 120
+
+
+def test_value_index_resolve_and_autocomplete(duck):
+    import io
+    from analytics.services import value_index
+
+    rows = ["In Progress,John Doe", "In Progress,Jane Roe", "Done,John Doe", "À faire,Élodie Martin"]
+    duck.load_to_duckdb(io.BytesIO(("status,owner\n" + "\n".join(rows) + "\n").encode()), "tasks")
+
+    found = value_index.resolve("Tâches IN PROGRESS de john doe ou a faire", "tasks")
+    assert [(f["column"], f["value"], f["match"]) for f in found] == [
+        ("status", "In Progress", "exact"), ("owner", "John Doe", "exact"), ("status", "À faire", "exact")]
+    assert value_index.resolve("tâches de Jonh Doe", "tasks")[0]["value"] == "John Doe"
+    assert [s["value"] for s in value_index.autocomplete("tasks", "elo")] == ["Élodie Martin"]
+    assert value_index.autocomplete("tasks", "in", 1) == [{"value": "In Progress", "column": "status", "freq": 2}]
+    url = reverse("analytics_datasets_autocomplete", args=["tasks"])
+    assert APIClient().get(url, {"q": "in", "limit": "abc"}).status_code == 400
+    assert APIClient().get(url, {"q": "in", "limit": "1"}).json()["suggestions"][0]["value"] == "In Progress"
+
+
+def test_table_query_filters_page_and_facets(duck):
+    import io
+    from analytics.services import table_query
+
+    csv = "name,status,amount\n" + "".join(f"n{i},{'ABC'[i % 3]},{i}\n" for i in range(30))
+    duck.load_to_duckdb(io.BytesIO(csv.encode()), "items")
+
+    spec = {"filters": [{"column": "status", "op": "in", "value": ["A", "B"]},
+                        {"column": "amount", "op": "gte", "value": 10}],
+            "sort": [{"column": "amount", "dir": "desc"}], "columns": ["name", "amount"],
+            "page": 2, "page_size": 5, "facets": ["status"]}
+    out = table_query.run("items", spec)
+    assert out["total"] == 13 and out["pages"] == 3
+    assert [r["amount"] for r in out["rows"]] == [21, 19, 18, 16, 15]
+    # facette disjonctive : "status" est compté sans son propre filtre (amount >= 10 seulement)
+    assert out["facets"] == {"status": [{"value": "B", "count": 7}, {"value": "C", "count": 7},
+                                        {"value": "A", "count": 6}]}
+    assert table_query.run("items", spec)["facets_cached"] is True
+    assert table_query.run("items", {"filters": [{"column": "name", "op": "contains", "value": "_"}]})["total"] == 0
+    with pytest.raises(table_query.SpecError):
+        table_query.run("items", {"sort": [{"column": "amount; DROP TABLE items"}]})
+    with pytest.raises(table_query.SpecError):
+        table_query.run("items", {"filters": [{"column": "amount", "op": "gte", "value": "abc"}]})
+
+
+def test_sampling_strata_append_and_approximate(duck, monkeypatch):
+    import pandas as pd
+    from django.conf import settings
+    from analytics.services import sampling
+
+    monkeypatch.setattr(settings, "SAMPLE_ROWS", 400, raising=False)
+    monkeypatch.setattr(settings, "SAMPLE_MIN_PER_STRATUM", 50, raising=False)
+    df = pd.DataFrame({"region": ["big"] * 3800 + ["small"] * 200, "amount": [1.0] * 4000})
+    duck.load_to_duckdb(df, "sales")
+
+    counts = dict(duck.query("SELECT __stratum, COUNT(*) FROM __sample_sales GROUP BY 1").values.tolist())
+    assert counts == {"big": 380, "small": 50}
+    # append : réservoir incrémental, poids = taille de la strate / lignes retenues
+    duck.load_to_duckdb(pd.DataFrame({"region": ["new"] * 100, "amount": [2.0] * 100}), "sales", mode="append")
+    assert sampling.info("sales")["source_rows"] == 4100
+    sql, meta = sampling.approximate_sql("SELECT region, SUM(amount) AS total, COUNT(*) AS n FROM sales GROUP BY 1")
+    assert meta["approximate"] and meta["estimated"] == ["total", "n"] and "__sample_sales" in sql
+    out = {r["region"]: r for r in duck.query(sql).to_dict("records")}
+    assert round(out["big"]["total"]) == 3800 and round(out["new"]["n"]) == 100 and out["small"]["total_se"] < 1e-6
+    assert sampling.approximate_sql("SELECT COUNT(DISTINCT region) FROM sales")[1]["approximate"] is False
+    assert sampling.approximate_sql("SELECT MIN(amount) AS lo, SUM(amount) AS s FROM sales")[1]["sample_bounds"] == ["lo"]
+    preview = sampling.preview("sales", 5)
+    assert "__w" not in preview["rows"][0] and preview["sampled"]["approximate_stats"] is True
+    # sous le seuil : pas d'aperçu échantillonné, l'appelant lit la tête de la table
+    duck.load_to_duckdb(pd.DataFrame({"region": ["a"] * 10, "amount": [1.0] * 10}), "tiny")
+    assert sampling.preview("tiny", 5) is None
+
+
+def test_progressive_stages_intervals_and_cancel(duck, tmp_path, monkeypatch):
+    import json
+    import pandas as pd
+    from django.conf import settings
+    from analytics.services import progressive
+
+    monkeypatch.setattr(settings, "PROGRESSIVE_MIN_STAGE_ROWS", 1000, raising=False)
+    monkeypatch.setattr(settings, "PROGRESSIVE_DIR", str(tmp_path / "progressive"), raising=False)
+    duck.load_to_duckdb(pd.DataFrame({"g": ["a", "b"] * 20000, "v": [2.0] * 40000}), "facts")
+
+    sql = "SELECT g, SUM(v) AS total FROM facts GROUP BY 1 ORDER BY 1"
+    events = [(e.split("\n")[0][7:], json.loads(e.split("\n")[1][6:]))
+              for e in progressive.ProgressiveRun(sql, stages="50,100").events() if e.startswith("event")]
+    assert [name for name, _ in events] == ["start", "estimate", "result", "done"]
+    assert events[1][1]["estimated"] == ["total"] and all("total_ci_low" in r for r in events[1][1]["rows"])
+    assert events[2][1]["rows"] == [{"g": "a", "total": 40000.0}, {"g": "b", "total": 40000.0}]
+    # étape trop petite ignorée, requête sans agrégat : étape exacte seule
+    assert progressive.ProgressiveRun(sql, stages="1,100").stages[0]["percent"] == 100.0
+    assert len(progressive.ProgressiveRun("SELECT * FROM facts", stages="50,100").stages) == 1
+
+    run = progressive.ProgressiveRun(sql, stages="50,100")
+    stream = run.events()
+    next(stream)
+    assert progressive.cancel(run.run_id) is True
+    assert [e.split("\n")[0] for e in stream] == ["event: cancelled"]
+    assert (tmp_path / "progressive").stat().st_mode & 0o777 == 0o700
+    # file d'attente du pool pleine : refus immédiat (503 côté vue)
+    from analytics.services import scheduler
+    monkeypatch.setattr(settings, "PROGRESSIVE_MAX_PENDING", 0, raising=False)
+    with pytest.raises(scheduler.QueueTimeout):
+        progressive.ProgressiveRun(sql, stages="50,100")
+
+
+def test_progressive_realized_weights_and_empty_replicates(duck, tmp_path, monkeypatch):
+    import json
+    import math
+    import duckdb
+    import pandas as pd
+    from django.conf import settings
+    from analytics.services import progressive, sampling
+
+    monkeypatch.setattr(settings, "PROGRESSIVE_MIN_STAGE_ROWS", 1000, raising=False)
+    monkeypatch.setattr(settings, "PROGRESSIVE_DIR", str(tmp_path / "progressive"), raising=False)
+    duck.load_to_duckdb(pd.DataFrame({"g": ["a", "b"] * 30000, "v": [2.0, 4.0] * 30000}), "facts")
+
+    # poids = fraction réellement tirée : COUNT(*) et SUM d'une constante par groupe sont exacts
+    sql = "SELECT g, COUNT(*) AS n, SUM(v) AS total, AVG(v) AS mean FROM facts GROUP BY 1 ORDER BY 1"
+
+    def strict(text):
+        return json.loads(text, parse_constant=lambda c: pytest.fail(f"jeton {c} dans le flux SSE"))
+
+    for _ in range(3):
+        events = [strict(e.split("\n")[1][6:]) for e in progressive.ProgressiveRun(sql, stages="20,100").events()
+                  if e.startswith("event: estimate")]
+        for row in events[0]["rows"]:
+            assert math.isclose(row["n"], 30000) and math.isclose(row["total"], 30000 * (2.0 if row["g"] == "a" else 4.0))
+            assert ("mean_ci_low" in row) == (row["mean_se"] is not None)
+    assert strict(progressive._sse("e", {"se": float("nan"), "rows": [{"x": float("inf")}]}).split("\n")[1][6:]) == \
+        {"se": None, "rows": [{"x": None}]}
+
+    # groupes de réplication vides (moins de blocs que de groupes) : erreur type sur les groupes présents
+    con = duckdb.connect()
+    con.execute("CREATE TABLE s AS SELECT i, i % 2 AS __rep, 2 AS __reps, 10.0 AS __w, 20.0 AS __wr, "
+                "(i % 7)::DOUBLE AS v FROM range(100) t(i)")
+    rewritten, estimated, _ = sampling.rewrite_weighted("SELECT AVG(v) AS m, SUM(v) AS t FROM facts",
+                                                        {"facts": "s"}, nrep="__reps")
+    m_se, t_se, reps = con.execute(f"SELECT m_se, t_se, __reps FROM ({rewritten})").fetchone()
+    assert estimated == ["m", "t"] and m_se is not None and m_se > 0 and t_se > 0 and reps == 2
+    assert progressive._quantile(reps) == 12.706 and progressive._quantile(None) == 1.96
+
+    import pandas as pd
+    from django.conf import settings
+    from analytics.services import admission, runners
+
+    monkeypatch.setattr(settings, "SAMPLE_ROWS", 500, raising=False)
+    monkeypatch.setattr(settings, "ADMISSION_POLICIES", {
+        "interactive": {"sample_scan_rows": 1000, "max_scan_rows": 10_000, "max_result_rows": 2000,
+                        "approximate": True},
+        "nl": {"sample_scan_rows": 1000, "max_scan_rows": 4000},
+        "export": {"max_result_rows": 2000},
+    }, raising=False)
+    duck.load_to_duckdb(pd.DataFrame({"g": ["a", "b"] * 2500, "v": [1.0] * 5000}), "facts")
+
+    assert admission.estimate("SELECT * FROM facts")["scan_rows"] == 5000
+    # agrégat trop coûteux : estimation sur l'échantillon, avec erreurs types
+    rows = runners.run_sql_safe("SELECT g, SUM(v) AS total FROM facts GROUP BY 1")
+    assert admission.current()["action"] == "sample" and "total_se" in rows[0]
+    # MIN / MAX restent exacts ; classe sans "approximate" : exact jusqu'à max_scan_rows, refus au-delà
+    assert admission.admit("SELECT g, MAX(v) AS hi FROM facts GROUP BY 1").action == "execute"
+    with pytest.raises(admission.QueryRejected, match="non activée"):
+        admission.admit("SELECT g, SUM(v) AS total FROM facts GROUP BY 1", endpoint="nl")
+    with admission.scope():
+        admission.admit("SELECT g, SUM(v) AS total FROM facts GROUP BY 1")
+        assert admission.current()["action"] == "sample"
+    assert admission.current()["action"] == "reject"  # décision du contexte englobant (refus nl) rétablie
+    with admission.scope():
+        assert admission.current() is None
+    # résultat trop gros : échantillon du résultat (interactif) ou refus (export)
+    assert admission.admit("SELECT * FROM facts").action == "sample"
+    with pytest.raises(admission.QueryRejected):
+        admission.admit("SELECT * FROM facts", endpoint="export")
+    with pytest.raises(admission.QueryRejected, match="jointure explosive"):
+        admission.admit("SELECT a.v FROM facts a, facts b")
+    assert admission.stats()["decisions"]["interactive:sample"] >= 2
+
+
+def test_scheduler_priority_fairness_and_timeout(monkeypatch):
+    import threading
+    import time
+    from django.conf import settings
+    from analytics.services import scheduler
+
+    monkeypatch.setattr(settings, "SCHEDULER_MAX_CONCURRENT", 1, raising=False)
+    monkeypatch.setattr(settings, "SCHEDULER_CLASSES", {"export": {"queue_timeout": 0.2, "threads": 1}}, raising=False)
+    assert "threads" not in scheduler.class_config("export")  # pas de threads par requête dans DuckDB
+    order, gate = [], threading.Event()
+
+    def job(cls, client):
+        try:
+            with scheduler.slot(cls, client=client):
+                order.append((cls, client))
+                gate.wait(5) if client == "first" else None
+        except scheduler.QueueTimeout:
+            order.append(("timeout", client))
+
+    threads = [threading.Thread(target=job, args=args) for args in
+               [("interactive", "first"), ("export", "e"), ("interactive", "a"), ("interactive", "first"), ("interactive", "b")]]
+    for t in threads:
+        t.start()
+        time.sleep(0.02)
+    assert scheduler.stats()["classes"]["interactive"]["queued"] == 3
+    time.sleep(0.3)
+    gate.set()
+    for t in threads:
+        t.join()
+    # interactif avant export (priorité), puis l'utilisateur sans requête en cours avant "first" (équité)
+    assert order == [("interactive", "first"), ("timeout", "e"), ("interactive", "a"), ("interactive", "b"),
+                     ("interactive", "first")]
+
+
+def test_client_key_trusts_forwarded_for_only_from_proxies(settings):
+    from django.test import RequestFactory
+    from analytics.services import scheduler
+
+    req = RequestFactory().get("/", REMOTE_ADDR="203.0.113.7", HTTP_X_FORWARDED_FOR="1.2.3.4")
+    settings.TRUSTED_PROXIES = []
+    assert scheduler.client_key(req) == "ip:203.0.113.7"  # en-tête du client ignoré
+    settings.TRUSTED_PROXIES = ["10.0.0.0/8"]
+    assert scheduler.client_key(req) == "ip:203.0.113.7"  # connexion directe, pas via le proxy
+    req = RequestFactory().get("/", REMOTE_ADDR="10.0.0.2", HTTP_X_FORWARDED_FOR="6.6.6.6, 198.51.100.9, 10.0.0.5")
+    assert scheduler.client_key(req) == "ip:198.51.100.9"  # première adresse hors proxies, de droite à gauche
+
+
+@pytest.mark.django_db
+def test_accounting_records_usage_quota_and_top(duck, monkeypatch):
+    import pandas as pd
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from analytics.models import QueryUsage
+
+    duck.load_to_duckdb(pd.DataFrame({"g": ["a", "b"] * 500, "v": range(1000)}), "facts")
+    user = get_user_model().objects.create_user("alice", password="x")
+    client = APIClient()
+    client.force_authenticate(user)
+
+    r = client.post(reverse("analytics_query_sql"), {"sql": "SELECT g, SUM(v) AS s FROM facts GROUP BY 1"}, format="json")
+    assert r.status_code == 200, r.content
+    usage = QueryUsage.objects.get(user=user)
+    assert (usage.kind, usage.dataset, usage.result_rows) == ("sql", "facts", 2)
+    assert 1000 <= usage.rows_scanned < 1100  # + lectures de catalogue éventuelles
+    assert usage.client == f"user:{user.pk}" and usage.cpu_ms > 0 and usage.peak_memory_bytes is not None
+
+    monkeypatch.setattr(settings, "ACCOUNTING_QUOTAS", {"rows_scanned": 1000}, raising=False)
+    r = client.post(reverse("analytics_query_sql"), {"sql": "SELECT COUNT(*) FROM facts"}, format="json")
+    assert r.status_code == 429 and r.json()["quota"]["metric"] == "rows_scanned"
+    assert client.get(reverse("analytics_usage_top")).status_code == 403
+
+    client.force_authenticate(get_user_model().objects.create_user("ops", password="x", is_staff=True))
+    top = client.get(reverse("analytics_usage_top"), {"by": "dataset", "metric": "rows_scanned"}).json()
+    assert top["top"][0]["dataset"] == "facts" and top["top"][0]["rows_scanned"] == usage.rows_scanned
+
+
+def test_memory_budgets_bound_results_and_slots(duck, monkeypatch):
+    import pandas as pd
+    from django.conf import settings
+    from analytics.services import scheduler
+    from analytics.services.runners import run_sql_safe
+
+    df = pd.DataFrame({"v": [1.5, None, 3.0, 10.0], "d": pd.to_datetime(["2024-01-01", "2024-01-03", None, "2024-01-05"])})
+    duck.load_to_duckdb(df, "facts")
+    desc = duck.describe_table("facts").set_index("index")
+    expected = df.describe().T
+    assert list(desc.index) == ["v", "d"]
+    assert desc.loc["v", "count"] == 3 and abs(desc.loc["v", "std"] - expected.loc["v", "std"]) < 1e-9
+    assert pd.Timestamp(desc.loc["d", "mean"]) == expected.loc["d", "mean"]
+
+    duck.load_to_duckdb(pd.DataFrame({"s": [f"ligne {i}" * 10 for i in range(50_000)]}), "big")
+    monkeypatch.setattr(settings, "SCHEDULER_CLASSES", {"interactive": {"result_memory": "1MB"}}, raising=False)
+    with pytest.raises(duck.ResultTooLarge):
+        run_sql_safe("SELECT s FROM big", add_limit=None)
+    assert len(run_sql_safe("SELECT COUNT(*) AS n FROM big")) == 1
+
+    # deux créneaux libres, mais la réservation mémoire de la classe ne tient qu'une fois dans le moteur
+    monkeypatch.setitem(duck.ENGINE_SETTINGS, "memory_limit", "1GB")
+    monkeypatch.setattr(settings, "SCHEDULER_CLASSES",
+                        {"analysis": {"slots": 2, "memory": "768MB", "queue_timeout": 0.1}}, raising=False)
+    with scheduler.slot("analysis", client="a"):
+        assert scheduler.stats()["memory"]["reserved_bytes"] == 768 << 20
+        with pytest.raises(scheduler.QueueTimeout):
+            scheduler.scheduler.acquire("analysis", "b")
+    assert scheduler.stats()["memory"]["reserved_bytes"] == 0
+
+
+def test_engine_service_serves_remote_connections(tmp_path, monkeypatch):
+    import threading
+    import duckdb
+    import pandas as pd
+    from analytics import duck
+    from analytics.services import engine
+
+    server = engine.EngineServer(str(tmp_path / "e.sock"), str(tmp_path / "t.duckdb"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(duck, "ENGINE_SOCKET", server.socket_path)
+    monkeypatch.setattr(duck, "DB_PATH", tmp_path / "unused.duckdb")  # aucun accès direct au fichier
+    try:
+        df = pd.DataFrame({"d": pd.to_datetime(["2024-01-01", "2024-02-01"] * 20_000), "v": range(40_000)})
+        assert duck.load_to_duckdb(df, "facts")["version"] == 1
+        assert duck.list_tables() == ["facts"]
+        out = duck.query("SELECT d, SUM(v) AS s FROM facts GROUP BY 1 ORDER BY 1")
+        local = duckdb.connect()
+        local.register("df", df)
+        assert out.dtypes.to_dict() == local.execute("SELECT d, SUM(v) AS s FROM df GROUP BY 1 ORDER BY 1").df().dtypes.to_dict()
+        with duck.connect() as con:
+            assert con.execute("SELECT COUNT(*) FROM facts WHERE v >= ?", [39_990]).fetchone() == (10,)
+            assert con.description[0][1] == "BIGINT"
+            # lecture par blocs : seuls les vecteurs demandés traversent la socket
+            first = con.execute("SELECT v FROM facts").fetch_df_chunk(1)
+            assert len(first) == 2048 and engine.stats(server.socket_path)["counters"]["rows_sent"] < 40_000
+        with pytest.raises(duck.ResultTooLarge):
+            duck.query("SELECT * FROM facts", max_bytes=100_000)
+        with pytest.raises(duckdb.CatalogException):
+            duck.query("SELECT * FROM nope")
+
+        con = duck.connect()
+        threading.Timer(0.3, con.interrupt).start()
+        with pytest.raises(duckdb.InterruptException):
+            con.execute("SELECT COUNT(*) FROM range(10000000000) a, range(10) b").fetchall()
+        con.close()
+        # second service sur la même socket : refusé, le premier continue de servir
+        with pytest.raises(OSError, match="répond déjà"):
+            engine.EngineServer(server.socket_path, str(tmp_path / "other.duckdb"))
+        assert duck.list_tables() == ["facts"]
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not (tmp_path / "unused.duckdb").exists()
+    monkeypatch.setattr(duck, "ENGINE_SOCKET", str(tmp_path / "e.sock"))
+    with pytest.raises(engine.EngineUnavailable):
+        duck.connect()
+
+    # socket orpheline (personne n'écoute) remplacée ; jeton exigé dès la première trame
+    import socket
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(str(tmp_path / "e.sock"))
+    stale.close()
+    server = engine.EngineServer(str(tmp_path / "e.sock"), ":memory:", token="s3cret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with pytest.raises(duckdb.PermissionException):
+            engine.RemoteConnection(server.socket_path, token="nope")
+        with pytest.raises(duckdb.PermissionException):
+            engine.stats(server.socket_path, token="")
+        with engine.RemoteConnection(server.socket_path, token="s3cret") as con:
+            assert con.execute("SELECT 42").fetchone() == (42,)
+        assert engine.stats(server.socket_path, token="s3cret")["counters"]["denied"] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_pandas_runner_reports_truncation_and_refuses_large_input(duck, settings):
+    import pandas as pd
+    from analytics.services import pandas_runner
+
+    duck.load_to_duckdb(pd.DataFrame({"v": range(50)}), "nums")
+    settings.PANDAS_MAX_RESULT_ROWS = 10
+    out = pandas_runner.run_pandas_analysis(None, "result_df = df", table="nums")
+    assert len(out["rows"]) == 10 and out["truncated"] is True
+    settings.PANDAS_MAX_ROWS = 20
+    assert "trop volumineux" in pandas_runner.run_pandas_analysis(None, "result_df = df", table="nums")["error"]
@@ -8,10 +8,21 @@ urlpatterns = [
     path("datasets/upload", views.upload_dataset, name="analytics_upload_dataset"),
     path("datasets/<str:table>/preview", views.datasets_preview, name="analytics_datasets_preview"),
     path("datasets/<str:table>/all", views.datasets_all, name="analytics_datasets_all"),  # Toutes les données
+    path("datasets/<str:table>/rows", views.datasets_rows, name="analytics_datasets_rows"),
+    path("datasets/<str:table>/autocomplete", views.datasets_autocomplete, name="analytics_datasets_autocomplete"),
 
     # Queries
     path("query/sql", views.query_sql, name="analytics_query_sql"),
     path("query/nl", views.query_nl, name="analytics_query_nl"),
+    path("query/rows", views.query_rows, name="analytics_query_rows"),
+    path("query/stats", views.query_stats, name="analytics_query_stats"),
+    path("query/progressive", views.query_progressive, name="analytics_query_progressive"),
+    path("query/progressive/<str:run_id>/cancel", views.query_progressive_cancel,
+         name="analytics_query_progressive_cancel"),
+    path("kpis", views.kpis_query, name="analytics_kpis"),
+    path("nl/fastpath/stats", views.nl_fastpath_stats, name="analytics_nl_fastpath_stats"),
+    path("nl/cache", views.nl_cache_view, name="analytics_nl_cache"),
+    path("usage/top", views.usage_top, name="analytics_usage_top"),
     
     # Export
     path("export", views.export_results, name="analytics_export_results"),
@@ -6,16 +6,18 @@ import json
 import logging
 import io
 import base64
+import uuid
 from datetime import datetime
 import pandas as pd
-from django.conf import settings
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, parser_classes, permission_classes
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 
 # ✅ Imports internes
+from . import duck
 from .duck import (
+    ResultTooLarge,
     load_to_duckdb,
     list_tables,
     profile_table,
@@ -23,9 +25,15 @@ from .duck import (
     auto_analyze,
     query,
 )
-from .services.guards import is_safe
-from .services.runners import run_sql_safe
-from .services.planner import build_sql_from_plan
+from .services.guards import is_safe, wrap_page
+from .services.runners import run_sql_safe, run_plan
+from .services.planner import ANOMALY_INTENTS, build_histogram_sql, compile_plan
+from .services import (
+    accounting, admission, engine, kpis, nl_cache, nl_fastpath, progressive, sampling, scheduler, schema_card, singleflight,
+    speculative, table_query, value_index,
+)
+from .services.cache import LRUCache
+from .services.downsample import downsample_rows, page_rows, reduce_query
 from integrations.n8n import nl_to_sql as n8n_nl_to_sql, is_configured as n8n_is_configured
 from integrations.n8n_analysis import analyze_result, is_configured as analysis_is_configured
 
@@ -172,16 +180,15 @@ def _infer_left_var_from_read_csv(code: str) -> str | None:
 
 
 def _inject_duckdb_preamble(code: str, table_name: str, prefer_var: str | None = None) -> str:
-    """Injecte le chargement DuckDB dans le code Python généré par le LLM."""
+    """
+    Raccorde le code Python généré par le LLM au dataset DuckDB : le runner charge la table dans `df`
+    (run_pandas_analysis(table=...), via duck.query, sans ouvrir le fichier) et les pd.read_csv la réutilisent.
+    """
     left_var = _infer_left_var_from_read_csv(code) or prefer_var or "df"
     patched = re.sub(r"pd\.read_csv\([^)]*\)", left_var, code or "", flags=re.MULTILINE)
-
-    preamble = f"""
-import duckdb as _ddb
-_con = _ddb.connect(r'{settings.DUCKDB_PATH}')
-{left_var} = _con.execute('SELECT * FROM "{table_name}"').df()
-"""
-    return preamble.strip() + "\n\n" + patched.strip()
+    if left_var == "df" or not left_var.isidentifier():
+        return patched.strip()
+    return f"{left_var} = df\n\n" + patched.strip()
 
 
 # ---------------------------------------------------------------------------
@@ -262,13 +269,16 @@ def _synth_sql_from_spec(dataset: str, spec: dict) -> tuple[str | None, dict]:
     def q(col: str) -> str:
         return f'"{col}"'
 
-    # 🔹 Histogramme simple (ex : distribution des valeurs)
+    # 🔹 Histogramme : binning dans DuckDB, seules les classes (bin_start, bin_end, count) sortent
     if typ == "histogram":
-        x = spec.get("x") or num_col
+        x = spec.get("column") or spec.get("x") or num_col
         if not x:
             return None, spec_norm
         spec_norm.setdefault("bins", 20)
-        return f'SELECT {q(x)} FROM "{dataset}" WHERE {q(x)} IS NOT NULL', spec_norm
+        spec_norm.setdefault("bins_method", "fixed")
+        sql = build_histogram_sql(dataset, x, spec_norm["bins"], spec_norm["bins_method"])
+        spec_norm.update({"column": x, "x": "bin_start", "y": "count", "binned": True})
+        return sql, spec_norm
 
     # 🔹 Graphique en barres
     if typ in ("bar", "bar_horizontal"):
@@ -333,6 +343,50 @@ ORDER BY 2 DESC;
 # 🌐 Endpoints API
 # ---------------------------------------------------------------------------
 
+def _busy(e: scheduler.QueueTimeout) -> JsonResponse:
+    """Moteur saturé pour cette classe de requête : 503 + Retry-After."""
+    response = JsonResponse({"detail": str(e), "query_class": e.query_class}, status=503)
+    response["Retry-After"] = "5"
+    return response
+
+
+def _spec_axes(chart_spec) -> tuple | None:
+    """(type, x, y) d'un chart_spec : la série réduite dans DuckDB n'est valable que pour ceux-là."""
+    if not isinstance(chart_spec, dict):
+        return None
+    return (str(chart_spec.get("type") or "").lower(), chart_spec.get("x"), chart_spec.get("y"))
+
+
+# Résultats non rejouables en SQL (code Pandas, plans de service) gardés pour la pagination du tableau
+_result_pages = LRUCache(maxsize=32, ttl=900)
+
+
+def _paged(rows: list, sql: str | None = None, row_count: int | None = None) -> dict:
+    """
+    Première page du tableau (page_rows() lignes) et de quoi lire la suite par query/rows :
+    le SQL s'il est rejouable, sinon un identifiant de résultat gardé en cache quelques minutes.
+    """
+    size = page_rows()
+    total = len(rows) if row_count is None else int(row_count)
+    out = {"rows": rows[:size], "row_count": total}
+    if total > size:
+        if sql:
+            out["rows_page"] = {"sql": sql, "limit": size}
+        else:
+            result_id = uuid.uuid4().hex
+            _result_pages.set(result_id, rows)
+            out["rows_page"] = {"result_id": result_id, "limit": size}
+    return out
+
+
+def _over_quota(e: accounting.QuotaExceeded) -> JsonResponse:
+    """Quota glissant du client atteint : 429 + Retry-After (un dixième de la fenêtre)."""
+    response = JsonResponse({"detail": str(e), "quota": {"metric": e.metric, "used": e.used, "limit": e.limit,
+                                                         "window_s": e.window}}, status=429)
+    response["Retry-After"] = str(max(60, int(e.window // 10)))
+    return response
+
+
 @api_view(["POST"])
 @parser_classes([MultiPartParser, FormParser])
 @permission_classes([AllowAny])
@@ -346,12 +400,19 @@ def upload_dataset(request):
         dataset = _normalize_dataset_name(request.data.get("dataset") or os.path.splitext(upfile.name)[0])
         ext = (upfile.name or "").lower().rsplit(".", 1)[-1]
 
+        mode = (request.data.get("mode") or "replace").lower()
+        if mode not in ("replace", "append"):
+            return JsonResponse({"detail": "Champ 'mode' invalide (replace | append)."}, status=400)
+
         if ext in ("csv", "xlsx", "xls", "json", "parquet"):
-            info = load_to_duckdb(upfile, dataset, file_type=ext if ext != "xls" else "excel")
+            with scheduler.slot("ingest"):
+                info = load_to_duckdb(upfile, dataset, file_type=ext if ext != "xls" else "excel", mode=mode)
             return JsonResponse({"ok": True, "table": dataset, **info}, status=201)
 
         return JsonResponse({"detail": "Format non supporté (CSV, XLSX, JSON, Parquet)."}, status=400)
 
+    except scheduler.QueueTimeout as e:
+        return _busy(e)
     except Exception as e:
         logger.exception("upload_dataset: erreur inattendue")
         return JsonResponse({"detail": f"Echec import: {e}"}, status=500)
@@ -370,16 +431,72 @@ def datasets_list(request):
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def datasets_preview(request, table: str):
-    """Preview limité d'un dataset (10-1000 lignes max)."""
+    """
+    Preview limité d'un dataset (10-1000 lignes max).
+    Lignes et stats lues depuis l'échantillon persistant s'il est à jour (clé "sampled"), sinon la table.
+    """
     try:
         limit = max(1, min(int(request.GET.get("limit", 10)), 1000))
-        info = profile_table(table, limit=limit)
+        with scheduler.slot("interactive"):
+            info = sampling.preview(table, limit=limit) or profile_table(table, limit=limit)
         return JsonResponse({"table": table, **info})
+    except scheduler.QueueTimeout as e:
+        return _busy(e)
     except Exception as e:
         logger.exception("datasets_preview: erreur inattendue")
         return JsonResponse({"detail": str(e)}, status=500)
 
 
+@api_view(["GET", "POST"])
+@permission_classes([AllowAny])
+def datasets_rows(request, table: str):
+    """
+    Vue tableau paginée côté serveur : filtres / tri / projection + facettes (services.table_query).
+    POST : spécification JSON ; GET : page / page_size / sort=col[:desc] pour les cas simples.
+    """
+    try:
+        dataset = _normalize_dataset_name(table)
+        if request.method == "POST":
+            spec = request.data or {}
+        else:
+            spec = {"page": request.GET.get("page"), "page_size": request.GET.get("page_size")}
+            if request.GET.get("sort"):
+                col, _, direction = request.GET["sort"].partition(":")
+                spec["sort"] = [{"column": col, "dir": direction or "asc"}]
+        with accounting.meter("table", query_class="interactive", dataset=dataset) as usage:
+            with scheduler.slot("interactive"):
+                result = table_query.run(dataset, spec)
+            usage.result_rows = len(result["rows"])
+        return JsonResponse({"table": dataset, **result})
+    except scheduler.QueueTimeout as e:
+        return _busy(e)
+    except accounting.QuotaExceeded as e:
+        return _over_quota(e)
+    except (table_query.SpecError, ValueError, TypeError) as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+    except Exception as e:
+        logger.exception("datasets_rows: erreur inattendue")
+        return JsonResponse({"detail": str(e)}, status=500)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def datasets_autocomplete(request, table: str):
+    """Suggestions de valeurs (index des valeurs distinctes) pour la saisie d'une question."""
+    try:
+        dataset = _normalize_dataset_name(table)
+        prefix = (request.GET.get("q") or "").strip()
+        try:
+            limit = max(1, min(int(request.GET.get("limit", 10)), 50))
+        except (TypeError, ValueError):
+            return JsonResponse({"detail": "'limit' doit être un entier."}, status=400)
+        return JsonResponse({"table": dataset, "q": prefix,
+                             "suggestions": value_index.autocomplete(dataset, prefix, limit)})
+    except Exception as e:
+        logger.exception("datasets_autocomplete: erreur inattendue")
+        return JsonResponse({"detail": str(e)}, status=500)
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def datasets_all(request, table: str):
@@ -396,13 +513,19 @@ def datasets_all(request, table: str):
             return JsonResponse({"detail": "Requête non autorisée."}, status=400)
         
         try:
-            rows = run_sql_safe(sql, add_limit=None)  # Pas de limite
+            rows = run_sql_safe(sql, add_limit=None, endpoint="export")  # Pas de limite
             return JsonResponse({
                 "table": dataset,
                 "rows": rows,
                 "count": len(rows),
                 "columns": list(rows[0].keys()) if rows else []
             })
+        except (admission.QueryRejected, ResultTooLarge) as e:
+            return JsonResponse({"detail": str(e), "admission": admission.current()}, status=422)
+        except scheduler.QueueTimeout as e:
+            return _busy(e)
+        except accounting.QuotaExceeded as e:
+            return _over_quota(e)
         except Exception as e:
             logger.error(f"Erreur récupération données complètes ({dataset}): {e}")
             return JsonResponse({"detail": f"Erreur lors de la récupération des données: {e}"}, status=500)
@@ -414,7 +537,10 @@ def datasets_all(request, table: str):
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def query_sql(request):
-    """Exécute une requête SQL brute (avec vérification de sécurité)."""
+    """
+    Exécute une requête SQL brute (avec vérification de sécurité).
+    "approximate": true -> lecture depuis les échantillons des datasets (estimations + colonnes <agrégat>_se).
+    """
     try:
         sql = (request.data.get("sql") or "").strip()
         if not sql:
@@ -423,13 +549,102 @@ def query_sql(request):
         if not is_safe(sql):
             return JsonResponse({"detail": "Requête SQL non autorisée."}, status=400)
 
+        approx = None
+        if request.data.get("approximate"):
+            sql, approx = sampling.approximate_sql(sql)
         rows = run_sql_safe(sql)
-        return JsonResponse({"rows": rows})
+        decision = admission.current()
+        return JsonResponse({"rows": rows, **({"approximate": approx} if approx else {}),
+                             **({"admission": decision} if decision and decision["action"] != "execute" else {})})
+    except (admission.QueryRejected, ResultTooLarge) as e:
+        return JsonResponse({"detail": str(e), "admission": admission.current()}, status=422)
+    except scheduler.QueueTimeout as e:
+        return _busy(e)
+    except accounting.QuotaExceeded as e:
+        return _over_quota(e)
     except Exception as e:
         logger.exception("query_sql: erreur inattendue")
         return JsonResponse({"detail": str(e)}, status=500)
 
 
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def query_rows(request):
+    """
+    Page suivante du tableau d'une réponse query/nl : {"sql" | "result_id", "offset", "limit"}.
+    Le SQL est rejoué avec LIMIT/OFFSET dans DuckDB, un result_id relit le résultat gardé en cache.
+    """
+    try:
+        offset = int(request.data.get("offset") or 0)
+        limit = int(request.data.get("limit") or page_rows())
+    except (TypeError, ValueError):
+        return JsonResponse({"detail": "'offset' et 'limit' doivent être des entiers."}, status=400)
+    if offset < 0 or not 0 < limit <= 1000:
+        return JsonResponse({"detail": "'offset' >= 0 et 0 < 'limit' <= 1000."}, status=400)
+
+    result_id = request.data.get("result_id")
+    if result_id:
+        rows = _result_pages.get(str(result_id))
+        if rows is None:
+            return JsonResponse({"detail": "Résultat expiré, relancer la question."}, status=404)
+        return JsonResponse({"rows": rows[offset:offset + limit], "offset": offset, "row_count": len(rows)})
+
+    sql = (request.data.get("sql") or "").strip()
+    if not sql:
+        return JsonResponse({"detail": "Champ 'sql' ou 'result_id' requis."}, status=400)
+    if not is_safe(sql):
+        return JsonResponse({"detail": "Requête SQL non autorisée."}, status=400)
+    try:
+        rows = run_sql_safe(wrap_page(sql, limit, offset), add_limit=None, endpoint="interactive")
+        return JsonResponse({"rows": rows, "offset": offset})
+    except (admission.QueryRejected, ResultTooLarge) as e:
+        return JsonResponse({"detail": str(e), "admission": admission.current()}, status=422)
+    except scheduler.QueueTimeout as e:
+        return _busy(e)
+    except accounting.QuotaExceeded as e:
+        return _over_quota(e)
+    except Exception as e:
+        logger.exception("query_rows: erreur inattendue")
+        return JsonResponse({"detail": str(e)}, status=500)
+
+
+@api_view(["GET", "POST"])
+@permission_classes([AllowAny])
+def query_progressive(request):
+    """
+    Exécution progressive d'une requête d'agrégat (Server-Sent Events) : estimations sur 1 %, 10 %
+    puis résultat exact (services.progressive). GET pour EventSource (?sql=...&stages=1,10,100),
+    POST pour un flux fetch. Fermer le flux ou appeler .../<run_id>/cancel arrête les étapes restantes.
+    """
+    params = request.data if request.method == "POST" else request.GET
+    sql = (params.get("sql") or "").strip()
+    if not sql:
+        return JsonResponse({"detail": "Champ 'sql' requis."}, status=400)
+    if not is_safe(sql):
+        return JsonResponse({"detail": "Requête SQL non autorisée."}, status=400)
+    try:
+        run = progressive.ProgressiveRun(sql, stages=params.get("stages"))
+    except (ValueError, TypeError) as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+    except admission.QueryRejected as e:
+        return JsonResponse({"detail": str(e), "admission": admission.current()}, status=422)
+    except scheduler.QueueTimeout as e:
+        return _busy(e)
+    except accounting.QuotaExceeded as e:
+        return _over_quota(e)
+    response = StreamingHttpResponse(run.events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # pas de mise en tampon par nginx
+    return response
+
+
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def query_progressive_cancel(request, run_id: str):
+    """Accepte l'estimation courante : arrête les étapes restantes d'une exécution progressive."""
+    return JsonResponse({"run_id": run_id, "cancelled": True, "local": progressive.cancel(run_id)})
+
+
 # ---------------------------------------------------------------------------
 # 🧠 Requêtes NL → SQL via LLM
 # ---------------------------------------------------------------------------
@@ -664,16 +879,20 @@ def auto_analyze_result(rows: list[dict], chart_spec: dict, question: str) -> st
     x_key = chart_spec.get("x", keys[0])
     y_key = chart_spec.get("y", keys[1])
     try:
-        y_values = [float(r[y_key]) for r in rows if r.get(y_key) is not None]
+        y_values = kpis.as_array([r.get(y_key) for r in rows])
     except Exception:
         return "Impossible d’interpréter les valeurs numériques."
+    y_values = y_values[~np.isnan(y_values)]
+    if not y_values.size:
+        return "Impossible d’interpréter les valeurs numériques."
 
-    # Statistiques de base
-    n = len(y_values)
-    mean_val = np.mean(y_values)
-    median_val = np.median(y_values)
-    min_val = np.min(y_values)
-    max_val = np.max(y_values)
+    # Statistiques de base (une passe pour count/moyenne/min/max)
+    m = kpis.Moments.of(y_values)
+    n = m.count
+    mean_val = m.mean
+    median_val = kpis.percentiles(y_values, (50,))[50]
+    min_val = m.min
+    max_val = m.max
     amplitude = max_val - min_val
 
     # Génération d’une analyse textuelle
@@ -691,8 +910,9 @@ def auto_analyze_result(rows: list[dict], chart_spec: dict, question: str) -> st
         else:
             analysis.append("La tendance reste stable sur la période.")
     elif typ in ["bar", "pie", "histogram", "stacked_bar"]:
-        max_row = max(rows, key=lambda r: r[y_key])
-        min_row = min(rows, key=lambda r: r[y_key])
+        valid_rows = [r for r in rows if r.get(y_key) is not None]
+        max_row = max(valid_rows, key=lambda r: r[y_key])
+        min_row = min(valid_rows, key=lambda r: r[y_key])
         analysis.append(f"La catégorie '{max_row[x_key]}' a la valeur la plus élevée ({max_row[y_key]:.2f}).")
         analysis.append(f"La catégorie '{min_row[x_key]}' est la plus faible ({min_row[y_key]:.2f}).")
         if amplitude / mean_val > 0.5:
@@ -709,6 +929,122 @@ def auto_analyze_result(rows: list[dict], chart_spec: dict, question: str) -> st
 
 
 
+@api_view(["GET", "POST"])
+@permission_classes([AllowAny])
+def kpis_query(request):
+    """
+    KPIs fenêtrés (moyenne mobile, YoY, MoM, cumul, part du total) compilés en une requête DuckDB,
+    sans appel n8n. Colonnes non fournies -> rôles déduits par _infer_columns. Résultat en cache
+    par version du dataset.
+    """
+    try:
+        data = request.data if request.method == "POST" else request.GET
+        dataset = _normalize_dataset_name(data.get("dataset"))
+        if not dataset:
+            return JsonResponse({"detail": "Champ 'dataset' requis."}, status=400)
+
+        date_col, val_col, _ = _infer_columns(dataset)
+        date_col = data.get("date_col") or date_col
+        if not date_col:
+            return JsonResponse({"detail": "Aucune colonne date détectée ('date_col' requis)."}, status=400)
+
+        metrics = data.get("kpis") or None
+        if isinstance(metrics, str):
+            metrics = [m.strip() for m in metrics.split(",") if m.strip()]
+
+        try:
+            rows, meta = kpis.window_kpis(
+                dataset,
+                date_col,
+                data.get("measure") or val_col,
+                grain=(data.get("grain") or "month").lower(),
+                metrics=metrics,
+                window=int(data.get("window") or 3),
+                category_col=data.get("category_col") or None,
+                date_from=data.get("date_from") or None,
+                date_to=data.get("date_to") or None,
+            )
+        except (ValueError, TypeError) as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        return JsonResponse({"dataset": dataset, "rows": rows, **meta})
+    except (admission.QueryRejected, ResultTooLarge) as e:
+        return JsonResponse({"detail": str(e), "admission": admission.current()}, status=422)
+    except scheduler.QueueTimeout as e:
+        return _busy(e)
+    except accounting.QuotaExceeded as e:
+        return _over_quota(e)
+    except Exception as e:
+        logger.exception("kpis_query: erreur inattendue")
+        return JsonResponse({"detail": f"Erreur interne: {e}"}, status=500)
+
+
+def _fallback_plan(data: dict, dataset: str) -> dict:
+    """Plan local utilisé quand n8n ne fournit ni SQL ni chart_spec (intent par défaut : série temporelle)."""
+    date_col, val_col, cat_col = _infer_columns(dataset)
+    return {
+        "intent": data.get("intent", "timeseries_total"),
+        "dataset": dataset,
+        "date_col": date_col,
+        "amount_col": val_col,
+        "category_col": cat_col,
+        "limit": int(data.get("limit", 1000)),
+        **{k: data[k] for k in ("grain", "date_from", "date_to", "exact", "window", "threshold", "season",
+                                "horizon", "level", "seasonal", "include_history")
+           if data.get(k) is not None},
+    }
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def query_stats(request):
+    """
+    Compteurs d'exécution : coalescence (single-flight), spéculation, admission (coût estimé vs réel),
+    ordonnanceur (créneaux, profondeur de file et attente par classe), service moteur s'il est utilisé.
+    """
+    out = {"singleflight": singleflight.stats(), "speculative": speculative.stats(),
+           "admission": admission.stats(), "scheduler": scheduler.stats()}
+    if duck.ENGINE_SOCKET:
+        try:
+            out["engine"] = engine.stats(duck.ENGINE_SOCKET)
+        except engine.EngineUnavailable as e:
+            out["engine"] = {"error": str(e)}
+    return JsonResponse(out)
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def nl_fastpath_stats(request):
+    """Couverture du fast-path NL (questions traitées localement vs envoyées à n8n)."""
+    return JsonResponse({"enabled": nl_fastpath.enabled(), **nl_fastpath.stats()})
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def usage_top(request):
+    """
+    Plus gros consommateurs du moteur (planification de capacité, réservé au staff) :
+    ?by=user|dataset&metric=cpu_ms|wall_ms|rows_scanned|result_bytes|queries&window=<s>&limit=20
+    """
+    try:
+        return JsonResponse(accounting.top_consumers(
+            by=request.GET.get("by", "user"),
+            window_s=float(request.GET.get("window") or 86400),
+            metric=request.GET.get("metric", "cpu_ms"),
+            limit=max(1, min(int(request.GET.get("limit") or 20), 200)),
+        ))
+    except ValueError as e:
+        return JsonResponse({"detail": str(e)}, status=400)
+
+
+@api_view(["GET", "DELETE"])
+@permission_classes([AllowAny])
+def nl_cache_view(request):
+    """Statistiques du cache NL→SQL (GET) ou purge complète (DELETE)."""
+    if request.method == "DELETE":
+        nl_cache.clear()
+    return JsonResponse({"enabled": nl_cache.enabled(), **nl_cache.stats()})
+
+
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def query_nl(request):
@@ -716,6 +1052,7 @@ def query_nl(request):
     NL → (n8n) → SQL/plan → exécution sécurisée → (optionnel) analyse experte n8n
     avec fallback local si n8n indisponible.
     """
+    spec = None
     try:
         data = request.data or {}
         question = (data.get("question") or "").strip()
@@ -727,25 +1064,71 @@ def query_nl(request):
         # 1) Schéma pour contextualiser
         schema = get_schema(dataset)
         extra = {k: v for k, v in data.items() if k not in {"question", "dataset"}}
-        extra.update({"schema": schema})
-
-        # 2) NL→SQL via n8n (si dispo)
+        # fiche schéma précalculée à l'ingestion (rôles, bornes, valeurs fréquentes), taille bornée
+        extra.update({"schema": schema_card.card_text(dataset) or schema,
+                      "sql_functions": kpis.sql_function_signatures()})
+        # valeurs citées dans la question -> filtres colonne = valeur suggérés au LLM
+        value_matches = value_index.resolve(question, dataset)
+        if value_matches:
+            extra["value_matches"] = value_matches
+
+        # 2) Fast-path local (questions courantes -> plan direct), sinon NL→SQL via n8n (si dispo)
         payload = {}
-        if n8n_is_configured():
-            try:
-                payload = n8n_nl_to_sql(question, dataset, extra=extra)
-            except Exception as e:
-                logger.warning(f"Erreur n8n (NL→SQL): {e}")
+        fast = None
+        if not data.get("intent") and not data.get("force_llm"):
+            fast = nl_fastpath.match(question, dataset)
+        # options utilisateur (hors question/dataset) : font partie de la clé du cache NL→SQL
+        options = {k: v for k, v in data.items() if k not in {"question", "dataset", "no_cache", "force_llm"}}
+        cache_meta = None
+        llm_out = None  # traduction n8n fraîche : mise en cache une fois exécutée avec succès
+        if not fast and n8n_is_configured():
+            if not data.get("no_cache"):
+                cached, cache_meta = nl_cache.lookup(question, dataset, schema, options)
+                payload = cached or {}
+            if not payload:
+                # Exécution spéculative du plan de repli pendant l'appel LLM
+                try:
+                    fallback = _fallback_plan(data, dataset)
+                    if fallback["intent"] not in ANOMALY_INTENTS and fallback["intent"] != "forecast":
+                        spec = speculative.start(compile_plan(fallback)[0])
+                except Exception as e:
+                    logger.debug(f"Spéculation ignorée: {e}")
+                # questions identiques simultanées : un seul appel n8n, résultat partagé
+                flight_key = ("n8n", dataset, nl_cache.normalize_question(question), nl_cache.schema_hash(schema),
+                              json.dumps(options, sort_keys=True, default=str))
+
+                def ask_llm() -> dict:
+                    return singleflight.nl_flight.do(flight_key, lambda: n8n_nl_to_sql(question, dataset, extra=extra))
+
+                if spec:
+                    # n8n et spéculation en concurrence : le premier résultat valide est servi
+                    payload, winner = speculative.race(spec, ask_llm)
+                    logger.info(f"[query_nl] course n8n / spéculation : {winner}")
+                    llm_out = payload if winner == "llm" else None
+                else:
+                    try:
+                        payload = llm_out = ask_llm()
+                    except Exception as e:
+                        logger.warning(f"Erreur n8n (NL→SQL): {e}")
 
         # 3) Cas code Python généré
         if payload.get("code_python"):
             code = _inject_duckdb_preamble(payload["code_python"], dataset, prefer_var=dataset)
-            result = run_pandas_analysis(code)
+            try:
+                with scheduler.slot("analysis"):
+                    result = run_pandas_analysis(None, code, table=dataset)
+            except scheduler.QueueTimeout as e:
+                return _busy(e)
+            except accounting.QuotaExceeded as e:
+                return _over_quota(e)
+            if llm_out and not result.get("error"):
+                nl_cache.store(question, dataset, schema, llm_out, options)
             rows = result.get("rows", [])
             chart_spec = payload.get("chart_spec", {"type": "custom"})
             
             # Vérifier si on doit afficher un graphique
             chart_spec = auto_fix_chart_spec(question, chart_spec, rows)
+            chart_rows, downsampling = downsample_rows(rows, chart_spec) if chart_spec else (rows, None)
             
             # Formater une réponse textuelle claire si pas de graphique
             text_response = None
@@ -756,7 +1139,7 @@ def query_nl(request):
             analysis_summary = ""
             if analysis_is_configured():
                 try:
-                    # Envoyer toutes les données à n8n (rows contient déjà toutes les données)
+                    # Envoyer toutes les données à n8n (rows contient déjà toutes les données, bornées par le runner)
                     logger.info(f"[query_nl] Envoi de {len(rows)} lignes à n8n pour analyse (dataset: {dataset}, code_python)")
                     n8n_out = analyze_result(question, rows, chart_spec)
                     raw_summary = n8n_out.get("summary") or n8n_out.get("text") or ""
@@ -788,14 +1171,20 @@ def query_nl(request):
                 else:
                     formatted_analysis = analysis_text
             
+            # tableau : première page seulement (suite via query/rows), graphique : série réduite
             return JsonResponse({
-                "rows": rows,
+                **_paged(rows),
                 "chart_spec": chart_spec,
                 "summary": combined_summary,
                 "analysis": formatted_analysis,
                 "text_response": text_response,  # Réponse textuelle si pas de graphique
                 "sql": payload.get("sql"),
                 "schema": schema,
+                **({"chart_rows": chart_rows} if chart_spec and len(rows) > page_rows() else {}),
+                **({"chart_rows": chart_rows, "downsampling": downsampling} if downsampling else {}),
+                **({"nl_cache": cache_meta} if cache_meta else {}),
+                **({"truncated": True} if result.get("truncated") else {}),
+                **({"error": result["error"]} if result.get("error") else {}),
             })
 
         # 4) Cas SQL généré (ou synthèse depuis chart_spec / plan)
@@ -805,27 +1194,79 @@ def query_nl(request):
         if not sql and chart_spec:
             sql, chart_spec = _synth_sql_from_spec(dataset, chart_spec)
 
-        if not sql:
-            date_col, val_col, cat_col = _infer_columns(dataset)
-            plan = {
-                "intent": data.get("intent", "timeseries_total"),
-                "dataset": dataset,
-                "date_col": date_col,
-                "amount_col": val_col,
-                "category_col": cat_col,
-                "limit": int(data.get("limit", 1000)),
-            }
-            sql = build_sql_from_plan(plan)
+        plan_meta = None
+        service_plan = None
+        if not sql and fast:
+            plan = {**fast.plan, **{k: data[k] for k in ("exact", "window", "threshold", "season", "level",
+                                                          "seasonal", "include_history")
+                                    if data.get(k) is not None}}
+            sql, plan_meta = compile_plan(plan)
+            chart_spec = dict(fast.chart_spec)
+            if plan["intent"] in ANOMALY_INTENTS or plan["intent"] == "forecast":
+                service_plan = plan
+        elif not sql:
+            plan = _fallback_plan(data, dataset)
+            sql, plan_meta = compile_plan(plan)
             chart_spec = {"type": "table"}
+            if plan["intent"] in ANOMALY_INTENTS:
+                service_plan = plan
+                chart_spec = {"type": "line", "x": "ts", "y": "val"}
+            elif plan["intent"] == "forecast":
+                service_plan = plan
 
         # 5) Sécurité puis exécution
         if not sql or not is_safe(sql):
             return JsonResponse({"detail": "SQL généré invalide ou non autorisé."}, status=400)
 
+        # Mode exploratoire : estimations depuis l'échantillon du dataset (avec erreurs types)
+        approx = None
+        if data.get("approximate") and not service_plan:
+            sql, approx = sampling.approximate_sql(sql)
+
         try:
             # Exécuter sans limite pour avoir toutes les données pour n8n
             # On limite seulement pour l'affichage frontend si nécessaire
-            rows = run_sql_safe(sql, add_limit=None)  # Pas de limite pour avoir toutes les données
+            rows = None
+            admission_meta = None
+            chart_rows, downsampling, row_count, reduced_for = None, None, None, None
+            if service_plan:
+                # anomalies glissantes (cache par version) / prévision multi-séries (ajustement vectorisé)
+                rows, service_meta = run_plan(service_plan)
+                plan_meta = {**plan_meta, **service_meta}
+            elif spec and spec.matches(sql):
+                # n8n indisponible ou même requête que la spéculation : résultat déjà calculé
+                rows = spec.result()
+                plan_meta = {**(plan_meta or {}), "speculative": rows is not None}
+                admission_meta = spec.admission() if rows is not None else None
+            if rows is None:
+                if spec:
+                    spec.cancel()
+                if not analysis_is_configured():
+                    # pas d'analyse n8n sur le résultat complet : graphique réduit dans DuckDB et première
+                    # page du tableau, le résultat complet n'est jamais matérialisé
+                    try:
+                        reduced = reduce_query(sql, chart_spec,
+                                               lambda q: run_sql_safe(q, add_limit=None, endpoint="nl"))
+                    except (admission.QueryRejected, ResultTooLarge, scheduler.QueueTimeout, accounting.QuotaExceeded):
+                        raise
+                    except Exception as e:
+                        logger.info(f"[query_nl] réduction SQL du graphique impossible, repli Python: {e}")
+                        reduced = None
+                    if reduced is not None:
+                        chart_rows, downsampling = reduced
+                        reduced_for = _spec_axes(chart_spec)
+                        row_count = downsampling["source_rows"]
+                        rows = run_sql_safe(wrap_page(sql, page_rows()), add_limit=None, endpoint="nl")
+                        downsampling = downsampling if downsampling["method"] else None
+                if rows is None:
+                    rows = run_sql_safe(sql, add_limit=None, endpoint="nl")  # résultat complet (analyse n8n)
+                admission_meta = admission.current()
+        except (admission.QueryRejected, ResultTooLarge) as e:
+            return JsonResponse({"detail": str(e), "sql": sql, "admission": admission.current()}, status=422)
+        except scheduler.QueueTimeout as e:
+            return _busy(e)
+        except accounting.QuotaExceeded as e:
+            return _over_quota(e)
         except Exception as e:
             logger.error(f"Erreur exécution SQL ({dataset}): {e}")
             # Formater l'erreur en message clair
@@ -843,6 +1284,23 @@ def query_nl(request):
 
         # 6) Fix chart + analyse locale / n8n
         chart_spec = auto_fix_chart_spec(question, chart_spec, rows)
+        if reduced_for and _spec_axes(chart_spec) != reduced_for:
+            # le graphique corrigé ne correspond plus à la série réduite : repli sur le résultat complet
+            try:
+                rows = run_sql_safe(sql, add_limit=None, endpoint="nl")
+            except (admission.QueryRejected, ResultTooLarge) as e:
+                return JsonResponse({"detail": str(e), "sql": sql, "admission": admission.current()}, status=422)
+            except scheduler.QueueTimeout as e:
+                return _busy(e)
+            except accounting.QuotaExceeded as e:
+                return _over_quota(e)
+            chart_rows, downsampling, row_count = None, None, None
+        if llm_out:
+            # SQL validé (is_safe) et exécuté : la traduction peut resservir
+            nl_cache.store(question, dataset, schema, llm_out, options)
+        # Série réduite pour le graphique (déjà faite dans DuckDB si réduction poussée)
+        if chart_rows is None:
+            chart_rows, downsampling = downsample_rows(rows, chart_spec) if chart_spec else (rows, None)
         
         # Formater une réponse textuelle claire si pas de graphique
         text_response = None
@@ -885,20 +1343,32 @@ def query_nl(request):
             else:
                 formatted_analysis = analysis_text
         
-        # Envoyer toutes les données (pas de limite)
+        # Tableau : première page (suite via query/rows) ; graphique : série réduite
+        total = len(rows) if row_count is None else row_count
         return JsonResponse({
-            "rows": rows,  # Toutes les données, sans limite
+            **_paged(rows, sql=None if service_plan else sql, row_count=total),
             "chart_spec": chart_spec,
             "summary": combined_summary,
             "analysis": formatted_analysis,
             "text_response": text_response,  # Réponse textuelle si pas de graphique
             "sql": sql,
             "schema": schema,
+            **({"chart_rows": chart_rows} if chart_spec and total > page_rows() else {}),
+            **({"chart_rows": chart_rows, "downsampling": downsampling} if downsampling else {}),
+            **({"plan": plan_meta} if plan_meta else {}),
+            **({"approximate": approx} if approx else {}),
+            **({"admission": admission_meta} if admission_meta and admission_meta["action"] != "execute" else {}),
+            **({"nl_cache": cache_meta} if cache_meta else {}),
+            **({"fastpath": {"intent": fast.plan["intent"], "confidence": fast.confidence, "slots": fast.slots}}
+               if fast else {}),
         })
 
     except Exception as e:
         logger.exception("query_nl: erreur inattendue")
         return JsonResponse({"detail": f"Erreur interne: {e}"}, status=500)
+    finally:
+        if spec:
+            spec.cancel()
 
 
 # ============================================================
@@ -924,23 +1394,46 @@ def export_results(request):
         summary = request.data.get("summary", "")
         analysis = request.data.get("analysis", "")
         sql = request.data.get("sql", "")
-        
+        result_id = request.data.get("result_id")
+
+        # le client n'a que la première page : relire le résultat complet (SQL rejoué ou cache)
+        if result_id and _result_pages.get(result_id) is not None:
+            rows = _result_pages.get(result_id)
+        elif sql and int(request.data.get("row_count") or 0) > len(rows):
+            if not is_safe(sql):
+                return JsonResponse({"detail": "Requête SQL non autorisée."}, status=400)
+            try:
+                rows = run_sql_safe(sql, add_limit=None, endpoint="export")
+            except (admission.QueryRejected, ResultTooLarge) as e:
+                return JsonResponse({"detail": str(e), "admission": admission.current()}, status=422)
+            except scheduler.QueueTimeout as e:
+                return _busy(e)
+
         if not rows:
             return JsonResponse({"detail": "Aucune donnée à exporter."}, status=400)
         
-        df = pd.DataFrame(rows)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename_base = f"export_{dataset}_{timestamp}" if dataset else f"export_{timestamp}"
-        
-        if format_type == "xlsx":
-            return _export_excel(df, question, dataset, summary, analysis, sql, chart_base64, filename_base)
-        elif format_type == "pdf":
-            return _export_pdf(df, question, dataset, summary, analysis, sql, chart_base64, filename_base)
-        elif format_type == "csv":
-            return _export_csv(df, filename_base)
-        else:
+        if format_type not in ("xlsx", "pdf", "csv"):
             return JsonResponse({"detail": f"Format non supporté: {format_type}"}, status=400)
-            
+
+        # génération du fichier imputée au client (temps, CPU, taille produite)
+        with accounting.meter("export", query_class="export", dataset=dataset) as usage:
+            df = pd.DataFrame(rows)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename_base = f"export_{dataset}_{timestamp}" if dataset else f"export_{timestamp}"
+
+            if format_type == "xlsx":
+                response = _export_excel(df, question, dataset, summary, analysis, sql, chart_base64, filename_base)
+            elif format_type == "pdf":
+                response = _export_pdf(df, question, dataset, summary, analysis, sql, chart_base64, filename_base)
+            else:
+                response = _export_csv(df, filename_base)
+            usage.result_rows = len(df)
+            usage.result_bytes = len(getattr(response, "content", b""))
+            usage.peak(int(df.memory_usage(deep=True).sum()))
+        return response
+
+    except accounting.QuotaExceeded as e:
+        return _over_quota(e)
     except Exception as e:
         logger.exception("export_results: erreur inattendue")
         return JsonResponse({"detail": f"Erreur lors de l'export: {e}"}, status=500)
@@ -997,6 +1490,8 @@ def _export_excel(df, question, dataset, summary, analysis, sql, chart_base64, f
         if chart_base64:
             try:
                 img_data = base64.b64decode(chart_base64.split(',')[-1] if ',' in chart_base64 else chart_base64)
+                if not img_data.startswith(b"\x89PNG"):
+                    raise ValueError("seuls les graphiques PNG sont intégrables (CHART_RENDER_FORMAT=svg ?)")
                 with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
                     tmp.write(img_data)
                     tmp_path = tmp.name
@@ -1121,6 +1616,8 @@ def _export_pdf(df, question, dataset, summary, analysis, sql, chart_base64, fil
         if chart_base64:
             try:
                 img_data = base64.b64decode(chart_base64.split(',')[-1] if ',' in chart_base64 else chart_base64)
+                if not img_data.startswith(b"\x89PNG"):
+                    raise ValueError("seuls les graphiques PNG sont intégrables (CHART_RENDER_FORMAT=svg ?)")
                 with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
                     tmp.write(img_data)
                     tmp_path = tmp.name
@@ -1,13 +1,22 @@
 import uuid
-from typing import Callable
+from contextvars import ContextVar
+from typing import Callable, Optional
 from django.http import HttpRequest, HttpResponse
 
+_current_request: ContextVar[Optional[HttpRequest]] = ContextVar("current_request", default=None)
+
+
+def current_request() -> Optional[HttpRequest]:
+    """Requete HTTP en cours de traitement dans ce contexte (None hors requete : commandes, threads)."""
+    return _current_request.get()
+
 
 class RequestIDMiddleware:
     """
     Ajoute un identifiant de requete a chaque reponse.
     - Header de sortie: X-Request-ID
-    - Accessible via request.request_id
+    - Accessible via request.request_id, et la requete via current_request()
+      (l'utilisateur DRF y est visible une fois la vue authentifiee)
     """
 
     def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
@@ -17,6 +26,10 @@ class RequestIDMiddleware:
         request_id = request.headers.get("X-Request-ID") or str(uuid.uuid4())
         setattr(request, "request_id", request_id)
 
-        response = self.get_response(request)
+        token = _current_request.set(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
         response.headers["X-Request-ID"] = request_id
         return response
@@ -1,5 +1,7 @@
 import os
+import stat
 from datetime import datetime, timezone
+from pathlib import Path
 from typing import Dict, Any
 
 
@@ -16,3 +18,20 @@ def now_utc() -> datetime:
 
 def dict_without_none(d: Dict[str, Any]) -> Dict[str, Any]:
     return {k: v for k, v in d.items() if v is not None}
+
+
+def private_dir(path) -> Path:
+    """
+    Dossier réservé au compte du processus, créé en 0700 (remis en 0700 s'il était ouvert au groupe /
+    aux autres). PermissionError s'il appartient à un autre compte ou si ce n'est pas un dossier.
+    """
+    path = Path(path)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode) or not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"{path} n'est pas un dossier")
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"{path} appartient à un autre compte (uid {st.st_uid})")
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 
     "common.middleware.RequestIDMiddleware",
+    "analytics.middleware.AdmissionScopeMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -142,6 +143,132 @@ if _CSFR_ENV:
 
 # ----- DuckDB -----
 DUCKDB_PATH = os.getenv("DUCKDB_PATH", str(DATA_DIR / "insight.duckdb"))
+# Service moteur (manage.py run_engine) : seul propriétaire du fichier, les workers s'y connectent
+# par cette socket Unix (lue par analytics.duck ; vide = chaque processus ouvre le fichier)
+DUCKDB_ENGINE_SOCKET = os.getenv("DUCKDB_ENGINE_SOCKET", "")
+# Jeton partagé service moteur / workers (lu dans l'environnement par analytics.services.engine) ;
+# vide = seul le contrôle du pair (même utilisateur, SO_PEERCRED) protège la socket
+DUCKDB_ENGINE_TOKEN = os.getenv("DUCKDB_ENGINE_TOKEN", "")
+
+# Rollups (tables pré-agrégées construites à l'ingestion, lues par le planner)
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "1") == "1"
+ROLLUP_MIN_ROWS = int(os.getenv("ROLLUP_MIN_ROWS", "50000"))
+ROLLUP_MAX_CATEGORIES = int(os.getenv("ROLLUP_MAX_CATEGORIES", "3"))
+ROLLUP_MAX_CARDINALITY = int(os.getenv("ROLLUP_MAX_CARDINALITY", "500"))
+
+# Vues matérialisées automatiques (requêtes d'agrégat fréquentes et coûteuses)
+MATVIEW_ENABLED = os.getenv("MATVIEW_ENABLED", "1") == "1"
+MATVIEW_MIN_RUNS = int(os.getenv("MATVIEW_MIN_RUNS", "3"))
+MATVIEW_MIN_COST_MS = float(os.getenv("MATVIEW_MIN_COST_MS", "200"))
+MATVIEW_MAX_ROWS = int(os.getenv("MATVIEW_MAX_ROWS", "100000"))
+MATVIEW_BUDGET_MB = float(os.getenv("MATVIEW_BUDGET_MB", "256"))
+
+# Planner : au-delà de PLANNER_APPROX_MIN_ROWS lignes scannées (sans rollup), agrégats sur échantillon
+# d'environ PLANNER_APPROX_TARGET_ROWS lignes, remis à l'échelle (désactivable par plan["exact"])
+PLANNER_APPROX_MIN_ROWS = int(os.getenv("PLANNER_APPROX_MIN_ROWS", "100000000"))
+PLANNER_APPROX_TARGET_ROWS = int(os.getenv("PLANNER_APPROX_TARGET_ROWS", "10000000"))
+
+# Fast-path NL : questions courantes traduites localement en plan (sans appel n8n)
+# au-delà de NL_FASTPATH_MIN_CONFIDENCE (0..1)
+NL_FASTPATH_ENABLED = os.getenv("NL_FASTPATH_ENABLED", "1").lower() not in {"0", "false", "no"}
+NL_FASTPATH_MIN_CONFIDENCE = float(os.getenv("NL_FASTPATH_MIN_CONFIDENCE", "0.75"))
+
+# Cache persistant NL→SQL (table DuckDB __nl_cache) : TTL en secondes, taille max (LRU),
+# seuil de similarité pour les formulations proches, mêmes mots pleins exigés (0 = désactivé, défaut)
+NL_CACHE_ENABLED = os.getenv("NL_CACHE_ENABLED", "1").lower() not in {"0", "false", "no"}
+NL_CACHE_TTL = int(os.getenv("NL_CACHE_TTL", str(7 * 24 * 3600)))
+NL_CACHE_MAX_ENTRIES = int(os.getenv("NL_CACHE_MAX_ENTRIES", "5000"))
+NL_CACHE_SIMILARITY = float(os.getenv("NL_CACHE_SIMILARITY", "0"))
+
+# Exécution spéculative du plan de repli pendant l'appel n8n NL→SQL (threads dédiés)
+NL_SPECULATIVE_ENABLED = os.getenv("NL_SPECULATIVE_ENABLED", "1").lower() not in {"0", "false", "no"}
+NL_SPECULATIVE_WORKERS = int(os.getenv("NL_SPECULATIVE_WORKERS", "4"))
+# n8n encore muet NL_SPECULATIVE_GRACE s après la fin de la spéculation -> résultat spéculatif servi
+NL_SPECULATIVE_GRACE = float(os.getenv("NL_SPECULATIVE_GRACE", "1"))
+
+# Coalescence des requêtes identiques (SQL, appels n8n) : entre workers via verrous fichiers
+SINGLEFLIGHT_CROSS_PROCESS = os.getenv("SINGLEFLIGHT_CROSS_PROCESS", "1").lower() not in {"0", "false", "no"}
+SINGLEFLIGHT_DIR = os.getenv("SINGLEFLIGHT_DIR", "") or str(DATA_DIR / "singleflight")  # mode 0700, propriétaire vérifié
+
+# Fiche schéma envoyée au LLM : taille max (caractères), valeurs fréquentes par colonne catégorielle,
+# cardinalité max d'une colonne texte considérée comme catégorie
+SCHEMA_CARD_MAX_CHARS = int(os.getenv("SCHEMA_CARD_MAX_CHARS", "4000"))
+SCHEMA_CARD_TOP_VALUES = int(os.getenv("SCHEMA_CARD_TOP_VALUES", "8"))
+SCHEMA_CARD_CATEGORY_MAX_DISTINCT = int(os.getenv("SCHEMA_CARD_CATEGORY_MAX_DISTINCT", "200"))
+
+# Index des valeurs distinctes (résolution d'entités, autocomplétion) : colonnes texte
+# de cardinalité <= VALUE_INDEX_MAX_DISTINCT
+VALUE_INDEX_MAX_DISTINCT = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", "50000"))
+
+# Échantillon stratifié persistant par dataset (__sample_<dataset>) : aperçus, fiches schéma,
+# option "approximate" de query_sql / query_nl (estimations pondérées + erreurs types)
+SAMPLE_ENABLED = os.getenv("SAMPLE_ENABLED", "1").lower() not in {"0", "false", "no"}
+SAMPLE_ROWS = int(os.getenv("SAMPLE_ROWS", "100000"))
+SAMPLE_MAX_STRATA = int(os.getenv("SAMPLE_MAX_STRATA", "200"))
+SAMPLE_MIN_PER_STRATUM = int(os.getenv("SAMPLE_MIN_PER_STRATUM", "200"))
+SAMPLE_REPLICATES = int(os.getenv("SAMPLE_REPLICATES", "10"))
+
+# Agrégation progressive (SSE) : étapes en % de la table (la dernière, 100, est exacte),
+# taille minimale d'une étape partielle, battement de cœur (s) pour détecter les déconnexions
+PROGRESSIVE_STAGES = os.getenv("PROGRESSIVE_STAGES", "1,10,100")
+PROGRESSIVE_MIN_STAGE_ROWS = int(os.getenv("PROGRESSIVE_MIN_STAGE_ROWS", "10000"))
+PROGRESSIVE_HEARTBEAT = float(os.getenv("PROGRESSIVE_HEARTBEAT", "2"))
+PROGRESSIVE_WORKERS = int(os.getenv("PROGRESSIVE_WORKERS", "4"))
+PROGRESSIVE_MAX_PENDING = int(os.getenv("PROGRESSIVE_MAX_PENDING", "16"))  # étapes en attente d'un worker
+PROGRESSIVE_DIR = os.getenv("PROGRESSIVE_DIR", "") or str(DATA_DIR / "progressive")  # mode 0700, propriétaire vérifié
+
+# Admission par coût estimé (EXPLAIN) avant exécution : exécuter, estimer sur échantillon ou refuser.
+# ADMISSION_POLICIES (JSON) surcharge les seuils par classe (interactive, nl, analysis, export), ex. :
+# {"interactive": {"max_scan_rows": 500000000, "sample_scan_rows": 50000000, "max_result_rows": 1000000,
+#                  "max_fanout": 1000, "sample_result": true, "approximate": true}}
+# "approximate" (défaut false) : au-delà de sample_scan_rows, agrégats estimés sur l'échantillon (colonnes _se,
+# MIN / MAX toujours exacts) ; sinon exécution exacte jusqu'à max_scan_rows, refus (422) au-delà.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1").lower() not in {"0", "false", "no"}
+ADMISSION_POLICIES = os.getenv("ADMISSION_POLICIES", "")
+
+# Ordonnanceur DuckDB : créneaux de concurrence, priorité, attente max, mémoire moteur réservée (memory)
+# et plafond du résultat côté Python (result_memory) par classe de requête (interactive, nl, analysis,
+# ingest, export). SCHEDULER_CLASSES (JSON) surcharge les défauts, ex. :
+# {"export": {"slots": 2, "queue_timeout": 300, "priority": 3, "memory": "1GB", "result_memory": "512MB"}}
+# Pas de "threads" par classe : DuckDB ne le règle que pour toute l'instance (DUCKDB_THREADS), la clé est ignorée.
+# Réglages de l'instance DuckDB (memory_limit, threads, temp_directory...) : variables DUCKDB_* lues
+# par analytics.duck (voir env.example).
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").lower() not in {"0", "false", "no"}
+SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", str(max(2, os.cpu_count() or 4))))
+SCHEDULER_CLASSES = os.getenv("SCHEDULER_CLASSES", "")
+# Reverse proxies de confiance (IP ou CIDR, séparés par des virgules) : X-Forwarded-For n'est lu que pour
+# les connexions venant d'eux (clé client de l'ordonnanceur et des quotas), sinon REMOTE_ADDR.
+TRUSTED_PROXIES = [p for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+# Comptabilité par utilisateur / dataset (temps, CPU, lignes scannées, octets, pic mémoire) et quotas glissants
+# ACCOUNTING_QUOTAS (JSON) : plafonds par client sur ACCOUNTING_QUOTA_WINDOW secondes (staff exempté), ex. :
+# {"rows_scanned": 5000000000, "cpu_ms": 3600000}
+ACCOUNTING_ENABLED = os.getenv("ACCOUNTING_ENABLED", "1").lower() not in {"0", "false", "no"}
+ACCOUNTING_QUOTAS = os.getenv("ACCOUNTING_QUOTAS", "")
+ACCOUNTING_QUOTA_WINDOW = int(os.getenv("ACCOUNTING_QUOTA_WINDOW", "3600"))
+
+# Plafonds du runner Pandas (même processus que le moteur) : lignes chargées (refus au-delà), empreinte
+# des DataFrames restants vérifiée APRÈS exécution (pas une limite pendant l'analyse), lignes renvoyées
+# (au-delà : coupe signalée par "truncated")
+PANDAS_MAX_ROWS = int(os.getenv("PANDAS_MAX_ROWS", "1000000"))
+PANDAS_MAX_FRAMES_MEMORY = os.getenv("PANDAS_MAX_FRAMES_MEMORY", "512MB")
+PANDAS_MAX_RESULT_ROWS = int(os.getenv("PANDAS_MAX_RESULT_ROWS", "100000"))
+
+# ----- Rendu des graphiques -----
+# png | svg | spec (spec = pas de rendu serveur, le frontend dessine depuis chart_spec)
+CHART_RENDER_FORMAT = os.getenv("CHART_RENDER_FORMAT", "png")
+CHART_RENDER_DPI = int(os.getenv("CHART_RENDER_DPI", "80"))
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2"))
+CHART_RENDER_EXECUTOR = os.getenv("CHART_RENDER_EXECUTOR", "thread")  # thread | process
+CHART_RENDER_CACHE_SIZE = int(os.getenv("CHART_RENDER_CACHE_SIZE", "256"))
+# attente max (s) d'un rendu de repli sur le fil de la requête ; au-delà le frontend dessine le chart_spec
+CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", "2"))
+
+# Réduction des séries envoyées au graphique (le tableau est paginé)
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+CHART_DOWNSAMPLE_METHOD = os.getenv("CHART_DOWNSAMPLE_METHOD", "lttb")  # lttb | minmax
+CHART_TOP_N = int(os.getenv("CHART_TOP_N", "20"))
+NL_RESULT_PAGE_ROWS = int(os.getenv("NL_RESULT_PAGE_ROWS", "200"))  # tableau NL : première page, suite via query/rows
 
 # ----- Logs simples -----
 LOGGING = {
@@ -1,4 +1,4 @@
-import api, { unwrap } from "./client";
+import api, { unwrap, BASE } from "./client";
 
 /** POST /api/analytics/query/nl */
 export function askQuestion(dataset, question, { row_limit = 200, preview = false } = {}) {
@@ -15,3 +15,39 @@ export function askQuestion(dataset, question, { row_limit = 200, preview = fals
 export function runQuery(sql, { row_limit = 200 } = {}) {
   return unwrap(api.post("/analytics/query/sql", { sql, row_limit }));
 }
+
+/**
+ * POST /api/analytics/query/rows : page suivante du tableau d'une réponse NL.
+ * page = data.rows_page ({ sql } ou { result_id }).
+ */
+export function fetchResultRows(page, offset, limit = 200) {
+  return unwrap(api.post("/analytics/query/rows", { ...page, offset, limit }));
+}
+
+/**
+ * GET /api/analytics/query/progressive (SSE) : estimations successives (1 %, 10 %, ...) puis résultat exact.
+ * onEvent(name, data) pour start | estimate | result | done | cancelled | error.
+ * accept() garde l'estimation courante et arrête les étapes restantes côté serveur.
+ */
+export function streamProgressiveQuery(sql, { stages, onEvent } = {}) {
+  const params = new URLSearchParams({ sql });
+  if (stages) params.set("stages", [].concat(stages).join(","));
+  const source = new EventSource(`${BASE}/analytics/query/progressive?${params}`);
+  let runId = null;
+  ["start", "estimate", "result", "done", "cancelled", "error"].forEach((name) => {
+    source.addEventListener(name, (e) => {
+      const data = e.data ? JSON.parse(e.data) : {};
+      if (name === "start") runId = data.run_id;
+      onEvent?.(name, data);
+      // fin du flux (ou erreur réseau) : pas de reconnexion automatique qui relancerait la requête
+      if (["done", "cancelled", "error"].includes(name)) source.close();
+    });
+  });
+  return {
+    close: () => source.close(),
+    accept: () => {
+      source.close();
+      return runId ? unwrap(api.post(`/analytics/query/progressive/${runId}/cancel`)) : Promise.resolve(null);
+    },
+  };
+}
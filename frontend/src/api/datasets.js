@@ -28,3 +28,17 @@ export async function getDatasetPreview(table, limit = 10) {
 
 // alias facultatif
 export const getDatasetSchema = (table) => getDatasetPreview(table, 0);
+
+// GET /analytics/datasets/:table/autocomplete?q=...&limit=8 -> { suggestions: [{ value, column, freq }] }
+export async function autocompleteValues(table, q, limit = 8) {
+  const data = await unwrap(api.get(`/analytics/datasets/${encodeURIComponent(table)}/autocomplete`, {
+    params: { q, limit },
+  }));
+  return Array.isArray(data?.suggestions) ? data.suggestions : [];
+}
+
+// POST /analytics/datasets/:table/rows -> { rows, total, page, pages, facets }
+// spec : { columns, filters: [{column, op, value}], sort: [{column, dir}], page, page_size, facets }
+export async function queryDatasetRows(table, spec = {}) {
+  return unwrap(api.post(`/analytics/datasets/${encodeURIComponent(table)}/rows`, spec));
+}
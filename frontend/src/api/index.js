@@ -7,11 +7,14 @@ export {
   uploadDataset,
   getDatasetSchema,
   getDatasetPreview,
+  autocompleteValues,
+  queryDatasetRows,
 } from "./datasets";
 
 // Analytics
 export {
   askQuestion,
   runQuery,
+  fetchResultRows,
 } from "./analytics";
 
@@ -1,5 +1,5 @@
-import React, { useMemo } from "react";
-import { Button } from "react-bootstrap";
+import React, { useEffect, useMemo, useState } from "react";
+import { queryDatasetRows } from "../api";
 
 function toCsv(rows, columns){
   const esc = (s)=>{
@@ -13,16 +13,89 @@ function toCsv(rows, columns){
   return head + "\n" + body;
 }
 
-export default function DataTable({ rows = [] }){
+/**
+ * Tableau de résultats.
+ * - rows : lignes déjà chargées (affichage simple)
+ * - table : nom d'un dataset -> tri, filtres (facettes) et pagination faits par le serveur
+ *   (POST /analytics/datasets/:table/rows), seule la page courante transite.
+ */
+export default function DataTable({ rows = [], table = null, pageSize = 50 }){
+  const [page, setPage] = useState(1);
+  const [sort, setSort] = useState(null);          // { column, dir }
+  const [filters, setFilters] = useState({});      // { colonne: valeur }
+  const [remote, setRemote] = useState(null);      // réponse de queryDatasetRows
+  const [busy, setBusy] = useState(false);
+  const [err, setErr] = useState("");
+
+  useEffect(()=>{
+    setPage(1); setSort(null); setFilters({}); setRemote(null);
+  }, [table]);
+
+  useEffect(()=>{
+    if (!table) return undefined;
+    let cancelled = false;
+    const spec = {
+      page,
+      page_size: pageSize,
+      sort: sort ? [sort] : [],
+      filters: Object.entries(filters).map(([column, value]) => ({ column, op: "eq", value })),
+    };
+    setBusy(true); setErr("");
+    queryDatasetRows(table, spec)
+      .then((data)=>{ if (!cancelled) setRemote(data); })
+      .catch((e)=>{ if (!cancelled) setErr(e?.response?.data?.detail || e?.message || "Erreur de chargement."); })
+      .finally(()=>{ if (!cancelled) setBusy(false); });
+    return () => { cancelled = true; };
+  }, [table, page, pageSize, sort, filters]);
+
+  const shown = table ? (remote?.rows || []) : rows;
   const columns = useMemo(()=>{
-    if (!rows || rows.length===0) return [];
-    return Object.keys(rows[0]);
-  }, [rows]);
+    if (table && remote?.columns) return remote.columns.map(c => c.name);
+    if (!shown || shown.length===0) return [];
+    return Object.keys(shown[0]);
+  }, [table, remote, shown]);
 
-  const csv = useMemo(()=> toCsv(rows, columns), [rows, columns]);
+  const csv = useMemo(()=> toCsv(shown, columns), [shown, columns]);
+
+  const toggleSort = (column) => {
+    if (!table) return;
+    setSort((s) => (s?.column !== column ? { column, dir: "asc" } : s.dir === "asc" ? { column, dir: "desc" } : null));
+    setPage(1);
+  };
+
+  const setFilter = (column, value) => {
+    setFilters((f) => {
+      const next = { ...f };
+      if (value === "") delete next[column]; else next[column] = value;
+      return next;
+    });
+    setPage(1);
+  };
+
+  const facets = (table && remote?.facets) || {};
 
   return (
     <div className="table-responsive">
+      {err && <div className="alert alert-danger py-2">{err}</div>}
+      {table && Object.keys(facets).length > 0 && (
+        <div className="d-flex flex-wrap gap-2 mb-2">
+          {Object.entries(facets).map(([column, values]) => (
+            <select
+              key={column}
+              className="form-select form-select-sm w-auto"
+              value={filters[column] ?? ""}
+              onChange={(e) => setFilter(column, e.target.value)}
+            >
+              <option value="">{column} : tous</option>
+              {values.map((v) => (
+                <option key={String(v.value)} value={v.value ?? ""}>
+                  {String(v.value)} ({v.count})
+                </option>
+              ))}
+            </select>
+          ))}
+        </div>
+      )}
       <div className="d-flex justify-content-end">
         <a
           className="btn btn-sm btn-outline-secondary mb-2"
@@ -34,16 +107,38 @@ export default function DataTable({ rows = [] }){
       </div>
       <table className="table table-sm table-striped">
         <thead>
-          <tr>{columns.map(c => <th key={c}>{c}</th>)}</tr>
+          <tr>
+            {columns.map(c => (
+              <th key={c} onClick={() => toggleSort(c)} style={table ? { cursor: "pointer" } : undefined}>
+                {c}
+                {sort?.column === c && <i className={`bi bi-caret-${sort.dir === "asc" ? "up" : "down"}-fill ms-1`}></i>}
+              </th>
+            ))}
+          </tr>
         </thead>
         <tbody>
-          {rows.map((r, i)=>(
+          {shown.map((r, i)=>(
             <tr key={i}>
               {columns.map(c => <td key={c}>{r[c]?.toString?.() ?? ""}</td>)}
             </tr>
           ))}
         </tbody>
       </table>
+      {table && remote && (
+        <div className="d-flex justify-content-between align-items-center">
+          <small className="text-muted">
+            {remote.total} ligne{remote.total > 1 ? "s" : ""} · page {remote.page} / {Math.max(1, remote.pages)}
+          </small>
+          <div className="btn-group btn-group-sm">
+            <button className="btn btn-outline-secondary" disabled={busy || page <= 1} onClick={() => setPage(page - 1)}>
+              Précédent
+            </button>
+            <button className="btn btn-outline-secondary" disabled={busy || page >= remote.pages} onClick={() => setPage(page + 1)}>
+              Suivant
+            </button>
+          </div>
+        </div>
+      )}
     </div>
   );
 }
@@ -1,7 +1,7 @@
 import React, { useEffect, useMemo, useState } from "react";
 import { useSearchParams } from "react-router-dom";
 import api, { unwrap } from "../api/client";
-import { listDatasets } from "../api";
+import { listDatasets, fetchResultRows, autocompleteValues } from "../api";
 import DataTable from "../components/DataTable";
 import {
   Area, AreaChart,
@@ -38,7 +38,7 @@ function inferIntent(q = "") {
 /* ============================================================
    🎨 ChartRenderer universel (Recharts + Base64 PNG)
    ============================================================ */
-function ChartRenderer({ rows = [], spec, base64 }) {
+function ChartRenderer({ rows = [], spec, base64, format = "png" }) {
   if (!spec && !base64) return null;
 
   const type = (spec?.type || spec?.mark || "").toLowerCase();
@@ -339,7 +339,7 @@ function ChartRenderer({ rows = [], spec, base64 }) {
       if (base64) {
         return (
           <div className="chart-container text-center">
-            <img alt="Graphique" src={`data:image/png;base64,${base64}`} className="chart-image img-fluid rounded shadow-sm" />
+            <img alt="Graphique" src={`data:${format === "svg" ? "image/svg+xml" : "image/png"};base64,${base64}`} className="chart-image img-fluid rounded shadow-sm" />
           </div>
         );
       }
@@ -366,7 +366,9 @@ export default function Ask() {
   const [busy, setBusy] = useState(false);
   const [error, setError] = useState("");
   const [rows, setRows] = useState([]);
+  const [chartRows, setChartRows] = useState(null);
   const [chart, setChart] = useState("");
+  const [chartFormat, setChartFormat] = useState("png");
   const [chartSpec, setChartSpec] = useState(null);
   const [sql, setSql] = useState("");
   const [summary, setSummary] = useState("");
@@ -376,6 +378,14 @@ export default function Ask() {
   const [suggestions, setSuggestions] = useState([]);
   const [analysis, setAnalysis] = useState("");
   const [showAllRows, setShowAllRows] = useState(false);
+  // le serveur n'envoie que la première page du tableau ; la suite via query/rows
+  const [rowCount, setRowCount] = useState(0);
+  const [rowsPage, setRowsPage] = useState(null);
+  const [truncated, setTruncated] = useState(false);
+  const [loadingRows, setLoadingRows] = useState(false);
+  // valeurs du dataset proposées pendant la saisie (index des valeurs distinctes côté serveur)
+  const [valueSuggestions, setValueSuggestions] = useState([]);
+  const [showValueList, setShowValueList] = useState(false);
 
 
   useEffect(() => {
@@ -408,6 +418,40 @@ export default function Ask() {
     }
   }, [tableFromQS]);
 
+  // dernier mot en cours de saisie (complété par une valeur du dataset)
+  const typedTerm = useMemo(() => {
+    const m = question.match(/([^\s,;:!?()"']+)$/);
+    return m ? m[1] : "";
+  }, [question]);
+
+  useEffect(() => {
+    const ds = dataset.trim();
+    if (!ds || typedTerm.length < 2) {
+      setValueSuggestions([]);
+      return undefined;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const found = await autocompleteValues(ds, typedTerm, 8);
+        if (!cancelled) setValueSuggestions(found);
+      } catch (err) {
+        console.warn("Autocomplétion indisponible :", err);
+        if (!cancelled) setValueSuggestions([]);
+      }
+    }, 200);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [dataset, typedTerm]);
+
+  const applyValueSuggestion = (value) => {
+    setQuestion((q) => q.slice(0, q.length - typedTerm.length) + value + " ");
+    setValueSuggestions([]);
+    setShowValueList(false);
+  };
+
   const canSubmit = useMemo(
     () => dataset.trim().length > 0 && question.trim().length > 0 && !busy,
     [dataset, question, busy]
@@ -415,6 +459,7 @@ export default function Ask() {
 
   const clearResults = () => {
     setRows([]);
+    setChartRows(null);
     setChart("");
     setChartSpec(null);
     setSql("");
@@ -423,6 +468,22 @@ export default function Ask() {
     setResultText("");
     setStdout("");
     setShowAllRows(false);
+    setRowCount(0);
+    setRowsPage(null);
+  };
+
+  const loadMoreRows = async () => {
+    if (!rowsPage || loadingRows) return;
+    try {
+      setLoadingRows(true);
+      const data = await fetchResultRows(rowsPage, rows.length, rowsPage.limit || 200);
+      setRows((prev) => prev.concat(Array.isArray(data.rows) ? data.rows : []));
+      setShowAllRows(true);
+    } catch (err) {
+      setError(err?.message || "Impossible de charger les lignes suivantes.");
+    } finally {
+      setLoadingRows(false);
+    }
   };
 
   const onAsk = async (e) => {
@@ -450,8 +511,17 @@ export default function Ask() {
       const data = await unwrap(api.post("/analytics/query/nl", payload));
       setAnalysis(data.analysis || "");
 
-      setRows(Array.isArray(data.rows) ? data.rows : []);
+      const firstRows = Array.isArray(data.rows) ? data.rows : [];
+      setRows(firstRows);
+      setRowCount(Number.isInteger(data.row_count) ? data.row_count : firstRows.length);
+      setRowsPage(data.rows_page || null);
+      // analyse Python : sortie coupée à PANDAS_MAX_RESULT_ROWS lignes, erreur du runner
+      setTruncated(Boolean(data.truncated));
+      if (data.error) setError(data.error);
+      // Série réduite côté serveur pour le graphique (rows ne contient que la première page du tableau)
+      setChartRows(Array.isArray(data.chart_rows) ? data.chart_rows : null);
       setChart(typeof data.chart === "string" ? data.chart : "");
+      setChartFormat(data.chart_format || "png");
       setChartSpec(data.chart_spec ?? null);
       setSql(data.sql || "");
       setSummary(data.summary || "");
@@ -612,15 +682,48 @@ export default function Ask() {
                       <i className="bi bi-chat-quote me-2 text-primary"></i>
                       Votre question
                     </label>
-                    <TextareaAutosize
-                      className="form-control form-control-lg"
-                      minRows={2}
-                      maxRows={5}
-                      value={question}
-                      onChange={(e) => setQuestion(e.target.value)}
-                      placeholder="Ex: Quels sont les joueurs ayant marqué plus de 10 buts ?"
-                      style={{ resize: "none" }}
-                    />
+                    <div className="position-relative">
+                      <TextareaAutosize
+                        className="form-control form-control-lg"
+                        minRows={2}
+                        maxRows={5}
+                        value={question}
+                        onChange={(e) => {
+                          setQuestion(e.target.value);
+                          setShowValueList(true);
+                        }}
+                        onBlur={() => setTimeout(() => setShowValueList(false), 200)}
+                        placeholder="Ex: Quels sont les joueurs ayant marqué plus de 10 buts ?"
+                        style={{ resize: "none" }}
+                      />
+                      {showValueList && valueSuggestions.length > 0 && (
+                        <div
+                          className="position-absolute w-100 bg-white border rounded shadow-lg mt-1"
+                          style={{ zIndex: 1000, maxHeight: "240px", overflowY: "auto" }}
+                        >
+                          {valueSuggestions.map((s) => (
+                            <div
+                              key={`${s.column}:${s.value}`}
+                              className="px-3 py-2 d-flex justify-content-between"
+                              style={{ cursor: "pointer" }}
+                              onMouseDown={(e) => {
+                                e.preventDefault();
+                                applyValueSuggestion(s.value);
+                              }}
+                              onMouseEnter={(e) => {
+                                e.currentTarget.style.backgroundColor = "#f8f9fa";
+                              }}
+                              onMouseLeave={(e) => {
+                                e.currentTarget.style.backgroundColor = "transparent";
+                              }}
+                            >
+                              <strong>{s.value}</strong>
+                              <small className="text-muted">{s.column}</small>
+                            </div>
+                          ))}
+                        </div>
+                      )}
+                    </div>
                     <small className="text-muted">
                       <i className="bi bi-info-circle me-1"></i>
                       Posez votre question en langage naturel
@@ -767,7 +870,7 @@ export default function Ask() {
                   </h6>
                 </div>
                 <div className="card-body p-4">
-                  <ChartRenderer rows={rows || []} spec={chartSpec} base64={chart} />
+                  <ChartRenderer rows={chartRows || rows || []} spec={chartSpec} base64={chart} format={chartFormat} />
                 </div>
               </div>
             </div>
@@ -780,16 +883,29 @@ export default function Ask() {
                 <div className="card-header bg-white border-bottom d-flex justify-content-between align-items-center">
                   <h6 className="mb-0 fw-semibold">
                     <i className="bi bi-table me-2 text-primary"></i>
-                    Données ({rows.length} ligne{rows.length > 1 ? "s" : ""})
+                    Données ({rowCount} ligne{rowCount > 1 ? "s" : ""})
                   </h6>
-                  <span className="badge bg-primary">{rows.length} résultat{rows.length > 1 ? "s" : ""}</span>
+                  <span>
+                    {truncated && <span className="badge bg-warning text-dark me-2">Résultat tronqué</span>}
+                    <span className="badge bg-primary">{rowCount} résultat{rowCount > 1 ? "s" : ""}</span>
+                  </span>
                 </div>
                 <div className="card-body p-0">
                   <div className="table-responsive">
                     <DataTable rows={showAllRows ? rows : rows.slice(0, 10)} />
                   </div>
-                  {rows.length > 10 && (
+                  {(rows.length > 10 || rows.length < rowCount) && (
                     <div className="card-footer bg-white border-top text-center py-3">
+                      {showAllRows && rows.length < rowCount && (
+                        <button
+                          className="btn btn-primary me-2"
+                          onClick={loadMoreRows}
+                          disabled={loadingRows}
+                        >
+                          <i className="bi bi-download me-2"></i>
+                          {loadingRows ? "Chargement..." : `Charger la suite (${rows.length} / ${rowCount})`}
+                        </button>
+                      )}
                       <button
                         className="btn btn-outline-primary"
                         onClick={() => setShowAllRows(!showAllRows)}
@@ -1,6 +1,7 @@
 import React, { useEffect, useState, useCallback, useMemo } from "react";
 import { useNavigate } from "react-router-dom";
 import FileUploader from "../components/FileUploader.jsx";
+import DataTable from "../components/DataTable";
 import { listDatasets } from "../api";
 import "bootstrap/dist/css/bootstrap.min.css";
 import "bootstrap-icons/font/bootstrap-icons.css";
@@ -330,34 +331,8 @@ export default function Home() {
                     )}
                   </div>
                 )}
-                {previewData.rows && previewData.rows.length > 0 ? (
-                  <div className="table-responsive">
-                    <table className="table table-sm table-hover">
-                      <thead className="table-light">
-                        <tr>
-                          {Object.keys(previewData.rows[0]).map((col) => (
-                            <th key={col} className="text-nowrap">
-                              {col}
-                            </th>
-                          ))}
-                        </tr>
-                      </thead>
-                      <tbody>
-                        {previewData.rows.map((row, idx) => (
-                          <tr key={idx}>
-                            {Object.keys(previewData.rows[0]).map((col) => (
-                              <td key={col} className="text-nowrap">
-                                {String(row[col] ?? "")}
-                              </td>
-                            ))}
-                          </tr>
-                        ))}
-                      </tbody>
-                    </table>
-                  </div>
-                ) : (
-                  <p className="text-muted mb-0">Aucune donnée à afficher</p>
-                )}
+                {/* tri, filtres par facette et pagination exécutés par le serveur (datasets/:table/rows) */}
+                <DataTable table={selectedTable} pageSize={20} />
                 <div className="mt-3">
                   <button
                     className="btn btn-primary btn-sm"